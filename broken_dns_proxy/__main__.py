@@ -21,16 +21,54 @@
 import sys
 import os
 
-from broken_dns_proxy.arguments_parser import ArgumentsParser
+from broken_dns_proxy.arguments_parser import ArgumentsParser, BenchArgumentsParser, StubArgumentsParser, \
+    ControlArgumentsParser, ReplayArgumentsParser
 from broken_dns_proxy.application import Application
+from broken_dns_proxy.lazy_import import import_object
 from broken_dns_proxy.logger import logger, LoggerHelper, logging
 from broken_dns_proxy.exceptions import BrokenDNSProxyError
 
 
+def run_subcommand(parser_class, function, argv):
+    """
+    Run the subcommand and exit
+
+    :param parser_class: class parsing the arguments of the subcommand
+    :param function: 'module:function' path of the function running the subcommand with the parsed arguments
+    :param argv: arguments following the subcommand name
+    """
+    args = parser_class(argv)
+    LoggerHelper.add_stream_handler(logger,
+                                    logging.Formatter('%(levelname)s:\t%(message)s'),
+                                    logging.DEBUG if args.verbose else logging.INFO)
+    try:
+        import_object(function)(args)
+    except KeyboardInterrupt:
+        logger.info('Interrupted by user')
+    except BrokenDNSProxyError as e:
+        logger.error('%s', str(e))
+        sys.exit(1)
+    else:
+        sys.exit(0)
+
+
+# subcommand -> (arguments parser class, function running it), the module is imported only when the subcommand is run
+subcommands = {
+    'bench': (BenchArgumentsParser, 'broken_dns_proxy.bench:run_bench'),
+    'replay': (ReplayArgumentsParser, 'broken_dns_proxy.replay:run_replay'),
+    'stub': (StubArgumentsParser, 'broken_dns_proxy.stub_upstream:run_stub'),
+    'control': (ControlArgumentsParser, 'broken_dns_proxy.control:run_control'),
+}
+
+
 def __main__():
     """
     Entry point for command line
     """
+    if len(sys.argv) > 1 and sys.argv[1] in subcommands:
+        parser_class, function = subcommands[sys.argv[1]]
+        run_subcommand(parser_class, function, sys.argv[2:])
+
     try:
         # add application-wide debug log
         LoggerHelper.add_debug_log_file(os.getcwd())
@@ -46,8 +84,13 @@ def __main__():
                                             logging.Formatter('%(levelname)s:\t%(message)s'),
                                             logging.INFO)
 
-        app = Application(args)
-        app.run()
+        if args.startup_profile:
+            from broken_dns_proxy.startup_profile import run_startup_profile
+
+            run_startup_profile(args)
+        else:
+            app = Application(args)
+            app.run()
     except KeyboardInterrupt:
         logger.info('Interrupted by user')
     except BrokenDNSProxyError as e:
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+
+import collections
+import socket
+from collections import OrderedDict
+
+import dns.flags
+import dns.rcode
+
+from broken_dns_proxy import wire
+from broken_dns_proxy.exceptions import BrokenDNSProxyError, WireFormatError
+
+
+# what happens to a Query which is not admitted
+SHED_DROP = 'drop'
+SHED_REFUSED = 'refused'
+SHED_TRUNCATE = 'truncate'
+SHED_ACTIONS = (SHED_DROP, SHED_REFUSED, SHED_TRUNCATE)
+
+# reasons of the admission decisions
+ADMITTED = 'admitted'
+RATE_LIMITED = 'rate_limited'
+QUEUE_FULL = 'queue_full'
+QUEUE_DELAY = 'queue_delay'
+
+_IPV4_MAPPED = b'\x00' * 10 + b'\xff\xff'
+_OPCODE_MASK = 0x7800
+
+
+def check_shed_action(action, option):
+    """
+    Check the name of the action taken on Queries which are not admitted
+
+    :param action: name of the action
+    :param option: configuration option the action comes from
+    :return: the action
+    """
+    if action not in SHED_ACTIONS:
+        raise BrokenDNSProxyError("Unknown action '{0}' in option '{1}', use one of: {2}".format(
+            action, option, ', '.join(SHED_ACTIONS)))
+    return action
+
+
+def shed_response(query, action):
+    """
+    Build the response sent instead of processing the Query. The response
+    has the header and the question of the Query and no records, so it is
+    never larger than the Query.
+
+    :param query: raw DNS message with the Query
+    :param action: SHED_REFUSED or SHED_TRUNCATE
+    :return: raw DNS message as bytearray
+    """
+    end = wire.question_end(query)
+    if end > len(query):
+        raise WireFormatError("Question exceeds the message")
+    response = bytearray(query[:end])
+    flags = wire.get_flags(query) & (_OPCODE_MASK | dns.flags.RD | dns.flags.CD)
+    flags |= dns.flags.QR
+    if action == SHED_TRUNCATE:
+        flags |= dns.flags.TC
+    else:
+        flags |= dns.rcode.REFUSED
+    wire.set_flags(response, flags)
+    for section in (wire.ANSWER, wire.AUTHORITY, wire.ADDITIONAL):
+        wire.set_count(response, section, 0)
+    return response
+
+
+class TokenBucket(object):
+    """
+    Tokens of one client prefix. The bucket is refilled lazily when a token is taken.
+    """
+
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, tokens, updated):
+        self.tokens = tokens
+        self.updated = updated
+
+
+class ClientRateLimiter(object):
+    """
+    Limits the rate of Queries of every client network with a token bucket.
+    Clients are grouped by the address prefix, so a flood from many addresses
+    of one network shares a single bucket. Only the buckets of the recently
+    seen prefixes are kept, a forgotten prefix starts again with a full bucket.
+    """
+
+    def __init__(self, rate, burst, prefix_v4=24, prefix_v6=56, max_clients=65536):
+        """
+        Constructor
+
+        :param rate: Queries per second allowed for one client prefix
+        :param burst: maximal number of Queries allowed at once
+        :param prefix_v4: length of the prefix grouping IPv4 clients
+        :param prefix_v6: length of the prefix grouping IPv6 clients
+        :param max_clients: maximal number of client prefixes remembered
+        :return: new object
+        """
+        if rate <= 0:
+            raise BrokenDNSProxyError("Rate limit must be positive, got '{0}'".format(rate))
+        if not 0 <= prefix_v4 <= 32 or not 0 <= prefix_v6 <= 128:
+            raise BrokenDNSProxyError("Wrong rate limit prefix length '/{0}' or '/{1}'".format(prefix_v4, prefix_v6))
+        self._rate = float(rate)
+        self._burst = float(max(burst, 1))
+        self._shift_v4 = 32 - prefix_v4
+        self._shift_v6 = 128 - prefix_v6
+        self._max_clients = max_clients
+        self._buckets = OrderedDict()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def __str__(self):
+        return "<ClientRateLimiter rate='{0}' burst='{1}' clients='{2}'>".format(self._rate, self._burst,
+                                                                               len(self._buckets))
+
+    def prefix(self, client_addr):
+        """
+        Return the prefix of the client address. IPv4-mapped IPv6 addresses
+        are grouped as IPv4 addresses.
+
+        :param client_addr: address tuple as returned by socket
+        :return: hashable key
+        """
+        host = client_addr[0]
+        if ':' not in host:
+            return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, host), 'big') >> self._shift_v4
+        # strip the zone index of link-local addresses
+        packed = socket.inet_pton(socket.AF_INET6, host.split('%', 1)[0])
+        if packed.startswith(_IPV4_MAPPED):
+            return 4, int.from_bytes(packed[12:], 'big') >> self._shift_v4
+        return 6, int.from_bytes(packed, 'big') >> self._shift_v6
+
+    def allow(self, client_addr, now):
+        """
+        Take a token for the Query of the client
+
+        :param client_addr: address tuple as returned by socket
+        :param now: time.perf_counter() value
+        :return: True if the Query is within the rate limit
+        """
+        key = self.prefix(client_addr)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(self._burst, now)
+            self._buckets[key] = bucket
+            if len(self._buckets) > self._max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket.tokens = min(self._burst, bucket.tokens + (now - bucket.updated) * self._rate)
+            bucket.updated = now
+        if bucket.tokens < 1.0:
+            return False
+        bucket.tokens -= 1.0
+        return True
+
+
+class AdmissionControl(object):
+    """
+    Decides which Queries are processed when the proxy is flooded. A Query is
+    not admitted when its client exceeds the rate limit or when too many
+    Queries are pending, and an admitted Query is shed when it waited in the
+    queue for too long. Every decision is counted by its reason and action.
+    """
+
+    def __init__(self, rate_limiter=None, max_pending=0, max_delay=0.0, rate_limit_action=SHED_DROP,
+                 shed_action=SHED_REFUSED):
+        """
+        Constructor
+
+        :param rate_limiter: ClientRateLimiter object or None
+        :param max_pending: maximal number of pending Queries, 0 for unlimited
+        :param max_delay: maximal time in seconds a Query may wait for processing, 0 for unlimited
+        :param rate_limit_action: action taken on Queries over the rate limit
+        :param shed_action: action taken on Queries when the proxy is overloaded
+        :return: new object
+        """
+        self.rate_limiter = rate_limiter
+        self.max_pending = max_pending
+        self.max_delay = max_delay
+        self.rate_limit_action = rate_limit_action
+        self.shed_action = shed_action
+        # (reason, action) -> number of Queries
+        self.decisions = collections.Counter()
+
+    def __str__(self):
+        return "<AdmissionControl max_pending='{0}' max_delay='{1}' decisions='{2}'>".format(
+            self.max_pending, self.max_delay, dict(self.decisions))
+
+    @property
+    def enabled(self):
+        """
+        True if some Queries may not be admitted
+        """
+        return self.rate_limiter is not None or self.max_pending > 0 or self.max_delay > 0
+
+    def _decide(self, reason, action, stream):
+        # TCP clients can not be pushed to TCP
+        if action == SHED_TRUNCATE and stream:
+            action = SHED_REFUSED
+        self.decisions[(reason, action)] += 1
+        return action
+
+    def admit(self, client_addr, pending, now, stream=False):
+        """
+        Decide whether the Query is admitted for processing
+
+        :param client_addr: address tuple of the client
+        :param pending: number of Queries already waiting or being processed
+        :param now: time.perf_counter() value when the Query was received
+        :param stream: True if the Query was received over TCP
+        :return: None if the Query is admitted, otherwise the action to take
+        """
+        if self.rate_limiter is not None and not self.rate_limiter.allow(client_addr, now):
+            return self._decide(RATE_LIMITED, self.rate_limit_action, stream)
+        if self.max_pending and pending >= self.max_pending:
+            return self._decide(QUEUE_FULL, self.shed_action, stream)
+        self.decisions[(ADMITTED, 'process')] += 1
+        return None
+
+    def check_delay(self, received, now, stream=False):
+        """
+        Decide whether the admitted Query is still processed after waiting in the queue
+
+        :param received: time.perf_counter() value when the Query was received
+        :param now: time.perf_counter() value when the processing starts
+        :param stream: True if the Query was received over TCP
+        :return: None if the Query is processed, otherwise the action to take
+        """
+        if self.max_delay and now - received > self.max_delay:
+            return self._decide(QUEUE_DELAY, self.shed_action, stream)
+        return None
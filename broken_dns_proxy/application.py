@@ -19,18 +19,45 @@
 # Authors:
 
 from broken_dns_proxy.logger import logger
-from broken_dns_proxy.proxy_server import ProxyServer
+from broken_dns_proxy.lazy_import import import_object
 from broken_dns_proxy.config import BrokenDnsProxyConfiguration
+from broken_dns_proxy.config_common import GlobalConfig
+from broken_dns_proxy.exceptions import BrokenDNSProxyError
+from broken_dns_proxy.workers import WorkerSupervisor
 
 
 class Application(object):
 
+    # available server implementations selectable by the 'Engine' option,
+    # only the selected one is imported (the asyncio engine imports asyncio)
+    engines = {
+        'select': 'broken_dns_proxy.proxy_server:ProxyServer',
+        'asyncio': 'broken_dns_proxy.async_proxy_server:AsyncProxyServer',
+    }
+
     def __init__(self, cli_args=None):
         """
         """
         self.configuration = BrokenDnsProxyConfiguration(cli_args)
-        self._server = ProxyServer(self.configuration)
+        engine = self.configuration.get(GlobalConfig.config_section_name(), GlobalConfig.CONFIG_ENGINE)
+        try:
+            server_class_path = self.engines[engine.strip().lower()]
+        except KeyError:
+            raise BrokenDNSProxyError("Engine '{0}' does not exist! Available engines: {1}".format(
+                engine, ', '.join(sorted(self.engines))))
+        self._server_class = import_object(server_class_path)
+        self._workers = self.configuration.getint(GlobalConfig.config_section_name(), GlobalConfig.CONFIG_WORKERS)
+        self._cpus = WorkerSupervisor.parse_cpu_affinity(
+            self.configuration.get(GlobalConfig.config_section_name(), GlobalConfig.CONFIG_WORKER_CPU_AFFINITY))
+        # in workers mode this only validates the configuration, every worker creates its own server
+        self._server = self._create_server()
+
+    def _create_server(self, worker=0):
+        return self._server_class(self.configuration, worker)
 
     def run(self):
         logger.debug("Staring proxy server '%s'", str(self._server))
-        self._server.process()
+        if self._workers > 1:
+            WorkerSupervisor(self._create_server, self._workers, self._cpus).run()
+        else:
+            self._server.process()
@@ -26,9 +26,12 @@ from broken_dns_proxy import settings
 class ArgumentsParser(object):
     """ Class for processing data from commandline """
 
+    DESCRIPTION = 'Simple DNS Proxy for simulating DNS issues.'
+    PROG = None
+
     def __init__(self, args=None):
         """ parse arguments """
-        self.parser = argparse.ArgumentParser(description='Simple DNS Proxy for simulating DNS issues.')
+        self.parser = argparse.ArgumentParser(prog=self.PROG, description=self.DESCRIPTION)
         self.add_args()
         self.args = self.parser.parse_args(args)
 
@@ -47,9 +50,254 @@ class ArgumentsParser(object):
             dest='config_path',
             help="Path to configuration file (default: '{0}')".format(settings.DEFAULT_CONFIG_LOCATION)
         )
+        self.parser.add_argument(
+            "--startup-profile",
+            default=False,
+            action="store_true",
+            help="Show what the startup with the configuration imports and how long it takes, don't serve"
+        )
 
     def __getattr__(self, name):
         try:
             return getattr(self.args, name)
         except AttributeError:
             return object.__getattribute__(self, name)
+
+
+class BenchArgumentsParser(ArgumentsParser):
+    """ Class for processing commandline of the 'bench' subcommand """
+
+    DESCRIPTION = 'Load generator measuring throughput and latency of a DNS server.'
+    PROG = 'bdp bench'
+
+    def add_args(self):
+        self.parser.add_argument(
+            "-v",
+            "--verbose",
+            default=False,
+            action="store_true",
+            help="Output is more verbose"
+        )
+        self.parser.add_argument(
+            "-s",
+            "--address",
+            default='127.0.0.1',
+            help="Address of the tested server (default: '127.0.0.1')"
+        )
+        self.parser.add_argument(
+            "-p",
+            "--port",
+            default=53,
+            type=int,
+            help="Port of the tested server (default: 53)"
+        )
+        self.parser.add_argument(
+            "-d",
+            "--queries",
+            default=None,
+            help="File with Queries, '<name> <type>' on every line. Queries are synthesized if not given"
+        )
+        self.parser.add_argument(
+            "--zone",
+            default='example.com.',
+            help="Zone of the synthesized Query names (default: 'example.com.')"
+        )
+        self.parser.add_argument(
+            "--names",
+            default=1000,
+            type=int,
+            help="Number of distinct synthesized Query names (default: 1000)"
+        )
+        self.parser.add_argument(
+            "--qtypes",
+            default='A:70,AAAA:25,MX:5',
+            help="Distribution of synthesized Query types (default: 'A:70,AAAA:25,MX:5')"
+        )
+        self.parser.add_argument(
+            "--tcp",
+            default=False,
+            action="store_true",
+            help="Send the Queries over TCP"
+        )
+        self.parser.add_argument(
+            "-c",
+            "--concurrency",
+            default=16,
+            type=int,
+            help="Number of outstanding Queries in closed loop, the limit of them at target QPS (default: 16)"
+        )
+        self.parser.add_argument(
+            "-q",
+            "--qps",
+            default=0,
+            type=float,
+            help="Target rate in Queries per second, 0 to run in closed loop (default: 0)"
+        )
+        self.parser.add_argument(
+            "-l",
+            "--duration",
+            default=10.0,
+            type=float,
+            help="Seconds to run, 0 for no limit (default: 10)"
+        )
+        self.parser.add_argument(
+            "-n",
+            "--count",
+            default=0,
+            type=int,
+            help="Number of Queries to send, 0 for no limit (default: 0)"
+        )
+        self.parser.add_argument(
+            "-t",
+            "--timeout",
+            default=2.0,
+            type=float,
+            help="Seconds after which the Query is considered lost (default: 2)"
+        )
+        self.parser.add_argument(
+            "--sockets",
+            default=8,
+            type=int,
+            help="Number of UDP sockets or TCP connections to use (default: 8)"
+        )
+
+
+class ReplayArgumentsParser(ArgumentsParser):
+    """ Class for processing commandline of the 'replay' subcommand """
+
+    DESCRIPTION = 'Send the DNS Queries from a pcap or pcapng capture to a DNS server.'
+    PROG = 'bdp replay'
+
+    def add_args(self):
+        self.parser.add_argument(
+            "-v",
+            "--verbose",
+            default=False,
+            action="store_true",
+            help="Output is more verbose"
+        )
+        self.parser.add_argument(
+            "-s",
+            "--address",
+            default='127.0.0.1',
+            help="Address of the tested server (default: '127.0.0.1')"
+        )
+        self.parser.add_argument(
+            "-p",
+            "--port",
+            default=53,
+            type=int,
+            help="Port of the tested server (default: 53)"
+        )
+        self.parser.add_argument(
+            "--speed",
+            default=1.0,
+            type=float,
+            help="Factor the original timing is scaled by, 0 to send as fast as possible (default: 1)"
+        )
+        self.parser.add_argument(
+            "--capture-port",
+            default=53,
+            type=int,
+            help="Destination port of the Queries in the capture (default: 53)"
+        )
+        self.parser.add_argument(
+            "-c",
+            "--concurrency",
+            default=1000,
+            type=int,
+            help="Maximal number of outstanding Queries, the replay waits if reached (default: 1000)"
+        )
+        self.parser.add_argument(
+            "-n",
+            "--count",
+            default=0,
+            type=int,
+            help="Number of Queries to send, 0 for all in the capture (default: 0)"
+        )
+        self.parser.add_argument(
+            "-t",
+            "--timeout",
+            default=2.0,
+            type=float,
+            help="Seconds after which the Query is considered lost (default: 2)"
+        )
+        self.parser.add_argument(
+            "--sockets",
+            default=8,
+            type=int,
+            help="Number of UDP sockets the original clients are spread over (default: 8)"
+        )
+        self.parser.add_argument(
+            "capture",
+            help="pcap or pcapng file with the Queries"
+        )
+
+
+class StubArgumentsParser(ArgumentsParser):
+    """ Class for processing commandline of the 'stub' subcommand """
+
+    DESCRIPTION = 'Authoritative DNS server answering from zone files, to be used as a local upstream server.'
+    PROG = 'bdp stub'
+
+    def add_args(self):
+        self.parser.add_argument(
+            "-v",
+            "--verbose",
+            default=False,
+            action="store_true",
+            help="Output is more verbose"
+        )
+        self.parser.add_argument(
+            "-a",
+            "--address",
+            default='127.0.0.1',
+            help="Address to listen on (default: '127.0.0.1')"
+        )
+        self.parser.add_argument(
+            "-p",
+            "--port",
+            default=5300,
+            type=int,
+            help="Port to listen on (default: 5300)"
+        )
+        self.parser.add_argument(
+            "zones",
+            nargs='+',
+            metavar='ZONE_FILE',
+            help="Zone file with $ORIGIN set"
+        )
+
+
+class ControlArgumentsParser(ArgumentsParser):
+    """ Class for processing commandline of the 'control' subcommand """
+
+    DESCRIPTION = 'Send command to the control socket of running proxy server.'
+    PROG = 'bdp control'
+
+    def add_args(self):
+        self.parser.add_argument(
+            "-v",
+            "--verbose",
+            default=False,
+            action="store_true",
+            help="Output is more verbose"
+        )
+        self.parser.add_argument(
+            "-s",
+            "--socket",
+            required=True,
+            help="Control socket of the server, path of UNIX socket or 'address@port'"
+        )
+        self.parser.add_argument(
+            "-t",
+            "--timeout",
+            default=10.0,
+            type=float,
+            help="Seconds to wait for the response (default: 10)"
+        )
+        self.parser.add_argument(
+            "command",
+            nargs='+',
+            help="'reload [CONFIG_PATH]' or 'status'"
+        )
@@ -0,0 +1,667 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+
+import asyncio
+import functools
+import struct
+import time
+
+import dns.flags
+
+from broken_dns_proxy import wire
+from broken_dns_proxy.logger import logger, LazyMessageDump
+from broken_dns_proxy.exceptions import WireFormatError
+from broken_dns_proxy.client import Client
+from broken_dns_proxy.buffer_pool import StreamReassembler
+from broken_dns_proxy.proxy_server import ProxyServer
+from broken_dns_proxy.upstream import UdpUpstream, TcpUpstream, parse_upstream_address
+from broken_dns_proxy.blocking_upstream import STUB_UPSTREAM
+from broken_dns_proxy.coalescing import InflightQueries
+from broken_dns_proxy.config_common import GlobalConfig
+
+
+class ProtocolClient(Client):
+    """
+    Client whose Query was already received by an asyncio protocol
+    """
+
+    __slots__ = ('_stream', 'done_callback')
+
+    def __init__(self, transport, msg_raw, client_addr=None, stream=False, received=None, done_callback=None):
+        """
+        Constructor
+
+        :param transport: asyncio transport on which the Query was received
+        :param msg_raw: raw DNS message with the Query
+        :param client_addr: address of the client (only for UDP)
+        :param stream: True if the client is connected using TCP
+        :param received: time.perf_counter() value when the Query was received
+        :param done_callback: called without arguments when the response is sent or the Query dropped
+        :return: None
+        """
+        self.setup(transport, msg_raw, client_addr, stream, received, done_callback)
+
+    def setup(self, transport, msg_raw, client_addr=None, stream=False, received=None, done_callback=None):
+        self._transport = transport
+        self._stream = stream
+        self._client_addr = client_addr if client_addr else transport.get_extra_info('peername')
+        self._client_msg_raw = msg_raw
+        self.received = received
+        self._detached = False
+        self.done_callback = done_callback
+        self._check_client_msg()
+
+    def clear(self):
+        super(ProtocolClient, self).clear()
+        self.done_callback = None
+
+    def is_stream(self):
+        return self._stream
+
+    def _send_stream(self, msg_raw):
+        """
+        Send raw DNS Message to client connected using TCP
+
+        :param msg_raw: raw DNS Message to sent to the client
+        :return: None
+        """
+        if self._transport.is_closing():
+            logger.debug('TCP client %s already disconnected', str(self._client_addr))
+            return
+        self._transport.write(struct.pack('!H', len(msg_raw)) + msg_raw)
+
+    def _send_datagram(self, msg_raw):
+        """
+        Send raw DNS Message to client connected using UDP
+
+        :param msg_raw: raw DNS Message to send to the client
+        :return: None
+        """
+        self._transport.sendto(msg_raw, self._client_addr)
+
+
+class DatagramListener(asyncio.DatagramProtocol):
+    """
+    asyncio protocol receiving client Queries over UDP
+    """
+
+    def __init__(self, server):
+        self._server = server
+        self._transport = None
+
+    def connection_made(self, transport):
+        self._transport = transport
+
+    def datagram_received(self, data, addr):
+        logger.debug('Received UDP data from: %s', str(addr))
+        self._server.handle_query(self._transport, data, addr)
+
+
+class StreamListener(asyncio.BufferedProtocol):
+    """
+    asyncio protocol receiving client Queries over a TCP connection.
+    Any number of Queries can be sent over one connection (RFC 7766).
+    The data are read straight into pooled buffers.
+    """
+
+    def __init__(self, server):
+        self._server = server
+        self._transport = None
+        self._input = StreamReassembler(server.buffer_pool)
+        self._queries = 0
+        self._pending = 0
+        self._closing = False
+        self._idle_timer = None
+
+    def connection_made(self, transport):
+        self._transport = transport
+        peer = transport.get_extra_info('peername')
+        if not self._server.add_connection(self):
+            logger.debug('Too many TCP connections... refusing client %s', str(peer))
+            transport.abort()
+            return
+        logger.debug('TCP client %s connected', str(peer))
+        self._reset_idle_timer()
+
+    def _reset_idle_timer(self):
+        if self._idle_timer is not None:
+            self._idle_timer.cancel()
+        self._idle_timer = self._server.call_later_idle(self._idle_timeout_expired)
+
+    def _idle_timeout_expired(self):
+        self._idle_timer = None
+        if self._pending:
+            # still waiting for the upstream server or sending a delayed response
+            self._reset_idle_timer()
+            return
+        logger.debug('TCP client %s idle for too long... closing', str(self._transport.get_extra_info('peername')))
+        self._transport.close()
+
+    def get_buffer(self, sizehint):
+        if self._closing:
+            # no more Queries are accepted, the data are thrown away
+            return bytearray(512)
+        return self._input.get_buffer()
+
+    def buffer_updated(self, nbytes):
+        if self._closing:
+            return
+        self._reset_idle_timer()
+        max_queries = self._server.tcp_max_queries
+        max_messages = max_queries - self._queries if max_queries else 0
+        for msg_view in self._input.buffer_updated(nbytes, max_messages):
+            # the Query outlives the buffer, it waits for the upstream server
+            msg_raw = bytes(msg_view)
+            logger.debug('TCP Query of length %s', str(len(msg_raw)))
+            self._queries += 1
+            self._pending += 1
+            self._server.handle_query(self._transport, msg_raw, stream=True, done_callback=self._query_done)
+        if max_queries and self._queries >= max_queries:
+            logger.debug('TCP client %s reached the limit of %d Queries',
+                         str(self._transport.get_extra_info('peername')), max_queries)
+            self._closing = True
+            self._input.release()
+        if self._closing and not self._pending:
+            self._transport.close()
+
+    def _query_done(self):
+        self._pending -= 1
+        if self._closing and not self._pending:
+            self._transport.close()
+        elif not self._transport.is_closing():
+            self._reset_idle_timer()
+
+    def abort(self):
+        self._transport.abort()
+
+    def connection_lost(self, exc):
+        self._input.release()
+        if self._idle_timer is not None:
+            self._idle_timer.cancel()
+            self._idle_timer = None
+        self._server.remove_connection(self)
+        logger.debug('TCP client %s disconnected', str(self._transport.get_extra_info('peername')))
+
+
+class AsyncProxyServer(ProxyServer):
+    """
+    Proxy server built on asyncio. Queries are processed concurrently, so many
+    Queries can wait for the upstream servers at the same time.
+    """
+
+    def __init__(self, configuration, worker=0):
+        """
+        Initialize the proxy server object
+
+        :param configuration: BrokenDnsProxyConfiguration object
+        :param worker: index of the worker process running the server
+        :return:
+        """
+        super(AsyncProxyServer, self).__init__(configuration, worker)
+        self._loop = None
+        # Tasks processing Queries, the loop holds only weak references to them
+        self._tasks = set()
+        # the Tasks are the pending Queries, nothing waits in a work queue
+        self._work_queue = None
+        # loop callback servicing the timer wheel
+        self._timers_handle = None
+        self._protocol_clients = self._create_client_pool(ProtocolClient)
+        # StreamListener objects of the connected TCP clients
+        self._stream_connections = set()
+        self._coalesce = self._configuration.getboolean(GlobalConfig.config_section_name(),
+                                                        GlobalConfig.CONFIG_COALESCE_QUERIES)
+        self._inflight = InflightQueries()
+
+    def __str__(self):
+        return "<AsyncProxyServer address='{0}' port='{1}' upstream_servers='{2}'>".format(self._listen_address,
+                                                                                           self._listen_port,
+                                                                                           self._upstream_servers)
+
+    def _send_later(self, delay, client, response_raw):
+        """
+        Park the response in the timer wheel serviced by one loop callback
+
+        :param delay: delay in seconds
+        :param client: detached Client object
+        :param response_raw: raw DNS message with the modified response
+        :return: None
+        """
+        self._timers.schedule(self._loop.time(), delay, self._send_delayed, client, response_raw)
+        self._arm_timers()
+
+    def _send_delayed(self, client, response_raw):
+        """
+        Send the delayed response and tell the listener the Query is finished
+
+        :param client: detached ProtocolClient object
+        :param response_raw: raw DNS message with the modified response
+        :return: None
+        """
+        done_callback = client.done_callback
+        super(AsyncProxyServer, self)._send_delayed(client, response_raw)
+        if done_callback is not None:
+            done_callback()
+
+    def _arm_timers(self):
+        """
+        Make sure the loop services the timer wheel at its next deadline
+
+        :return: None
+        """
+        deadline = self._timers.next_deadline()
+        if deadline is None:
+            return
+        if self._timers_handle is not None:
+            if self._timers_handle.when() <= deadline:
+                return
+            self._timers_handle.cancel()
+        self._timers_handle = self._loop.call_at(deadline, self._service_timers)
+
+    def _service_timers(self):
+        self._timers_handle = None
+        self._timers.advance(self._loop.time())
+        self._arm_timers()
+
+    def _pending(self):
+        """
+        Return the number of Queries being processed
+
+        :return: int
+        """
+        return len(self._tasks)
+
+    def _create_stub_upstream(self, stream=False):
+        from broken_dns_proxy.stub_upstream import AsyncStubUpstream
+
+        return AsyncStubUpstream(self._stub_resolver, stream)
+
+    def _get_udp_upstream(self, upstream_server):
+        """
+        Get the UdpUpstream object for the upstream server
+
+        :param upstream_server: address of the upstream server
+        :return: UdpUpstream object
+        """
+        try:
+            return self._udp_upstreams[upstream_server]
+        except KeyError:
+            if upstream_server == STUB_UPSTREAM:
+                upstream = self._create_stub_upstream()
+            else:
+                address, port = parse_upstream_address(upstream_server)
+                upstream = UdpUpstream(address, port, loop=self._loop)
+            self._udp_upstreams[upstream_server] = upstream
+            return upstream
+
+    def _get_tcp_upstream(self, upstream_server):
+        """
+        Get the pool of TCP connections to the upstream server
+
+        :param upstream_server: address of the upstream server
+        :return: TcpUpstream object
+        """
+        try:
+            return self._tcp_upstreams[upstream_server]
+        except KeyError:
+            if upstream_server == STUB_UPSTREAM:
+                upstream = self._create_stub_upstream(stream=True)
+            else:
+                address, port = parse_upstream_address(upstream_server)
+                upstream = TcpUpstream(address, port,
+                                       loop=self._loop,
+                                       max_connections=self._upstream_tcp_connections,
+                                       max_pipeline=self._upstream_tcp_pipeline,
+                                       idle_timeout=self._upstream_tcp_idle_timeout)
+            self._tcp_upstreams[upstream_server] = upstream
+            return upstream
+
+    async def _forward(self, msg_raw, upstream_server, stream=False):
+        """
+        Forward the Query to the upstream server. Queries received over TCP are
+        forwarded over TCP. Truncated UDP responses are retried over TCP.
+
+        :param msg_raw: raw DNS message with the client Query
+        :param upstream_server: address of the upstream server
+        :param stream: True if the client Query was received over TCP
+        :return: raw DNS message with the response
+        """
+        logger.debug("Forwarding Query to upstream server '%s'", str(upstream_server))
+        if stream:
+            return await self._get_tcp_upstream(upstream_server).query(msg_raw, self._retry_policy.timeout)
+
+        response_raw = await self._get_udp_upstream(upstream_server).query(msg_raw, self._retry_policy.timeout)
+        if wire.get_flags(response_raw) & dns.flags.TC:
+            logger.debug("Response from '%s' truncated... retrying over TCP", str(upstream_server))
+            full_response_raw = await self._get_tcp_upstream(upstream_server).query(msg_raw,
+                                                                                    self._retry_policy.timeout)
+            # the client would not be able to receive it over UDP anyway
+            if len(full_response_raw) <= self.max_udp_payload(msg_raw):
+                return full_response_raw
+        return response_raw
+
+    @property
+    def tcp_max_queries(self):
+        return self._tcp_max_queries
+
+    @property
+    def buffer_pool(self):
+        return self._buffer_pool
+
+    def add_connection(self, connection):
+        """
+        Register new client TCP connection
+
+        :param connection: StreamListener object
+        :return: False if the limit of connections was reached
+        """
+        if len(self._stream_connections) >= self._tcp_max_connections:
+            return False
+        self._stream_connections.add(connection)
+        return True
+
+    def remove_connection(self, connection):
+        self._stream_connections.discard(connection)
+
+    def call_later_idle(self, callback):
+        """
+        Schedule callback after the TCP idle timeout
+
+        :param callback: callable
+        :return: asyncio.TimerHandle object
+        """
+        return self._loop.call_later(self._tcp_idle_timeout, callback)
+
+    def handle_query(self, transport, msg_raw, client_addr=None, stream=False, done_callback=None):
+        """
+        Start processing of a Query received by one of the listeners
+
+        :param transport: asyncio transport on which the Query was received
+        :param msg_raw: raw DNS message with the Query
+        :param client_addr: address of the client (only for UDP)
+        :param stream: True if the Query was received over TCP
+        :param done_callback: called without arguments when the response is sent or the Query dropped
+        :return: None
+        """
+        received = time.perf_counter()
+        try:
+            client = self._protocol_clients.acquire(transport, msg_raw, client_addr, stream, received, done_callback)
+        except Exception as e:
+            logger.debug("Dropping malformed Query: %s", str(e))
+            if done_callback is not None:
+                done_callback()
+            return
+        self._metrics.parse_time.observe(time.perf_counter() - received)
+        action = self._admission.admit(client.client_addr(), self._pending(), received, stream)
+        if action is not None:
+            self._shed(client, action)
+            self._protocol_clients.release(client)
+            if done_callback is not None:
+                done_callback()
+            return
+        task = self._loop.create_task(self._process_client(client))
+        self._tasks.add(task)
+        task.add_done_callback(functools.partial(self._task_done, client))
+
+    def _task_done(self, client, task):
+        """
+        Clean up after the Task processing the Query finished. The delayed
+        response is still pending, _send_delayed() finishes the Query.
+
+        :param client: ProtocolClient object of the Query
+        :param task: finished Task
+        :return: None
+        """
+        self._tasks.discard(task)
+        if client.detached:
+            return
+        done_callback = client.done_callback
+        self._protocol_clients.release(client)
+        if done_callback is not None:
+            done_callback()
+
+    async def _query_upstream(self, msg_raw, upstream_server, stream):
+        """
+        Forward the Query to one upstream server and account the result
+
+        :param msg_raw: raw DNS message with the client Query
+        :param upstream_server: address of the upstream server
+        :param stream: True if the client Query was received over TCP
+        :return: raw DNS message with the response
+        """
+        start = time.monotonic()
+        try:
+            response_raw = await self._forward(msg_raw, upstream_server, stream)
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            logger.debug("Upstream server '%s' did not respond in time", str(upstream_server))
+            self._retry_policy.counters.timeouts += 1
+            self._upstream_selection.report_failure(upstream_server)
+            raise
+        except Exception as e:
+            logger.debug("Forwarding Query to '%s' failed: %s", str(upstream_server), str(e))
+            self._retry_policy.counters.failures += 1
+            self._upstream_selection.report_failure(upstream_server)
+            raise
+        rtt = time.monotonic() - start
+        self._upstream_selection.report(upstream_server, rtt)
+        self._retry_policy.report(rtt)
+        self._metrics.observe_upstream(upstream_server, rtt)
+        return response_raw
+
+    async def _query_hedged(self, msg_raw, tried, stream):
+        """
+        Forward the Query to an upstream server. If the response does not arrive
+        before the hedge delay, the Query is sent also to another upstream server
+        and the first response wins.
+
+        :param msg_raw: raw DNS message with the client Query
+        :param tried: list of upstream servers already tried, chosen servers are appended
+        :param stream: True if the client Query was received over TCP
+        :return: raw DNS message with the response
+        """
+        upstream_server = self._upstream_selection.choose_other(tried)
+        tried.append(upstream_server)
+        primary = self._loop.create_task(self._query_upstream(msg_raw, upstream_server, stream))
+        delay = self._retry_policy.hedge_delay()
+        if delay is None or len(tried) >= len(self._upstream_servers):
+            return await primary
+
+        done, _ = await asyncio.wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+
+        upstream_server = self._upstream_selection.choose_other(tried)
+        tried.append(upstream_server)
+        logger.debug("Hedging Query to upstream server '%s'", str(upstream_server))
+        self._retry_policy.counters.hedges += 1
+        hedged = self._loop.create_task(self._query_upstream(msg_raw, upstream_server, stream))
+        pending = {primary, hedged}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedged:
+                            self._retry_policy.counters.hedge_wins += 1
+                        return task.result()
+            # both failed
+            return primary.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _resolve(self, msg_raw, stream=False):
+        """
+        Get the response from upstream servers. A Query which failed or timed out
+        is retried on another upstream server until the retries are exhausted.
+
+        :param msg_raw: raw DNS message with the client Query
+        :param stream: True if the client Query was received over TCP
+        :return: raw DNS message with the response
+        """
+        tried = []
+        for attempt in range(self._retry_policy.attempts):
+            if attempt:
+                self._retry_policy.counters.retries += 1
+            try:
+                return await self._query_hedged(msg_raw, tried, stream)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                error = e
+        self._retry_policy.counters.exhausted += 1
+        raise error
+
+    async def _resolve_and_cache(self, msg_raw, stream):
+        """
+        Get the response from upstream servers and store it in the cache
+
+        :param msg_raw: raw DNS message with the client Query
+        :param stream: True if the client Query was received over TCP
+        :return: raw DNS message with the response
+        """
+        response_raw = await self._resolve(msg_raw, stream)
+        if self._cache is not None:
+            self._cache.put(msg_raw, response_raw, stream, self.max_udp_payload(msg_raw))
+        return response_raw
+
+    def _collect_metrics(self):
+        collected = super(AsyncProxyServer, self)._collect_metrics()
+        collected.append(('bdp_coalesced_queries_total', 'counter',
+                          'Queries which waited for identical Query already sent upstream.',
+                          [((), self._inflight.coalesced)]))
+        collected.append(('bdp_tcp_connections', 'gauge', 'Open client TCP connections.',
+                          [((), len(self._stream_connections))]))
+        return collected
+
+    async def _process_client(self, client):
+        """
+        Forward the client Query to upstream server and send the modified response back
+
+        :param client: Client object
+        :return: None
+        """
+        received = client.received
+        if received is not None:
+            # the Task waits for the loop as long as the loop is busy
+            action = self._admission.check_delay(received, time.perf_counter(), client.is_stream())
+            if action is not None:
+                self._shed(client, action)
+                return
+
+        try:
+            msg_raw = client.msg_raw()
+            dump = self._dump_sampler.sample(msg_raw)
+            if dump:
+                logger.debug("Received DNS message:\n"
+                             "-----------------------------\n"
+                             "%s\n"
+                             "-----------------------------", LazyMessageDump(msg_raw))
+
+            stream = client.is_stream()
+            max_udp_payload = self.max_udp_payload(msg_raw)
+            response_raw = self._cache.get(msg_raw, stream, max_udp_payload) if self._cache is not None else None
+            if response_raw is None:
+                key = self._inflight.key(msg_raw, stream, max_udp_payload) if self._coalesce else None
+                try:
+                    response_raw = await self._inflight.resolve(msg_raw, key,
+                                                                lambda: self._resolve_and_cache(msg_raw, stream))
+                except Exception as e:
+                    logger.debug("Unable to get response from upstream servers: %s", str(e))
+                    self._send_servfail(client)
+                    if received is not None:
+                        self._metrics.service_time.observe(time.perf_counter() - received)
+                    return
+            else:
+                logger.debug("Using cached response")
+
+            # modify the message for client
+            chain_start = time.perf_counter()
+            chain = self._chains.select(msg_raw, client.client_addr())
+            response_raw = self._modify(chain, response_raw)
+            self._metrics.chain_time.observe(time.perf_counter() - chain_start)
+            self._metrics.count_modified(chain)
+
+            if dump:
+                logger.debug("Sending DNS message:\n"
+                             "-----------------------------\n"
+                             "%s\n"
+                             "-----------------------------", LazyMessageDump(response_raw))
+            self._metrics.count_response(stream, response_raw)
+            self._send_response(client, chain, response_raw)
+            if received is not None:
+                self._metrics.service_time.observe(time.perf_counter() - received)
+        except WireFormatError as e:
+            # the Task has nobody to report to, the Query is dropped as in the select engine
+            logger.debug("Dropping malformed Query: %s", str(e))
+
+    async def _start_listeners(self):
+        """
+        Create the listening sockets and attach asyncio protocols to them
+
+        :return: list of created asyncio transports and servers
+        """
+        s_udp6, s_tcp6 = self._create_sockets()
+        s_udp6.setblocking(False)
+        s_tcp6.setblocking(False)
+        udp_transport, _ = await self._loop.create_datagram_endpoint(lambda: DatagramListener(self), sock=s_udp6)
+        tcp_server = await self._loop.create_server(lambda: StreamListener(self), sock=s_tcp6,
+                                                    backlog=self._tcp_backlog)
+        return [udp_transport, tcp_server]
+
+    def process(self):
+        """
+        Start listening and processing Queries.
+        :return:
+        """
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        listeners = []
+        try:
+            listeners = self._loop.run_until_complete(self._start_listeners())
+            self._start_control()
+
+            logger.info('Listening on port %s...', str(self._listen_port))
+
+            self._loop.run_forever()
+        finally:
+            for listener in listeners:
+                listener.close()
+            for connection in list(self._stream_connections):
+                connection.abort()
+            if self._tasks:
+                for task in self._tasks:
+                    task.cancel()
+                self._loop.run_until_complete(asyncio.gather(*self._tasks, return_exceptions=True))
+            self._stop_control()
+            self._close_sockets()
+            logger.info('Upstream Queries: %s', str(self._retry_policy.counters))
+            logger.info('Coalesced Queries: %s', str(self._inflight))
+            asyncio.set_event_loop(None)
+            self._loop.close()
+
+    def stop(self):
+        """
+        Stop processing Queries. Can be called from any thread.
+
+        :return: None
+        """
+        self._loop.call_soon_threadsafe(self._loop.stop)
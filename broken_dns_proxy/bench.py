@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+
+import asyncio
+import collections
+import random
+import time
+
+import dns.message
+import dns.rcode
+import dns.rdatatype
+
+from broken_dns_proxy import wire
+from broken_dns_proxy.logger import logger
+from broken_dns_proxy.exceptions import BrokenDNSProxyError
+from broken_dns_proxy.metrics import Histogram
+from broken_dns_proxy.upstream import UdpUpstream, TcpUpstream
+
+
+class QueryMix(object):
+    """
+    Queries to send, encoded in advance. The message ID is replaced when sending.
+    """
+
+    def __init__(self, queries, weights=None):
+        """
+        Constructor
+
+        :param queries: list of (qname, qtype) tuples
+        :param weights: relative frequency of every Query, None for the same frequency
+        :return: new object
+        """
+        if not queries:
+            raise BrokenDNSProxyError("The Query mix is empty!")
+        try:
+            self._queries = [dns.message.make_query(qname, qtype).to_wire() for qname, qtype in queries]
+        except Exception as e:
+            raise BrokenDNSProxyError("Wrong Query in the mix: {0}".format(str(e)))
+        self._weights = weights
+        self._index = 0
+
+    def __len__(self):
+        return len(self._queries)
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        Read the Queries from file with '<name> <type>' on every line, like
+        the files used by dnsperf. Empty lines and lines starting with '#' are skipped.
+
+        :param path: path to the file
+        :return: QueryMix object
+        """
+        queries = []
+        try:
+            with open(path) as f:
+                for line in f:
+                    fields = line.split()
+                    if not fields or fields[0].startswith('#'):
+                        continue
+                    queries.append((fields[0], fields[1] if len(fields) > 1 else 'A'))
+        except IOError as e:
+            raise BrokenDNSProxyError("Unable to read Queries from '{0}': {1}".format(path, e.strerror))
+        return cls(queries)
+
+    @classmethod
+    def synthesize(cls, zone, names, qtypes):
+        """
+        Create Queries for random names in the zone
+
+        :param zone: zone the names are in
+        :param names: number of distinct names
+        :param qtypes: dictionary {qtype: relative frequency}
+        :return: QueryMix object
+        """
+        queries = []
+        weights = []
+        for i in range(names):
+            qname = 'q{0}.{1}'.format(i, zone)
+            for qtype, weight in sorted(qtypes.items()):
+                queries.append((qname, qtype))
+                weights.append(weight)
+        return cls(queries, weights)
+
+    @staticmethod
+    def parse_qtypes(value):
+        """
+        Parse the Query types distribution
+
+        :param value: string like 'A:70,AAAA:20,MX:10'
+        :return: dictionary {qtype: relative frequency}
+        """
+        qtypes = dict()
+        for item in value.split(','):
+            qtype, _, weight = item.strip().partition(':')
+            try:
+                dns.rdatatype.from_text(qtype)
+                qtypes[qtype.upper()] = float(weight) if weight else 1.0
+            except (ValueError, dns.rdatatype.UnknownRdatatype):
+                raise BrokenDNSProxyError("Wrong Query type distribution '{0}'".format(value))
+        return qtypes
+
+    def next(self):
+        """
+        Return the next Query to send
+
+        :return: raw DNS message
+        """
+        if self._weights is not None:
+            return random.choices(self._queries, self._weights)[0]
+        query = self._queries[self._index]
+        self._index = (self._index + 1) % len(self._queries)
+        return query
+
+
+class BenchResult(object):
+    """
+    Results of one benchmark run. Latencies are counted in a histogram,
+    so the memory doesn't grow with the length of the run.
+    """
+
+    def __init__(self):
+        self.sent = 0
+        self.received = 0
+        self.lost = 0
+        self.errors = 0
+        # Queries not sent in open-loop mode, because too many were outstanding
+        self.skipped = 0
+        self.rcodes = collections.Counter()
+        self.latency = Histogram()
+        self.elapsed = 0.0
+
+    def record(self, response_raw, latency):
+        self.received += 1
+        self.rcodes[wire.get_flags(response_raw) & 0xF] += 1
+        self.latency.observe(latency)
+
+    @property
+    def qps(self):
+        return self.received / self.elapsed if self.elapsed else 0.0
+
+    def percentile(self, p):
+        """
+        Return the p-th percentile of the response latencies, rounded up to the histogram bucket bound
+
+        :param p: percentile between 0 and 100
+        :return: latency in seconds or None if there are no responses
+        """
+        return self.latency.percentile(p)
+
+    def report(self):
+        """
+        Return human readable report
+
+        :return: str
+        """
+        def ms(value):
+            return '{0:.3f} ms'.format(value * 1000) if value is not None else '-'
+
+        lines = ['Queries sent:      {0}'.format(self.sent),
+                 'Responses:         {0} ({1})'.format(self.received, ', '.join(
+                     '{0} {1}'.format(dns.rcode.to_text(rcode), count) for rcode, count in sorted(self.rcodes.items()))),
+                 'Lost:              {0} ({1:.2f}%)'.format(self.lost,
+                                                           100.0 * self.lost / self.sent if self.sent else 0.0),
+                 'Errors:            {0}'.format(self.errors),
+                 'Elapsed:           {0:.3f} s'.format(self.elapsed),
+                 'Achieved QPS:      {0:.1f}'.format(self.qps),
+                 'Latency p50:       {0}'.format(ms(self.percentile(50))),
+                 'Latency p99:       {0}'.format(ms(self.percentile(99))),
+                 'Latency p99.9:     {0}'.format(ms(self.percentile(99.9)))]
+        if self.skipped:
+            lines.insert(1, 'Queries skipped:   {0} (too many outstanding)'.format(self.skipped))
+        return '\n'.join(lines)
+
+
+class LoadGenerator(object):
+    """
+    Sends the Query mix to the proxy over UDP or TCP, either in closed loop
+    (every worker sends the next Query when it gets the response) or at the
+    target rate regardless of the responses.
+    """
+
+    def __init__(self, address, port, mix, stream=False, concurrency=16, qps=0, duration=10.0, count=0,
+                 timeout=2.0, sockets=8):
+        """
+        Constructor
+
+        :param address: address of the proxy
+        :param port: port of the proxy
+        :param mix: QueryMix object
+        :param stream: True to send the Queries over TCP
+        :param concurrency: number of closed-loop workers, or the limit of outstanding Queries at target rate
+        :param qps: target rate in Queries per second, 0 for closed loop
+        :param duration: seconds to run, 0 for no limit
+        :param count: number of Queries to send, 0 for no limit
+        :param timeout: seconds after which the Query is considered lost
+        :param sockets: number of UDP sockets or TCP connections to spread the Queries over
+        :return: new object
+        """
+        if not duration and not count:
+            raise BrokenDNSProxyError("Either duration or count of Queries must be set!")
+        self._address = address
+        self._port = port
+        self._mix = mix
+        self._stream = stream
+        self._concurrency = max(1, concurrency)
+        self._qps = qps
+        self._duration = duration
+        self._count = count
+        self._timeout = timeout
+        self._sockets = max(1, sockets)
+        self._clients = []
+        self._next_client = 0
+        self._outstanding = 0
+        self._deadline = None
+        self._result = None
+
+    def _create_clients(self, loop):
+        if self._stream:
+            # one pool spreading the pipelined Queries over the connections
+            self._clients = [TcpUpstream(self._address, self._port, loop=loop, max_connections=self._sockets,
+                                         max_pipeline=max(1, self._concurrency // self._sockets))]
+        else:
+            # more source ports, so the Queries are spread among the proxy workers
+            self._clients = [UdpUpstream(self._address, self._port, loop=loop) for _ in range(self._sockets)]
+
+    def _more(self):
+        if self._count and self._result.sent >= self._count:
+            return False
+        return not self._deadline or time.monotonic() < self._deadline
+
+    async def _query(self):
+        result = self._result
+        client = self._clients[self._next_client]
+        self._next_client = (self._next_client + 1) % len(self._clients)
+        result.sent += 1
+        self._outstanding += 1
+        start = time.perf_counter()
+        try:
+            response_raw = await client.query(self._mix.next(), self._timeout)
+        except asyncio.TimeoutError:
+            result.lost += 1
+        except Exception as e:
+            logger.debug('Query failed: %s', str(e))
+            result.errors += 1
+        else:
+            result.record(response_raw, time.perf_counter() - start)
+        finally:
+            self._outstanding -= 1
+
+    async def _closed_loop_worker(self):
+        while self._more():
+            await self._query()
+
+    async def _open_loop(self):
+        loop = asyncio.get_running_loop()
+        tasks = set()
+        interval = 1.0 / self._qps
+        start = time.monotonic()
+        sent = 0
+        while self._more():
+            delay = start + sent * interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            sent += 1
+            if self._outstanding >= self._concurrency:
+                self._result.skipped += 1
+                continue
+            task = loop.create_task(self._query())
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    async def run(self):
+        """
+        Run the benchmark
+
+        :return: BenchResult object
+        """
+        self._result = BenchResult()
+        self._create_clients(asyncio.get_running_loop())
+        start = time.monotonic()
+        self._deadline = start + self._duration if self._duration else None
+        try:
+            if self._qps:
+                await self._open_loop()
+            else:
+                await asyncio.gather(*[self._closed_loop_worker() for _ in range(self._concurrency)])
+        finally:
+            self._result.elapsed = time.monotonic() - start
+            for client in self._clients:
+                client.close()
+        return self._result
+
+
+def run_bench(args):
+    """
+    Run the benchmark configured from the command line and print the report
+
+    :param args: BenchArgumentsParser object
+    :return: BenchResult object
+    """
+    if args.queries:
+        mix = QueryMix.from_file(args.queries)
+    else:
+        mix = QueryMix.synthesize(args.zone, args.names, QueryMix.parse_qtypes(args.qtypes))
+    generator = LoadGenerator(args.address, args.port, mix, stream=args.tcp, concurrency=args.concurrency,
+                              qps=args.qps, duration=args.duration, count=args.count, timeout=args.timeout,
+                              sockets=args.sockets)
+    logger.info("Sending %d distinct Queries to %s port %d over %s (%s)...", len(mix), args.address, args.port,
+                'TCP' if args.tcp else 'UDP',
+                '{0} QPS'.format(args.qps) if args.qps else 'closed loop, concurrency {0}'.format(args.concurrency))
+    result = asyncio.run(generator.run())
+    print(result.report())
+    return result
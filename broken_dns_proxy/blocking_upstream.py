@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+
+import socket
+import struct
+
+from broken_dns_proxy import wire
+from broken_dns_proxy.logger import logger
+from broken_dns_proxy.exceptions import BrokenDNSProxyError, UpstreamConnectionError
+
+
+# name of the upstream server answering from the zone files in the proxy process
+STUB_UPSTREAM = 'stub'
+
+
+def parse_upstream_address(upstream_server, default_port=53):
+    """
+    Split the upstream server from configuration into address and port
+
+    :param upstream_server: 'address' or 'address@port'
+    :param default_port: port used if not specified
+    :return: tuple (address, port)
+    """
+    address, separator, port = upstream_server.rpartition('@')
+    if not separator:
+        return upstream_server, default_port
+    try:
+        return address, int(port)
+    except ValueError:
+        raise BrokenDNSProxyError("Wrong port in upstream server '{0}'".format(upstream_server))
+
+
+class BlockingUdpUpstream(object):
+    """
+    Blocking UDP client for one upstream server. Every Query is sent from
+    a new socket, so it gets a random source port.
+    """
+
+    def __init__(self, address, port=53, timeout=None):
+        """
+        Constructor
+
+        :param address: address of the upstream server
+        :param port: port of the upstream server
+        :param timeout: socket timeout in seconds
+        :return: new object
+        """
+        self.address = address
+        self.port = port
+        self._timeout = timeout
+
+    def query(self, msg_raw):
+        """
+        Send the Query to the upstream server and wait for the response.
+
+        :param msg_raw: raw DNS message with the Query
+        :return: raw DNS message with the response
+        """
+        msg_id = wire.get_id(msg_raw)
+        family = socket.AF_INET6 if ':' in self.address else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_DGRAM)
+        try:
+            sock.settimeout(self._timeout)
+            sock.connect((self.address, self.port))
+            sock.send(msg_raw)
+            while True:
+                response_raw = sock.recv(2**16)
+                # skip anything what is not the response to our Query
+                if len(response_raw) >= wire.HEADER_LENGTH and wire.get_id(response_raw) == msg_id:
+                    return response_raw
+        finally:
+            sock.close()
+
+    def close(self):
+        pass
+
+
+class BlockingTcpUpstream(object):
+    """
+    Blocking client keeping one persistent TCP connection to an upstream server.
+    Lost connection is reopened transparently.
+    """
+
+    def __init__(self, address, port=53, timeout=None):
+        """
+        Constructor
+
+        :param address: address of the upstream server
+        :param port: port of the upstream server
+        :param timeout: socket timeout in seconds
+        :return: new object
+        """
+        self.address = address
+        self.port = port
+        self._timeout = timeout
+        self._sock = None
+
+    def _recv_exactly(self, length):
+        data = bytearray()
+        while len(data) < length:
+            chunk = self._sock.recv(length - len(data))
+            if not chunk:
+                raise UpstreamConnectionError("Connection to '{0}' closed".format(self.address))
+            data.extend(chunk)
+        return bytes(data)
+
+    def _exchange(self, msg_raw, msg_id):
+        if self._sock is None:
+            logger.debug("Opening new TCP connection to upstream server '%s'", self.address)
+            self._sock = socket.create_connection((self.address, self.port), self._timeout)
+        self._sock.sendall(struct.pack('!H', len(msg_raw)) + msg_raw)
+        while True:
+            msg_len = struct.unpack('!H', self._recv_exactly(2))[0]
+            if msg_len < wire.HEADER_LENGTH:
+                # the stream can't be trusted any more, the connection is reopened
+                raise UpstreamConnectionError("Response of length {0} from '{1}' is shorter than DNS header".format(
+                    msg_len, self.address))
+            response_raw = self._recv_exactly(msg_len)
+            # skip responses to Queries which timed out before
+            if struct.unpack('!H', response_raw[:2])[0] == msg_id:
+                return response_raw
+
+    def query(self, msg_raw):
+        """
+        Send the Query to the upstream server and wait for the response.
+
+        :param msg_raw: raw DNS message with the Query
+        :return: raw DNS message with the response
+        """
+        msg_id = wire.get_id(msg_raw)
+        try:
+            response_raw = self._exchange(msg_raw, msg_id)
+        except socket.timeout:
+            self.close()
+            raise
+        except (socket.error, UpstreamConnectionError) as e:
+            logger.debug("TCP connection to '%s' failed: %s... retrying", self.address, str(e))
+            self.close()
+            try:
+                response_raw = self._exchange(msg_raw, msg_id)
+            except (socket.error, UpstreamConnectionError):
+                self.close()
+                raise
+        return response_raw
+
+    def close(self):
+        """
+        Close the connection to the upstream server.
+
+        :return: None
+        """
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
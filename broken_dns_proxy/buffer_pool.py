@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+
+import struct
+
+
+# large enough for any datagram and for an incomplete TCP message (2B length
+# and up to 65535B of data) followed by room for the next read
+BUFFER_SIZE = 2**17
+MAX_DATAGRAM = 2**16 - 1
+
+_SHORT = struct.Struct('!H')
+
+
+class BufferPool(object):
+    """
+    Free list of receive buffers of the same size. Data are received into the
+    buffers with recv_into()/recvfrom_into() and handed over as memoryview
+    slices, so no new bytes object is allocated for every message.
+    """
+
+    def __init__(self, buffer_size=BUFFER_SIZE, max_free=64):
+        """
+        Constructor
+
+        :param buffer_size: size of every buffer in bytes
+        :param max_free: maximal number of unused buffers kept for later
+        :return: new object
+        """
+        self.buffer_size = buffer_size
+        self._max_free = max_free
+        self._free = []
+        # number of buffers created and of buffers served from the free list
+        self.allocated = 0
+        self.reused = 0
+
+    def __str__(self):
+        return "<BufferPool buffer_size='{0}' free='{1}' allocated='{2}' reused='{3}'>".format(
+            self.buffer_size, len(self._free), self.allocated, self.reused)
+
+    def __len__(self):
+        return len(self._free)
+
+    def acquire(self):
+        """
+        Return unused buffer
+
+        :return: bytearray
+        """
+        if self._free:
+            self.reused += 1
+            return self._free.pop()
+        self.allocated += 1
+        return bytearray(self.buffer_size)
+
+    def release(self, buf):
+        """
+        Return the buffer to the pool. Memoryviews of the buffer must not
+        be used once the buffer is acquired again.
+
+        :param buf: bytearray returned by acquire()
+        :return: None
+        """
+        if len(self._free) < self._max_free:
+            self._free.append(buf)
+
+
+class StreamReassembler(object):
+    """
+    Splits data read from a TCP connection into DNS messages prefixed with
+    2B length (RFC 1035 section 4.2.2). The data are read straight into a pooled
+    buffer, complete messages are returned as memoryview slices of it and only
+    an incomplete message at the end is moved to the start of the buffer.
+
+    The buffer is held only while an incomplete message waits for the rest
+    of its data. The messages are valid until the next call of get_buffer()
+    on any reassembler using the same pool.
+    """
+
+    def __init__(self, pool):
+        """
+        Constructor
+
+        :param pool: BufferPool with buffers of at least BUFFER_SIZE bytes
+        :return: new object
+        """
+        self._pool = pool
+        self._buffer = None
+        # incomplete data are buffer[start:end]
+        self._start = 0
+        self._end = 0
+
+    def pending(self):
+        """
+        Return the number of bytes of incomplete message
+
+        :return: int
+        """
+        return self._end - self._start
+
+    def get_buffer(self):
+        """
+        Return the writable part of the buffer the next data should be read into
+
+        :return: memoryview
+        """
+        if self._buffer is None:
+            self._buffer = self._pool.acquire()
+        elif self._start:
+            # the incomplete message always fits in the free space before it
+            length = self._end - self._start
+            self._buffer[:length] = self._buffer[self._start:self._end]
+            self._start, self._end = 0, length
+        return memoryview(self._buffer)[self._end:]
+
+    def buffer_updated(self, nbytes, max_messages=0):
+        """
+        Account data written into the buffer returned by get_buffer()
+
+        :param nbytes: number of bytes written
+        :param max_messages: maximal number of messages to return, 0 for no limit
+        :return: list of memoryview with the complete messages
+        """
+        self._end += nbytes
+        view = memoryview(self._buffer)
+        messages = []
+        start, end = self._start, self._end
+        while end - start >= 2:
+            msg_len = _SHORT.unpack_from(view, start)[0]
+            if end - start < msg_len + 2:
+                break
+            messages.append(view[start + 2:start + 2 + msg_len])
+            start += msg_len + 2
+            if max_messages and len(messages) >= max_messages:
+                break
+        self._start = start
+        if start == end:
+            self.release()
+        return messages
+
+    def release(self):
+        """
+        Drop the incomplete data and return the buffer to the pool
+
+        :return: None
+        """
+        if self._buffer is not None:
+            self._pool.release(self._buffer)
+            self._buffer = None
+        self._start = self._end = 0
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+
+import struct
+import time
+from collections import OrderedDict
+
+import dns.flags
+import dns.rcode
+
+from broken_dns_proxy import wire
+from broken_dns_proxy.exceptions import WireFormatError
+
+
+class CacheEntry(object):
+    """
+    One cached upstream response
+    """
+
+    __slots__ = ('response_raw', 'stored', 'ttl')
+
+    def __init__(self, response_raw, stored, ttl):
+        self.response_raw = response_raw
+        self.stored = stored
+        self.ttl = ttl
+
+
+class ResponseCache(object):
+    """
+    Bounded LRU cache of upstream responses honouring the TTLs.
+    Responses are stored unmodified, so the ModificationChain runs on every
+    cached answer as it would on a fresh one.
+    """
+
+    # rcodes of responses which are cached (RFC 2308 negative caching included)
+    CACHEABLE_RCODES = (dns.rcode.NOERROR, dns.rcode.NXDOMAIN)
+
+    def __init__(self, max_entries, max_bytes=0, clock=time.monotonic):
+        """
+        Constructor
+
+        :param max_entries: maximal number of cached responses
+        :param max_bytes: maximal size of all cached responses in bytes, 0 for no limit
+        :param clock: function returning current time in seconds
+        :return: new object
+        """
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._clock = clock
+        self._entries = OrderedDict()
+        self.size_bytes = 0
+        # statistics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __str__(self):
+        return "<ResponseCache entries='{0}' bytes='{1}' hits='{2}' misses='{3}' evictions='{4}' " \
+               "expirations='{5}'>".format(len(self._entries), self.size_bytes, self.hits, self.misses,
+                                           self.evictions, self.expirations)
+
+    @staticmethod
+    def key(msg_raw, stream=False, max_udp_payload=512):
+        """
+        Return the cache key for the Query
+
+        :param msg_raw: raw DNS message with the Query
+        :param stream: True if the Query was received over TCP
+        :param max_udp_payload: maximal size of UDP response the client is able to receive
+        :return: tuple (qname, qtype, qclass, DO bit, CD bit, stream, UDP payload size) or None
+                 if the Query can't be cached
+        """
+        if wire.get_count(msg_raw, wire.QUESTION) != 1:
+            return None
+        try:
+            qname, qtype, qclass = wire.parse_question(msg_raw)
+        except WireFormatError:
+            # malformed question is never cached, the upstream server answers it
+            return None
+        opt = wire.find_opt(msg_raw)
+        do = opt is not None and bool(wire.get_edns_flags(msg_raw, opt) & dns.flags.DO)
+        # the response over UDP may be truncated depending on the size client can receive
+        return qname, qtype, qclass, do, bool(wire.get_flags(msg_raw) & dns.flags.CD), \
+            stream, None if stream else max_udp_payload
+
+    @staticmethod
+    def response_ttl(response_raw):
+        """
+        Return for how long the response can be cached
+
+        :param response_raw: raw DNS message with the response
+        :return: TTL in seconds or None if the response can't be cached
+        """
+        flags = wire.get_flags(response_raw)
+        if flags & 0xF not in ResponseCache.CACHEABLE_RCODES or flags & dns.flags.TC:
+            return None
+        ttl = None
+        negative_ttl = None
+        for rr in wire.iter_records(response_raw):
+            if rr.rdtype == wire.TYPE_OPT:
+                continue
+            rr_ttl = wire.get_ttl(response_raw, rr)
+            ttl = rr_ttl if ttl is None else min(ttl, rr_ttl)
+            if rr.section == wire.AUTHORITY and rr.rdtype == wire.TYPE_SOA:
+                # SOA MINIMUM is the last field of RDATA
+                minimum = struct.unpack_from('!I', response_raw, rr.rdata + rr.rdlength - 4)[0]
+                negative_ttl = min(rr_ttl, minimum)
+        if wire.get_count(response_raw, wire.ANSWER) == 0:
+            # negative answer is cached according to the SOA record (RFC 2308)
+            return negative_ttl
+        return ttl
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self.size_bytes -= len(entry.response_raw)
+
+    def get(self, msg_raw, stream=False, max_udp_payload=512):
+        """
+        Return the cached response to the Query, with TTLs decreased by the time spent in cache
+
+        :param msg_raw: raw DNS message with the Query
+        :param stream: True if the Query was received over TCP
+        :param max_udp_payload: maximal size of UDP response the client is able to receive
+        :return: raw DNS message with the response or None
+        """
+        key = self.key(msg_raw, stream, max_udp_payload)
+        entry = self._entries.get(key) if key is not None else None
+        if entry is None:
+            self.misses += 1
+            return None
+
+        age = int(self._clock() - entry.stored)
+        if age >= entry.ttl:
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        response = bytearray(entry.response_raw)
+        wire.set_id(response, wire.get_id(msg_raw))
+        # keep the case of the Query name
+        question_end = wire.copy_question(response, msg_raw)
+        if age:
+            for rr in wire.iter_records(response, question_end):
+                if rr.rdtype != wire.TYPE_OPT:
+                    wire.set_ttl(response, rr, max(0, wire.get_ttl(response, rr) - age))
+        return response
+
+    def put(self, msg_raw, response_raw, stream=False, max_udp_payload=512):
+        """
+        Store the upstream response to the Query, if it can be cached
+
+        :param msg_raw: raw DNS message with the Query
+        :param response_raw: raw DNS message with the upstream response
+        :param stream: True if the Query was received over TCP
+        :param max_udp_payload: maximal size of UDP response the client is able to receive
+        :return: None
+        """
+        key = self.key(msg_raw, stream, max_udp_payload)
+        if key is None:
+            return
+        ttl = self.response_ttl(response_raw)
+        if not ttl:
+            return
+
+        if self._max_bytes and len(response_raw) > self._max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = CacheEntry(bytes(response_raw), self._clock(), ttl)
+        self.size_bytes += len(response_raw)
+
+        # evict the least recently used entries
+        while len(self._entries) > self._max_entries or (self._max_bytes and self.size_bytes > self._max_bytes):
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
@@ -19,83 +19,104 @@
 # Authors:
 
 import socket
-import dns.message
 import struct
+import sys
 
+import dns.flags
+
+from broken_dns_proxy import wire
 from broken_dns_proxy.exceptions import BrokenDNSProxyError
-from broken_dns_proxy.logger import logger
+from broken_dns_proxy.logger import logger, LazyMessageDump
+
+
+_SHORT = struct.Struct('!H')
 
 
 class Client(object):
     """
-    Class representing a client connection
+    Record of one client Query, kept while the Query is processed. Records
+    don't have instance dictionary and are recycled by ClientPool, so there
+    is no new object for every Query and hundreds of thousands of Queries
+    can wait for their responses at once.
     """
 
-    _client_sock = None
-    _client_addr = None
-    _client_msg_len = None
-    _client_msg_raw = ''
-    _client_msg = None
+    __slots__ = ('_transport', '_client_addr', '_client_msg_raw', 'query_id', 'received', '_detached')
 
-    def __init__(self, server_socket):
+    def __init__(self, server_socket, buffer=None, received=None):
         """
         Constructor
 
         :param server_socket: The socket object on which we have possible client pending
+        :param buffer: bytearray the Query is received into, the Query is valid only until the buffer is reused
+        :param received: time.perf_counter() value when the Query was received
+        :return: None
+        """
+        self.setup(server_socket, buffer, received)
+
+    def setup(self, server_socket, buffer=None, received=None):
+        """
+        Receive the Query into the record, the arguments are the same as of the constructor
+
         :return: None
         """
-        if server_socket.type not in (socket.SOCK_DGRAM, socket.SOCK_STREAM):
+        # TCP clients are handled by TcpClientConnection
+        if server_socket.type != socket.SOCK_DGRAM:
             raise BrokenDNSProxyError("Pending client on socket with wrong type '{0}'".format(server_socket.type))
 
-        self._receive_client_msg(server_socket)
-        self._client_msg = dns.message.from_wire(self._client_msg_raw)
-        logger.debug("Received DNS message:\n"
-                     "-----------------------------\n"
-                     "%s\n"
-                     "-----------------------------", str(self._client_msg))
+        self._transport = server_socket
+        self.received = received
+        self._detached = False
+        self._receive_client_msg(server_socket, buffer)
+        self._check_client_msg()
 
-    def _receive_client_msg(self, server_socket):
+    def clear(self):
         """
+        Drop the references to the Query and the client, so the record
+        in the free list doesn't keep them alive
 
-        :param server_socket:
-        :return:
+        :return: None
         """
-        if server_socket.type == socket.SOCK_STREAM:
-            self._handle_stream_socket(server_socket)
-        elif server_socket.type == socket.SOCK_DGRAM:
-            self._handle_datagram_socket(server_socket)
+        self._transport = None
+        self._client_addr = None
+        self._client_msg_raw = None
 
-    def _handle_stream_socket(self, server_socket):
+    def _check_client_msg(self):
         """
+        Check the raw client Query. The Query is not parsed into DNS Message
+        object unless somebody asks for it.
 
-        :param server_socket:
-        :return:
+        :return: None
         """
-        self._client_sock, self._client_addr = server_socket.accept()
-        logger.debug('TCP client %s connected', str(self._client_addr))
+        wire.check_header(self._client_msg_raw)
+        if wire.get_flags(self._client_msg_raw) & dns.flags.QR:
+            raise BrokenDNSProxyError("Received DNS message is not a Query")
+        self.query_id = wire.get_id(self._client_msg_raw)
+        logger.debug("Received DNS message with ID '%d'", self.query_id)
 
-        self._client_msg_len = struct.unpack('!H', self._client_sock.recv(2))[0]
-        logger.debug('TCP Query of length %s', str(self._client_msg_len))
+    def _receive_client_msg(self, server_socket, buffer=None):
+        """
 
-        while len(self._client_msg_raw) < self._client_msg_len:
-            # read all data
-            chunk = self._client_sock.recv(self._client_msg_len - len(self._client_msg_raw))
-            if not chunk:
-                raise BrokenDNSProxyError('Unable to get all TCP data')
-            self._client_msg_raw += chunk
+        :param server_socket:
+        :param buffer:
+        :return:
+        """
+        self._handle_datagram_socket(server_socket, buffer)
 
-    def _handle_datagram_socket(self, server_socket):
+    def _handle_datagram_socket(self, server_socket, buffer=None):
         """
 
         :param server_socket:
+        :param buffer:
         :return:
         """
-        # 16bit max udp length limit
-        self._client_msg_raw, self._client_addr = server_socket.recvfrom(2**16)
+        if buffer is not None:
+            msg_len, self._client_addr = server_socket.recvfrom_into(buffer)
+            self._client_msg_raw = memoryview(buffer)[:msg_len]
+        else:
+            # 16bit max udp length limit
+            self._client_msg_raw, self._client_addr = server_socket.recvfrom(2**16)
         logger.debug('Received UDP data from: %s', str(self._client_addr))
-        self._client_msg_len = len(self._client_msg_raw)
-        logger.debug('UDP Query of length %s', str(self._client_msg_len))
-        self._client_sock = server_socket
+        logger.debug('UDP Query of length %s', str(len(self._client_msg_raw)))
 
     def msg(self):
         """
@@ -103,7 +124,54 @@ class Client(object):
 
         :return: DNS Message object with the client Query
         """
-        return self._client_msg
+        # importing the message parser is slow and most Queries never need it,
+        # the parsed message is not kept to keep the record small
+        import dns.message
+
+        return dns.message.from_wire(bytes(self._client_msg_raw))
+
+    def msg_raw(self):
+        """
+        Returns the raw DNS message with the client query
+
+        :return: raw DNS message with the client Query
+        """
+        return self._client_msg_raw
+
+    def client_addr(self):
+        """
+        Returns the address of the client
+
+        :return: address tuple as returned by socket
+        """
+        return self._client_addr
+
+    def is_stream(self):
+        """
+        Returns True if the client is connected using TCP
+
+        :return: bool
+        """
+        return self._transport.type == socket.SOCK_STREAM
+
+    @property
+    def detached(self):
+        """
+        True if the response is sent later and the record must be kept until then
+
+        :return: bool
+        """
+        return self._detached
+
+    def detach(self):
+        """
+        Keep the Query valid after the receive buffer is reused, so the
+        response can be sent later.
+
+        :return: None
+        """
+        self._client_msg_raw = bytes(self._client_msg_raw)
+        self._detached = True
 
     def send(self, msg):
         """
@@ -116,38 +184,125 @@ class Client(object):
                      '-----------------------------\n'
                      '%s\n'
                      '-----------------------------',
-                     str(self._client_addr), str(msg))
+                     str(self._client_addr), LazyMessageDump(msg))
 
-        if self._client_sock.type == socket.SOCK_STREAM:
-            self._send_stream(msg)
-        elif self._client_sock.type == socket.SOCK_DGRAM:
-            self._send_datagram(msg)
+        self.send_raw(msg.to_wire())
 
-    def _send_stream(self, msg):
+    def send_raw(self, msg_raw):
         """
-        Send DNS Message to client connected using TCP
+        Send the raw DNS message as a response to the client query.
 
-        :param msg: DNS Message object to sent to the client
+        :param msg_raw: raw DNS message
         :return: None
         """
         # to make sure the Response ID matches the Query ID
-        msg.id = self._client_msg.id
-        msg_raw = msg.to_wire()
+        msg_raw = _SHORT.pack(self.query_id) + msg_raw[2:]
+        logger.debug('Sending response of length %s to client %s', str(len(msg_raw)), str(self._client_addr))
+
+        if self.is_stream():
+            self._send_stream(msg_raw)
+        else:
+            self._send_datagram(msg_raw)
+        # the record is not needed after the response is sent
+        self._detached = False
+
+    def _send_stream(self, msg_raw):
+        """
+        Send raw DNS Message to client connected using TCP
+
+        :param msg_raw: raw DNS Message to sent to the client
+        :return: None
+        """
         msg_len = struct.pack('!H', len(msg_raw))
 
         # send the data to the client. 1st 2B is the length
-        self._client_sock.send(msg_len + msg_raw)
+        self._transport.send(msg_len + msg_raw)
 
-    def _send_datagram(self, msg):
+    def _send_datagram(self, msg_raw):
         """
-        Send DNS Message to client connected using UDP
+        Send raw DNS Message to client connected using UDP
 
-        :param msg: DNS Message object to send to the client
+        :param msg_raw: raw DNS Message to send to the client
         :return: None
         """
-        # to make sure the Response ID matches the Query ID
-        msg.id = self._client_msg.id
-        msg_raw = msg.to_wire()
-
         # send the data to the client
-        self._client_sock.sendto(msg_raw, self._client_addr)
+        self._transport.sendto(msg_raw, self._client_addr)
+
+
+class ClientPool(object):
+    """
+    Free list of Client records of one class. Records are set up for every
+    Query with the arguments the class constructor takes and returned to the
+    pool when the Query is answered or dropped.
+    """
+
+    def __init__(self, client_class=Client, max_free=1024):
+        """
+        Constructor
+
+        :param client_class: Client or its subclass
+        :param max_free: maximal number of unused records kept for later
+        :return: new object
+        """
+        self.client_class = client_class
+        self._max_free = max_free
+        self._free = []
+        # number of records created and of records served from the free list
+        self.allocated = 0
+        self.reused = 0
+        # number of records holding a Query
+        self.in_use = 0
+
+    def __str__(self):
+        return "<ClientPool client_class='{0}' free='{1}' in_use='{2}' allocated='{3}' reused='{4}'>".format(
+            self.client_class.__name__, len(self._free), self.in_use, self.allocated, self.reused)
+
+    def __len__(self):
+        return len(self._free)
+
+    def record_size(self):
+        """
+        Return the memory taken by one record, without the Query and the address it refers to
+
+        :return: size in bytes
+        """
+        return sys.getsizeof(self.client_class.__new__(self.client_class))
+
+    def acquire(self, *args):
+        """
+        Return the record set up with the arguments of the Client class constructor
+
+        :return: Client object
+        """
+        if self._free:
+            client = self._free.pop()
+            self.reused += 1
+        else:
+            client = self.client_class.__new__(self.client_class)
+            self.allocated += 1
+        try:
+            client.setup(*args)
+        except Exception:
+            self._release(client)
+            raise
+        self.in_use += 1
+        return client
+
+    def release(self, client):
+        """
+        Return the record to the pool, unless it is detached. Detached record
+        is released by the next call after its response was sent. The record
+        must not be used after it is released.
+
+        :param client: Client object returned by acquire()
+        :return: None
+        """
+        if client.detached:
+            return
+        self.in_use -= 1
+        self._release(client)
+
+    def _release(self, client):
+        client.clear()
+        if len(self._free) < self._max_free:
+            self._free.append(client)
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+
+import asyncio
+
+import dns.flags
+
+from broken_dns_proxy import wire
+from broken_dns_proxy.cache import ResponseCache
+
+
+class InflightQueries(object):
+    """
+    Table of Queries being resolved by upstream servers. A Query identical to
+    one which is already in flight waits for its response instead of being
+    forwarded again.
+    """
+
+    def __init__(self, loop=None):
+        """
+        Constructor
+
+        :param loop: asyncio event loop
+        :return: new object
+        """
+        self._loop = loop
+        self._pending = dict()
+        # statistics
+        self.forwarded = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def __str__(self):
+        return "<InflightQueries pending='{0}' forwarded='{1}' coalesced='{2}'>".format(len(self._pending),
+                                                                                        self.forwarded,
+                                                                                        self.coalesced)
+
+    @staticmethod
+    def key(msg_raw, stream, max_udp_payload):
+        """
+        Return the key of the Query. Queries with the same key get the same
+        response from upstream servers.
+
+        :param msg_raw: raw DNS message with the Query
+        :param stream: True if the Query was received over TCP
+        :param max_udp_payload: maximal size of UDP response the client is able to receive
+        :return: tuple or None if the Query can't be coalesced
+        """
+        key = ResponseCache.key(msg_raw, stream, max_udp_payload)
+        if key is None:
+            return None
+        return key + (bool(wire.get_flags(msg_raw) & dns.flags.RD),)
+
+    async def resolve(self, msg_raw, key, resolver):
+        """
+        Get the response to the Query. Only the first of identical Queries calls
+        the resolver, the others get copy of its response.
+
+        :param msg_raw: raw DNS message with the Query
+        :param key: key of the Query returned by key(), None to not coalesce the Query
+        :param resolver: coroutine function without arguments returning the raw response
+        :return: raw DNS message with the response
+        """
+        if key is None:
+            self.forwarded += 1
+            return await resolver()
+
+        future = self._pending.get(key)
+        if future is not None:
+            self.coalesced += 1
+            # the waiter being cancelled must not cancel the Query for the others
+            response_raw = await asyncio.shield(future)
+            response = bytearray(response_raw)
+            wire.copy_question(response, msg_raw)
+            return response
+
+        loop = self._loop if self._loop is not None else asyncio.get_running_loop()
+        future = self._pending[key] = loop.create_future()
+        self.forwarded += 1
+        try:
+            response_raw = await resolver()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # waiters get the exception, nobody else has to retrieve it
+            future.exception()
+            raise
+        else:
+            future.set_result(response_raw)
+            return response_raw
+        finally:
+            del self._pending[key]
@@ -19,13 +19,14 @@
 # Authors:
 
 import os
+import types
 import six
 from six.moves.configparser import ConfigParser
 
 from broken_dns_proxy.logger import logger
 from broken_dns_proxy.exceptions import BrokenDNSProxyError
 from broken_dns_proxy.modifiers import get_modifier_by_name
-from broken_dns_proxy.config_common import GlobalConfig
+from broken_dns_proxy.config_common import GlobalConfig, ChainConfig
 
 
 class BrokenDnsProxyConfiguration(object):
@@ -34,6 +35,7 @@ class BrokenDnsProxyConfiguration(object):
     """
 
     def __init__(self, cli_conf):
+        self._cli_conf = cli_conf
         self._config = ConfigParser()
         self._add_commandline_arguments(cli_conf)
         self._read_proxy_default_config()
@@ -51,17 +53,43 @@ class BrokenDnsProxyConfiguration(object):
         # include configuration for all modifiers
         self._read_modifiers_default_config()
 
+    def reload(self, config_path=None):
+        """
+        Read the configuration file again. Unlike at startup, the file
+        has to exist.
+
+        :param config_path: path to other configuration file to read instead
+        :return: new BrokenDnsProxyConfiguration object
+        """
+        config_path = os.path.abspath(config_path or self._cli_conf.config_path)
+        if not os.path.isfile(config_path) or not os.access(config_path, os.R_OK):
+            raise BrokenDNSProxyError("Configuration file '{0}' could not be read".format(config_path))
+        cli_conf = types.SimpleNamespace(verbose=self._cli_conf.verbose, config_path=config_path)
+        return BrokenDnsProxyConfiguration(cli_conf)
+
     def _read_modifiers_default_config(self):
         """
+        Add default configuration of all used modifiers and Modification chains
 
-        :return:
+        :return: None
         """
-        for mod_name in self.getlist(GlobalConfig.config_section_name(), GlobalConfig.CONFIG_MODIFIERS):
+        modifier_specs = self.getlist(GlobalConfig.config_section_name(), GlobalConfig.CONFIG_MODIFIERS)
+        for chain_name in self.getlist(GlobalConfig.config_section_name(), GlobalConfig.CONFIG_CHAINS):
+            section = ChainConfig.chain_section_name(chain_name)
+            if not self._config.has_section(section):
+                raise BrokenDNSProxyError("Configuration section '{0}' of the chain doesn't exist!".format(section))
+            BrokenDnsProxyConfiguration.config_parser_read_dict(self._config, {section:
+                                                                               ChainConfig.default_configuration_dict()})
+            modifier_specs.extend(self.getlist(section, ChainConfig.CONFIG_MODIFIERS))
+
+        for mod_spec in modifier_specs:
+            mod_name, _, section = mod_spec.partition(':')
             modifier = get_modifier_by_name(mod_name)
             if not modifier:
                 logger.error("Error in Modifiers configuration!")
                 raise BrokenDNSProxyError("Modifier with name '{0}' doesn't exist!".format(mod_name))
-            BrokenDnsProxyConfiguration.config_parser_read_dict(self._config, {modifier.config_section_name():
+            section = section or modifier.config_section_name()
+            BrokenDnsProxyConfiguration.config_parser_read_dict(self._config, {section:
                                                                                modifier.default_configuration_dict()})
 
     def _read_proxy_default_config(self):
@@ -66,10 +66,155 @@ class GlobalConfig(ConfigurableClass):
     CONFIG_UPSTREAM_SERVERS_VALUE = '8.8.8.8 8.8.4.4'
     CONFIG_MODIFIERS = 'Modifiers'
     CONFIG_MODIFIERS_VALUE = ''
+    CONFIG_ENGINE = 'Engine'
+    CONFIG_ENGINE_VALUE = 'select'
+    CONFIG_WORKERS = 'Workers'
+    CONFIG_WORKERS_VALUE = '1'
+    CONFIG_WORKER_CPU_AFFINITY = 'WorkerCpuAffinity'
+    CONFIG_WORKER_CPU_AFFINITY_VALUE = 'no'
+    CONFIG_UPSTREAM_SELECTION = 'UpstreamSelection'
+    CONFIG_UPSTREAM_SELECTION_VALUE = 'random'
+    CONFIG_CACHE_MAX_ENTRIES = 'CacheMaxEntries'
+    CONFIG_CACHE_MAX_ENTRIES_VALUE = '0'
+    CONFIG_CACHE_MAX_BYTES = 'CacheMaxBytes'
+    CONFIG_CACHE_MAX_BYTES_VALUE = '16777216'
+    CONFIG_DEBUG_DUMP_SAMPLING = 'DebugDumpSampling'
+    CONFIG_DEBUG_DUMP_SAMPLING_VALUE = '1'
+    CONFIG_DEBUG_DUMP_NAMES = 'DebugDumpNames'
+    CONFIG_DEBUG_DUMP_NAMES_VALUE = ''
+    CONFIG_UPSTREAM_TCP_CONNECTIONS = 'UpstreamTcpConnections'
+    CONFIG_UPSTREAM_TCP_CONNECTIONS_VALUE = '1'
+    CONFIG_UPSTREAM_TCP_PIPELINE = 'UpstreamTcpPipeline'
+    CONFIG_UPSTREAM_TCP_PIPELINE_VALUE = '64'
+    CONFIG_UPSTREAM_TCP_IDLE_TIMEOUT = 'UpstreamTcpIdleTimeout'
+    CONFIG_UPSTREAM_TCP_IDLE_TIMEOUT_VALUE = '30'
+    CONFIG_UPSTREAM_TIMEOUT = 'UpstreamTimeout'
+    CONFIG_UPSTREAM_TIMEOUT_VALUE = '5'
+    CONFIG_UPSTREAM_RETRIES = 'UpstreamRetries'
+    CONFIG_UPSTREAM_RETRIES_VALUE = '1'
+    CONFIG_UPSTREAM_HEDGE_PERCENTILE = 'UpstreamHedgePercentile'
+    CONFIG_UPSTREAM_HEDGE_PERCENTILE_VALUE = '0'
+    CONFIG_UPSTREAM_HEDGE_MIN_DELAY = 'UpstreamHedgeMinDelay'
+    CONFIG_UPSTREAM_HEDGE_MIN_DELAY_VALUE = '0.01'
+    CONFIG_COALESCE_QUERIES = 'CoalesceQueries'
+    CONFIG_COALESCE_QUERIES_VALUE = 'yes'
+    CONFIG_METRICS_PORT = 'MetricsPort'
+    CONFIG_METRICS_PORT_VALUE = '0'
+    CONFIG_METRICS_ADDRESS = 'MetricsAddress'
+    CONFIG_METRICS_ADDRESS_VALUE = '127.0.0.1'
+    CONFIG_CHAINS = 'Chains'
+    CONFIG_CHAINS_VALUE = ''
+    CONFIG_STUB_ZONES = 'StubZones'
+    CONFIG_STUB_ZONES_VALUE = ''
+    CONFIG_MEMO_MAX_ENTRIES = 'MemoMaxEntries'
+    CONFIG_MEMO_MAX_ENTRIES_VALUE = '1024'
+    CONFIG_CONTROL_SOCKET = 'ControlSocket'
+    CONFIG_CONTROL_SOCKET_VALUE = ''
+    CONFIG_UDP_BATCH_SIZE = 'UdpBatchSize'
+    CONFIG_UDP_BATCH_SIZE_VALUE = '1'
+    CONFIG_RATE_LIMIT_QPS = 'RateLimitQps'
+    CONFIG_RATE_LIMIT_QPS_VALUE = '0'
+    CONFIG_RATE_LIMIT_BURST = 'RateLimitBurst'
+    CONFIG_RATE_LIMIT_BURST_VALUE = '20'
+    CONFIG_RATE_LIMIT_PREFIX_V4 = 'RateLimitPrefixV4'
+    CONFIG_RATE_LIMIT_PREFIX_V4_VALUE = '24'
+    CONFIG_RATE_LIMIT_PREFIX_V6 = 'RateLimitPrefixV6'
+    CONFIG_RATE_LIMIT_PREFIX_V6_VALUE = '56'
+    CONFIG_RATE_LIMIT_ACTION = 'RateLimitAction'
+    CONFIG_RATE_LIMIT_ACTION_VALUE = 'drop'
+    CONFIG_MAX_PENDING_QUERIES = 'MaxPendingQueries'
+    CONFIG_MAX_PENDING_QUERIES_VALUE = '0'
+    CONFIG_MAX_QUEUE_DELAY = 'MaxQueueDelay'
+    CONFIG_MAX_QUEUE_DELAY_VALUE = '0'
+    CONFIG_SHED_ACTION = 'ShedAction'
+    CONFIG_SHED_ACTION_VALUE = 'refused'
+    CONFIG_TCP_BACKLOG = 'TcpBacklog'
+    CONFIG_TCP_BACKLOG_VALUE = '128'
+    CONFIG_TCP_IDLE_TIMEOUT = 'TcpIdleTimeout'
+    CONFIG_TCP_IDLE_TIMEOUT_VALUE = '10'
+    CONFIG_TCP_MAX_QUERIES_PER_CONNECTION = 'TcpMaxQueriesPerConnection'
+    CONFIG_TCP_MAX_QUERIES_PER_CONNECTION_VALUE = '0'
+    CONFIG_TCP_MAX_CONNECTIONS = 'TcpMaxConnections'
+    CONFIG_TCP_MAX_CONNECTIONS_VALUE = '1024'
 
     _options_dict = {
         CONFIG_PORT: CONFIG_PORT_VALUE,
         CONFIG_ADDRESS: CONFIG_ADDRESS_VALUE,
         CONFIG_UPSTREAM_SERVERS: CONFIG_UPSTREAM_SERVERS_VALUE,
-        CONFIG_MODIFIERS: CONFIG_MODIFIERS_VALUE
-    }
\ No newline at end of file
+        CONFIG_MODIFIERS: CONFIG_MODIFIERS_VALUE,
+        CONFIG_ENGINE: CONFIG_ENGINE_VALUE,
+        CONFIG_WORKERS: CONFIG_WORKERS_VALUE,
+        CONFIG_WORKER_CPU_AFFINITY: CONFIG_WORKER_CPU_AFFINITY_VALUE,
+        CONFIG_UPSTREAM_SELECTION: CONFIG_UPSTREAM_SELECTION_VALUE,
+        CONFIG_CACHE_MAX_ENTRIES: CONFIG_CACHE_MAX_ENTRIES_VALUE,
+        CONFIG_CACHE_MAX_BYTES: CONFIG_CACHE_MAX_BYTES_VALUE,
+        CONFIG_DEBUG_DUMP_SAMPLING: CONFIG_DEBUG_DUMP_SAMPLING_VALUE,
+        CONFIG_DEBUG_DUMP_NAMES: CONFIG_DEBUG_DUMP_NAMES_VALUE,
+        CONFIG_UPSTREAM_TCP_CONNECTIONS: CONFIG_UPSTREAM_TCP_CONNECTIONS_VALUE,
+        CONFIG_UPSTREAM_TCP_PIPELINE: CONFIG_UPSTREAM_TCP_PIPELINE_VALUE,
+        CONFIG_UPSTREAM_TCP_IDLE_TIMEOUT: CONFIG_UPSTREAM_TCP_IDLE_TIMEOUT_VALUE,
+        CONFIG_UPSTREAM_TIMEOUT: CONFIG_UPSTREAM_TIMEOUT_VALUE,
+        CONFIG_UPSTREAM_RETRIES: CONFIG_UPSTREAM_RETRIES_VALUE,
+        CONFIG_UPSTREAM_HEDGE_PERCENTILE: CONFIG_UPSTREAM_HEDGE_PERCENTILE_VALUE,
+        CONFIG_UPSTREAM_HEDGE_MIN_DELAY: CONFIG_UPSTREAM_HEDGE_MIN_DELAY_VALUE,
+        CONFIG_COALESCE_QUERIES: CONFIG_COALESCE_QUERIES_VALUE,
+        CONFIG_METRICS_PORT: CONFIG_METRICS_PORT_VALUE,
+        CONFIG_METRICS_ADDRESS: CONFIG_METRICS_ADDRESS_VALUE,
+        CONFIG_CHAINS: CONFIG_CHAINS_VALUE,
+        CONFIG_STUB_ZONES: CONFIG_STUB_ZONES_VALUE,
+        CONFIG_MEMO_MAX_ENTRIES: CONFIG_MEMO_MAX_ENTRIES_VALUE,
+        CONFIG_CONTROL_SOCKET: CONFIG_CONTROL_SOCKET_VALUE,
+        CONFIG_UDP_BATCH_SIZE: CONFIG_UDP_BATCH_SIZE_VALUE,
+        CONFIG_RATE_LIMIT_QPS: CONFIG_RATE_LIMIT_QPS_VALUE,
+        CONFIG_RATE_LIMIT_BURST: CONFIG_RATE_LIMIT_BURST_VALUE,
+        CONFIG_RATE_LIMIT_PREFIX_V4: CONFIG_RATE_LIMIT_PREFIX_V4_VALUE,
+        CONFIG_RATE_LIMIT_PREFIX_V6: CONFIG_RATE_LIMIT_PREFIX_V6_VALUE,
+        CONFIG_RATE_LIMIT_ACTION: CONFIG_RATE_LIMIT_ACTION_VALUE,
+        CONFIG_MAX_PENDING_QUERIES: CONFIG_MAX_PENDING_QUERIES_VALUE,
+        CONFIG_MAX_QUEUE_DELAY: CONFIG_MAX_QUEUE_DELAY_VALUE,
+        CONFIG_SHED_ACTION: CONFIG_SHED_ACTION_VALUE,
+        CONFIG_TCP_BACKLOG: CONFIG_TCP_BACKLOG_VALUE,
+        CONFIG_TCP_IDLE_TIMEOUT: CONFIG_TCP_IDLE_TIMEOUT_VALUE,
+        CONFIG_TCP_MAX_QUERIES_PER_CONNECTION: CONFIG_TCP_MAX_QUERIES_PER_CONNECTION_VALUE,
+        CONFIG_TCP_MAX_CONNECTIONS: CONFIG_TCP_MAX_CONNECTIONS_VALUE
+    }
+
+
+class ChainConfig(ConfigurableClass):
+    """
+    Configuration of one conditional Modification chain. Each chain has its
+    own section named 'Chain:<name>'. All match rules which are set must
+    match for the chain to be used.
+    """
+
+    CONFIG_SECTION_PREFIX = 'Chain:'
+
+    # modifiers of the chain, 'Modifier' or 'Modifier:Section' to read the configuration from other section
+    CONFIG_MODIFIERS = 'Modifiers'
+    CONFIG_MODIFIERS_VALUE = ''
+    # Query name suffixes
+    CONFIG_NAMES = 'Names'
+    CONFIG_NAMES_VALUE = ''
+    # Query types
+    CONFIG_TYPES = 'Types'
+    CONFIG_TYPES_VALUE = ''
+    # client address prefixes
+    CONFIG_CLIENTS = 'Clients'
+    CONFIG_CLIENTS_VALUE = ''
+
+    _options_dict = {
+        CONFIG_MODIFIERS: CONFIG_MODIFIERS_VALUE,
+        CONFIG_NAMES: CONFIG_NAMES_VALUE,
+        CONFIG_TYPES: CONFIG_TYPES_VALUE,
+        CONFIG_CLIENTS: CONFIG_CLIENTS_VALUE
+    }
+
+    @classmethod
+    def chain_section_name(cls, chain_name):
+        """
+        Return the name of the configuration section for the chain
+
+        :param chain_name: name of the chain
+        :return: str
+        """
+        return cls.CONFIG_SECTION_PREFIX + chain_name
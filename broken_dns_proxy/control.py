@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+
+import os
+import socket
+import socketserver
+import threading
+
+from broken_dns_proxy.logger import logger
+from broken_dns_proxy.exceptions import BrokenDNSProxyError
+from broken_dns_proxy.blocking_upstream import parse_upstream_address
+
+
+def parse_control_address(value, worker=0):
+    """
+    Parse the control socket from configuration
+
+    :param value: path of UNIX socket or 'address@port' on loopback
+    :param worker: index of the worker, every worker has its own socket
+    :return: tuple (address family, path or (address, port))
+    """
+    if '/' in value:
+        return socket.AF_UNIX, '{0}.{1}'.format(value, worker) if worker else value
+    address, port = parse_upstream_address(value, default_port=0)
+    if not port:
+        raise BrokenDNSProxyError("Control socket '{0}' must be a path or 'address@port'".format(value))
+    return socket.AF_INET6 if ':' in address else socket.AF_INET, (address, port + worker)
+
+
+class _ControlRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Executes the commands, one per line. Every response is one line
+    starting with 'OK' or 'ERROR'.
+    """
+
+    def handle(self):
+        for line in self.rfile:
+            command = line.decode('utf-8', 'replace').strip()
+            if not command:
+                continue
+            response = self.server.control.execute(command)
+            self.wfile.write(response.encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class _UnixControlServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _TcpControlServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Tcp6ControlServer(_TcpControlServer):
+    address_family = socket.AF_INET6
+
+
+class ControlServer(object):
+    """
+    Local control socket of the proxy server, running in a thread. Commands:
+
+      reload [CONFIG_PATH]  re-read the configuration (or read another file)
+                            and swap in the new Modification chains
+      status                show the Modification chains in use
+    """
+
+    def __init__(self, server, family, address):
+        """
+        Constructor
+
+        :param server: ProxyServer object which is controlled
+        :param family: socket.AF_UNIX, socket.AF_INET or socket.AF_INET6
+        :param address: path of UNIX socket or tuple (address, port)
+        :return: new object
+        """
+        self._server = server
+        self._family = family
+        self._address = address
+        self._socket_server = None
+        self._thread = None
+
+    def __str__(self):
+        return "<ControlServer address='{0}'>".format(self.address)
+
+    @property
+    def address(self):
+        if self._socket_server is not None:
+            return self._socket_server.server_address
+        return self._address
+
+    def execute(self, command):
+        """
+        Execute the command
+
+        :param command: command line
+        :return: response line
+        """
+        name, _, argument = command.partition(' ')
+        argument = argument.strip()
+        try:
+            if name == 'reload':
+                return 'OK ' + self._server.reload(argument or None)
+            if name == 'status':
+                return 'OK ' + self._server.status()
+        except BrokenDNSProxyError as e:
+            return 'ERROR ' + str(e)
+        return "ERROR unknown command '{0}'".format(name)
+
+    def start(self):
+        """
+        Start accepting commands in a daemon thread
+
+        :return: None
+        """
+        try:
+            if self._family == socket.AF_UNIX:
+                if os.path.exists(self._address):
+                    # left by previous run
+                    os.unlink(self._address)
+                self._socket_server = _UnixControlServer(self._address, _ControlRequestHandler)
+            elif self._family == socket.AF_INET6:
+                self._socket_server = _Tcp6ControlServer(self._address, _ControlRequestHandler)
+            else:
+                self._socket_server = _TcpControlServer(self._address, _ControlRequestHandler)
+        except OSError as e:
+            raise BrokenDNSProxyError("Unable to open control socket '{0}': {1}".format(self._address, e.strerror))
+        self._socket_server.control = self
+        self._thread = threading.Thread(target=self._socket_server.serve_forever, name='control', daemon=True)
+        self._thread.start()
+        logger.info("Accepting commands on control socket '%s'...", str(self.address))
+
+    def stop(self):
+        """
+        Stop the server
+
+        :return: None
+        """
+        if self._socket_server is not None:
+            self._socket_server.shutdown()
+            self._socket_server.server_close()
+            self._socket_server = None
+            self._thread = None
+            if self._family == socket.AF_UNIX:
+                try:
+                    os.unlink(self._address)
+                except OSError:
+                    pass
+
+
+def send_command(family, address, command, timeout=10.0):
+    """
+    Send the command to the control socket of running proxy server
+
+    :param family: socket.AF_UNIX, socket.AF_INET or socket.AF_INET6
+    :param address: path of UNIX socket or tuple (address, port)
+    :param command: command line
+    :param timeout: seconds to wait for the response
+    :return: response line
+    """
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(address)
+        sock.sendall(command.encode('utf-8') + b'\n')
+        response = sock.makefile('rb').readline()
+    except OSError as e:
+        raise BrokenDNSProxyError("Control socket '{0}' failed: {1}".format(address, e.strerror or str(e)))
+    finally:
+        sock.close()
+    return response.decode('utf-8', 'replace').strip()
+
+
+def run_control(args):
+    """
+    Send the command from the command line to the control socket and print the response
+    """
+    family, address = parse_control_address(args.socket)
+    response = send_command(family, address, ' '.join(args.command), args.timeout)
+    print(response)
+    if not response.startswith('OK'):
+        raise BrokenDNSProxyError('Command failed')
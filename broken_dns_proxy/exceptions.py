@@ -25,3 +25,18 @@ class BrokenDNSProxyError(Exception):
     catching some expected and well known exception/error.
     """
     pass
+
+
+class UpstreamConnectionError(BrokenDNSProxyError):
+    """
+    Class representing Error raised when the connection to upstream server
+    was lost before the response was received.
+    """
+    pass
+
+
+class WireFormatError(BrokenDNSProxyError):
+    """
+    Class representing Error raised when a raw DNS message is malformed.
+    """
+    pass
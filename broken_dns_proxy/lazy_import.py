@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+
+import sys
+
+from broken_dns_proxy.exceptions import BrokenDNSProxyError
+
+
+def import_object(path):
+    """
+    Import the module and return the object named by the path. Used for the
+    parts of the proxy which are needed only with some configurations, so
+    the startup does not pay for importing all of them.
+
+    :param path: 'package.module:name' string, as used by the package entry points
+    :return: the object
+    """
+    module_name, _, name = path.partition(':')
+    try:
+        # unlike importlib.import_module(), __import__() shows in 'python -X importtime'
+        __import__(module_name)
+        module = sys.modules[module_name]
+    except ImportError as e:
+        raise BrokenDNSProxyError("Failed to import '{0}': {1}".format(module_name, str(e)))
+    try:
+        return getattr(module, name) if name else module
+    except AttributeError:
+        raise BrokenDNSProxyError("Module '{0}' has no attribute '{1}'!".format(module_name, name))
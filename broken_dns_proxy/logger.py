@@ -20,7 +20,10 @@
 
 import os
 import logging
+
 from broken_dns_proxy import settings
+from broken_dns_proxy import wire
+from broken_dns_proxy.exceptions import WireFormatError
 
 
 class LoggerHelper(object):
@@ -89,6 +92,119 @@ class LoggerHelper(object):
         except (IOError, OSError):
             logger.warning("Can not create debug log '%s'", debug_log_file)
 
+    @staticmethod
+    def will_emit(logger, level):
+        """
+        Check if any handler would actually emit a record with the given severity
+
+        :param logger: Logger object
+        :param level: severity level
+        :return: bool
+        """
+        if not logger.isEnabledFor(level):
+            return False
+        current = logger
+        while current:
+            for handler in current.handlers:
+                if level >= handler.level:
+                    return True
+            if not current.propagate:
+                break
+            current = current.parent
+        return False
+
+
+class LazyMessageDump(object):
+    """
+    DNS message rendered to text only when a log handler formats it.
+    The text is rendered at most once, even if more handlers emit it.
+    """
+
+    def __init__(self, msg):
+        """
+        Constructor
+
+        :param msg: raw DNS message or DNS Message object
+        :return: new object
+        """
+        self._msg = msg
+        self._text = None
+
+    def __str__(self):
+        if self._text is None:
+            msg = self._msg
+            try:
+                import dns.message
+
+                if not isinstance(msg, dns.message.Message):
+                    msg = dns.message.from_wire(bytes(msg))
+                self._text = str(msg)
+            except Exception as e:
+                self._text = "<unable to parse DNS message: {0}>".format(str(e))
+        return self._text
+
+
+class MessageDumpSampler(object):
+    """
+    Decides which Queries get their messages dumped into the debug log.
+    Only every N-th Query is dumped and if names are given, only Queries
+    for those names and their subdomains are considered.
+    """
+
+    def __init__(self, logger, sample_rate=1, names=None):
+        """
+        Constructor
+
+        :param logger: Logger object the dumps are written to
+        :param sample_rate: dump every N-th Query, 0 to never dump
+        :param names: list of domain names to dump Queries for, empty for all names
+        :return: new object
+        """
+        self._logger = logger
+        self._sample_rate = sample_rate
+        self._names = []
+        if names:
+            import dns.name
+
+            self._names = [dns.name.from_text(name).to_wire().lower() for name in names]
+        self._seen = 0
+
+    def sample(self, msg_raw):
+        """
+        Check if the messages of the Query should be dumped
+
+        :param msg_raw: raw DNS message with the Query
+        :return: bool
+        """
+        if not self._sample_rate or not LoggerHelper.will_emit(self._logger, logging.DEBUG):
+            return False
+        if self._names:
+            try:
+                question = wire.parse_question(msg_raw)
+            except WireFormatError:
+                return False
+            if question is None or not any(self._is_subdomain(question[0], name) for name in self._names):
+                return False
+        self._seen += 1
+        return self._seen % self._sample_rate == 0
+
+    @staticmethod
+    def _is_subdomain(qname, name):
+        """
+        Check that the name is a suffix of the qname ending at a label boundary
+
+        :param qname: lower-cased domain name in wire format
+        :param name: lower-cased domain name in wire format
+        :return: bool
+        """
+        if not qname.endswith(name):
+            return False
+        offset = len(qname) - len(name)
+        position = 0
+        while position < offset:
+            position += qname[position] + 1
+        return position == offset
+
 
 #  the main Broken DNS Proxy logger
 logger = LoggerHelper.get_basic_logger('broken-dns-proxy')
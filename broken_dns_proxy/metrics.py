@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+
+import bisect
+
+import dns.rcode
+
+from broken_dns_proxy import wire
+
+
+def _log_buckets(lowest, highest, per_octave):
+    """
+    Return upper bounds of buckets growing exponentially from lowest to highest
+
+    :param lowest: upper bound of the first bucket
+    :param highest: the last upper bound is not smaller than this
+    :param per_octave: number of buckets per doubling of the value
+    :return: list of floats
+    """
+    bounds = []
+    i = 0
+    while not bounds or bounds[-1] < highest:
+        bounds.append(lowest * 2 ** (float(i) / per_octave))
+        i += 1
+    return bounds
+
+
+# 1us .. ~67s, 4 buckets per doubling (relative error below 19%)
+LATENCY_BUCKETS = _log_buckets(1e-6, 60.0, 4)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(name, value) for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class Histogram(object):
+    """
+    Histogram with fixed logarithmic buckets. Observing a value only
+    increments preallocated counters.
+    """
+
+    __slots__ = ('_bounds', '_counts', 'count', 'sum')
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        """
+        Constructor
+
+        :param bounds: sorted upper bounds of the buckets
+        :return: new object
+        """
+        self._bounds = bounds
+        # the last bucket is for values above the highest bound
+        self._counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        """
+        Account one value
+
+        :param value: observed value
+        :return: None
+        """
+        self._counts[bisect.bisect_left(self._bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, p):
+        """
+        Return upper bound of the bucket containing the p-th percentile
+
+        :param p: percentile between 0 and 100
+        :return: float or None if nothing was observed
+        """
+        if not self.count:
+            return None
+        rank = max(1, int(round(self.count * p / 100.0)))
+        seen = 0
+        for bound, count in zip(self._bounds, self._counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def samples(self, name, labels=()):
+        """
+        Return the histogram in Prometheus text format
+
+        :param name: metric name
+        :param labels: tuple of (label, value) pairs
+        :return: list of lines
+        """
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self._bounds, self._counts):
+            cumulative += count
+            lines.append('{0}_bucket{1} {2}'.format(name, _format_labels(labels + (('le', '{0:.6g}'.format(bound)),)),
+                                                    cumulative))
+        lines.append('{0}_bucket{1} {2}'.format(name, _format_labels(labels + (('le', '+Inf'),)), self.count))
+        lines.append('{0}_sum{1} {2!r}'.format(name, _format_labels(labels), self.sum))
+        lines.append('{0}_count{1} {2}'.format(name, _format_labels(labels), self.count))
+        return lines
+
+
+class ProxyMetrics(object):
+    """
+    Metrics of one proxy server. All counters and histograms are created
+    up front, so recording a Query does not allocate any new objects.
+    """
+
+    TRANSPORTS = ('udp', 'tcp')
+
+    def __init__(self, upstream_servers, modifiers=()):
+        """
+        Constructor
+
+        :param upstream_servers: list of upstream server addresses
+        :param modifiers: names of the modifiers in the ModificationChain
+        :return: new object
+        """
+        # responses sent to clients by transport and rcode
+        self.responses = dict((transport, [0] * 16) for transport in self.TRANSPORTS)
+        # responses passed through the modifier, by modifier name
+        self.modified = {}
+        self.modifiers = []
+        self.set_modifiers(modifiers)
+        self.parse_time = Histogram()
+        self.chain_time = Histogram()
+        self.service_time = Histogram()
+        self.upstream_rtt = dict((server, Histogram()) for server in upstream_servers)
+        # functions returning list of (name, type, help, [(labels, value), ...]) of other components
+        self._collectors = []
+        # histograms of other components as (name, help, Histogram)
+        self._histograms = []
+
+    def add_collector(self, collector):
+        """
+        Add function providing metrics of another component when the metrics are rendered
+
+        :param collector: function returning list of (name, type, help, [(labels, value), ...])
+        :return: None
+        """
+        self._collectors.append(collector)
+
+    def add_histogram(self, name, help_text, histogram):
+        """
+        Add histogram of another component
+
+        :param name: metric name
+        :param help_text: description of the metric
+        :param histogram: Histogram object
+        :return: None
+        """
+        self._histograms.append((name, help_text, histogram))
+
+    def set_modifiers(self, modifiers):
+        """
+        Set the modifiers reported, after the Modification chains are replaced.
+        Counters of the modifiers present before are kept.
+
+        :param modifiers: names of the modifiers in the Modification chains
+        :return: None
+        """
+        self.modifiers = list(modifiers)
+        for modifier in self.modifiers:
+            self.modified.setdefault(modifier, 0)
+
+    def count_modified(self, chain):
+        """
+        Account response passed through the Modification chain
+
+        :param chain: ModificationChain selected for the Query
+        :return: None
+        """
+        modified = self.modified
+        for modifier in chain.active_modifiers:
+            modified[modifier] += 1
+
+    def count_response(self, stream, response_raw):
+        """
+        Account response sent to the client
+
+        :param stream: True if the client is connected over TCP
+        :param response_raw: raw DNS message with the response
+        :return: None
+        """
+        self.responses['tcp' if stream else 'udp'][wire.get_flags(response_raw) & 0xF] += 1
+
+    def observe_upstream(self, upstream_server, rtt):
+        """
+        Account RTT of successful Query to the upstream server
+
+        :param upstream_server: address of the upstream server
+        :param rtt: RTT in seconds
+        :return: None
+        """
+        histogram = self.upstream_rtt.get(upstream_server)
+        if histogram is not None:
+            histogram.observe(rtt)
+
+    def render(self):
+        """
+        Return all metrics in Prometheus text exposition format
+
+        :return: str
+        """
+        lines = ['# HELP bdp_responses_total Responses sent to clients.',
+                 '# TYPE bdp_responses_total counter']
+        for transport in self.TRANSPORTS:
+            for rcode, count in enumerate(self.responses[transport]):
+                if count:
+                    lines.append('bdp_responses_total{0} {1}'.format(
+                        _format_labels((('transport', transport), ('rcode', dns.rcode.to_text(rcode)))), count))
+
+        lines.append('# HELP bdp_modified_responses_total Responses passed through the modifier.')
+        lines.append('# TYPE bdp_modified_responses_total counter')
+        for modifier in self.modifiers:
+            lines.append('bdp_modified_responses_total{0} {1}'.format(_format_labels((('modifier', modifier),)),
+                                                                      self.modified[modifier]))
+
+        for name, histogram, help_text in (
+                ('bdp_parse_seconds', self.parse_time, 'Time spent receiving and checking the Query.'),
+                ('bdp_modification_chain_seconds', self.chain_time, 'Time spent in the ModificationChain.'),
+                ('bdp_service_seconds', self.service_time, 'Time from receiving the Query to sending the response.')):
+            lines.append('# HELP {0} {1}'.format(name, help_text))
+            lines.append('# TYPE {0} histogram'.format(name))
+            lines.extend(histogram.samples(name))
+
+        lines.append('# HELP bdp_upstream_rtt_seconds RTT of successful Queries to the upstream server.')
+        lines.append('# TYPE bdp_upstream_rtt_seconds histogram')
+        for server, histogram in sorted(self.upstream_rtt.items()):
+            lines.extend(histogram.samples('bdp_upstream_rtt_seconds', (('upstream', server),)))
+
+        for name, help_text, histogram in self._histograms:
+            lines.append('# HELP {0} {1}'.format(name, help_text))
+            lines.append('# TYPE {0} histogram'.format(name))
+            lines.extend(histogram.samples(name))
+
+        for collector in self._collectors:
+            for name, metric_type, help_text, samples in collector():
+                lines.append('# HELP {0} {1}'.format(name, help_text))
+                lines.append('# TYPE {0} {1}'.format(name, metric_type))
+                for labels, value in samples:
+                    lines.append('{0}{1} {2}'.format(name, _format_labels(labels), _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+def __getattr__(name):
+    # the HTTP server is imported only when the metrics are served
+    if name == 'MetricsServer':
+        from broken_dns_proxy.metrics_server import MetricsServer
+        return MetricsServer
+    raise AttributeError("module '{0}' has no attribute '{1}'".format(__name__, name))
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from broken_dns_proxy.logger import logger
+from broken_dns_proxy.exceptions import BrokenDNSProxyError
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug('Metrics request from %s: %s', self.client_address[0], format % args)
+
+
+class MetricsServer(object):
+    """
+    HTTP server exposing the metrics in Prometheus text format, running in a thread.
+    """
+
+    def __init__(self, metrics, address, port):
+        """
+        Constructor
+
+        :param metrics: ProxyMetrics object
+        :param address: address to listen on
+        :param port: port to listen on
+        :return: new object
+        """
+        self._metrics = metrics
+        self._address = address
+        self._port = port
+        self._httpd = None
+        self._thread = None
+
+    def __str__(self):
+        return "<MetricsServer address='{0}' port='{1}'>".format(self._address, self._port)
+
+    @property
+    def port(self):
+        return self._httpd.server_address[1] if self._httpd is not None else self._port
+
+    def start(self):
+        """
+        Start serving the metrics in a daemon thread
+
+        :return: None
+        """
+        try:
+            self._httpd = ThreadingHTTPServer((self._address, self._port), _MetricsRequestHandler)
+        except OSError as e:
+            raise BrokenDNSProxyError("Unable to start metrics server on port {0}: {1}".format(self._port,
+                                                                                              e.strerror))
+        self._httpd.daemon_threads = True
+        self._httpd.metrics = self._metrics
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='metrics', daemon=True)
+        self._thread.start()
+        logger.info('Serving metrics on port %s...', str(self.port))
+
+    def stop(self):
+        """
+        Stop the server
+
+        :return: None
+        """
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+            self._thread = None
@@ -18,8 +18,17 @@
 #
 # Authors:
 
-from .modifiers import register_modifier, is_modifier, get_modifier_by_name
+from .modifiers import register_modifier, is_modifier, get_modifier_by_name, builtin_modifiers, ENTRY_POINT_GROUP
 
+from .operations import ParseDepth, ExecutionPlan
 from .base_modifier import BaseModifier
-from .flags_modifier import FlagsModifier
-from .modification_chain import ModificationChain
\ No newline at end of file
+from .modification_chain import ModificationChain
+from .chain_selector import ChainSelector
+
+
+def __getattr__(name):
+    # modifier classes are imported on first use, see builtin_modifiers
+    for path in builtin_modifiers.values():
+        if path.endswith(':' + name):
+            return get_modifier_by_name(name)
+    raise AttributeError("module '{0}' has no attribute '{1}'".format(__name__, name))
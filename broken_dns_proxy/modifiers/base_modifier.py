@@ -19,6 +19,7 @@
 # Authors:
 
 from broken_dns_proxy.config_common import ConfigurableClass
+from broken_dns_proxy.modifiers.operations import ParseDepth, ModifierOperation
 
 
 class BaseModifier(ConfigurableClass):
@@ -26,11 +27,12 @@ class BaseModifier(ConfigurableClass):
     Base class for dns message modifier
     """
 
-    def __init__(self, configuration):
+    def __init__(self, configuration, section=None):
         """
         Constructor
 
         :param configuration: BrokenDnsProxyConfiguration object
+        :param section: configuration section to read, None for the section named after the modifier
         :return: new object
         """
         raise NotImplementedError()
@@ -42,4 +44,32 @@ class BaseModifier(ConfigurableClass):
         :param dns_message: dns message object to modify
         :return: possibly modified dns message object
         """
-        raise NotImplementedError()
\ No newline at end of file
+        raise NotImplementedError()
+
+    def parse_depth(self):
+        """
+        Return how much of the DNS message the modifier needs to be parsed.
+        Modifiers which need less than ParseDepth.FULL must implement modify_wire().
+
+        :return: one of ParseDepth values
+        """
+        return ParseDepth.FULL
+
+    def modify_wire(self, buf):
+        """
+        Method modifying the raw DNS message in place, based on Modifier configuration
+
+        :param buf: raw dns message as bytearray
+        :return: None
+        """
+        raise NotImplementedError()
+
+    def compile(self):
+        """
+        Return the operations doing what the modifier does with its configuration.
+        Modifiers which do nothing with their configuration return empty list,
+        modifiers touching only header flags return operations that can be fused.
+
+        :return: list of Operation objects
+        """
+        return [ModifierOperation(self)]
\ No newline at end of file
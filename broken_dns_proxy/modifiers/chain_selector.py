@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+
+import ipaddress
+
+import dns.rdatatype
+
+from broken_dns_proxy import wire
+from broken_dns_proxy.modifiers.modification_chain import ModificationChain
+from broken_dns_proxy.logger import logger
+from broken_dns_proxy.exceptions import BrokenDNSProxyError
+from broken_dns_proxy.config_common import GlobalConfig, ChainConfig
+
+
+def wire_labels(name):
+    """
+    Split the domain name in uncompressed wire format into labels
+
+    :param name: domain name in wire format
+    :return: list of labels (bytes), without the root label
+    """
+    labels = []
+    offset = 0
+    length = name[0]
+    while length:
+        labels.append(name[offset + 1:offset + 1 + length])
+        offset += length + 1
+        length = name[offset]
+    return labels
+
+
+class NameTrie(object):
+    """
+    Trie of domain names indexed by labels from the root, so all suffixes
+    of a name are found in one walk over its labels. Every node holds a bit
+    mask of the rules matching the name and all its subdomains.
+    """
+
+    def __init__(self):
+        # node is [mask, {label: node}]
+        self._root = [0, {}]
+
+    def add(self, name, mask):
+        """
+        Add the rule matching the name and its subdomains
+
+        :param name: domain name in uncompressed wire format
+        :param mask: bit mask of the rule
+        :return: None
+        """
+        node = self._root
+        for label in reversed(wire_labels(name.lower())):
+            node = node[1].setdefault(label, [0, {}])
+        node[0] |= mask
+
+    def match(self, name):
+        """
+        Return mask of the rules matching the name
+
+        :param name: lower-cased domain name in uncompressed wire format
+        :return: int
+        """
+        node = self._root
+        mask = node[0]
+        for label in reversed(wire_labels(name)):
+            node = node[1].get(label)
+            if node is None:
+                break
+            mask |= node[0]
+        return mask
+
+
+class PrefixTree(object):
+    """
+    Binary trie of address prefixes. Every node holds a bit mask of the rules
+    matching the prefix, the lookup walks only as deep as the longest prefix.
+    """
+
+    def __init__(self, bits):
+        """
+        Constructor
+
+        :param bits: length of the addresses (32 or 128)
+        :return: new object
+        """
+        self._bits = bits
+        # node is [mask, child 0, child 1]
+        self._root = [0, None, None]
+        self._depth = 0
+
+    def add(self, network, mask):
+        """
+        Add the rule matching the network
+
+        :param network: ipaddress.IPv4Network or IPv6Network object
+        :param mask: bit mask of the rule
+        :return: None
+        """
+        address = int(network.network_address)
+        node = self._root
+        for i in range(network.prefixlen):
+            bit = (address >> (self._bits - 1 - i)) & 1
+            if node[1 + bit] is None:
+                node[1 + bit] = [0, None, None]
+            node = node[1 + bit]
+        node[0] |= mask
+        self._depth = max(self._depth, network.prefixlen)
+
+    def match(self, address):
+        """
+        Return mask of the rules matching the address
+
+        :param address: address as int
+        :return: int
+        """
+        node = self._root
+        mask = node[0]
+        shift = self._bits - 1
+        for _ in range(self._depth):
+            node = node[1 + ((address >> shift) & 1)]
+            if node is None:
+                break
+            mask |= node[0]
+            shift -= 1
+        return mask
+
+
+class ChainSelector(object):
+    """
+    Picks the Modification chain for the Query. Chains listed in the 'Chains'
+    option are tried in order and the first one whose rules match the Query
+    name suffix, the Query type and the client address is used. Queries not
+    matching any chain use the default chain from the 'Modifiers' option.
+
+    The rules are compiled into a name trie, a table of types and prefix trees
+    of client addresses returning bit masks of the matching chains, so the
+    cost of selection does not grow with the number of rules.
+    """
+
+    def __init__(self, configuration):
+        """
+        Constructor
+
+        :param configuration: BrokenDnsProxyConfiguration object
+        :return: new object
+        """
+        self.default = ModificationChain(configuration)
+        self.chains = []
+        self._names = NameTrie()
+        self._types = dict()
+        self._clients_v4 = PrefixTree(32)
+        self._clients_v6 = PrefixTree(128)
+        # chains without rule of the kind match everything
+        self._any_name = 0
+        self._any_type = 0
+        self._any_client = 0
+        self._client_rules = False
+
+        chain_names = configuration.getlist(GlobalConfig.config_section_name(), GlobalConfig.CONFIG_CHAINS)
+        for index, chain_name in enumerate(chain_names):
+            section = ChainConfig.chain_section_name(chain_name)
+            mask = 1 << index
+            self.chains.append(ModificationChain(configuration,
+                                                 configuration.getlist(section, ChainConfig.CONFIG_MODIFIERS),
+                                                 chain_name))
+            self._add_names(mask, configuration.getlist(section, ChainConfig.CONFIG_NAMES), chain_name)
+            self._add_types(mask, configuration.getlist(section, ChainConfig.CONFIG_TYPES), chain_name)
+            self._add_clients(mask, configuration.getlist(section, ChainConfig.CONFIG_CLIENTS), chain_name)
+        if self.chains:
+            logger.debug("Compiled rules of %d Modification chains", len(self.chains))
+
+    def __str__(self):
+        return "<ChainSelector chains='{0}'>".format(' '.join(chain.name for chain in self.chains))
+
+    def _add_names(self, mask, names, chain_name):
+        if not names:
+            self._any_name |= mask
+            return
+        import dns.name
+
+        for name in names:
+            try:
+                self._names.add(dns.name.from_text(name).to_wire(), mask)
+            except Exception as e:
+                raise BrokenDNSProxyError("Wrong name '{0}' in chain '{1}': {2}".format(name, chain_name, str(e)))
+
+    def _add_types(self, mask, types, chain_name):
+        if not types:
+            self._any_type |= mask
+        for rdtype in types:
+            try:
+                rdtype = int(dns.rdatatype.from_text(rdtype))
+            except Exception:
+                raise BrokenDNSProxyError("Wrong Query type '{0}' in chain '{1}'".format(rdtype, chain_name))
+            self._types[rdtype] = self._types.get(rdtype, 0) | mask
+
+    def _add_clients(self, mask, clients, chain_name):
+        if not clients:
+            self._any_client |= mask
+        for client in clients:
+            self._client_rules = True
+            try:
+                network = ipaddress.ip_network(client, strict=False)
+            except ValueError as e:
+                raise BrokenDNSProxyError("Wrong client prefix '{0}' in chain '{1}': {2}".format(client, chain_name,
+                                                                                                 str(e)))
+            if network.version == 4:
+                self._clients_v4.add(network, mask)
+                # IPv4 clients of the IPv6 socket have IPv4-mapped addresses
+                mapped = ipaddress.ip_network('::ffff:{0}/{1}'.format(network.network_address,
+                                                                      96 + network.prefixlen))
+                self._clients_v6.add(mapped, mask)
+            else:
+                self._clients_v6.add(network, mask)
+
+    def _match_client(self, client_addr):
+        if client_addr is None:
+            return 0
+        try:
+            address = ipaddress.ip_address(client_addr[0].split('%', 1)[0])
+        except ValueError:
+            return 0
+        if address.version == 4:
+            return self._clients_v4.match(int(address))
+        return self._clients_v6.match(int(address))
+
+    def select(self, msg_raw, client_addr=None):
+        """
+        Return the Modification chain for the Query
+
+        :param msg_raw: raw DNS message with the Query
+        :param client_addr: address tuple of the client, as returned by socket
+        :return: ModificationChain object
+        """
+        if not self.chains:
+            return self.default
+        question = wire.parse_question(msg_raw)
+        if question is None:
+            return self.default
+        qname, qtype, _ = question
+
+        mask = self._names.match(qname) | self._any_name
+        if mask:
+            mask &= self._types.get(qtype, 0) | self._any_type
+        if mask and self._client_rules:
+            mask &= self._match_client(client_addr) | self._any_client
+        if not mask:
+            return self.default
+        # the lowest bit is the first matching chain
+        return self.chains[(mask & -mask).bit_length() - 1]
+
+    @property
+    def active_modifiers(self):
+        """
+        Names of the modifiers doing something in any chain
+
+        :return: list of str
+        """
+        names = []
+        for chain in [self.default] + self.chains:
+            for name in chain.active_modifiers:
+                if name not in names:
+                    names.append(name)
+        return names
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+
+from broken_dns_proxy.modifiers import register_modifier
+from broken_dns_proxy.modifiers import BaseModifier, ParseDepth
+from broken_dns_proxy.modifiers.operations import DelayOperation
+from broken_dns_proxy.exceptions import BrokenDNSProxyError
+
+
+@register_modifier
+class DelayModifier(BaseModifier):
+    """
+    Modifier delaying the response, e.g. to simulate a slow resolver or
+    an answer arriving just after the client timeout. The message itself
+    is not changed. The server parks the response in its timer wheel, so
+    a delayed response never blocks other clients.
+
+    Delay per Query name or type is configured with Modification chains,
+    e.g. 'Modifiers = DelayModifier:SlowDelay' in a chain matching the names.
+
+    Distributions
+        fixed         every response waits Delay seconds
+        uniform       Delay +- Jitter seconds
+        normal        mean Delay seconds, standard deviation Jitter seconds
+        exponential   mean Delay seconds
+    Delays are never negative and never longer than MaxDelay (0 for no limit).
+    """
+
+    CONFIG_SECTION_NAME = 'DelayModifier'
+    CONFIG_DISTRIBUTION = 'Distribution'
+    CONFIG_DELAY = 'Delay'
+    CONFIG_JITTER = 'Jitter'
+    CONFIG_MAX_DELAY = 'MaxDelay'
+
+    CONFIG_DISTRIBUTION_VALUE = DelayOperation.FIXED
+    CONFIG_DELAY_VALUE = '0'
+    CONFIG_JITTER_VALUE = '0'
+    CONFIG_MAX_DELAY_VALUE = '0'
+
+    _options_dict = {
+        CONFIG_DISTRIBUTION: CONFIG_DISTRIBUTION_VALUE,
+        CONFIG_DELAY: CONFIG_DELAY_VALUE,
+        CONFIG_JITTER: CONFIG_JITTER_VALUE,
+        CONFIG_MAX_DELAY: CONFIG_MAX_DELAY_VALUE
+    }
+
+    def __init__(self, configuration, section=None):
+        """
+        Constructor
+
+        :param configuration: BrokenDnsProxyConfiguration object
+        :param section: configuration section to read, None for the section named after the modifier
+        :return: new object
+        """
+        self._configuration = configuration
+        self._section = section or self.CONFIG_SECTION_NAME
+        self._distribution = self._configuration.get(self._section, self.CONFIG_DISTRIBUTION).strip().lower()
+        if self._distribution not in DelayOperation.DISTRIBUTIONS:
+            raise BrokenDNSProxyError("Unknown delay distribution '{0}' in section '{1}', use one of: {2}".format(
+                self._distribution, self._section, ', '.join(DelayOperation.DISTRIBUTIONS)))
+        self._delay = self._get_seconds(self.CONFIG_DELAY)
+        self._jitter = self._get_seconds(self.CONFIG_JITTER)
+        self._max_delay = self._get_seconds(self.CONFIG_MAX_DELAY)
+
+    def _get_seconds(self, option_name):
+        value = self._configuration.getfloat(self._section, option_name)
+        if value < 0:
+            raise BrokenDNSProxyError("Option '{0}' in section '{1}' must not be negative".format(option_name,
+                                                                                                  self._section))
+        return value
+
+    def compile(self):
+        """
+        Responses which would never wait produce no operation at all.
+
+        :return: list of Operation objects
+        """
+        if self._delay <= 0 and (self._jitter <= 0 or self._distribution in (DelayOperation.FIXED,
+                                                                             DelayOperation.EXPONENTIAL)):
+            return []
+        return [DelayOperation(self._distribution, self._delay, self._jitter, self._max_delay)]
+
+    def parse_depth(self):
+        return ParseDepth.NONE
+
+    def modify(self, dns_message):
+        """
+        The message is not changed, the delay is applied by the server
+
+        :param dns_message: dns message object
+        :return: the same dns message object
+        """
+        return dns_message
+
+    def modify_wire(self, buf):
+        pass
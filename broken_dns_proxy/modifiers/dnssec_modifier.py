@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+
+import dns.rdatatype
+
+from broken_dns_proxy import wire
+from broken_dns_proxy.modifiers import register_modifier
+from broken_dns_proxy.modifiers import BaseModifier, ParseDepth
+from broken_dns_proxy.modifiers.operations import RecordsOperation
+from broken_dns_proxy.exceptions import BrokenDNSProxyError
+
+
+@register_modifier
+class DnssecModifier(BaseModifier):
+    """
+    Modifier removing DNSSEC records from the response or corrupting them,
+    e.g. to simulate a resolver stripping signatures or a zone with bogus
+    signatures. The records are walked on the wire, the message is never
+    parsed into DNS Message object unless another modifier needs it.
+
+    Strip       RR types to remove, e.g. 'RRSIG NSEC NSEC3'
+    Corrupt     RR types whose RDATA gets the lowest bit of the last byte
+                flipped, e.g. 'RRSIG DNSKEY DS' breaks the signatures, keys
+                and digests
+    Sections    sections to modify, any of 'answer authority additional'
+    """
+
+    CONFIG_SECTION_NAME = 'DnssecModifier'
+    CONFIG_STRIP = 'Strip'
+    CONFIG_CORRUPT = 'Corrupt'
+    CONFIG_SECTIONS = 'Sections'
+
+    CONFIG_STRIP_VALUE = ''
+    CONFIG_CORRUPT_VALUE = ''
+    CONFIG_SECTIONS_VALUE = 'answer authority additional'
+
+    _options_dict = {
+        CONFIG_STRIP: CONFIG_STRIP_VALUE,
+        CONFIG_CORRUPT: CONFIG_CORRUPT_VALUE,
+        CONFIG_SECTIONS: CONFIG_SECTIONS_VALUE
+    }
+
+    SECTIONS = dict((name, section) for section, name in RecordsOperation.SECTION_NAMES.items())
+
+    def __init__(self, configuration, section=None):
+        """
+        Constructor
+
+        :param configuration: BrokenDnsProxyConfiguration object
+        :param section: configuration section to read, None for the section named after the modifier
+        :return: new object
+        """
+        self._configuration = configuration
+        self._section = section or self.CONFIG_SECTION_NAME
+        self._strip_types = self._get_types(self.CONFIG_STRIP)
+        self._corrupt_types = self._get_types(self.CONFIG_CORRUPT)
+        self._sections = []
+        for name in self._configuration.getlist(self._section, self.CONFIG_SECTIONS):
+            try:
+                self._sections.append(self.SECTIONS[name.lower()])
+            except KeyError:
+                raise BrokenDNSProxyError("Unknown section '{0}' in section '{1}', use any of: {2}".format(
+                    name, self._section, ' '.join(sorted(self.SECTIONS))))
+        self._operations = self.compile()
+
+    def _get_types(self, option_name):
+        types = []
+        for rdtype in self._configuration.getlist(self._section, option_name):
+            try:
+                rdtype = int(dns.rdatatype.from_text(rdtype))
+            except Exception:
+                raise BrokenDNSProxyError("Wrong RR type '{0}' in option '{1}' of section '{2}'".format(
+                    rdtype, option_name, self._section))
+            if rdtype == wire.TYPE_OPT:
+                raise BrokenDNSProxyError("OPT pseudo-RR can not be modified by option '{0}' of section '{1}'".format(
+                    option_name, self._section))
+            types.append(rdtype)
+        return types
+
+    def compile(self):
+        """
+        Nothing to strip or corrupt produces no operation at all.
+
+        :return: list of Operation objects
+        """
+        operation = RecordsOperation(self._sections, self._strip_types, self._corrupt_types)
+        return [] if operation.is_noop() else [operation]
+
+    def parse_depth(self):
+        return max([op.depth for op in self._operations] + [ParseDepth.NONE])
+
+    def modify(self, dns_message):
+        """
+        Method modifying the DNS message, based on Modifier configuration
+
+        :param dns_message: dns message object to modify
+        :return: possibly modified dns message object
+        """
+        for op in self._operations:
+            dns_message = op.apply_message(dns_message)
+        return dns_message
+
+    def modify_wire(self, buf):
+        """
+        Method modifying the raw DNS message in place, based on Modifier configuration
+
+        :param buf: raw dns message as bytearray
+        :return: None
+        """
+        for op in self._operations:
+            op.apply_wire(buf)
@@ -21,7 +21,8 @@
 import dns.flags
 
 from broken_dns_proxy.modifiers import register_modifier
-from broken_dns_proxy.modifiers import BaseModifier
+from broken_dns_proxy.modifiers import BaseModifier, ParseDepth
+from broken_dns_proxy.modifiers.operations import HeaderFlagsOperation, EdnsFlagsOperation
 from broken_dns_proxy.logger import logger
 
 
@@ -80,15 +81,17 @@ class FlagsModifier(BaseModifier):
         CONFIG_DO: CONFIG_DO_VALUE
     }
 
-    def __init__(self, configuration):
+    def __init__(self, configuration, section=None):
         """
         Constructor
 
         :param configuration: BrokenDnsProxyConfiguration object
+        :param section: configuration section to read, None for the section named after the modifier
         :return: new object
         """
         # global configuration
         self._configuration = configuration
+        self._section = section or self.CONFIG_SECTION_NAME
         # ProxyServer specific configuration
         self._aa_flag = self._get_action(self.CONFIG_AA)
         self._tc_flag = self._get_action(self.CONFIG_TC)
@@ -98,6 +101,21 @@ class FlagsModifier(BaseModifier):
         self._cd_flag = self._get_action(self.CONFIG_CD)
         self._do_flag = self._get_action(self.CONFIG_DO)
 
+        # DNS header flags to set and to clear as bit masks
+        self._set_mask = 0
+        self._clear_mask = 0
+        for action, flag in ((self._aa_flag, dns.flags.AA),
+                             (self._tc_flag, dns.flags.TC),
+                             (self._rd_flag, dns.flags.RD),
+                             (self._ra_flag, dns.flags.RA),
+                             (self._ad_flag, dns.flags.AD),
+                             (self._cd_flag, dns.flags.CD)):
+            if action is self.ACTION_SET:
+                self._set_mask |= int(flag)
+            elif action is self.ACTION_CLEAR:
+                self._clear_mask |= int(flag)
+        self._operations = self.compile()
+
     def _get_action(self, option_name):
         """
         Get the action for a specific option (flag)
@@ -106,12 +124,32 @@ class FlagsModifier(BaseModifier):
         :return: True for set; False for clear/unset; None for unchanged
         """
         try:
-            return self._configuration.getboolean(self.CONFIG_SECTION_NAME, option_name)
+            return self._configuration.getboolean(self._section, option_name)
         except ValueError:
-            value = self._configuration.get(self.CONFIG_SECTION_NAME, option_name)
+            value = self._configuration.get(self._section, option_name)
             if value.strip().lower() != self.ACTION_NONE:
                 logger.error("Wrong value '%s' in configuration for %s", value, option_name)
 
+    def compile(self):
+        """
+        DO flag is in the OPT pseudo-RR, all other flags are in the DNS header.
+        Flags left unchanged produce no operation at all.
+
+        :return: list of Operation objects
+        """
+        operations = []
+        if self._set_mask or self._clear_mask:
+            operations.append(HeaderFlagsOperation(self._set_mask, self._clear_mask))
+        # DO  DNSSEC answer OK [RFC 4035][RFC 3225]
+        if self._do_flag is self.ACTION_SET:
+            operations.append(EdnsFlagsOperation(set_mask=int(dns.flags.DO)))
+        elif self._do_flag is self.ACTION_CLEAR:
+            operations.append(EdnsFlagsOperation(clear_mask=int(dns.flags.DO)))
+        return operations
+
+    def parse_depth(self):
+        return max([op.depth for op in self._operations] + [ParseDepth.NONE])
+
     def modify(self, dns_message):
         """
         Method modifying the DNS message, based on Modifier configuration
@@ -119,64 +157,16 @@ class FlagsModifier(BaseModifier):
         :param dns_message: dns message object to modify
         :return: possibly modified dns message object
         """
-        # go through all flags in settings and set/clear/do nothing with the flag
-        # AA  Authoritative Answer [RFC 1035]
-        if self._aa_flag is not None:
-            if self._aa_flag:
-                logger.debug("Setting AA flag")
-                dns_message.flags |= dns.flags.AA
-            else:
-                logger.debug("Clearing AA flag")
-                dns_message.flags &= ~dns.flags.AA
-        # TC  Truncated Response   [RFC 1035]
-        if self._tc_flag is not None:
-            if self._tc_flag:
-                logger.debug("Setting TC flag")
-                dns_message.flags |= dns.flags.TC
-            else:
-                logger.debug("Clearing TC flag")
-                dns_message.flags &= ~dns.flags.TC
-        # RD  Recursion Desired    [RFC 1035]
-        if self._rd_flag is not None:
-            if self._rd_flag:
-                logger.debug("Setting RD flag")
-                dns_message.flags |= dns.flags.RD
-            else:
-                logger.debug("Clearing RD flag")
-                dns_message.flags &= ~dns.flags.RD
-        # RA  Recursion Allowed    [RFC 1035]
-        if self._ra_flag is not None:
-            if self._ra_flag:
-                logger.debug("Setting RA flag")
-                dns_message.flags |= dns.flags.RA
-            else:
-                logger.debug("Clearing RA flag")
-                dns_message.flags &= ~dns.flags.RA
-        # AD  Authentic Data       [RFC 4035]
-        if self._ad_flag is not None:
-            if self._ad_flag:
-                logger.debug("Setting AD flag")
-                dns_message.flags |= dns.flags.AD
-            else:
-                logger.debug("Clearing AD flag")
-                dns_message.flags &= ~dns.flags.AD
-        # CD  Checking Disabled    [RFC 4035]
-        if self._cd_flag is not None:
-            if self._cd_flag:
-                logger.debug("Setting CD flag")
-                dns_message.flags |= dns.flags.CD
-            else:
-                logger.debug("Clearing CD flag")
-                dns_message.flags &= ~dns.flags.CD
-        # DO  DNSSEC answer OK [RFC 4035][RFC 3225]
-        if self._do_flag is not None:
-            if self._do_flag:
-                # enable EDNS if not enabled
-                if dns_message.edns == -1:
-                    logger.debug("EDNS0 not used... enabling")
-                    dns.message.use_edns()
-                logger.debug("Setting DO flag")
-                dns_message.ednsflags |= dns.flags.DO
-            else:
-                logger.debug("Clearing DO flag")
-                dns_message.ednsflags &= ~dns.flags.DO
+        for op in self._operations:
+            dns_message = op.apply_message(dns_message)
+        return dns_message
+
+    def modify_wire(self, buf):
+        """
+        Method modifying the raw DNS message in place, based on Modifier configuration
+
+        :param buf: raw dns message as bytearray
+        :return: None
+        """
+        for op in self._operations:
+            op.apply_wire(buf)
@@ -18,7 +18,7 @@
 #
 # Authors:
 
-from broken_dns_proxy.modifiers import get_modifier_by_name
+from broken_dns_proxy.modifiers import get_modifier_by_name, ExecutionPlan
 from broken_dns_proxy.logger import logger
 from broken_dns_proxy.exceptions import BrokenDNSProxyError
 from broken_dns_proxy.config_common import GlobalConfig
@@ -29,21 +29,62 @@ class ModificationChain(object):
     Class representing a specific chain od modifiers
     """
 
-    def __init__(self, configuration):
+    def __init__(self, configuration, modifiers_list=None, name='default'):
         """
 
         :param configuration:
+        :param modifiers_list: list of 'Modifier' or 'Modifier:Section', None for the 'Modifiers' option
+        :param name: name of the chain used in log messages
         :return:
         """
+        self.name = name
         self._modifiers = list()
-        modifiers_list = configuration.getlist(GlobalConfig.config_section_name(), GlobalConfig.CONFIG_MODIFIERS)
+        if modifiers_list is None:
+            modifiers_list = configuration.getlist(GlobalConfig.config_section_name(), GlobalConfig.CONFIG_MODIFIERS)
 
-        for mod_name in modifiers_list:
+        for mod_spec in modifiers_list:
+            mod_name, _, section = mod_spec.partition(':')
             mod = get_modifier_by_name(mod_name)
             if not mod:
                 raise BrokenDNSProxyError("Modifier '{0}' does not exist!".format(mod_name))
-            logger.debug("Adding modifier '%s' to Modification Chain", mod_name)
-            self._modifiers.append(mod(configuration))
+            logger.debug("Adding modifier '%s' to Modification Chain '%s'", mod_spec, self.name)
+            self._modifiers.append(mod(configuration, section or None))
+
+        self.plan = self.compile()
+        # the cheapest representation of the message all modifiers can work with
+        self.parse_depth = self.plan.depth
+
+    def compile(self):
+        """
+        Compile the chain into ExecutionPlan. Modifiers doing nothing with their
+        configuration are dropped and neighbouring flag edits are fused into one.
+        The plan is the function the server runs on every response.
+
+        :return: ExecutionPlan object
+        """
+        operations = []
+        # names of modifiers which actually do something
+        self.active_modifiers = []
+        for mod in self._modifiers:
+            mod_operations = mod.compile()
+            if not mod_operations:
+                logger.debug("Modifier '%s' does nothing with its configuration... dropping",
+                             mod.config_section_name())
+            else:
+                self.active_modifiers.append(mod.config_section_name())
+            operations.extend(mod_operations)
+
+        plan = ExecutionPlan(operations)
+        logger.debug("Modification Chain '%s' compiled into %s", self.name, str(plan))
+        return plan
+
+    def describe(self):
+        """
+        Return human readable description of what actually runs on every response
+
+        :return: list of strings
+        """
+        return self.plan.describe()
 
     def run_modifiers(self, dns_message):
         """
@@ -55,6 +96,8 @@ class ModificationChain(object):
 
         for mod in self._modifiers:
             logger.debug("Running '%s' modifier...", mod.config_section_name())
-            dns_message = mod.modify(dns_message)
+            modified_message = mod.modify(dns_message)
+            if modified_message is not None:
+                dns_message = modified_message
 
         return dns_message
\ No newline at end of file
@@ -19,13 +19,28 @@
 # Authors:
 
 from broken_dns_proxy.exceptions import BrokenDNSProxyError
+from broken_dns_proxy.lazy_import import import_object
+from broken_dns_proxy.logger import logger
 
 
 modifiers = {}
 
+# group of package entry points through which other packages provide modifiers,
+# the entry point name is the configuration section name of the modifier
+ENTRY_POINT_GROUP = 'broken_dns_proxy.modifiers'
+
+# modifiers shipped with the proxy, the same as its entry points in setup.cfg,
+# so they are found without looking through the installed packages.
+# Modules are imported only when the modifier is named in the configuration.
+builtin_modifiers = {
+    'flagsmodifier': 'broken_dns_proxy.modifiers.flags_modifier:FlagsModifier',
+    'delaymodifier': 'broken_dns_proxy.modifiers.delay_modifier:DelayModifier',
+    'dnssecmodifier': 'broken_dns_proxy.modifiers.dnssec_modifier:DnssecModifier',
+}
+
 
 def register_modifier(modifier):
-    if is_modifier(modifier.config_section_name().lower()):
+    if modifier.config_section_name().lower() in modifiers:
         raise BrokenDNSProxyError("Modifier with name {0} already exists!".format(modifier.config_section_name()))
     modifiers[modifier.config_section_name().lower()] = modifier
     return modifier
@@ -36,7 +51,50 @@ def is_modifier(modifier_name):
 
 
 def get_modifier_by_name(modifier_name):
+    name = modifier_name.lower()
     try:
-        return modifiers[modifier_name.lower()]
+        return modifiers[name]
     except KeyError:
-        return None
\ No newline at end of file
+        pass
+
+    if name in builtin_modifiers:
+        path = builtin_modifiers[name]
+    else:
+        entry_point = _find_entry_point(name)
+        if entry_point is None:
+            return None
+        path = entry_point.value
+
+    logger.debug("Loading modifier '%s' from '%s'", modifier_name, path)
+    modifier = import_object(path)
+    # modules of modifiers usually register them when imported
+    if name not in modifiers:
+        if modifier.config_section_name().lower() != name:
+            raise BrokenDNSProxyError("Modifier '{0}' from '{1}' has section name '{2}'!".format(
+                modifier_name, path, modifier.config_section_name()))
+        register_modifier(modifier)
+    return modifiers[name]
+
+
+def _find_entry_point(name):
+    """
+    Find the modifier among the entry points of installed packages
+
+    :param name: lowercase name of the modifier
+    :return: EntryPoint object or None
+    """
+    # importing the package metadata is slow, so it is done only for modifiers not shipped with the proxy
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        return None
+
+    eps = entry_points()
+    if hasattr(eps, 'select'):
+        eps = eps.select(group=ENTRY_POINT_GROUP)
+    else:
+        eps = eps.get(ENTRY_POINT_GROUP, [])
+    for entry_point in eps:
+        if entry_point.name.lower() == name:
+            return entry_point
+    return None
@@ -0,0 +1,420 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+
+import random
+
+import dns.flags
+import dns.rdatatype
+
+from broken_dns_proxy import wire
+
+
+class ParseDepth(object):
+    """
+    How much of the DNS message a modifier needs to be parsed.
+    Higher depth includes all the lower ones.
+    """
+
+    # modifier doesn't touch the message at all
+    NONE = 0
+    # only the fixed DNS header (ID, flags, counts)
+    HEADER = 1
+    # the DNS header and the OPT pseudo-RR
+    EDNS = 2
+    # all Resource Records walked on the wire
+    RECORDS = 3
+    # the whole message parsed into DNS Message object
+    FULL = 4
+
+
+class Operation(object):
+    """
+    One step of the compiled ModificationChain. Every operation can be applied
+    to the raw message (if its depth is lower than FULL) and to DNS Message object.
+    """
+
+    depth = ParseDepth.FULL
+
+    def apply_wire(self, buf):
+        """
+        Apply the operation to the raw message in place
+
+        :param buf: raw DNS message as bytearray
+        :return: None
+        """
+        raise NotImplementedError()
+
+    def apply_message(self, dns_message):
+        """
+        Apply the operation to the DNS Message object
+
+        :param dns_message: DNS Message object
+        :return: possibly modified DNS Message object
+        """
+        raise NotImplementedError()
+
+    def fuse(self, other):
+        """
+        Merge the operation with the operation following it
+
+        :param other: Operation applied right after this one
+        :return: new Operation doing both or None if they can't be merged
+        """
+        return None
+
+    def is_noop(self):
+        return False
+
+
+class FlagsOperation(Operation):
+    """
+    Base for operations setting and clearing bits in a 16bit flags field
+    """
+
+    def __init__(self, set_mask=0, clear_mask=0):
+        self.set_mask = set_mask
+        self.clear_mask = clear_mask & ~set_mask
+
+    def __str__(self):
+        return "<{0} set='{1:#06x}' clear='{2:#06x}'>".format(self.__class__.__name__, self.set_mask, self.clear_mask)
+
+    def fuse(self, other):
+        if type(other) is not type(self):
+            return None
+        # bits touched by the later operation take precedence
+        return type(self)((self.set_mask & ~other.clear_mask) | other.set_mask,
+                          (self.clear_mask & ~other.set_mask) | other.clear_mask)
+
+    def is_noop(self):
+        return not self.set_mask and not self.clear_mask
+
+    def _apply(self, flags):
+        return (flags & ~self.clear_mask) | self.set_mask
+
+
+class HeaderFlagsOperation(FlagsOperation):
+    """
+    Set and clear DNS header flags
+    """
+
+    depth = ParseDepth.HEADER
+
+    def __str__(self):
+        return "<HeaderFlagsOperation set='{0}' clear='{1}'>".format(dns.flags.to_text(self.set_mask),
+                                                                    dns.flags.to_text(self.clear_mask))
+
+    def apply_wire(self, buf):
+        wire.set_flags(buf, self._apply(wire.get_flags(buf)))
+
+    def apply_message(self, dns_message):
+        dns_message.flags = self._apply(dns_message.flags)
+        return dns_message
+
+
+class EdnsFlagsOperation(FlagsOperation):
+    """
+    Set and clear EDNS header flags. EDNS is enabled if a flag has to be set in a message without it.
+    """
+
+    depth = ParseDepth.EDNS
+
+    def __str__(self):
+        return "<EdnsFlagsOperation set='{0}' clear='{1}'>".format(dns.flags.edns_to_text(self.set_mask),
+                                                                  dns.flags.edns_to_text(self.clear_mask))
+
+    def apply_wire(self, buf):
+        opt = wire.find_opt(buf)
+        if opt is None:
+            if not self.set_mask:
+                return
+            opt = wire.add_opt(buf)
+        wire.set_edns_flags(buf, opt, self._apply(wire.get_edns_flags(buf, opt)))
+
+    def apply_message(self, dns_message):
+        if dns_message.edns == -1:
+            if not self.set_mask:
+                return dns_message
+            dns_message.use_edns()
+        dns_message.ednsflags = self._apply(dns_message.ednsflags)
+        return dns_message
+
+
+class RecordsOperation(Operation):
+    """
+    Remove Resource Records of some types and corrupt RDATA of others in the
+    selected sections. RDATA is corrupted by flipping the lowest bit of its
+    last byte, which is in the signature of RRSIG, the key of DNSKEY and the
+    digest of DS.
+    """
+
+    depth = ParseDepth.RECORDS
+
+    SECTION_NAMES = {wire.ANSWER: 'answer', wire.AUTHORITY: 'authority', wire.ADDITIONAL: 'additional'}
+
+    def __init__(self, sections, strip_types=(), corrupt_types=()):
+        """
+        Constructor
+
+        :param sections: message sections to modify (wire.ANSWER, wire.AUTHORITY, wire.ADDITIONAL)
+        :param strip_types: RR types to remove
+        :param corrupt_types: RR types to corrupt
+        :return: new object
+        """
+        self.sections = frozenset(sections)
+        self.strip_types = frozenset(strip_types)
+        self.corrupt_types = frozenset(corrupt_types) - self.strip_types
+
+    def __str__(self):
+        return "<RecordsOperation sections='{0}' strip='{1}' corrupt='{2}'>".format(
+            ' '.join(self.SECTION_NAMES[section] for section in sorted(self.sections)),
+            ' '.join(sorted(dns.rdatatype.to_text(rdtype) for rdtype in self.strip_types)),
+            ' '.join(sorted(dns.rdatatype.to_text(rdtype) for rdtype in self.corrupt_types)))
+
+    def fuse(self, other):
+        if type(other) is not type(self) or other.sections != self.sections:
+            return None
+        return RecordsOperation(self.sections, self.strip_types | other.strip_types,
+                                self.corrupt_types | other.corrupt_types)
+
+    def is_noop(self):
+        return not self.sections or (not self.strip_types and not self.corrupt_types)
+
+    def apply_wire(self, buf):
+        if self.strip_types:
+            records = [rr for rr in wire.iter_records(buf)
+                       if rr.rdtype in self.strip_types and rr.section in self.sections]
+            if records:
+                buf[:] = wire.remove_records(buf, records)
+        if self.corrupt_types:
+            for rr in wire.iter_records(buf):
+                if rr.rdtype in self.corrupt_types and rr.section in self.sections and rr.rdlength:
+                    buf[rr.rdata + rr.rdlength - 1] ^= 0x01
+
+    def apply_message(self, dns_message):
+        for section in self.sections:
+            rrsets = dns_message.sections[section]
+            kept = []
+            for rrset in rrsets:
+                if rrset.rdtype in self.strip_types:
+                    continue
+                if rrset.rdtype in self.corrupt_types:
+                    rrset = self._corrupt(rrset)
+                kept.append(rrset)
+            rrsets[:] = kept
+        return dns_message
+
+    @staticmethod
+    def _corrupt(rrset):
+        import dns.rdata
+        import dns.rrset
+
+        rdatas = []
+        for rd in rrset:
+            rdata_raw = bytearray(rd.to_wire())
+            if rdata_raw:
+                rdata_raw[-1] ^= 0x01
+            rdatas.append(dns.rdata.from_wire(rd.rdclass, rd.rdtype, bytes(rdata_raw), 0, len(rdata_raw)))
+        return dns.rrset.from_rdata_list(rrset.name, rrset.ttl, rdatas)
+
+
+class ModifierOperation(Operation):
+    """
+    Operation running a modifier which doesn't provide more specific operations
+    """
+
+    def __init__(self, modifier):
+        self.modifier = modifier
+        self.depth = modifier.parse_depth()
+
+    def __str__(self):
+        return "<ModifierOperation modifier='{0}' depth='{1}'>".format(self.modifier.config_section_name(), self.depth)
+
+    def apply_wire(self, buf):
+        self.modifier.modify_wire(buf)
+
+    def apply_message(self, dns_message):
+        modified_message = self.modifier.modify(dns_message)
+        return dns_message if modified_message is None else modified_message
+
+    def is_noop(self):
+        return self.depth == ParseDepth.NONE
+
+
+class DelayOperation(Operation):
+    """
+    Delay sending of the response. The message is not touched, the delay
+    is sampled for every response by ExecutionPlan.sample_delay().
+    """
+
+    depth = ParseDepth.NONE
+
+    FIXED = 'fixed'
+    UNIFORM = 'uniform'
+    NORMAL = 'normal'
+    EXPONENTIAL = 'exponential'
+    DISTRIBUTIONS = (FIXED, UNIFORM, NORMAL, EXPONENTIAL)
+
+    def __init__(self, distribution, delay, jitter=0.0, max_delay=0.0):
+        """
+        Constructor
+
+        :param distribution: one of DISTRIBUTIONS
+        :param delay: fixed delay or the mean of the distribution in seconds
+        :param jitter: half-width of the uniform distribution or deviation of the normal one
+        :param max_delay: upper bound of the delay, 0 for no bound
+        :return: new object
+        """
+        self.distribution = distribution
+        self.delay = delay
+        self.jitter = jitter
+        self.max_delay = max_delay
+        if distribution == self.FIXED:
+            self._sample = lambda: delay
+        elif distribution == self.UNIFORM:
+            self._sample = lambda: random.uniform(delay - jitter, delay + jitter)
+        elif distribution == self.NORMAL:
+            self._sample = lambda: random.gauss(delay, jitter)
+        elif distribution == self.EXPONENTIAL:
+            self._sample = lambda: random.expovariate(1.0 / delay)
+        else:
+            raise ValueError("Unknown delay distribution '{0}'".format(distribution))
+
+    def __str__(self):
+        return "<DelayOperation distribution='{0}' delay='{1}' jitter='{2}' max='{3}'>".format(
+            self.distribution, self.delay, self.jitter, self.max_delay)
+
+    def sample(self):
+        """
+        Return the delay for one response
+
+        :return: delay in seconds
+        """
+        delay = max(0.0, self._sample())
+        if self.max_delay:
+            delay = min(delay, self.max_delay)
+        return delay
+
+    def apply_wire(self, buf):
+        pass
+
+    def apply_message(self, dns_message):
+        return dns_message
+
+
+class ExecutionPlan(object):
+    """
+    Compiled ModificationChain: the list of operations left after dropping
+    no-ops and fusing neighbouring operations, and a single function
+    running all of them on the cheapest message representation.
+    """
+
+    def __init__(self, operations):
+        """
+        Constructor
+
+        :param operations: list of Operation objects in the order they are applied
+        :return: new object
+        """
+        self.operations = self._optimize(operations)
+        self.depth = max([op.depth for op in self.operations] + [ParseDepth.NONE])
+        # delays don't touch the message, they are sampled for every response
+        self.delays = [op for op in self.operations if isinstance(op, DelayOperation)]
+        self._run = self._build([op for op in self.operations if not isinstance(op, DelayOperation)])
+
+    def __str__(self):
+        return "<ExecutionPlan depth='{0}' operations='[{1}]'>".format(
+            self.depth, ', '.join(str(op) for op in self.operations))
+
+    def __call__(self, msg_raw):
+        """
+        Run the plan on the raw DNS message
+
+        :param msg_raw: raw DNS message
+        :return: modified raw DNS message
+        """
+        return self._run(msg_raw)
+
+    def sample_delay(self):
+        """
+        Return how long the response should wait before it is sent
+
+        :return: delay in seconds, 0 if the response is sent at once
+        """
+        return sum(op.sample() for op in self.delays)
+
+    def describe(self):
+        """
+        Return human readable description of the operations
+
+        :return: list of strings
+        """
+        return [str(op) for op in self.operations]
+
+    @staticmethod
+    def _optimize(operations):
+        optimized = []
+        for op in operations:
+            if op.is_noop():
+                continue
+            if optimized:
+                fused = optimized[-1].fuse(op)
+                if fused is not None:
+                    if fused.is_noop():
+                        optimized.pop()
+                    else:
+                        optimized[-1] = fused
+                    continue
+            optimized.append(op)
+        return optimized
+
+    def _build(self, operations):
+        if not operations:
+            return lambda msg_raw: msg_raw
+
+        if self.depth == ParseDepth.FULL:
+            # importing the message parser is slow, only the chains which need it pay for it
+            import dns.message
+
+            apply_functions = [op.apply_message for op in operations]
+
+            def run_message(msg_raw):
+                dns_message = dns.message.from_wire(bytes(msg_raw))
+                for apply_message in apply_functions:
+                    dns_message = apply_message(dns_message)
+                return dns_message.to_wire()
+            return run_message
+
+        if len(operations) == 1:
+            apply_wire = operations[0].apply_wire
+
+            def run_single(msg_raw):
+                buf = bytearray(msg_raw)
+                apply_wire(buf)
+                return buf
+            return run_single
+
+        apply_functions = [op.apply_wire for op in operations]
+
+        def run_wire(msg_raw):
+            buf = bytearray(msg_raw)
+            for apply_wire in apply_functions:
+                apply_wire(buf)
+            return buf
+        return run_wire
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+
+import socket
+import struct
+from collections import namedtuple
+
+from broken_dns_proxy.exceptions import BrokenDNSProxyError
+
+
+# Reader of packet captures in pcap and pcapng format. The file is read one
+# record at a time, so captures of any size are processed in constant memory.
+
+# UDP datagram found in the capture
+#   timestamp   - capture time in seconds
+#   src, sport  - source address and port
+#   dst, dport  - destination address and port
+#   payload     - UDP payload
+UdpPacket = namedtuple('UdpPacket', ['timestamp', 'src', 'sport', 'dst', 'dport', 'payload'])
+
+PCAP_MAGIC_USEC = 0xA1B2C3D4
+PCAP_MAGIC_NSEC = 0xA1B23C4D
+PCAPNG_SHB = 0x0A0D0D0A
+PCAPNG_BYTE_ORDER_MAGIC = 0x1A2B3C4D
+PCAPNG_IDB = 0x00000001
+PCAPNG_SPB = 0x00000003
+PCAPNG_EPB = 0x00000006
+PCAPNG_OPT_IF_TSRESOL = 9
+
+# link-layer header types
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LOOP = 108
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+LINKTYPE_LINUX_SLL2 = 276
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86DD
+ETHERTYPES_VLAN = (0x8100, 0x88A8, 0x9100)
+
+IPPROTO_UDP = 17
+# IPv6 extension headers which can be skipped over
+IPV6_EXTENSION_HEADERS = (0, 43, 60)
+
+
+def _network_layer(linktype, frame):
+    """
+    Return the IP packet carried in the frame
+
+    :param linktype: link-layer header type of the capture
+    :param frame: captured data
+    :return: memoryview with the IP packet or None
+    """
+    if linktype in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6):
+        return frame
+    if linktype in (LINKTYPE_NULL, LINKTYPE_LOOP):
+        # 4B address family in unknown byte order, the IP version tells the rest
+        return frame[4:]
+    if linktype == LINKTYPE_ETHERNET:
+        offset = 12
+        ethertype = struct.unpack_from('!H', frame, offset)[0]
+        while ethertype in ETHERTYPES_VLAN:
+            offset += 4
+            ethertype = struct.unpack_from('!H', frame, offset)[0]
+        offset += 2
+    elif linktype == LINKTYPE_LINUX_SLL:
+        ethertype = struct.unpack_from('!H', frame, 14)[0]
+        offset = 16
+    elif linktype == LINKTYPE_LINUX_SLL2:
+        ethertype = struct.unpack_from('!H', frame, 0)[0]
+        offset = 20
+    else:
+        return None
+    if ethertype not in (ETHERTYPE_IPV4, ETHERTYPE_IPV6):
+        return None
+    return frame[offset:]
+
+
+def parse_udp(timestamp, linktype, frame):
+    """
+    Decode the UDP datagram in the captured frame. Fragmented IP packets are not reassembled.
+
+    :param timestamp: capture time in seconds
+    :param linktype: link-layer header type of the capture
+    :param frame: captured data as memoryview
+    :return: UdpPacket or None if the frame doesn't contain UDP datagram
+    """
+    try:
+        packet = _network_layer(linktype, frame)
+        if packet is None or not len(packet):
+            return None
+        version = packet[0] >> 4
+        if version == 4:
+            header_length = (packet[0] & 0xF) * 4
+            total_length, fragment, protocol = struct.unpack_from('!H2xHxB', packet, 2)
+            if protocol != IPPROTO_UDP or fragment & 0x3FFF:
+                return None
+            src = socket.inet_ntop(socket.AF_INET, packet[12:16])
+            dst = socket.inet_ntop(socket.AF_INET, packet[16:20])
+            end = min(total_length, len(packet))
+            offset = header_length
+        elif version == 6:
+            payload_length, protocol = struct.unpack_from('!HB', packet, 4)
+            src = socket.inet_ntop(socket.AF_INET6, packet[8:24])
+            dst = socket.inet_ntop(socket.AF_INET6, packet[24:40])
+            end = min(40 + payload_length, len(packet))
+            offset = 40
+            while protocol in IPV6_EXTENSION_HEADERS:
+                protocol, length = struct.unpack_from('!BB', packet, offset)
+                offset += (length + 1) * 8
+            if protocol != IPPROTO_UDP:
+                return None
+        else:
+            return None
+        sport, dport, udp_length = struct.unpack_from('!HHH', packet, offset)
+        end = min(end, offset + udp_length)
+        return UdpPacket(timestamp, src, sport, dst, dport, bytes(packet[offset + 8:end]))
+    except (struct.error, ValueError, IndexError):
+        # truncated by the snapshot length
+        return None
+
+
+def _read_exactly(f, length):
+    data = f.read(length)
+    if len(data) != length:
+        if data:
+            raise BrokenDNSProxyError("Capture file is truncated")
+        return None
+    return data
+
+
+def _read_pcap(f, header):
+    magic = struct.unpack('<I', header)[0]
+    byte_order = '<' if magic in (PCAP_MAGIC_USEC, PCAP_MAGIC_NSEC) else '>'
+    magic = struct.unpack(byte_order + 'I', header)[0]
+    resolution = 1e-9 if magic == PCAP_MAGIC_NSEC else 1e-6
+    rest = _read_exactly(f, 20)
+    if rest is None:
+        return
+    linktype = struct.unpack(byte_order + 'I', rest[16:20])[0] & 0xFFFF
+    record = struct.Struct(byte_order + 'IIII')
+    while True:
+        record_header = _read_exactly(f, record.size)
+        if record_header is None:
+            return
+        seconds, fraction, captured, _ = record.unpack(record_header)
+        frame = _read_exactly(f, captured)
+        if frame is None:
+            raise BrokenDNSProxyError("Capture file is truncated")
+        yield seconds + fraction * resolution, linktype, memoryview(frame)
+
+
+def _tsresol(options, byte_order):
+    """
+    Return the timestamp resolution from options of the Interface Description Block
+
+    :param options: raw options
+    :param byte_order: '<' or '>'
+    :return: seconds per timestamp unit
+    """
+    offset = 0
+    while offset + 4 <= len(options):
+        code, length = struct.unpack_from(byte_order + 'HH', options, offset)
+        if code == 0:
+            break
+        if code == PCAPNG_OPT_IF_TSRESOL and length >= 1:
+            value = options[offset + 4]
+            return 2 ** -(value & 0x7F) if value & 0x80 else 10 ** -value
+        offset += 4 + (length + 3) // 4 * 4
+    return 1e-6
+
+
+def _read_block_body(f, length):
+    body = _read_exactly(f, length)
+    if body is None:
+        raise BrokenDNSProxyError("Capture file is truncated")
+    return body
+
+
+def _read_pcapng(f, header):
+    byte_order = '<'
+    interfaces = []
+    block_header = header
+    while True:
+        block_type = struct.unpack(byte_order + 'I', block_header)[0]
+        length_raw = _read_block_body(f, 4)
+        if block_type == PCAPNG_SHB:
+            # every section can have different byte order
+            magic = _read_block_body(f, 4)
+            byte_order = '<' if struct.unpack('<I', magic)[0] == PCAPNG_BYTE_ORDER_MAGIC else '>'
+            interfaces = []
+        block_length = struct.unpack(byte_order + 'I', length_raw)[0]
+        # type, length and the trailing length, plus byte-order magic in Section Header Block
+        if block_length < (16 if block_type == PCAPNG_SHB else 12):
+            raise BrokenDNSProxyError("Capture file is corrupt, wrong pcapng block length {0}".format(block_length))
+        if block_type == PCAPNG_SHB:
+            body = magic + _read_block_body(f, block_length - 12)
+        else:
+            body = _read_block_body(f, block_length - 8)
+
+        if block_type == PCAPNG_IDB:
+            if len(body) < 12:
+                raise BrokenDNSProxyError("Capture file is corrupt, Interface Description Block is too short")
+            linktype, _, _ = struct.unpack_from(byte_order + 'HHI', body)
+            interfaces.append((linktype, _tsresol(body[8:-4], byte_order)))
+        elif block_type == PCAPNG_EPB:
+            if len(body) < 24:
+                raise BrokenDNSProxyError("Capture file is corrupt, Enhanced Packet Block is too short")
+            interface, ts_high, ts_low, captured, _ = struct.unpack_from(byte_order + 'IIIII', body)
+            if interface >= len(interfaces):
+                raise BrokenDNSProxyError("Capture file is corrupt, packet from undescribed interface {0}".format(
+                    interface))
+            if captured > len(body) - 24:
+                raise BrokenDNSProxyError("Capture file is corrupt, packet is longer than its block")
+            linktype, resolution = interfaces[interface]
+            yield ((ts_high << 32) | ts_low) * resolution, linktype, memoryview(body)[20:20 + captured]
+        elif block_type == PCAPNG_SPB and interfaces:
+            if len(body) < 8:
+                raise BrokenDNSProxyError("Capture file is corrupt, Simple Packet Block is too short")
+            # no timestamp in Simple Packet Block
+            linktype, _ = interfaces[0]
+            yield None, linktype, memoryview(body)[4:-4]
+
+        block_header = _read_exactly(f, 4)
+        if block_header is None:
+            return
+
+
+def read_frames(f):
+    """
+    Iterate over the frames in the capture
+
+    :param f: file object opened in binary mode
+    :return: generator of (timestamp or None, linktype, memoryview with the frame)
+    """
+    header = _read_exactly(f, 4)
+    if header is None:
+        return
+    magic = struct.unpack('<I', header)[0]
+    if magic == PCAPNG_SHB:
+        return (yield from _read_pcapng(f, header))
+    if magic in (PCAP_MAGIC_USEC, PCAP_MAGIC_NSEC) or struct.unpack('>I', header)[0] in (PCAP_MAGIC_USEC,
+                                                                                         PCAP_MAGIC_NSEC):
+        return (yield from _read_pcap(f, header))
+    raise BrokenDNSProxyError("Not a pcap or pcapng file")
+
+
+def read_udp_packets(path):
+    """
+    Iterate over the UDP datagrams in the capture file
+
+    :param path: path to pcap or pcapng file
+    :return: generator of UdpPacket
+    """
+    try:
+        with open(path, 'rb') as f:
+            previous = 0.0
+            for timestamp, linktype, frame in read_frames(f):
+                if timestamp is None:
+                    timestamp = previous
+                previous = timestamp
+                packet = parse_udp(timestamp, linktype, frame)
+                if packet is not None:
+                    yield packet
+    except IOError as e:
+        raise BrokenDNSProxyError("Unable to read capture '{0}': {1}".format(path, e.strerror))
@@ -18,20 +18,35 @@
 #
 # Authors:
 
+import signal
 import socket
-import select
-import random
+import selectors
+import threading
+import time
+from collections import deque
 
-import dns.message
-import dns.rcode
 import dns.flags
-import dns.query
+import dns.rcode
+from six.moves import configparser
 
-from broken_dns_proxy.logger import logger
-from broken_dns_proxy.exceptions import BrokenDNSProxyError
-from broken_dns_proxy.client import Client
-from broken_dns_proxy.modifiers import ModificationChain
+from broken_dns_proxy import wire
+from broken_dns_proxy.logger import logger, LazyMessageDump, MessageDumpSampler
+from broken_dns_proxy.exceptions import BrokenDNSProxyError, WireFormatError
+from broken_dns_proxy.client import Client, ClientPool
+from broken_dns_proxy.buffer_pool import BufferPool
+from broken_dns_proxy.tcp_connection import TcpClientConnection, StreamClient
+from broken_dns_proxy.modifiers import ChainSelector, ParseDepth
 from broken_dns_proxy.config_common import GlobalConfig
+from broken_dns_proxy.blocking_upstream import BlockingUdpUpstream, BlockingTcpUpstream, parse_upstream_address, \
+    STUB_UPSTREAM
+from broken_dns_proxy.upstream_selection import get_strategy_by_name
+from broken_dns_proxy.cache import ResponseCache
+from broken_dns_proxy.response_memo import ResponseMemo
+from broken_dns_proxy.retry_policy import RetryPolicy
+from broken_dns_proxy.metrics import ProxyMetrics
+from broken_dns_proxy.timer_wheel import TimerWheel
+from broken_dns_proxy.admission import AdmissionControl, ClientRateLimiter, SHED_DROP, check_shed_action, \
+    shed_response
 
 
 class ProxyServer(object):
@@ -39,11 +54,12 @@ class ProxyServer(object):
     Class representing the proxy server listening on ports for client Queries.
     """
 
-    def __init__(self, configuration):
+    def __init__(self, configuration, worker=0):
         """
         Initialize the proxy server object
 
-        :param port: port on which the proxy should listen
+        :param configuration: BrokenDnsProxyConfiguration object
+        :param worker: index of the worker process running the server
         :return:
         """
         # global configuration
@@ -53,10 +69,130 @@ class ProxyServer(object):
         self._listen_address = self._configuration.get(GlobalConfig.config_section_name(), GlobalConfig.CONFIG_ADDRESS)
         self._upstream_servers = self._configuration.getlist(GlobalConfig.config_section_name(),
                                                              GlobalConfig.CONFIG_UPSTREAM_SERVERS)
+        # more processes share the listening port
+        self._reuse_port = self._configuration.getint(GlobalConfig.config_section_name(),
+                                                      GlobalConfig.CONFIG_WORKERS) > 1
+        stub_zones = self._configuration.getlist(GlobalConfig.config_section_name(), GlobalConfig.CONFIG_STUB_ZONES)
+        if STUB_UPSTREAM in self._upstream_servers:
+            if not stub_zones:
+                raise BrokenDNSProxyError("Upstream server '{0}' needs zone files in the '{1}' option!".format(
+                    STUB_UPSTREAM, GlobalConfig.CONFIG_STUB_ZONES))
+            # zone files parsing pulls in most of dnspython, imported only when used
+            from broken_dns_proxy.stub_upstream import StubResolver
+
+            self._stub_resolver = StubResolver(stub_zones)
+        else:
+            self._stub_resolver = None
+        selection = self._configuration.get(GlobalConfig.config_section_name(), GlobalConfig.CONFIG_UPSTREAM_SELECTION)
+        self._upstream_selection = get_strategy_by_name(selection)(self._upstream_servers)
+        self._upstream_tcp_connections = self._configuration.getint(GlobalConfig.config_section_name(),
+                                                                    GlobalConfig.CONFIG_UPSTREAM_TCP_CONNECTIONS)
+        self._upstream_tcp_pipeline = self._configuration.getint(GlobalConfig.config_section_name(),
+                                                                 GlobalConfig.CONFIG_UPSTREAM_TCP_PIPELINE)
+        self._upstream_tcp_idle_timeout = self._configuration.getfloat(GlobalConfig.config_section_name(),
+                                                                       GlobalConfig.CONFIG_UPSTREAM_TCP_IDLE_TIMEOUT)
+        self._retry_policy = RetryPolicy(
+            self._configuration.getfloat(GlobalConfig.config_section_name(), GlobalConfig.CONFIG_UPSTREAM_TIMEOUT),
+            self._configuration.getint(GlobalConfig.config_section_name(), GlobalConfig.CONFIG_UPSTREAM_RETRIES),
+            self._configuration.getfloat(GlobalConfig.config_section_name(),
+                                         GlobalConfig.CONFIG_UPSTREAM_HEDGE_PERCENTILE),
+            self._configuration.getfloat(GlobalConfig.config_section_name(),
+                                         GlobalConfig.CONFIG_UPSTREAM_HEDGE_MIN_DELAY))
+        self._udp_batch_size = self._configuration.getint(GlobalConfig.config_section_name(),
+                                                          GlobalConfig.CONFIG_UDP_BATCH_SIZE)
+        self._udp_batch_io = None
+        self._admission = self._create_admission_control()
+        # records of UDP Queries admitted for processing, None when processed at once
+        self._work_queue = deque() if self._admission.max_pending > 0 else None
+        self._outbox = []
+        # responses delayed by the Modification chains
+        self._timers = TimerWheel(time.monotonic())
+        self._tcp_backlog = self._configuration.getint(GlobalConfig.config_section_name(),
+                                                       GlobalConfig.CONFIG_TCP_BACKLOG)
+        self._tcp_idle_timeout = self._configuration.getfloat(GlobalConfig.config_section_name(),
+                                                              GlobalConfig.CONFIG_TCP_IDLE_TIMEOUT)
+        self._tcp_max_queries = self._configuration.getint(GlobalConfig.config_section_name(),
+                                                           GlobalConfig.CONFIG_TCP_MAX_QUERIES_PER_CONNECTION)
+        self._tcp_max_connections = self._configuration.getint(GlobalConfig.config_section_name(),
+                                                               GlobalConfig.CONFIG_TCP_MAX_CONNECTIONS)
+        cache_max_entries = self._configuration.getint(GlobalConfig.config_section_name(),
+                                                       GlobalConfig.CONFIG_CACHE_MAX_ENTRIES)
+        cache_max_bytes = self._configuration.getint(GlobalConfig.config_section_name(),
+                                                     GlobalConfig.CONFIG_CACHE_MAX_BYTES)
+        self._cache = ResponseCache(cache_max_entries, cache_max_bytes) if cache_max_entries > 0 else None
+        memo_max_entries = self._configuration.getint(GlobalConfig.config_section_name(),
+                                                      GlobalConfig.CONFIG_MEMO_MAX_ENTRIES)
+        self._memo = ResponseMemo(memo_max_entries) if memo_max_entries > 0 else None
+        dump_sampling = self._configuration.getint(GlobalConfig.config_section_name(),
+                                                   GlobalConfig.CONFIG_DEBUG_DUMP_SAMPLING)
+        dump_names = self._configuration.getlist(GlobalConfig.config_section_name(),
+                                                 GlobalConfig.CONFIG_DEBUG_DUMP_NAMES)
+        self._dump_sampler = MessageDumpSampler(logger, dump_sampling, dump_names)
         # internal variables
         self._sockets = []
-        # create Modification chain
-        self._modification_chain = ModificationChain(self._configuration)
+        self._connections = dict()
+        # epoll or the best the platform has, select() can't watch descriptors above FD_SETSIZE
+        self._selector = None
+        # receive buffers of client Queries
+        self._buffer_pool = BufferPool()
+        # free lists of the client Query records by the record class
+        self._client_pools = dict()
+        self._udp_clients = self._create_client_pool(Client)
+        self._stream_clients = self._create_client_pool(StreamClient)
+        self._batch_clients = None
+        self._udp_upstreams = dict()
+        self._tcp_upstreams = dict()
+        # create Modification chains
+        self._chains = ChainSelector(self._configuration)
+        self._metrics = ProxyMetrics(self._upstream_servers, self._chains.active_modifiers)
+        self._metrics.add_collector(self._collect_metrics)
+        metrics_port = self._configuration.getint(GlobalConfig.config_section_name(), GlobalConfig.CONFIG_METRICS_PORT)
+        if metrics_port:
+            from broken_dns_proxy.metrics_server import MetricsServer
+
+            # every worker serves its own metrics on the next port
+            self._metrics_server = MetricsServer(
+                self._metrics,
+                self._configuration.get(GlobalConfig.config_section_name(), GlobalConfig.CONFIG_METRICS_ADDRESS),
+                metrics_port + worker)
+        else:
+            self._metrics_server = None
+        control_socket = self._configuration.get(GlobalConfig.config_section_name(),
+                                                 GlobalConfig.CONFIG_CONTROL_SOCKET).strip()
+        if control_socket:
+            from broken_dns_proxy.control import ControlServer, parse_control_address
+
+            self._control_server = ControlServer(self, *parse_control_address(control_socket, worker))
+        else:
+            self._control_server = None
+        # reload() replaces the Modification chains while the Queries are processed
+        self._reload_lock = threading.Lock()
+        self._chains_generation = 0
+        self._previous_sighup_handler = None
+
+    def _create_admission_control(self):
+        """
+        Create the admission control from the configuration
+
+        :return: AdmissionControl object
+        """
+        section = GlobalConfig.config_section_name()
+        rate = self._configuration.getfloat(section, GlobalConfig.CONFIG_RATE_LIMIT_QPS)
+        if rate > 0:
+            rate_limiter = ClientRateLimiter(
+                rate, self._configuration.getfloat(section, GlobalConfig.CONFIG_RATE_LIMIT_BURST),
+                self._configuration.getint(section, GlobalConfig.CONFIG_RATE_LIMIT_PREFIX_V4),
+                self._configuration.getint(section, GlobalConfig.CONFIG_RATE_LIMIT_PREFIX_V6))
+        else:
+            rate_limiter = None
+        return AdmissionControl(
+            rate_limiter,
+            self._configuration.getint(section, GlobalConfig.CONFIG_MAX_PENDING_QUERIES),
+            self._configuration.getfloat(section, GlobalConfig.CONFIG_MAX_QUEUE_DELAY),
+            check_shed_action(self._configuration.get(section, GlobalConfig.CONFIG_RATE_LIMIT_ACTION).strip(),
+                              GlobalConfig.CONFIG_RATE_LIMIT_ACTION),
+            check_shed_action(self._configuration.get(section, GlobalConfig.CONFIG_SHED_ACTION).strip(),
+                              GlobalConfig.CONFIG_SHED_ACTION))
 
     def __str__(self):
         """
@@ -67,53 +203,762 @@ class ProxyServer(object):
                                                                                       self._listen_port,
                                                                                       self._upstream_servers)
 
-    def process(self):
+    @property
+    def chains_generation(self):
         """
-        Start listening and processing Queries.
-        :return:
+        Number of times the Modification chains were replaced
+        """
+        return self._chains_generation
+
+    def reload(self, config_path=None):
+        """
+        Read the configuration again and replace the Modification chains. The new
+        chains are built completely before they are swapped in, so every response
+        is modified either by the old or by the new chains and no Query is lost.
+        Other options are applied only after restart.
+
+        :param config_path: path to other configuration file to read instead
+        :return: description of the result
+        """
+        with self._reload_lock:
+            started = time.perf_counter()
+            try:
+                configuration = self._configuration.reload(config_path)
+                chains = ChainSelector(configuration)
+            except (configparser.Error, ValueError) as e:
+                raise BrokenDNSProxyError("Wrong configuration: {0}".format(str(e)))
+            # the counters exist before any Query gets to the new chains
+            self._metrics.set_modifiers(chains.active_modifiers)
+            self._chains = chains
+            self._configuration = configuration
+            self._chains_generation += 1
+            elapsed = time.perf_counter() - started
+        config_path = configuration.get(GlobalConfig.config_section_name(), GlobalConfig.CONFIG_CONFIG_PATH)
+        logger.info("Modification chains replaced from '%s' in %.1f ms", config_path, elapsed * 1000)
+        return "reloaded '{0}' in {1:.1f} ms".format(config_path, elapsed * 1000)
+
+    def status(self):
+        """
+        Describe the Modification chains in use
+
+        :return: str
+        """
+        chains = self._chains
+        return "generation={0} chains={1} modifiers={2}".format(
+            self._chains_generation, ','.join(['default'] + [chain.name for chain in chains.chains]),
+            ','.join(chains.active_modifiers) or '-')
+
+    def _reload_in_background(self, signum=None, frame=None):
+        """
+        SIGHUP handler, the configuration is read in a thread not to delay Queries
+
+        :return: None
+        """
+        def reload():
+            try:
+                self.reload()
+            except BrokenDNSProxyError as e:
+                logger.error("Reloading configuration failed: %s", str(e))
+
+        threading.Thread(target=reload, name='reload', daemon=True).start()
+
+    def _start_control(self):
+        """
+        Start the metrics and control servers and reload the configuration on SIGHUP
+
+        :return: None
+        """
+        if self._metrics_server is not None:
+            self._metrics_server.start()
+        if self._control_server is not None:
+            self._control_server.start()
+        # signals can be handled only in the main thread
+        if threading.current_thread() is threading.main_thread():
+            self._previous_sighup_handler = signal.signal(signal.SIGHUP, self._reload_in_background)
+
+    def _stop_control(self):
+        """
+        Stop the metrics and control servers
+
+        :return: None
+        """
+        if self._previous_sighup_handler is not None:
+            signal.signal(signal.SIGHUP, self._previous_sighup_handler)
+            self._previous_sighup_handler = None
+        if self._control_server is not None:
+            self._control_server.stop()
+        if self._metrics_server is not None:
+            self._metrics_server.stop()
+
+    @staticmethod
+    def max_udp_payload(msg_raw):
+        """
+        Return the maximal size of UDP response the client is able to receive
+
+        :param msg_raw: raw DNS message with the client Query
+        :return: int
+        """
+        opt = wire.find_opt(msg_raw)
+        if opt is not None:
+            return max(512, opt.rdclass)
+        return 512
+
+    def _create_stub_upstream(self, stream=False):
+        """
+        Create the upstream answering from zone files in this process
+
+        :param stream: True if the upstream is used for Queries forwarded over TCP
+        :return: StubUpstream object
+        """
+        from broken_dns_proxy.stub_upstream import StubUpstream
+
+        return StubUpstream(self._stub_resolver, stream)
+
+    def _get_udp_upstream(self, upstream_server):
+        """
+        Get the object sending Queries to the upstream server over UDP
+
+        :param upstream_server: address of the upstream server
+        :return: BlockingUdpUpstream object
+        """
+        try:
+            return self._udp_upstreams[upstream_server]
+        except KeyError:
+            if upstream_server == STUB_UPSTREAM:
+                upstream = self._create_stub_upstream()
+            else:
+                address, port = parse_upstream_address(upstream_server)
+                upstream = BlockingUdpUpstream(address, port, timeout=self._retry_policy.timeout)
+            self._udp_upstreams[upstream_server] = upstream
+            return upstream
+
+    def _get_tcp_upstream(self, upstream_server):
+        """
+        Get the object keeping persistent TCP connection to the upstream server
+
+        :param upstream_server: address of the upstream server
+        :return: BlockingTcpUpstream object
+        """
+        try:
+            return self._tcp_upstreams[upstream_server]
+        except KeyError:
+            if upstream_server == STUB_UPSTREAM:
+                upstream = self._create_stub_upstream(stream=True)
+            else:
+                address, port = parse_upstream_address(upstream_server)
+                upstream = BlockingTcpUpstream(address, port, timeout=self._retry_policy.timeout)
+            self._tcp_upstreams[upstream_server] = upstream
+            return upstream
+
+    def _forward(self, msg_raw, upstream_server, stream=False):
+        """
+        Forward the Query to the upstream server. Queries received over TCP are
+        forwarded over TCP. Truncated UDP responses are retried over TCP.
+
+        :param msg_raw: raw DNS message with the client Query
+        :param upstream_server: address of the upstream server
+        :param stream: True if the client Query was received over TCP
+        :return: raw DNS message with the response
+        """
+        logger.debug("Forwarding Query to upstream server '%s'", str(upstream_server))
+        if stream:
+            return self._get_tcp_upstream(upstream_server).query(msg_raw)
+
+        response_raw = self._get_udp_upstream(upstream_server).query(msg_raw)
+        if wire.get_flags(response_raw) & dns.flags.TC:
+            logger.debug("Response from '%s' truncated... retrying over TCP", str(upstream_server))
+            full_response_raw = self._get_tcp_upstream(upstream_server).query(msg_raw)
+            # the client would not be able to receive it over UDP anyway
+            if len(full_response_raw) <= self.max_udp_payload(msg_raw):
+                return full_response_raw
+        return response_raw
+
+    def _resolve(self, msg_raw, stream=False):
+        """
+        Get the response from upstream servers. A Query which failed or timed out
+        is retried on another upstream server until the retries are exhausted.
+
+        :param msg_raw: raw DNS message with the client Query
+        :param stream: True if the client Query was received over TCP
+        :return: raw DNS message with the response
+        """
+        counters = self._retry_policy.counters
+        tried = []
+        for attempt in range(self._retry_policy.attempts):
+            if attempt:
+                counters.retries += 1
+            upstream_server = self._upstream_selection.choose_other(tried)
+            tried.append(upstream_server)
+            start = time.monotonic()
+            try:
+                response_raw = self._forward(msg_raw, upstream_server, stream)
+            except socket.timeout as e:
+                logger.debug("Upstream server '%s' did not respond in time", str(upstream_server))
+                counters.timeouts += 1
+                error = e
+            except (socket.error, BrokenDNSProxyError) as e:
+                logger.debug("Forwarding Query to '%s' failed: %s", str(upstream_server), str(e))
+                counters.failures += 1
+                error = e
+            else:
+                rtt = time.monotonic() - start
+                self._upstream_selection.report(upstream_server, rtt)
+                self._retry_policy.report(rtt)
+                self._metrics.observe_upstream(upstream_server, rtt)
+                return response_raw
+            self._upstream_selection.report_failure(upstream_server)
+        counters.exhausted += 1
+        raise error
+
+    def _collect_metrics(self):
+        """
+        Return metrics of the server components for ProxyMetrics
+
+        :return: list of (name, type, help, [(labels, value), ...])
+        """
+        collected = [('bdp_upstream_queries_total', 'counter', 'Upstream Queries which did not go the straight way.',
+                      [((('result', name),), value) for name, value in
+                       sorted(self._retry_policy.counters.as_dict().items())])]
+        collected.append(('bdp_receive_buffers_total', 'counter', 'Receive buffers taken from the pool.',
+                          [((('result', 'allocated'),), self._buffer_pool.allocated),
+                           ((('result', 'reused'),), self._buffer_pool.reused)]))
+        if self._udp_batch_io is not None:
+            stats = self._udp_batch_io.stats
+            collected.append(('bdp_udp_batch_calls_total', 'counter', 'Batched UDP system calls.',
+                              [((('op', 'recv'),), stats.recv_calls), ((('op', 'send'),), stats.send_calls)]))
+            collected.append(('bdp_udp_batch_datagrams_total', 'counter', 'Datagrams moved by batched UDP calls.',
+                              [((('op', 'recv'),), stats.recv_datagrams),
+                               ((('op', 'send'),), stats.send_datagrams)]))
+        pools = sorted(self._client_pools.values(), key=lambda pool: pool.client_class.__name__)
+        collected.append(('bdp_client_records_total', 'counter', 'Client Query records taken from the pools.',
+                          [((('class', pool.client_class.__name__), ('result', result)), value) for pool in pools
+                           for result, value in (('allocated', pool.allocated), ('reused', pool.reused))]))
+        collected.append(('bdp_client_records', 'gauge', 'Client Query records in use and in the free lists.',
+                          [((('class', pool.client_class.__name__), ('state', state)), value) for pool in pools
+                           for state, value in (('in_use', pool.in_use), ('free', len(pool)))]))
+        collected.append(('bdp_client_record_bytes', 'gauge', 'Memory taken by one client Query record.',
+                          [((('class', pool.client_class.__name__),), pool.record_size()) for pool in pools]))
+        collected.append(('bdp_delayed_responses_total', 'counter', 'Responses delayed by Modification chains.',
+                          [((), self._timers.scheduled)]))
+        collected.append(('bdp_delayed_responses', 'gauge', 'Delayed responses waiting to be sent.',
+                          [((), len(self._timers))]))
+        if self._admission.enabled:
+            collected.append(('bdp_admission_decisions_total', 'counter', 'Admission decisions on client Queries.',
+                              [((('reason', reason), ('action', action)), value) for (reason, action), value in
+                               sorted(self._admission.decisions.items())]))
+            if self._work_queue is not None:
+                collected.append(('bdp_work_queue_length', 'gauge', 'UDP Queries waiting for processing.',
+                                  [((), len(self._work_queue))]))
+        if self._memo is not None:
+            collected.append(('bdp_memo_lookups_total', 'counter', 'Lookups of memoized modified responses.',
+                              [((('result', 'hit'),), self._memo.hits), ((('result', 'miss'),), self._memo.misses)]))
+        if self._cache is not None:
+            collected.append(('bdp_cache_lookups_total', 'counter', 'Lookups in the response cache.',
+                              [((('result', 'hit'),), self._cache.hits), ((('result', 'miss'),), self._cache.misses)]))
+            collected.append(('bdp_cache_entries', 'gauge', 'Responses in the cache.', [((), len(self._cache))]))
+            collected.append(('bdp_cache_bytes', 'gauge', 'Size of responses in the cache.',
+                              [((), self._cache.size_bytes)]))
+        return collected
+
+    def _modify(self, chain, response_raw):
+        """
+        Run the Modification chain on the response. Results of chains which walk
+        all records or parse the whole message are memoized, chains touching only
+        the header or EDNS are cheaper to run than to look up.
+
+        :param chain: ModificationChain object
+        :param response_raw: raw DNS message with the upstream response
+        :return: raw DNS message with the modified response
+        """
+        if self._memo is None or chain.parse_depth < ParseDepth.RECORDS:
+            return chain.plan(response_raw)
+        return self._memo.modify(chain, response_raw)
+
+    def _process_client(self, client):
+        """
+        Forward the client Query to upstream server and send the modified response back
+
+        :param client: Client object
+        :return: None
+        """
+        received = client.received
+        msg_raw = client.msg_raw()
+        dump = self._dump_sampler.sample(msg_raw)
+        if dump:
+            logger.debug("Received DNS message:\n"
+                         "-----------------------------\n"
+                         "%s\n"
+                         "-----------------------------", LazyMessageDump(msg_raw))
+
+        stream = client.is_stream()
+        max_udp_payload = self.max_udp_payload(msg_raw)
+        response_raw = self._cache.get(msg_raw, stream, max_udp_payload) if self._cache is not None else None
+        if response_raw is None:
+            try:
+                response_raw = self._resolve(msg_raw, stream)
+            except (socket.error, BrokenDNSProxyError) as e:
+                logger.debug("Unable to get response from upstream servers: %s", str(e))
+                self._send_servfail(client)
+                if received is not None:
+                    self._metrics.service_time.observe(time.perf_counter() - received)
+                return
+            if self._cache is not None:
+                self._cache.put(msg_raw, response_raw, stream, max_udp_payload)
+        else:
+            logger.debug("Using cached response")
+
+        # modify the message for client
+        chain_start = time.perf_counter()
+        chain = self._chains.select(msg_raw, client.client_addr())
+        response_raw = self._modify(chain, response_raw)
+        self._metrics.chain_time.observe(time.perf_counter() - chain_start)
+        self._metrics.count_modified(chain)
+
+        if dump:
+            logger.debug("Sending DNS message:\n"
+                         "-----------------------------\n"
+                         "%s\n"
+                         "-----------------------------", LazyMessageDump(response_raw))
+        self._metrics.count_response(stream, response_raw)
+        self._send_response(client, chain, response_raw)
+        if received is not None:
+            self._metrics.service_time.observe(time.perf_counter() - received)
+
+    def _send_response(self, client, chain, response_raw):
+        """
+        Send the modified response now or after the delay of the Modification chain
+
+        :param client: Client object
+        :param chain: ModificationChain the response was modified by
+        :param response_raw: raw DNS message with the modified response
+        :return: None
+        """
+        if chain.plan.delays:
+            delay = chain.plan.sample_delay()
+            if delay > 0:
+                client.detach()
+                self._send_later(delay, client, response_raw)
+                return
+        client.send_raw(response_raw)
+
+    def _send_later(self, delay, client, response_raw):
+        """
+        Park the response in the timer wheel, the server loop sends it
+
+        :param delay: delay in seconds
+        :param client: detached Client object
+        :param response_raw: raw DNS message with the modified response
+        :return: None
+        """
+        self._timers.schedule(time.monotonic(), delay, self._send_delayed, client, response_raw)
+
+    def _send_delayed(self, client, response_raw):
+        """
+        Send the delayed response and return the client record to its pool
+
+        :param client: detached Client object
+        :param response_raw: raw DNS message with the modified response
+        :return: None
+        """
+        client.send_raw(response_raw)
+        pool = self._client_pools.get(type(client))
+        if pool is not None:
+            pool.release(client)
+
+    def _create_client_pool(self, client_class):
+        """
+        Create the free list of client Query records of the class
+
+        :param client_class: Client or its subclass
+        :return: ClientPool object
+        """
+        pool = ClientPool(client_class)
+        self._client_pools[client_class] = pool
+        return pool
+
+    def _fire_timers(self):
+        """
+        Send the delayed responses which are due
+
+        :return: None
+        """
+        if self._timers.advance(time.monotonic()):
+            self._flush_outbox()
+
+    def _shed(self, client, action):
+        """
+        Answer the Query which is not processed because of the admission control
+
+        :param client: Client object
+        :param action: action decided by the admission control
+        :return: None
+        """
+        if action == SHED_DROP:
+            return
+        try:
+            response_raw = shed_response(client.msg_raw(), action)
+        except BrokenDNSProxyError as e:
+            logger.debug("Unable to create response to shed Query: %s", str(e))
+            return
+        self._metrics.count_response(client.is_stream(), response_raw)
+        client.send_raw(response_raw)
+
+    def _send_servfail(self, client):
+        """
+        Send SERVFAIL response to the client
+
+        :param client: Client object
+        :return: None
+        """
+        try:
+            import dns.message
+
+            response = dns.message.make_response(client.msg())
+        except Exception as e:
+            logger.debug("Unable to create SERVFAIL response: %s", str(e))
+            return
+        response.set_rcode(dns.rcode.SERVFAIL)
+        self._metrics.responses['tcp' if client.is_stream() else 'udp'][dns.rcode.SERVFAIL] += 1
+        client.send(response)
+
+    def _create_sockets(self):
+        """
+        Create and bind the UDP and TCP listening sockets.
+
+        :return: tuple (udp socket, tcp socket)
         """
         # TODO: need to figure out what to do when ony IPv4 address is to be used
         s_udp6 = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
         s_tcp6 = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
         s_udp6.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         s_tcp6.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self._reuse_port:
+            if not hasattr(socket, 'SO_REUSEPORT'):
+                raise BrokenDNSProxyError("Running more workers needs SO_REUSEPORT, which is not supported "
+                                          "on this platform!")
+            s_udp6.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            s_tcp6.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self._sockets.append(s_udp6)
         self._sockets.append(s_tcp6)
 
+        # kernel allows to receive IPv4 packets
         try:
-            # kernel allows to receive IPv4 packets
+            s_udp6.bind((self._listen_address, self._listen_port))
+            s_tcp6.bind((self._listen_address, self._listen_port))
+        except socket.error as e:
+            # [Errno 13] Permission denied
+            if e.errno == 13:
+                logger.error('You need to be root to bind to port %s', str(self._listen_port))
+            # [Errno -9] Address family for hostname not supported
+            elif e.errno == -9:
+                logger.error("Only IPv4 addresses or 'localhost' is supported at this point.")
+            raise BrokenDNSProxyError(e.strerror)
+
+        s_tcp6.setblocking(False)
+        s_tcp6.listen(self._tcp_backlog)
+        return s_udp6, s_tcp6
+
+    def _close_sockets(self):
+        """
+        Close all sockets opened by the server, including connections to upstream servers.
+
+        :return: None
+        """
+        for connection in self._connections.values():
+            connection.close()
+        self._connections = dict()
+        if self._selector is not None:
+            self._selector.close()
+            self._selector = None
+        for s in self._sockets:
+            s.close()
+        self._sockets = []
+        for upstream in list(self._udp_upstreams.values()) + list(self._tcp_upstreams.values()):
+            upstream.close()
+        self._udp_upstreams = dict()
+        self._tcp_upstreams = dict()
+
+    def _accept_connections(self, listener):
+        """
+        Accept all pending TCP connections without blocking.
+
+        :param listener: listening TCP socket
+        :return: None
+        """
+        while True:
             try:
-                s_udp6.bind((self._listen_address, self._listen_port))
-                s_tcp6.bind((self._listen_address, self._listen_port))
+                sock, addr = listener.accept()
+            except (BlockingIOError, InterruptedError):
+                return
             except socket.error as e:
-                # [Errno 13] Permission denied
-                if e.errno == 13:
-                    logger.error('You need to be root to bind to port %s', str(self._listen_port))
-                # [Errno -9] Address family for hostname not supported
-                elif e.errno == -9:
-                    logger.error("Only IPv4 addresses or 'localhost' is supported at this point.")
-                raise BrokenDNSProxyError(e.strerror)
+                logger.error('Unable to accept TCP connection: %s', str(e))
+                return
+            if len(self._connections) >= self._tcp_max_connections:
+                logger.debug('Too many TCP connections... refusing client %s', str(addr))
+                sock.close()
+                continue
+            logger.debug('TCP client %s connected', str(addr))
+            connection = TcpClientConnection(sock, addr, self._tcp_max_queries, self._buffer_pool)
+            stale = self._connections.get(connection.fileno())
+            if stale is not None:
+                # closed earlier in this loop iteration, the descriptor was reused
+                self._remove_connection(stale)
+            self._connections[connection.fileno()] = connection
+            self._selector.register(connection, selectors.EVENT_READ)
 
-            s_tcp6.listen(0)
+    def _remove_connection(self, connection):
+        """
+        Stop watching the TCP connection and close it
 
-            logger.info('Listening on port %s...', str(self._listen_port))
+        :param connection: TcpClientConnection object
+        :return: None
+        """
+        try:
+            self._selector.unregister(connection)
+        except KeyError:
+            pass
+        connection.close()
 
-            while True:
-                ready_r, ready_w, _ = select.select(self._sockets, [], [])
+    def _read_connection(self, connection):
+        """
+        Process all complete Queries received on the client TCP connection.
 
-                for s in ready_r:
-                    client = Client(s)
-                    msg = client.msg()
+        :param connection: TcpClientConnection object
+        :return: None
+        """
+        for msg_raw in connection.read():
+            client = None
+            try:
+                received = time.perf_counter()
+                client = self._stream_clients.acquire(connection, msg_raw, received)
+                self._metrics.parse_time.observe(time.perf_counter() - received)
+                action = self._admission.admit(connection.addr, self._pending(), received, stream=True)
+                if action is None:
+                    self._process_client(client)
+                else:
+                    self._shed(client, action)
+            except WireFormatError as e:
+                # the framing is intact, only this Query is dropped
+                logger.debug("Dropping malformed Query: %s", str(e))
+            except BrokenDNSProxyError as e:
+                logger.error('Unable to process TCP Query from %s: %s', str(connection.addr), str(e))
+                connection.close()
+                break
+            finally:
+                if client is not None:
+                    self._stream_clients.release(client)
 
-                    # sample code sending a response to the client
-                    upstream_server = random.choice(self._upstream_servers)
-                    logger.debug("Forwarding Query to upstream server '%s'", str(upstream_server))
-                    response = dns.query.udp(msg, upstream_server)
+    def _process_datagram(self, s_udp):
+        """
+        Process one Query received on the UDP socket.
 
-                    # modify the message for client
-                    self._modification_chain.run_modifiers(response)
+        :param s_udp: UDP socket
+        :return: None
+        """
+        received = time.perf_counter()
+        buf = self._buffer_pool.acquire()
+        try:
+            try:
+                client = self._udp_clients.acquire(s_udp, buf, received)
+            except BrokenDNSProxyError as e:
+                logger.debug("Dropping malformed Query: %s", str(e))
+                return
+            try:
+                self._metrics.parse_time.observe(time.perf_counter() - received)
+                action = self._admission.admit(client.client_addr(), 0, received)
+                if action is None:
+                    self._process_client(client)
+                else:
+                    self._shed(client, action)
+            except WireFormatError as e:
+                logger.debug("Dropping malformed Query: %s", str(e))
+            finally:
+                self._udp_clients.release(client)
+        finally:
+            self._buffer_pool.release(buf)
+
+    def _process_datagram_batch(self):
+        """
+        Process all Queries ready on the UDP socket, up to the batch size,
+        and send the responses together.
+
+        :return: None
+        """
+        datagrams = self._udp_batch_io.recv()
+        batch_received = time.perf_counter()
+        for msg_raw, client_addr in datagrams:
+            received = time.perf_counter()
+            try:
+                client = self._batch_clients.acquire(msg_raw, client_addr, self._outbox, received)
+            except BrokenDNSProxyError as e:
+                logger.debug("Dropping malformed Query: %s", str(e))
+                continue
+            self._metrics.parse_time.observe(time.perf_counter() - received)
+            # later Queries of the batch wait for the earlier ones
+            action = self._admission.admit(client_addr, 0, batch_received)
+            if action is None:
+                action = self._admission.check_delay(batch_received, received)
+            try:
+                if action is None:
+                    self._process_client(client)
+                else:
+                    self._shed(client, action)
+            except WireFormatError as e:
+                logger.debug("Dropping malformed Query: %s", str(e))
+            finally:
+                self._batch_clients.release(client)
+        self._flush_outbox()
 
-                    client.send(response)
+    def _pending(self):
+        """
+        Return the number of UDP Queries waiting in the work queue
+
+        :return: int
+        """
+        return len(self._work_queue) if self._work_queue is not None else 0
+
+    def _enqueue_datagrams(self):
+        """
+        Move the Queries ready on the UDP socket into the work queue. Queries
+        which are not admitted are answered at once, so the socket is drained
+        even when the proxy is overloaded and the kernel does not have to drop
+        the datagrams at random.
+
+        :return: None
+        """
+        drained = 0
+        while drained < self._admission.max_pending:
+            datagrams = self._udp_batch_io.recv()
+            if not datagrams:
+                break
+            received = time.perf_counter()
+            for msg_raw, client_addr in datagrams:
+                parse_start = time.perf_counter()
+                try:
+                    # the receive buffers are reused by the next recv()
+                    client = self._batch_clients.acquire(bytes(msg_raw), client_addr, self._outbox, received)
+                except BrokenDNSProxyError as e:
+                    logger.debug("Dropping malformed Query: %s", str(e))
+                    continue
+                self._metrics.parse_time.observe(time.perf_counter() - parse_start)
+                action = self._admission.admit(client_addr, len(self._work_queue), received)
+                if action is None:
+                    self._work_queue.append(client)
+                else:
+                    self._shed(client, action)
+                    self._batch_clients.release(client)
+            drained += len(datagrams)
+        self._flush_outbox()
+
+    def _process_queued(self):
+        """
+        Process the oldest Query in the work queue, unless it waited for too long.
+
+        :return: None
+        """
+        client = self._work_queue.popleft()
+        action = self._admission.check_delay(client.received, time.perf_counter())
+        try:
+            if action is None:
+                self._process_client(client)
+            else:
+                self._shed(client, action)
+        except WireFormatError as e:
+            logger.debug("Dropping malformed Query: %s", str(e))
         finally:
+            self._batch_clients.release(client)
+        self._flush_outbox()
+
+    def _flush_outbox(self):
+        """
+        Send the responses queued for the batched UDP clients
+
+        :return: None
+        """
+        if self._outbox:
+            self._udp_batch_io.send(self._outbox)
+            # the queued clients keep the reference to the list
+            del self._outbox[:]
+
+    def _expire_connections(self):
+        """
+        Close TCP connections which are done or idle for too long.
+
+        :return: time in seconds until the next connection may expire, None if there are no connections
+        """
+        now = time.monotonic()
+        timeout = None
+        for fd, connection in list(self._connections.items()):
+            if connection.closed or connection.is_finished():
+                self._remove_connection(connection)
+            elif connection.is_idle(now, self._tcp_idle_timeout):
+                logger.debug('TCP client %s idle for too long... closing', str(connection.addr))
+                self._remove_connection(connection)
+            else:
+                expires = max(0.0, connection.last_activity + self._tcp_idle_timeout - now)
+                timeout = expires if timeout is None else min(timeout, expires)
+                events = selectors.EVENT_READ | selectors.EVENT_WRITE if connection.wants_write() \
+                    else selectors.EVENT_READ
+                if self._selector.get_key(connection).events != events:
+                    self._selector.modify(connection, events)
+                continue
+            del self._connections[fd]
+        return timeout
+
+    def process(self):
+        """
+        Start listening and processing Queries.
+        :return:
+        """
+        try:
+            s_udp, s_tcp = self._create_sockets()
+            if self._udp_batch_size > 1 or self._work_queue is not None:
+                # ctypes bindings of recvmmsg() are loaded only for batching
+                from broken_dns_proxy.udp_batch import BatchClient, create_batch_io
+
+                self._udp_batch_io = create_batch_io(s_udp, self._udp_batch_size, self._buffer_pool)
+                self._batch_clients = self._create_client_pool(BatchClient)
+                logger.info('Receiving UDP Queries in batches of up to %d using %s()', self._udp_batch_size,
+                            self._udp_batch_io.NAME)
+                self._metrics.add_histogram('bdp_udp_recv_batch_size', 'Datagrams received in one batch.',
+                                            self._udp_batch_io.stats.recv_batch_size)
+            self._selector = selectors.DefaultSelector()
             for s in self._sockets:
-                s.close()
\ No newline at end of file
+                self._selector.register(s, selectors.EVENT_READ)
+            self._start_control()
+
+            logger.info('Listening on port %s...', str(self._listen_port))
+
+            while True:
+                timeout = self._expire_connections()
+                deadline = self._timers.next_deadline()
+                if deadline is not None:
+                    until_deadline = max(0.0, deadline - time.monotonic())
+                    timeout = until_deadline if timeout is None else min(timeout, until_deadline)
+                if self._work_queue:
+                    # only poll for more Queries while there is work queued
+                    timeout = 0
+                for key, events in self._selector.select(timeout):
+                    s = key.fileobj
+                    if events & selectors.EVENT_WRITE:
+                        s.flush()
+                    if not events & selectors.EVENT_READ:
+                        continue
+                    if s is s_udp:
+                        if self._work_queue is not None:
+                            self._enqueue_datagrams()
+                        elif self._udp_batch_io is not None:
+                            self._process_datagram_batch()
+                        else:
+                            self._process_datagram(s)
+                    elif s is s_tcp:
+                        self._accept_connections(s)
+                    elif not s.closed:
+                        self._read_connection(s)
+                if self._work_queue:
+                    self._process_queued()
+                self._fire_timers()
+        finally:
+            self._stop_control()
+            self._close_sockets()
+            logger.info('Upstream Queries: %s', str(self._retry_policy.counters))
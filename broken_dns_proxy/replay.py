@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+
+import asyncio
+import collections
+import time
+
+import dns.flags
+
+from broken_dns_proxy import wire
+from broken_dns_proxy.bench import BenchResult
+from broken_dns_proxy.exceptions import BrokenDNSProxyError, WireFormatError
+from broken_dns_proxy.logger import logger
+from broken_dns_proxy.pcap import read_udp_packets
+
+
+class ReplayResult(BenchResult):
+    """
+    Results of a capture replay
+    """
+
+    def __init__(self):
+        super(ReplayResult, self).__init__()
+        # responses which don't belong to any outstanding Query, by reason
+        self.mismatches = collections.Counter()
+        # UDP datagrams in the capture which are not DNS Queries
+        self.ignored = 0
+        # Queries sent while a Query with the same ID was outstanding on all sockets
+        self.id_collisions = 0
+
+    def report(self):
+        lines = [super(ReplayResult, self).report(),
+                 'Mismatches:        {0} ({1})'.format(sum(self.mismatches.values()), ', '.join(
+                     '{0} {1}'.format(reason, count) for reason, count in sorted(self.mismatches.items()))),
+                 'ID collisions:     {0}'.format(self.id_collisions),
+                 'Ignored packets:   {0}'.format(self.ignored)]
+        return '\n'.join(lines)
+
+
+class _ReplayProtocol(asyncio.DatagramProtocol):
+    """
+    asyncio protocol receiving responses on one replay socket
+    """
+
+    def __init__(self, replay, index):
+        self._replay = replay
+        self._index = index
+
+    def datagram_received(self, data, addr):
+        self._replay.response_received(self._index, data)
+
+    def error_received(self, exc):
+        logger.debug('Replay socket %d failed: %s', self._index, str(exc))
+        self._replay.result.errors += 1
+
+
+class CaptureReplay(object):
+    """
+    Sends the DNS Queries from a packet capture to the proxy, keeping the
+    original timing scaled by the speed factor, or as fast as possible.
+
+    The original clients are spread over connected UDP sockets, so the kernel
+    accepts only responses from the proxy on the socket the Query was sent from.
+    Responses are matched by the socket, the message ID and the question. A Query
+    whose ID is already outstanding on the socket of its client is sent from
+    another socket.
+    """
+
+    def __init__(self, address, port, packets, speed=1.0, capture_port=53, concurrency=1000, timeout=2.0,
+                 sockets=8, count=0):
+        """
+        Constructor
+
+        :param address: address of the proxy
+        :param port: port of the proxy
+        :param packets: iterable of UdpPacket from the capture
+        :param speed: factor the original timing is scaled by, 0 to send as fast as possible
+        :param capture_port: destination port of the Queries in the capture
+        :param concurrency: maximal number of outstanding Queries, the replay waits if reached
+        :param timeout: seconds after which the Query is considered lost
+        :param sockets: number of UDP sockets the original clients are spread over
+        :param count: number of Queries to send, 0 for all in the capture
+        :return: new object
+        """
+        self._address = address
+        self._port = port
+        self._packets = packets
+        self._speed = speed
+        self._capture_port = capture_port
+        self._concurrency = max(1, concurrency)
+        self._timeout = timeout
+        self._sockets = max(1, sockets)
+        self._count = count
+        self._transports = []
+        # (socket index, message ID) -> (time sent, question), in the order of sending
+        self._pending = collections.OrderedDict()
+        self._space = None
+        self.result = None
+
+    def _expire(self):
+        """
+        Count the Queries without response for too long as lost
+
+        :return: None
+        """
+        deadline = time.perf_counter() - self._timeout
+        while self._pending:
+            key, (sent, _) = next(iter(self._pending.items()))
+            if sent > deadline:
+                break
+            del self._pending[key]
+            self.result.lost += 1
+        if len(self._pending) < self._concurrency:
+            self._space.set()
+
+    def response_received(self, index, response_raw):
+        """
+        Match the response to the outstanding Query
+
+        :param index: index of the socket the response was received on
+        :param response_raw: raw DNS message with the response
+        :return: None
+        """
+        if len(response_raw) < wire.HEADER_LENGTH or not wire.get_flags(response_raw) & dns.flags.QR:
+            self.result.mismatches['malformed'] += 1
+            return
+        entry = self._pending.pop((index, wire.get_id(response_raw)), None)
+        if entry is None:
+            # unknown ID or the Query already timed out
+            self.result.mismatches['unexpected'] += 1
+            return
+        if len(self._pending) < self._concurrency:
+            self._space.set()
+        sent, question = entry
+        try:
+            matches = wire.parse_question(response_raw) == question
+        except WireFormatError:
+            matches = False
+        # FORMERR and similar responses don't have to repeat the question
+        if not matches and wire.get_count(response_raw, wire.QUESTION):
+            self.result.mismatches['question'] += 1
+            return
+        self.result.record(response_raw, time.perf_counter() - sent)
+
+    def _queries(self):
+        """
+        Filter the DNS Queries out of the captured packets
+
+        :return: generator of UdpPacket
+        """
+        for packet in self._packets:
+            payload = packet.payload
+            if packet.dport != self._capture_port or len(payload) < wire.HEADER_LENGTH or \
+                    wire.get_flags(payload) & dns.flags.QR:
+                self.result.ignored += 1
+                continue
+            yield packet
+
+    async def _send_all(self, loop):
+        result = self.result
+        start = loop.time()
+        first_timestamp = None
+        for packet in self._queries():
+            if self._count and result.sent >= self._count:
+                break
+            try:
+                question = wire.parse_question(packet.payload)
+            except WireFormatError:
+                result.ignored += 1
+                continue
+
+            if self._speed:
+                if first_timestamp is None:
+                    first_timestamp = packet.timestamp
+                delay = start + (packet.timestamp - first_timestamp) / self._speed - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            if len(self._pending) >= self._concurrency:
+                self._space.clear()
+                while len(self._pending) >= self._concurrency:
+                    try:
+                        await asyncio.wait_for(self._space.wait(), self._timeout)
+                    except asyncio.TimeoutError:
+                        pass
+                    self._expire()
+            elif result.sent % 64 == 0:
+                # let the responses in even if the replay is behind the schedule
+                await asyncio.sleep(0)
+
+            msg_id = wire.get_id(packet.payload)
+            index = hash((packet.src, packet.sport)) % self._sockets
+            key = (index, msg_id)
+            if key in self._pending:
+                # the same ID is outstanding on the socket of the client, try the other sockets
+                for other in range(index + 1, index + self._sockets):
+                    if (other % self._sockets, msg_id) not in self._pending:
+                        index = other % self._sockets
+                        key = (index, msg_id)
+                        break
+                else:
+                    result.id_collisions += 1
+                    result.lost += 1
+                    del self._pending[key]
+            self._pending[key] = (time.perf_counter(), question)
+            self._transports[index].sendto(packet.payload)
+            result.sent += 1
+            if result.sent % 64 == 0:
+                self._expire()
+
+    async def run(self):
+        """
+        Run the replay
+
+        :return: ReplayResult object
+        """
+        loop = asyncio.get_running_loop()
+        self.result = ReplayResult()
+        self._space = asyncio.Event()
+        self._space.set()
+        for index in range(self._sockets):
+            transport, _ = await loop.create_datagram_endpoint(lambda index=index: _ReplayProtocol(self, index),
+                                                               remote_addr=(self._address, self._port))
+            self._transports.append(transport)
+        start = time.monotonic()
+        try:
+            await self._send_all(loop)
+            while self._pending:
+                await asyncio.sleep(min(0.05, self._timeout))
+                self._expire()
+        finally:
+            self.result.elapsed = time.monotonic() - start
+            for transport in self._transports:
+                transport.close()
+        return self.result
+
+
+def run_replay(args):
+    """
+    Replay the capture configured from the command line and print the report
+
+    :param args: ReplayArgumentsParser object
+    :return: ReplayResult object
+    """
+    if args.speed < 0:
+        raise BrokenDNSProxyError("Speed factor can't be negative")
+    replay = CaptureReplay(args.address, args.port, read_udp_packets(args.capture), speed=args.speed,
+                           capture_port=args.capture_port, concurrency=args.concurrency, timeout=args.timeout,
+                           sockets=args.sockets, count=args.count)
+    logger.info("Replaying Queries from '%s' to %s port %d (%s)...", args.capture, args.address, args.port,
+                '{0}x speed'.format(args.speed) if args.speed else 'as fast as possible')
+    result = asyncio.run(replay.run())
+    print(result.report())
+    return result
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+
+from collections import OrderedDict
+
+
+class ResponseMemo(object):
+    """
+    Bounded LRU memo of responses modified by a ModificationChain. The key is
+    the chain and the upstream response without its ID, so a hit returns the
+    final message without parsing and serializing it again. The client ID is
+    set when the response is sent, as for any other response.
+    """
+
+    def __init__(self, max_entries):
+        """
+        Constructor
+
+        :param max_entries: maximal number of memoized responses
+        :return: new object
+        """
+        self._max_entries = max_entries
+        self._entries = OrderedDict()
+        # statistics
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __str__(self):
+        return "<ResponseMemo entries='{0}' hits='{1}' misses='{2}'>".format(len(self._entries), self.hits,
+                                                                           self.misses)
+
+    @staticmethod
+    def key(chain, response_raw):
+        """
+        Return the memo key. Chains are replaced by new objects on reload,
+        so responses of the old chains are never returned.
+
+        :param chain: ModificationChain the response is modified by
+        :param response_raw: raw DNS message with the upstream response
+        :return: hashable key
+        """
+        return chain, bytes(response_raw[2:])
+
+    def modify(self, chain, response_raw):
+        """
+        Return the response modified by the chain, memoized if possible
+
+        :param chain: ModificationChain object
+        :param response_raw: raw DNS message with the upstream response
+        :return: raw DNS message with the modified response
+        """
+        key = self.key(chain, response_raw)
+        modified_raw = self._entries.get(key)
+        if modified_raw is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return modified_raw
+
+        self.misses += 1
+        modified_raw = bytes(chain.plan(response_raw))
+        self._entries[key] = modified_raw
+        if len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+        return modified_raw
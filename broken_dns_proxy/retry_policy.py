@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+
+import collections
+
+
+class RttPercentile(object):
+    """
+    Percentiles of RTT over a sliding window of the most recent samples.
+    The samples are sorted again only after enough new ones arrived, so
+    the percentile may lag behind the most recent samples.
+    """
+
+    def __init__(self, window=1024, refresh=64):
+        """
+        Constructor
+
+        :param window: number of the most recent samples to keep
+        :param refresh: number of new samples after which the samples are sorted again
+        :return: new object
+        """
+        self._samples = collections.deque(maxlen=window)
+        self._sorted = []
+        self._refresh = refresh
+        # samples added since the last sort
+        self._stale = 0
+
+    def __len__(self):
+        return len(self._samples)
+
+    def add(self, rtt):
+        """
+        Account RTT of a successful Query
+
+        :param rtt: RTT in seconds
+        :return: None
+        """
+        self._samples.append(rtt)
+        self._stale += 1
+
+    def percentile(self, p):
+        """
+        Return the p-th percentile of the samples
+
+        :param p: percentile between 0 and 100
+        :return: RTT in seconds or None if there are no samples
+        """
+        if not self._samples:
+            return None
+        if self._stale >= self._refresh or (self._stale and not self._sorted):
+            self._sorted = sorted(self._samples)
+            self._stale = 0
+        index = min(len(self._sorted) - 1, int(len(self._sorted) * p / 100.0))
+        return self._sorted[index]
+
+
+class RetryCounters(object):
+    """
+    Counters of the upstream Queries which did not go the straight way.
+    """
+
+    __slots__ = ('timeouts', 'failures', 'retries', 'hedges', 'hedge_wins', 'exhausted')
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+    def __str__(self):
+        return '<RetryCounters {0}>'.format(' '.join("{0}='{1}'".format(name, getattr(self, name))
+                                                      for name in self.__slots__))
+
+    def as_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+
+class RetryPolicy(object):
+    """
+    Deadline of upstream Queries, number of retries on other upstream servers
+    and the delay after which a hedged Query is sent to another upstream server.
+    """
+
+    # no hedging until there is enough samples for the percentile to make sense
+    HEDGE_MIN_SAMPLES = 20
+
+    def __init__(self, timeout, retries=0, hedge_percentile=0, hedge_min_delay=0.0):
+        """
+        Constructor
+
+        :param timeout: seconds to wait for the response from one upstream server
+        :param retries: number of times the Query is retried on another upstream server
+        :param hedge_percentile: percentile of the observed RTT after which the hedged Query is sent, 0 to disable
+        :param hedge_min_delay: minimal delay in seconds before the hedged Query is sent
+        :return: new object
+        """
+        self.timeout = timeout
+        self.retries = retries
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.counters = RetryCounters()
+        self._rtt = RttPercentile()
+
+    def __str__(self):
+        return "<RetryPolicy timeout='{0}' retries='{1}' hedge_percentile='{2}'>".format(self.timeout, self.retries,
+                                                                                         self.hedge_percentile)
+
+    @property
+    def attempts(self):
+        return self.retries + 1
+
+    def report(self, rtt):
+        """
+        Account RTT of a successful upstream Query
+
+        :param rtt: RTT in seconds
+        :return: None
+        """
+        self._rtt.add(rtt)
+
+    def hedge_delay(self):
+        """
+        Return the time after which the hedged Query should be sent
+
+        :return: delay in seconds or None if hedging is disabled
+        """
+        if not self.hedge_percentile or len(self._rtt) < self.HEDGE_MIN_SAMPLES:
+            return None
+        delay = max(self.hedge_min_delay, self._rtt.percentile(self.hedge_percentile))
+        if delay >= self.timeout:
+            return None
+        return delay
@@ -19,4 +19,4 @@
 # Authors:
 
 DEFAULT_CONFIG_LOCATION = '/etc/dbp.conf'
-DEBUG_LOG_FILE_NAME = 'broken-dns-proxy-debug.log'
\ No newline at end of file
+DEBUG_LOG_FILE_NAME = 'broken-dns-proxy-debug.log'
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+
+import collections
+import os
+import subprocess
+import sys
+from collections import namedtuple
+
+from broken_dns_proxy.exceptions import BrokenDNSProxyError
+
+
+# one line of 'python -X importtime' output, times in microseconds, depth is the nesting of the import
+ImportTime = namedtuple('ImportTime', ['module', 'self_us', 'cumulative_us', 'depth'])
+
+IMPORTTIME_PREFIX = 'import time:'
+
+# code run in the profiled interpreter, starts the proxy the same way as the 'bdp' command,
+# just doesn't serve, and writes the time it took to stdout
+_PROFILED_CODE = '''
+import sys
+import time
+start = time.perf_counter()
+from broken_dns_proxy.__main__ import Application
+from broken_dns_proxy.arguments_parser import ArgumentsParser
+Application(ArgumentsParser(sys.argv[1:]))
+print(time.perf_counter() - start)
+'''
+
+
+def parse_importtime(lines):
+    """
+    Parse the output of 'python -X importtime'
+
+    :param lines: lines written by the interpreter to stderr, other lines are skipped
+    :return: list of ImportTime tuples in the order the imports finished
+    """
+    imports = []
+    for line in lines:
+        if not line.startswith(IMPORTTIME_PREFIX):
+            continue
+        fields = line[len(IMPORTTIME_PREFIX):].split('|')
+        if len(fields) != 3:
+            continue
+        try:
+            self_us, cumulative_us = int(fields[0]), int(fields[1])
+        except ValueError:
+            # the header line
+            continue
+        name = fields[2].rstrip()
+        module = name.lstrip()
+        # every nesting level is indented by two spaces
+        imports.append(ImportTime(module, self_us, cumulative_us, (len(name) - len(module) - 1) // 2))
+    return imports
+
+
+class StartupProfile(object):
+    """
+    Imports done while the proxy starts and how long they took
+    """
+
+    def __init__(self, imports, startup_time):
+        """
+        Constructor
+
+        :param imports: list of ImportTime tuples
+        :param startup_time: seconds spent importing and configuring the proxy
+        :return: new object
+        """
+        self.imports = imports
+        self.startup_time = startup_time
+
+    @property
+    def import_time(self):
+        """
+        Seconds spent importing modules
+
+        :return: float
+        """
+        return sum(imp.cumulative_us for imp in self.imports if imp.depth == 0) / 1e6
+
+    def is_imported(self, module):
+        return any(imp.module == module for imp in self.imports)
+
+    def slowest(self, count):
+        """
+        Return the imports taking the most time themselves, without the modules they import
+
+        :param count: number of imports
+        :return: list of ImportTime tuples
+        """
+        return sorted(self.imports, key=lambda imp: imp.self_us, reverse=True)[:count]
+
+    def packages(self):
+        """
+        Return the import time of top-level packages, slowest first
+
+        :return: list of tuples (package name, seconds)
+        """
+        packages = collections.Counter()
+        for imp in self.imports:
+            packages[imp.module.partition('.')[0]] += imp.self_us
+        return [(package, self_us / 1e6) for package, self_us in packages.most_common()]
+
+    def report(self, count=15):
+        """
+        Return human readable report
+
+        :param count: number of the slowest imports and packages to list
+        :return: str
+        """
+        def ms(value):
+            return '{0:.3f} ms'.format(value * 1000)
+
+        lines = ['Startup time:      {0} (importing and configuring the proxy)'.format(ms(self.startup_time)),
+                 'Import time:       {0} ({1} modules)'.format(ms(self.import_time), len(self.imports)),
+                 'Slowest packages:']
+        lines.extend('    {0:>12}  {1}'.format(ms(seconds), package)
+                     for package, seconds in self.packages()[:count])
+        lines.append('Slowest imports (self, cumulative):')
+        lines.extend('    {0:>12} {1:>12}  {2}'.format(ms(imp.self_us / 1e6), ms(imp.cumulative_us / 1e6), imp.module)
+                     for imp in self.slowest(count))
+        return '\n'.join(lines)
+
+
+def profile_startup(argv):
+    """
+    Start the proxy in a new interpreter with import profiling enabled. The
+    server is created from the configuration, but doesn't serve, so the
+    profile contains exactly what the configuration needs to import.
+
+    :param argv: command line arguments of the proxy
+    :return: StartupProfile object
+    """
+    env = dict(os.environ)
+    # the package doesn't have to be installed
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join(path for path in (package_root, env.get('PYTHONPATH')) if path)
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', _PROFILED_CODE] + list(argv),
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, env=env)
+    stderr = process.stderr.splitlines()
+    if process.returncode != 0:
+        errors = [line for line in stderr if not line.startswith(IMPORTTIME_PREFIX)]
+        raise BrokenDNSProxyError("Profiled startup failed: {0}".format(
+            errors[-1] if errors else 'exit code {0}'.format(process.returncode)))
+    return StartupProfile(parse_importtime(stderr), float(process.stdout.split()[-1]))
+
+
+def run_startup_profile(args):
+    """
+    Profile the startup with the configuration from the command line and print the report
+
+    :param args: ArgumentsParser object
+    :return: StartupProfile object
+    """
+    profile = profile_startup(['-c', args.config_path])
+    print(profile.report())
+    return profile
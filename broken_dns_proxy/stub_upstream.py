@@ -0,0 +1,437 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+
+import asyncio
+import bisect
+import struct
+
+import dns.exception
+import dns.flags
+import dns.message
+import dns.name
+import dns.rcode
+import dns.rdataclass
+import dns.rdatatype
+import dns.zone
+
+from broken_dns_proxy import wire
+from broken_dns_proxy.logger import logger
+from broken_dns_proxy.exceptions import BrokenDNSProxyError
+from broken_dns_proxy.blocking_upstream import STUB_UPSTREAM
+
+
+class StubZone(object):
+    """
+    One zone loaded from a zone file, with names sorted in the DNSSEC
+    canonical order for finding NSEC records proving nonexistence.
+    """
+
+    def __init__(self, zone):
+        """
+        Constructor
+
+        :param zone: dns.zone.Zone object with absolute names
+        :return: new object
+        """
+        self.zone = zone
+        self.origin = zone.origin
+        self.soa = zone.get_node(self.origin).get_rdataset(dns.rdataclass.IN, dns.rdatatype.SOA)
+        self._names = sorted(zone.nodes.keys())
+
+    def get_node(self, name):
+        return self.zone.nodes.get(name)
+
+    def covering_name(self, name):
+        """
+        Return the name preceding the name in canonical order
+
+        :param name: dns.name.Name object
+        :return: dns.name.Name object
+        """
+        index = bisect.bisect_right(self._names, name) - 1
+        return self._names[index] if index >= 0 else self._names[-1]
+
+
+class StubResolver(object):
+    """
+    Authoritative responder answering from zone files loaded in memory.
+    Rendered responses are remembered, so repeated Queries only get the
+    message ID and the question copied into the remembered response.
+    """
+
+    # rendered responses are forgotten when there is more of them
+    MAX_RESPONSES = 2**16
+    # limit of followed CNAME records
+    MAX_CNAME_CHAIN = 8
+
+    def __init__(self, zone_files):
+        """
+        Constructor
+
+        :param zone_files: list of paths to zone files, every file must set $ORIGIN
+        :return: new object
+        """
+        self._zones = dict()
+        for path in zone_files:
+            try:
+                zone = dns.zone.from_file(path, relativize=False)
+            except (IOError, OSError) as e:
+                raise BrokenDNSProxyError("Unable to read zone file '{0}': {1}".format(path, e.strerror))
+            except dns.exception.DNSException as e:
+                raise BrokenDNSProxyError("Unable to load zone file '{0}': {1}".format(path, str(e)))
+            logger.debug("Loaded zone '%s' with %d names from '%s'", zone.origin, len(zone.nodes), path)
+            self._zones[zone.origin] = StubZone(zone)
+        if not self._zones:
+            raise BrokenDNSProxyError("No zone files for the stub upstream server configured!")
+        self._responses = dict()
+
+    def __str__(self):
+        return "<StubResolver zones='{0}'>".format(' '.join(str(origin) for origin in self._zones))
+
+    def _find_zone(self, qname):
+        name = qname
+        while True:
+            zone = self._zones.get(name)
+            if zone is not None or name == dns.name.root:
+                return zone
+            name = name.parent()
+
+    @staticmethod
+    def _add_rdataset(response, section, name, rdataset, zone_node=None, dnssec=False):
+        response.find_rrset(section, name, rdataset.rdclass, rdataset.rdtype, rdataset.covers,
+                            create=True).update(rdataset)
+        if dnssec and zone_node is not None:
+            signatures = zone_node.get_rdataset(rdataset.rdclass, dns.rdatatype.RRSIG, rdataset.rdtype)
+            if signatures is not None:
+                response.find_rrset(section, name, signatures.rdclass, signatures.rdtype, signatures.covers,
+                                    create=True).update(signatures)
+
+    def _add_soa(self, response, zone, dnssec):
+        self._add_rdataset(response, response.authority, zone.origin, zone.soa, zone.get_node(zone.origin), dnssec)
+
+    def _add_nsec(self, response, zone, name):
+        node = zone.get_node(name)
+        nsec = node.get_rdataset(dns.rdataclass.IN, dns.rdatatype.NSEC) if node is not None else None
+        if nsec is not None:
+            self._add_rdataset(response, response.authority, name, nsec, node, True)
+
+    def _referral(self, response, zone, qname, qtype, dnssec):
+        """
+        Find zone cut between the zone apex and the qname
+
+        :return: True if the referral was added to the response
+        """
+        labels = len(qname) - len(zone.origin)
+        for i in range(labels - 1, -1, -1):
+            name = qname.split(len(zone.origin) + labels - i)[1]
+            node = zone.get_node(name)
+            if node is None:
+                continue
+            ns = node.get_rdataset(dns.rdataclass.IN, dns.rdatatype.NS)
+            if ns is None or (name == qname and qtype == dns.rdatatype.DS):
+                continue
+            response.flags &= ~dns.flags.AA
+            self._add_rdataset(response, response.authority, name, ns)
+            if dnssec:
+                ds = node.get_rdataset(dns.rdataclass.IN, dns.rdatatype.DS)
+                if ds is not None:
+                    self._add_rdataset(response, response.authority, name, ds, node, True)
+                else:
+                    self._add_nsec(response, zone, name)
+            # glue
+            for rdata in ns:
+                glue = zone.get_node(rdata.target)
+                if glue is None:
+                    continue
+                for rdtype in (dns.rdatatype.A, dns.rdatatype.AAAA):
+                    rdataset = glue.get_rdataset(dns.rdataclass.IN, rdtype)
+                    if rdataset is not None:
+                        self._add_rdataset(response, response.additional, rdata.target, rdataset)
+            return True
+        return False
+
+    def _answer(self, query):
+        """
+        Create the response to the Query
+
+        :param query: DNS Message object with the Query
+        :return: DNS Message object with the response
+        """
+        response = dns.message.make_response(query)
+        response.flags &= ~dns.flags.RA
+        if len(query.question) != 1:
+            response.set_rcode(dns.rcode.FORMERR)
+            return response
+        question = query.question[0]
+        qname = question.name
+        qtype = question.rdtype
+        zone = self._find_zone(qname) if question.rdclass == dns.rdataclass.IN else None
+        if zone is None:
+            response.set_rcode(dns.rcode.REFUSED)
+            return response
+        response.flags |= dns.flags.AA
+        dnssec = query.ednsflags & dns.flags.DO != 0
+
+        for _ in range(self.MAX_CNAME_CHAIN):
+            if self._referral(response, zone, qname, qtype, dnssec):
+                return response
+
+            node = zone.get_node(qname)
+            owner = qname
+            if node is None and qname != zone.origin:
+                # wildcard matching only the immediate parent is supported
+                node = zone.get_node(dns.name.Name((b'*',) + qname.parent().labels))
+            if node is None:
+                response.set_rcode(dns.rcode.NXDOMAIN)
+                self._add_soa(response, zone, dnssec)
+                if dnssec:
+                    self._add_nsec(response, zone, zone.covering_name(qname))
+                return response
+
+            if qtype == dns.rdatatype.ANY:
+                for rdataset in node.rdatasets:
+                    if rdataset.rdtype != dns.rdatatype.RRSIG:
+                        self._add_rdataset(response, response.answer, owner, rdataset, node, dnssec)
+                return response
+
+            rdataset = node.get_rdataset(dns.rdataclass.IN, qtype)
+            if rdataset is not None:
+                self._add_rdataset(response, response.answer, owner, rdataset, node, dnssec)
+                return response
+
+            cname = node.get_rdataset(dns.rdataclass.IN, dns.rdatatype.CNAME)
+            if cname is None:
+                # NODATA
+                self._add_soa(response, zone, dnssec)
+                if dnssec:
+                    self._add_nsec(response, zone, owner)
+                return response
+
+            self._add_rdataset(response, response.answer, owner, cname, node, dnssec)
+            qname = cname[0].target
+            zone = self._find_zone(qname)
+            if zone is None:
+                return response
+        return response
+
+    @staticmethod
+    def _key(msg_raw):
+        wire.check_header(msg_raw)
+        if wire.get_count(msg_raw, wire.QUESTION) != 1:
+            return None
+        opt = wire.find_opt(msg_raw)
+        do = opt is not None and bool(wire.get_edns_flags(msg_raw, opt) & dns.flags.DO)
+        return wire.parse_question(msg_raw) + (opt is not None, do)
+
+    def resolve(self, msg_raw):
+        """
+        Answer the Query
+
+        :param msg_raw: raw DNS message with the Query
+        :return: raw DNS message with the response
+        """
+        key = self._key(msg_raw)
+        template = self._responses.get(key) if key is not None else None
+        if template is None:
+            try:
+                query = dns.message.from_wire(bytes(msg_raw))
+            except dns.exception.DNSException as e:
+                raise BrokenDNSProxyError("Stub upstream received malformed Query: {0}".format(str(e)))
+            response_raw = self._answer(query).to_wire()
+            if key is None:
+                return response_raw
+            if len(self._responses) >= self.MAX_RESPONSES:
+                self._responses.clear()
+            template = self._responses[key] = response_raw
+
+        response = bytearray(template)
+        wire.set_id(response, wire.get_id(msg_raw))
+        wire.copy_question(response, msg_raw)
+        copied_flags = dns.flags.RD | dns.flags.CD
+        wire.set_flags(response, (wire.get_flags(response) & ~copied_flags) | (wire.get_flags(msg_raw) & copied_flags))
+        return response
+
+
+def truncate_udp_response(msg_raw, response_raw):
+    """
+    Truncate the response the client would not be able to receive over UDP
+    to the header and the question, with the TC bit set, so the client
+    retries over TCP
+
+    :param msg_raw: raw DNS message with the Query
+    :param response_raw: raw DNS message with the response
+    :return: raw DNS message with the response, truncated if needed
+    """
+    opt = wire.find_opt(msg_raw)
+    max_payload = max(512, opt.rdclass) if opt is not None else 512
+    if len(response_raw) <= max_payload:
+        return response_raw
+    response = bytearray(response_raw[:wire.question_end(response_raw)])
+    wire.set_flags(response, wire.get_flags(response) | dns.flags.TC)
+    for section in (wire.ANSWER, wire.AUTHORITY, wire.ADDITIONAL):
+        wire.set_count(response, section, 0)
+    return response
+
+
+class StubUpstream(object):
+    """
+    Upstream server answering from the StubResolver in the proxy process, without any network
+    """
+
+    address = STUB_UPSTREAM
+
+    def __init__(self, resolver, stream=False):
+        """
+        Constructor
+
+        :param resolver: StubResolver object
+        :param stream: True if the upstream stands for TCP, otherwise the responses are truncated as over UDP
+        :return: new object
+        """
+        self._resolver = resolver
+        self._stream = stream
+
+    def _answer(self, msg_raw):
+        response_raw = self._resolver.resolve(msg_raw)
+        if self._stream:
+            return response_raw
+        return truncate_udp_response(msg_raw, response_raw)
+
+    def query(self, msg_raw):
+        return self._answer(msg_raw)
+
+    def close(self):
+        pass
+
+
+class AsyncStubUpstream(StubUpstream):
+    """
+    StubUpstream with the interface of the asyncio upstream clients
+    """
+
+    async def query(self, msg_raw, timeout=None):
+        return self._answer(msg_raw)
+
+
+class _StubDatagramProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, resolver):
+        self._resolver = resolver
+        self._transport = None
+
+    def connection_made(self, transport):
+        self._transport = transport
+
+    def datagram_received(self, data, addr):
+        try:
+            response_raw = self._resolver.resolve(data)
+        except BrokenDNSProxyError as e:
+            logger.debug('%s', str(e))
+            return
+        self._transport.sendto(truncate_udp_response(data, response_raw), addr)
+
+
+class _StubStreamProtocol(asyncio.Protocol):
+
+    def __init__(self, resolver):
+        self._resolver = resolver
+        self._transport = None
+        self._buffer = bytearray()
+
+    def connection_made(self, transport):
+        self._transport = transport
+
+    def data_received(self, data):
+        self._buffer.extend(data)
+        while len(self._buffer) >= 2:
+            msg_len = struct.unpack_from('!H', self._buffer)[0]
+            if len(self._buffer) < msg_len + 2:
+                break
+            msg_raw = bytes(self._buffer[2:msg_len + 2])
+            del self._buffer[:msg_len + 2]
+            try:
+                response_raw = self._resolver.resolve(msg_raw)
+            except BrokenDNSProxyError as e:
+                logger.debug('%s', str(e))
+                self._transport.close()
+                return
+            self._transport.write(struct.pack('!H', len(response_raw)) + response_raw)
+
+
+class StubServer(object):
+    """
+    StubResolver listening on UDP and TCP port, to be used as a local upstream server
+    """
+
+    def __init__(self, resolver, address='127.0.0.1', port=53):
+        """
+        Constructor
+
+        :param resolver: StubResolver object
+        :param address: address to listen on
+        :param port: port to listen on
+        :return: new object
+        """
+        self._resolver = resolver
+        self._address = address
+        self._port = port
+        self._listeners = []
+
+    def __str__(self):
+        return "<StubServer address='{0}' port='{1}' resolver='{2}'>".format(self._address, self._port,
+                                                                             self._resolver)
+
+    async def start(self):
+        """
+        Start listening, on the port the UDP socket got if the port is 0
+
+        :return: port the server listens on
+        """
+        loop = asyncio.get_running_loop()
+        udp_transport, _ = await loop.create_datagram_endpoint(lambda: _StubDatagramProtocol(self._resolver),
+                                                               local_addr=(self._address, self._port))
+        self._port = udp_transport.get_extra_info('sockname')[1]
+        tcp_server = await loop.create_server(lambda: _StubStreamProtocol(self._resolver), self._address, self._port)
+        self._listeners = [udp_transport, tcp_server]
+        return self._port
+
+    def close(self):
+        for listener in self._listeners:
+            listener.close()
+        self._listeners = []
+
+    async def serve_forever(self):
+        await self.start()
+        logger.info('Stub upstream server listening on %s port %s...', self._address, str(self._port))
+        try:
+            await asyncio.Event().wait()
+        finally:
+            self.close()
+
+
+def run_stub(args):
+    """
+    Run the stub upstream server configured from the command line
+
+    :param args: StubArgumentsParser object
+    :return: None
+    """
+    server = StubServer(StubResolver(args.zones), args.address, args.port)
+    asyncio.run(server.serve_forever())
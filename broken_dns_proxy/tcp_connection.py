@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+
+import errno
+import socket
+import struct
+import time
+
+from broken_dns_proxy.logger import logger
+from broken_dns_proxy.client import Client
+from broken_dns_proxy.buffer_pool import BufferPool, StreamReassembler
+
+
+class StreamClient(Client):
+    """
+    Client whose Query was received over a TCP connection. The response
+    is queued on the connection, so it never blocks on a slow client.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, connection, msg_raw, received=None):
+        """
+        Constructor
+
+        :param connection: TcpClientConnection object the Query was received on
+        :param msg_raw: raw DNS message with the Query
+        :param received: time.perf_counter() value when the Query was received
+        :return: None
+        """
+        self.setup(connection, msg_raw, received)
+
+    def setup(self, connection, msg_raw, received=None):
+        # the connection is the transport of TCP clients
+        self._transport = connection
+        self._client_addr = connection.addr
+        self._client_msg_raw = msg_raw
+        self.received = received
+        self._detached = False
+        self._check_client_msg()
+
+    def is_stream(self):
+        return True
+
+    def detach(self):
+        """
+        Keep the Query for the response sent later and the connection open until then
+
+        :return: None
+        """
+        super(StreamClient, self).detach()
+        self._transport.delayed_responses += 1
+
+    def _send_stream(self, msg_raw):
+        """
+        Queue raw DNS Message for the client connected using TCP
+
+        :param msg_raw: raw DNS Message to sent to the client
+        :return: None
+        """
+        if self._detached:
+            self._transport.delayed_responses -= 1
+        self._transport.send_message(msg_raw)
+
+
+class TcpClientConnection(object):
+    """
+    State of one client TCP connection (RFC 7766). Any number of Queries can
+    be sent over the connection, data is read and written without blocking.
+    """
+
+    # the connection is closed if the client doesn't read its responses
+    MAX_OUTPUT_BUFFER = 2**20
+
+    def __init__(self, sock, addr, max_queries=0, buffer_pool=None):
+        """
+        Constructor
+
+        :param sock: accepted socket
+        :param addr: address of the client
+        :param max_queries: number of Queries after which the connection is closed, 0 for no limit
+        :param buffer_pool: BufferPool the data are received into, shared by all connections
+        :return: new object
+        """
+        self.sock = sock
+        self.sock.setblocking(False)
+        self.addr = addr
+        self.last_activity = time.monotonic()
+        self.queries = 0
+        # responses waiting in the timer wheel
+        self.delayed_responses = 0
+        self.closed = False
+        self._max_queries = max_queries
+        self._input = StreamReassembler(buffer_pool if buffer_pool is not None else BufferPool(max_free=1))
+        self._output = bytearray()
+        # no more Queries are read, the connection is closed once the responses are sent
+        self._closing = False
+
+    def __str__(self):
+        return "<TcpClientConnection addr='{0}' queries='{1}'>".format(self.addr, self.queries)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def wants_write(self):
+        return bool(self._output)
+
+    def is_idle(self, now, idle_timeout):
+        """
+        Check if the connection was not used for longer than the timeout
+
+        :param now: current time
+        :param idle_timeout: timeout in seconds
+        :return: bool
+        """
+        return not self._output and not self.delayed_responses and now - self.last_activity > idle_timeout
+
+    def read(self):
+        """
+        Read the available data and return all complete Queries. The Queries
+        are memoryview slices of the pooled buffer, valid until the next read()
+        of any connection sharing the pool.
+
+        :return: list of raw DNS messages
+        """
+        if self._closing:
+            # no more Queries are accepted, only wait for EOF
+            buf = bytearray(512)
+        else:
+            buf = self._input.get_buffer()
+        try:
+            nbytes = self.sock.recv_into(buf)
+        except (BlockingIOError, InterruptedError):
+            return []
+        except socket.error as e:
+            logger.debug('Reading from TCP client %s failed: %s', str(self.addr), str(e))
+            self.close()
+            return []
+        if not nbytes:
+            logger.debug('TCP client %s disconnected', str(self.addr))
+            self.close()
+            return []
+
+        self.last_activity = time.monotonic()
+        if self._closing:
+            return []
+
+        max_messages = self._max_queries - self.queries if self._max_queries else 0
+        messages = self._input.buffer_updated(nbytes, max_messages)
+        self.queries += len(messages)
+        if self._max_queries and self.queries >= self._max_queries:
+            logger.debug('TCP client %s reached the limit of %d Queries', str(self.addr), self._max_queries)
+            self._closing = True
+            self._input.release()
+        return messages
+
+    def send_message(self, msg_raw):
+        """
+        Queue the message for the client and send as much as possible right away
+
+        :param msg_raw: raw DNS message
+        :return: None
+        """
+        if self.closed:
+            logger.debug('TCP client %s already disconnected', str(self.addr))
+            return
+        self._output.extend(struct.pack('!H', len(msg_raw)))
+        self._output.extend(msg_raw)
+        if len(self._output) > self.MAX_OUTPUT_BUFFER:
+            logger.debug('TCP client %s does not read its responses... closing', str(self.addr))
+            self.close()
+            return
+        self.flush()
+
+    def flush(self):
+        """
+        Send the queued data without blocking
+
+        :return: None
+        """
+        try:
+            while self._output:
+                sent = self.sock.send(self._output)
+                del self._output[:sent]
+        except (BlockingIOError, InterruptedError):
+            return
+        except socket.error as e:
+            if e.errno != errno.EPIPE:
+                logger.debug('Writing to TCP client %s failed: %s', str(self.addr), str(e))
+            self.close()
+            return
+        self.last_activity = time.monotonic()
+
+    def is_finished(self):
+        """
+        Check if the limit of Queries was reached and all responses were sent
+
+        :return: bool
+        """
+        return self._closing and not self._output and not self.delayed_responses
+
+    def close(self):
+        """
+        Close the connection
+
+        :return: None
+        """
+        if not self.closed:
+            self.closed = True
+            self._input.release()
+            self.sock.close()
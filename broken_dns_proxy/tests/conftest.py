@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+
+from broken_dns_proxy.arguments_parser import ArgumentsParser
+from broken_dns_proxy.config import BrokenDnsProxyConfiguration
+
+
+@pytest.fixture
+def make_config(tmp_path):
+    """
+    Factory of configurations read from a file in the temporary directory of the test
+
+    The factory takes the text of the configuration file and optionally the options
+    appended to it, i.e. to its last section, and returns BrokenDnsProxyConfiguration.
+    """
+    def make(text, options=None):
+        cfg_file = tmp_path / 'config'
+        cfg_file.write_text(text + ''.join('{0} = {1}\n'.format(option, value)
+                                           for option, value in (options or {}).items()))
+        return BrokenDnsProxyConfiguration(ArgumentsParser(['-c', str(cfg_file)]))
+
+    return make
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import dns.flags
+import dns.message
+import dns.rcode
+import pytest
+
+from broken_dns_proxy.admission import AdmissionControl, ClientRateLimiter, shed_response, check_shed_action, \
+    ADMITTED, RATE_LIMITED, QUEUE_FULL, QUEUE_DELAY, SHED_DROP, SHED_REFUSED, SHED_TRUNCATE
+from broken_dns_proxy.exceptions import BrokenDNSProxyError
+
+
+class TestClientRateLimiter(object):
+
+    def test_burst_and_refill(self):
+        limiter = ClientRateLimiter(10, 3)
+        client = ('192.0.2.1', 5353)
+        assert [limiter.allow(client, 0.0) for _ in range(4)] == [True, True, True, False]
+        # one token is back after 0.1s
+        assert limiter.allow(client, 0.1)
+        assert not limiter.allow(client, 0.1)
+        # never more tokens than the burst
+        assert [limiter.allow(client, 10.0) for _ in range(4)] == [True, True, True, False]
+
+    def test_prefix_grouping(self):
+        limiter = ClientRateLimiter(1, 1, prefix_v4=24, prefix_v6=56)
+        assert limiter.allow(('192.0.2.1', 1), 0.0)
+        assert not limiter.allow(('192.0.2.200', 2), 0.0)
+        assert not limiter.allow(('::ffff:192.0.2.7', 3, 0, 0), 0.0)
+        assert limiter.allow(('192.0.3.1', 1), 0.0)
+        assert limiter.allow(('2001:db8:0:100::1', 1, 0, 0), 0.0)
+        assert not limiter.allow(('2001:db8:0:1ff::2', 1, 0, 0), 0.0)
+        assert limiter.allow(('2001:db8:0:200::1', 1, 0, 0), 0.0)
+        assert len(limiter) == 4
+
+    def test_bounded_clients(self):
+        limiter = ClientRateLimiter(1, 1, prefix_v4=32, max_clients=2)
+        for host in ('192.0.2.1', '192.0.2.2', '192.0.2.3'):
+            assert limiter.allow((host, 1), 0.0)
+        assert len(limiter) == 2
+        # the oldest client was forgotten and starts with a full bucket
+        assert limiter.allow(('192.0.2.1', 1), 0.0)
+        assert not limiter.allow(('192.0.2.3', 1), 0.0)
+
+    def test_wrong_parameters(self):
+        with pytest.raises(BrokenDNSProxyError):
+            ClientRateLimiter(0, 1)
+        with pytest.raises(BrokenDNSProxyError):
+            ClientRateLimiter(1, 1, prefix_v4=33)
+
+
+class TestAdmissionControl(object):
+
+    def test_disabled(self):
+        admission = AdmissionControl()
+        assert not admission.enabled
+        assert admission.admit(('192.0.2.1', 1), 1000, 0.0) is None
+        assert admission.check_delay(0.0, 100.0) is None
+
+    def test_decisions(self):
+        admission = AdmissionControl(ClientRateLimiter(1, 1), max_pending=2, max_delay=0.5,
+                                     rate_limit_action=SHED_DROP, shed_action=SHED_TRUNCATE)
+        assert admission.enabled
+        assert admission.admit(('192.0.2.1', 1), 0, 0.0) is None
+        assert admission.admit(('192.0.2.2', 1), 0, 0.0) == SHED_DROP
+        assert admission.admit(('198.51.100.1', 1), 2, 0.0) == SHED_TRUNCATE
+        assert admission.check_delay(0.0, 0.4) is None
+        assert admission.check_delay(0.0, 0.6) == SHED_TRUNCATE
+        assert admission.decisions == {(ADMITTED, 'process'): 1, (RATE_LIMITED, SHED_DROP): 1,
+                                       (QUEUE_FULL, SHED_TRUNCATE): 1, (QUEUE_DELAY, SHED_TRUNCATE): 1}
+
+    def test_stream_is_not_truncated(self):
+        admission = AdmissionControl(max_pending=1, shed_action=SHED_TRUNCATE)
+        assert admission.admit(('192.0.2.1', 1), 1, 0.0, stream=True) == SHED_REFUSED
+        assert admission.decisions[(QUEUE_FULL, SHED_REFUSED)] == 1
+
+    def test_check_shed_action(self):
+        assert check_shed_action('truncate', 'ShedAction') == SHED_TRUNCATE
+        with pytest.raises(BrokenDNSProxyError):
+            check_shed_action('servfail', 'ShedAction')
+
+
+class TestShedResponse(object):
+
+    def test_refused(self):
+        query = dns.message.make_query('example.com.', 'A', want_dnssec=True)
+        query.flags |= dns.flags.CD
+        response = dns.message.from_wire(bytes(shed_response(query.to_wire(), SHED_REFUSED)))
+        assert response.id == query.id
+        assert response.rcode() == dns.rcode.REFUSED
+        assert response.flags & ~0xF == dns.flags.QR | dns.flags.RD | dns.flags.CD
+        assert response.question == query.question
+        assert not response.answer and not response.additional and response.edns < 0
+
+    def test_truncated(self):
+        query = dns.message.make_query('example.com.', 'AAAA')
+        response_raw = shed_response(query.to_wire(), SHED_TRUNCATE)
+        response = dns.message.from_wire(bytes(response_raw))
+        assert response.rcode() == dns.rcode.NOERROR
+        assert response.flags & dns.flags.TC
+        assert response.question == query.question
+        assert len(response_raw) <= len(query.to_wire())
+
+    def test_malformed_question(self):
+        query = dns.message.make_query('example.com.', 'A').to_wire()
+        with pytest.raises(BrokenDNSProxyError):
+            shed_response(query[:20], SHED_REFUSED)
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import asyncio
+import struct
+
+import dns.message
+import dns.rrset
+
+from broken_dns_proxy.async_proxy_server import AsyncProxyServer, ProtocolClient, StreamListener
+
+DELAY_CONFIG = """
+[Chain:slow]
+Modifiers = DelayModifier:Slow
+Names = slow.example.
+[Slow]
+Delay = 0.3
+[Proxy]
+UpstreamServers = 127.0.0.1@5300
+Chains = slow
+"""
+
+
+def make_server(make_config, options):
+    server = AsyncProxyServer(make_config(DELAY_CONFIG, options))
+
+    async def forward(msg_raw, upstream_server, stream=False):
+        query = dns.message.from_wire(bytes(msg_raw))
+        response = dns.message.make_response(query)
+        response.answer.append(dns.rrset.from_text(query.question[0].name, 300, 'IN', 'A', '192.0.2.1'))
+        return response.to_wire()
+
+    server._forward = forward
+    return server
+
+
+def run_tcp_queries(server, qnames):
+    """
+    Send the Queries over one TCP connection and read the responses until
+    the proxy closes the connection
+    """
+    async def run():
+        server._loop = asyncio.get_running_loop()
+        tcp_server = await server._loop.create_server(lambda: StreamListener(server), '127.0.0.1', 0)
+        try:
+            reader, writer = await asyncio.open_connection(*tcp_server.sockets[0].getsockname())
+            for qname in qnames:
+                query_raw = dns.message.make_query(qname, 'A').to_wire()
+                writer.write(struct.pack('!H', len(query_raw)) + query_raw)
+            responses = []
+            while True:
+                try:
+                    length = await asyncio.wait_for(reader.readexactly(2), 2)
+                except asyncio.IncompleteReadError:
+                    break
+                responses.append(dns.message.from_wire(await reader.readexactly(struct.unpack('!H', length)[0])))
+            writer.close()
+            return responses
+        finally:
+            tcp_server.close()
+
+    return asyncio.run(run())
+
+
+class FakeDatagramTransport(object):
+
+    def __init__(self):
+        self.sent = []
+
+    def sendto(self, data, addr):
+        self.sent.append(data)
+
+
+class TestAsyncProxyServer(object):
+    """
+    Test cases for AsyncProxyServer class
+    """
+
+    def test_malformed_question(self, make_config):
+        """ Test that Query with a truncated question is dropped and the server keeps answering """
+        server = make_server(make_config, {'CacheMaxEntries': 100, 'CoalesceQueries': 'yes'})
+        transport = FakeDatagramTransport()
+        # valid header with QDCOUNT=1 and ARCOUNT=1, the question name is cut off
+        malformed = struct.pack('!6H', 1234, 0x0100, 1, 0, 0, 1) + b'\x07exam'
+        query = dns.message.make_query('example.com.', 'A')
+
+        async def run():
+            server._loop = asyncio.get_running_loop()
+            for msg_raw in (malformed, query.to_wire()):
+                await server._process_client(ProtocolClient(transport, msg_raw, ('127.0.0.1', 5353)))
+
+        asyncio.run(run())
+        assert [dns.message.from_wire(bytes(msg_raw)).id for msg_raw in transport.sent] == [query.id]
+
+    def test_slow_upstream_does_not_block(self, make_config):
+        """ Test that a Query is answered while the Query sent before it still waits for the upstream """
+        server = make_server(make_config, {})
+        transport = FakeDatagramTransport()
+        forward = server._forward
+
+        async def wait_for_responses(count):
+            for _ in range(200):
+                if len(transport.sent) >= count:
+                    return
+                await asyncio.sleep(0.01)
+
+        async def run():
+            upstream_answered = asyncio.Event()
+
+            async def slow_forward(msg_raw, upstream_server, stream=False):
+                if dns.message.from_wire(bytes(msg_raw)).question[0].name.to_text() == 'slow-upstream.example.':
+                    await upstream_answered.wait()
+                return await forward(msg_raw, upstream_server, stream)
+
+            server._loop = asyncio.get_running_loop()
+            server._forward = slow_forward
+            for qname in ('slow-upstream.example.', 'fast.example.'):
+                server.handle_query(transport, dns.message.make_query(qname, 'A').to_wire(), ('127.0.0.1', 5353))
+            await wait_for_responses(1)
+            answered = [dns.message.from_wire(bytes(msg_raw)).question[0].name.to_text() for msg_raw in transport.sent]
+            upstream_answered.set()
+            await wait_for_responses(2)
+            return answered
+
+        assert asyncio.run(run()) == ['fast.example.']
+        assert len(transport.sent) == 2
+
+
+class TestStreamListener(object):
+    """
+    Test cases for StreamListener class
+    """
+
+    def test_delay_longer_than_idle_timeout(self, make_config):
+        """ Test that the idle connection is not closed before the delayed response is sent """
+        server = make_server(make_config, {'TcpIdleTimeout': 0.1})
+        responses = run_tcp_queries(server, ['slow.example.'])
+        assert [response.question[0].name.to_text() for response in responses] == ['slow.example.']
+        assert server._protocol_clients.in_use == 0
+
+    def test_delayed_response_before_max_queries_close(self, make_config):
+        """ Test that the connection reaching the limit of Queries is closed after the delayed response """
+        server = make_server(make_config, {'TcpMaxQueriesPerConnection': 2})
+        responses = run_tcp_queries(server, ['slow.example.', 'fast.example.'])
+        assert [response.question[0].name.to_text() for response in responses] == ['fast.example.', 'slow.example.']
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+
+import dns.message
+import dns.rcode
+
+from broken_dns_proxy.bench import QueryMix, BenchResult, LoadGenerator
+
+
+class EchoServer(asyncio.DatagramProtocol):
+    """
+    Fake DNS server answering every second Query with NXDOMAIN and dropping every third
+    """
+
+    def __init__(self):
+        self.transport = None
+        self.queries = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.queries += 1
+        if self.queries % 3 == 0:
+            return
+        response = dns.message.make_response(dns.message.from_wire(data))
+        if self.queries % 2 == 0:
+            response.set_rcode(dns.rcode.NXDOMAIN)
+        self.transport.sendto(response.to_wire(), addr)
+
+
+class TestQueryMix(object):
+
+    def test_from_file(self, tmp_path):
+        path = tmp_path / 'queries'
+        path.write_text('# comment\nexample.com A\n\nexample.org AAAA\nexample.net\n')
+        mix = QueryMix.from_file(str(path))
+        assert len(mix) == 3
+        questions = [dns.message.from_wire(mix.next()).question[0].to_text() for _ in range(4)]
+        assert questions == ['example.com. IN A', 'example.org. IN AAAA', 'example.net. IN A', 'example.com. IN A']
+
+    def test_synthesize(self):
+        mix = QueryMix.synthesize('example.com.', 10, QueryMix.parse_qtypes('A:1,mx:0'))
+        assert len(mix) == 20
+        for _ in range(20):
+            assert dns.message.from_wire(mix.next()).question[0].rdtype == dns.rdatatype.A
+
+
+class TestBenchResult(object):
+
+    def test_percentile(self):
+        result = BenchResult()
+        assert result.percentile(50) is None
+        response = dns.message.make_response(dns.message.make_query('example.com.', 'A')).to_wire()
+        for i in range(1000):
+            result.record(response, i / 1000.0)
+        # the latency is rounded up to the histogram bucket, less than 19% more
+        assert 0.5 <= result.percentile(50) < 0.5 * 1.19
+        assert 0.999 <= result.percentile(99.9) < 0.999 * 1.19
+        assert 'NOERROR 1000' in result.report()
+
+
+class TestLoadGenerator(object):
+
+    def test_closed_loop(self):
+        async def run():
+            loop = asyncio.get_running_loop()
+            transport, server = await loop.create_datagram_endpoint(EchoServer, local_addr=('127.0.0.1', 0))
+            port = transport.get_extra_info('sockname')[1]
+            mix = QueryMix([('example.com.', 'A')])
+            generator = LoadGenerator('127.0.0.1', port, mix, concurrency=4, duration=0, count=30, timeout=0.1,
+                                      sockets=2)
+            try:
+                return await generator.run()
+            finally:
+                transport.close()
+
+        result = asyncio.run(run())
+        assert result.sent == 30
+        assert (result.received, result.lost) == (20, 10)
+        assert result.rcodes[dns.rcode.NXDOMAIN] == 10
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import struct
+
+from broken_dns_proxy.buffer_pool import BufferPool, StreamReassembler
+
+
+def frame(msg_raw):
+    return struct.pack('!H', len(msg_raw)) + msg_raw
+
+
+def feed(reassembler, data):
+    buf = reassembler.get_buffer()
+    buf[:len(data)] = data
+    return [bytes(msg) for msg in reassembler.buffer_updated(len(data))]
+
+
+class TestBufferPool(object):
+
+    def test_reuse(self):
+        pool = BufferPool(16)
+        buf = pool.acquire()
+        assert len(buf) == 16
+        pool.release(buf)
+        assert pool.acquire() is buf
+        assert pool.allocated == 1
+        assert pool.reused == 1
+
+    def test_max_free(self):
+        pool = BufferPool(16, max_free=1)
+        buffers = [pool.acquire() for _ in range(3)]
+        for buf in buffers:
+            pool.release(buf)
+        assert len(pool) == 1
+
+
+class TestStreamReassembler(object):
+
+    def setup_method(self, method):
+        self.pool = BufferPool()
+        self.reassembler = StreamReassembler(self.pool)
+
+    def test_complete_messages(self):
+        assert feed(self.reassembler, frame(b'first') + frame(b'second')) == [b'first', b'second']
+        # nothing is pending, the buffer is back in the pool
+        assert self.reassembler.pending() == 0
+        assert len(self.pool) == 1
+
+    def test_split_message(self):
+        data = frame(b'query') + frame(b'split message')
+        assert feed(self.reassembler, data[:10]) == [b'query']
+        assert self.reassembler.pending() == 3
+        assert len(self.pool) == 0
+        assert feed(self.reassembler, data[10:12]) == []
+        assert feed(self.reassembler, data[12:]) == [b'split message']
+
+    def test_largest_message(self):
+        msg = bytes(range(256)) * 255 + b'x' * 255
+        data = frame(b'q') + frame(msg)
+        for offset in range(0, len(data), 1000):
+            messages = feed(self.reassembler, data[offset:offset + 1000])
+            if offset == 0:
+                assert messages == [b'q']
+        assert messages == [msg]
+
+    def test_max_messages(self):
+        data = frame(b'a') + frame(b'b') + frame(b'c')
+        buf = self.reassembler.get_buffer()
+        buf[:len(data)] = data
+        assert [bytes(msg) for msg in self.reassembler.buffer_updated(len(data), 2)] == [b'a', b'b']
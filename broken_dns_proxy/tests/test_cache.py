@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import dns.flags
+import dns.message
+import dns.name
+import dns.rcode
+import dns.rrset
+
+from broken_dns_proxy.cache import ResponseCache
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_response(qname, ttl=300, want_dnssec=False):
+    query = dns.message.make_query(qname, 'A', want_dnssec=want_dnssec)
+    response = dns.message.make_response(query)
+    response.answer.append(dns.rrset.from_text(qname, ttl, 'IN', 'A', '192.0.2.1'))
+    return query.to_wire(), response.to_wire()
+
+
+class TestResponseCache(object):
+    """
+    Test cases for ResponseCache class
+    """
+
+    def test_hit_decreases_ttl(self):
+        """ Test that cached response is returned with ID of the Query and decreased TTL """
+        clock = FakeClock()
+        cache = ResponseCache(10, clock=clock)
+        query, response = make_response('example.com.')
+
+        assert cache.get(query) is None
+        cache.put(query, response)
+        clock.now += 100
+        query = dns.message.from_wire(query)
+        query.id = 4321
+        query.question[0].name = dns.name.from_text('EXAMPLE.com.')
+        cached = dns.message.from_wire(bytes(cache.get(query.to_wire())))
+
+        assert cached.id == 4321
+        assert str(cached.question[0].name) == 'EXAMPLE.com.'
+        assert cached.answer[0].ttl == 200
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    def test_expiration(self):
+        """ Test that response is not returned after its TTL elapsed """
+        clock = FakeClock()
+        cache = ResponseCache(10, clock=clock)
+        query, response = make_response('example.com.', ttl=30)
+        cache.put(query, response)
+        clock.now += 30
+
+        assert cache.get(query) is None
+        assert cache.expirations == 1
+        assert len(cache) == 0
+
+    def test_key_includes_do_bit(self):
+        """ Test that Queries differing in DO bit don't share the cache entry """
+        cache = ResponseCache(10)
+        query, response = make_response('example.com.')
+        cache.put(query, response)
+        dnssec_query, _ = make_response('example.com.', want_dnssec=True)
+
+        assert cache.get(dnssec_query) is None
+        assert cache.get(query) is not None
+
+    def test_key_includes_transport(self):
+        """ Test that response cached for TCP client is not served to UDP client and vice versa """
+        cache = ResponseCache(10)
+        query, response = make_response('example.com.')
+        cache.put(query, response, stream=True)
+
+        assert cache.get(query) is None
+        assert cache.get(query, stream=True, max_udp_payload=1232) is not None
+
+    def test_key_includes_udp_payload(self):
+        """ Test that UDP clients receiving different sizes don't share the cache entry """
+        cache = ResponseCache(10)
+        query, response = make_response('example.com.')
+        cache.put(query, response, max_udp_payload=4096)
+
+        assert cache.get(query) is None
+        assert cache.get(query, max_udp_payload=4096) is not None
+
+    def test_malformed_question_not_cached(self):
+        """ Test that Query with truncated question name has no key """
+        query, _ = make_response('example.com.')
+        assert ResponseCache.key(query[:16]) is None
+
+    def test_lru_eviction(self):
+        """ Test that the least recently used response is evicted """
+        cache = ResponseCache(2)
+        queries = []
+        for name in ('a.example.', 'b.example.', 'c.example.'):
+            query, response = make_response(name)
+            queries.append(query)
+            cache.put(query, response)
+            if name == 'b.example.':
+                # make 'a' recently used
+                assert cache.get(queries[0]) is not None
+
+        assert cache.get(queries[0]) is not None
+        assert cache.get(queries[1]) is None
+        assert cache.evictions == 1
+
+    def test_servfail_not_cached(self):
+        """ Test that SERVFAIL responses are not cached """
+        cache = ResponseCache(10)
+        query, response = make_response('example.com.')
+        response = dns.message.from_wire(response)
+        response.set_rcode(dns.rcode.SERVFAIL)
+        cache.put(query, response.to_wire())
+
+        assert len(cache) == 0
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import socket
+
+import dns.message
+import pytest
+
+from broken_dns_proxy.client import Client, ClientPool
+from broken_dns_proxy.exceptions import BrokenDNSProxyError
+from broken_dns_proxy.udp_batch import BatchClient
+
+
+ADDR = ('192.0.2.1', 5353)
+
+
+class TestClient(object):
+
+    def setup_method(self, method):
+        self.query = dns.message.make_query('example.com', 'A')
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.client.settimeout(2)
+
+    def teardown_method(self, method):
+        self.server.close()
+        self.client.close()
+
+    def test_record_has_no_dict(self):
+        self.client.sendto(self.query.to_wire(), self.server.getsockname())
+        client = Client(self.server, bytearray(2**16), 1.5)
+        assert not hasattr(client, '__dict__')
+        assert client.query_id == self.query.id
+        assert client.received == 1.5
+        assert client.client_addr()[1] == self.client.getsockname()[1]
+
+    def test_response_id(self):
+        self.client.sendto(self.query.to_wire(), self.server.getsockname())
+        client = Client(self.server)
+        client.send_raw(dns.message.make_response(dns.message.make_query('example.com', 'A')).to_wire())
+        assert dns.message.from_wire(self.client.recv(2**16)).id == self.query.id
+
+
+class TestClientPool(object):
+
+    def setup_method(self, method):
+        self.query = dns.message.make_query('example.com', 'A').to_wire()
+        self.outbox = []
+        self.pool = ClientPool(BatchClient)
+
+    def test_records_are_reused(self):
+        client = self.pool.acquire(self.query, ADDR, self.outbox, 1.0)
+        assert self.pool.in_use == 1
+        self.pool.release(client)
+        assert self.pool.in_use == 0
+        # the released record doesn't keep the Query alive
+        assert client.msg_raw() is None
+        assert self.pool.acquire(self.query, ADDR, self.outbox, 2.0) is client
+        assert client.received == 2.0
+        assert (self.pool.allocated, self.pool.reused) == (1, 1)
+
+    def test_malformed_query(self):
+        response = dns.message.make_response(dns.message.make_query('example.com', 'A')).to_wire()
+        with pytest.raises(BrokenDNSProxyError):
+            self.pool.acquire(response, ADDR, self.outbox)
+        assert self.pool.in_use == 0
+        assert len(self.pool) == 1
+
+    def test_detached_record(self):
+        """ Test that the record waiting for the delayed response is released only after it is sent """
+        client = self.pool.acquire(self.query, ADDR, self.outbox)
+        client.detach()
+        self.pool.release(client)
+        assert self.pool.in_use == 1
+        assert len(self.pool) == 0
+        client.send_raw(self.query)
+        self.pool.release(client)
+        assert self.pool.in_use == 0
+        assert self.outbox == [(self.query, ADDR)]
+
+    def test_max_free(self):
+        pool = ClientPool(BatchClient, max_free=1)
+        clients = [pool.acquire(self.query, ADDR, self.outbox) for _ in range(3)]
+        for client in clients:
+            pool.release(client)
+        assert len(pool) == 1
+
+    def test_record_size(self):
+        # the record is a few pointers, the Query and the address are referenced only
+        assert 0 < self.pool.record_size() <= 128
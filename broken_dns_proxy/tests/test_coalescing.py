@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+
+import dns.message
+import dns.rcode
+
+from broken_dns_proxy.coalescing import InflightQueries
+
+
+def make_query(qname='example.com.', rdtype='A'):
+    return dns.message.make_query(qname, rdtype).to_wire()
+
+
+class TestInflightQueries(object):
+
+    def test_key(self):
+        query = make_query()
+        assert InflightQueries.key(query, False, 512) == InflightQueries.key(make_query('EXAMPLE.com.'), False, 512)
+        assert InflightQueries.key(query, False, 512) != InflightQueries.key(make_query(rdtype='AAAA'), False, 512)
+        assert InflightQueries.key(query, False, 512) != InflightQueries.key(query, True, 512)
+        assert InflightQueries.key(query, False, 512) != InflightQueries.key(query, False, 1232)
+        assert InflightQueries.key(query, True, 512) == InflightQueries.key(query, True, 1232)
+
+    def test_coalesce(self):
+        inflight = InflightQueries()
+        upstream_queries = []
+
+        async def resolver(msg_raw):
+            upstream_queries.append(msg_raw)
+            await asyncio.sleep(0.01)
+            response = dns.message.make_response(dns.message.from_wire(msg_raw))
+            response.set_rcode(dns.rcode.NXDOMAIN)
+            return response.to_wire()
+
+        async def resolve(msg_raw):
+            key = inflight.key(msg_raw, False, 512)
+            return await inflight.resolve(msg_raw, key, lambda: resolver(msg_raw))
+
+        async def run():
+            queries = [make_query(), make_query('EXAMPLE.com.'), make_query()]
+            return queries, await asyncio.gather(*[resolve(query) for query in queries])
+
+        queries, responses = asyncio.run(run())
+        assert len(upstream_queries) == 1
+        assert (inflight.forwarded, inflight.coalesced, len(inflight)) == (1, 2, 0)
+        for query, response in zip(queries, responses):
+            assert dns.message.from_wire(bytes(response)).question == dns.message.from_wire(query).question
+        # case of the name is kept for every client
+        assert b'EXAMPLE' in responses[1]
+
+    def test_failure(self):
+        inflight = InflightQueries()
+
+        async def resolver():
+            await asyncio.sleep(0.01)
+            raise ConnectionResetError()
+
+        async def run():
+            key = inflight.key(make_query(), False, 512)
+            return await asyncio.gather(*[inflight.resolve(make_query(), key, resolver) for _ in range(3)],
+                                        return_exceptions=True)
+
+        results = asyncio.run(run())
+        assert all(isinstance(result, ConnectionResetError) for result in results)
+        assert len(inflight) == 0
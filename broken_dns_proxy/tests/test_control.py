@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import socket
+
+import dns.flags
+import dns.message
+import pytest
+
+from broken_dns_proxy.arguments_parser import ArgumentsParser
+from broken_dns_proxy.config import BrokenDnsProxyConfiguration
+from broken_dns_proxy.control import ControlServer, parse_control_address, send_command
+from broken_dns_proxy.exceptions import BrokenDNSProxyError
+from broken_dns_proxy.proxy_server import ProxyServer
+
+CONFIG = """
+[Proxy]
+UpstreamServers = 127.0.0.1@5300
+Modifiers = FlagsModifier
+[FlagsModifier]
+RA = no
+"""
+
+OTHER_CONFIG = """
+[Proxy]
+UpstreamServers = 127.0.0.1@5300
+Chains = zone
+[Chain:zone]
+Modifiers = FlagsModifier:ZoneFlags
+Names = example.com
+[ZoneFlags]
+AA = yes
+"""
+
+
+def response_flags(server, qname):
+    query = dns.message.make_query(qname, 'A')
+    response = dns.message.make_response(query)
+    response.flags |= dns.flags.RA
+    response_raw = response.to_wire()
+    response_raw = server._chains.select(query.to_wire()).plan(response_raw)
+    return dns.message.from_wire(bytes(response_raw)).flags
+
+
+class TestParseControlAddress(object):
+
+    def test_unix_socket(self):
+        assert parse_control_address('/run/bdp.sock') == (socket.AF_UNIX, '/run/bdp.sock')
+        assert parse_control_address('/run/bdp.sock', 2) == (socket.AF_UNIX, '/run/bdp.sock.2')
+
+    def test_loopback(self):
+        assert parse_control_address('127.0.0.1@5380', 1) == (socket.AF_INET, ('127.0.0.1', 5381))
+        assert parse_control_address('::1@5380') == (socket.AF_INET6, ('::1', 5380))
+
+    def test_missing_port(self):
+        with pytest.raises(BrokenDNSProxyError):
+            parse_control_address('127.0.0.1')
+
+
+class TestReload(object):
+
+    def setup_method(self, method):
+        self.cfg_file = None
+
+    def make_server(self, tmp_path):
+        self.cfg_file = tmp_path / 'config'
+        self.cfg_file.write_text(CONFIG)
+        return ProxyServer(BrokenDnsProxyConfiguration(ArgumentsParser(['-c', str(self.cfg_file)])))
+
+    def test_reload(self, tmp_path):
+        server = self.make_server(tmp_path)
+        assert not response_flags(server, 'example.com.') & dns.flags.RA
+
+        self.cfg_file.write_text(OTHER_CONFIG)
+        server.reload()
+        assert server.chains_generation == 1
+        assert response_flags(server, 'example.com.') & dns.flags.AA
+        assert response_flags(server, 'example.org.') & dns.flags.RA
+        assert not response_flags(server, 'example.org.') & dns.flags.AA
+        assert 'chains=default,zone' in server.status()
+
+    def test_reload_other_file(self, tmp_path):
+        server = self.make_server(tmp_path)
+        other_file = tmp_path / 'other'
+        other_file.write_text(OTHER_CONFIG)
+        server.reload(str(other_file))
+        assert response_flags(server, 'example.com.') & dns.flags.AA
+
+    def test_wrong_configuration_keeps_chains(self, tmp_path):
+        server = self.make_server(tmp_path)
+        chains = server._chains
+        self.cfg_file.write_text('[Proxy]\nChains = missing\n')
+        with pytest.raises(BrokenDNSProxyError):
+            server.reload()
+        with pytest.raises(BrokenDNSProxyError):
+            server.reload(str(tmp_path / 'does-not-exist'))
+        assert server._chains is chains
+        assert server.chains_generation == 0
+
+    def test_control_socket(self, tmp_path):
+        server = self.make_server(tmp_path)
+        path = str(tmp_path / 'control.sock')
+        control = ControlServer(server, socket.AF_UNIX, path)
+        control.start()
+        try:
+            assert send_command(socket.AF_UNIX, path, 'status').startswith('OK generation=0')
+            self.cfg_file.write_text(OTHER_CONFIG)
+            assert send_command(socket.AF_UNIX, path, 'reload').startswith('OK reloaded')
+            assert send_command(socket.AF_UNIX, path, 'status').startswith('OK generation=1')
+            assert send_command(socket.AF_UNIX, path, 'reload /does/not/exist').startswith('ERROR')
+            assert send_command(socket.AF_UNIX, path, 'restart').startswith('ERROR')
+        finally:
+            control.stop()
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import logging
+
+import dns.message
+
+from broken_dns_proxy.logger import LoggerHelper, LazyMessageDump, MessageDumpSampler
+
+
+def make_logger(name, handler_level):
+    logger = LoggerHelper.get_basic_logger(name)
+    logger.propagate = False
+    handler = logging.NullHandler()
+    handler.setLevel(handler_level)
+    logger.addHandler(handler)
+    return logger
+
+
+def query(qname):
+    return dns.message.make_query(qname, 'A').to_wire()
+
+
+class TestMessageDumps(object):
+    """
+    Test cases for lazy and sampled DNS message dumps
+    """
+
+    def test_lazy_dump_rendered_once(self):
+        """ Test that the message is rendered on first use only """
+        dump = LazyMessageDump(query('example.com.'))
+        assert dump._text is None
+        assert 'example.com. IN A' in str(dump)
+        assert str(dump) is str(dump)
+
+    def test_no_dumps_without_debug_handler(self):
+        """ Test that nothing is sampled if no handler emits debug messages """
+        sampler = MessageDumpSampler(make_logger('test-dumps-info', logging.INFO))
+        assert not sampler.sample(query('example.com.'))
+
+    def test_sampling_and_names(self):
+        """ Test that only every N-th Query for the configured names is dumped """
+        sampler = MessageDumpSampler(make_logger('test-dumps-debug', logging.DEBUG), 2, ['Example.com'])
+        assert not sampler.sample(query('badexample.com.'))
+        assert not sampler.sample(query('www.example.com.'))
+        assert sampler.sample(query('example.com.'))
+        assert not sampler.sample(query('example.org.'))
+        assert not sampler.sample(query('a.example.com.'))
+        assert sampler.sample(query('b.EXAMPLE.com.'))
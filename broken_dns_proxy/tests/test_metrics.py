@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import urllib.request
+
+import dns.message
+import dns.rcode
+
+from broken_dns_proxy.metrics import Histogram, ProxyMetrics, MetricsServer, LATENCY_BUCKETS
+from broken_dns_proxy.modifiers import ModificationChain
+
+
+def make_response(rcode):
+    response = dns.message.make_response(dns.message.make_query('example.com.', 'A'))
+    response.set_rcode(rcode)
+    return response.to_wire()
+
+
+class TestHistogram(object):
+
+    def test_buckets(self):
+        assert LATENCY_BUCKETS[0] == 1e-6
+        assert LATENCY_BUCKETS[-1] >= 60.0
+        assert all(lower < upper for lower, upper in zip(LATENCY_BUCKETS, LATENCY_BUCKETS[1:]))
+
+    def test_percentile(self):
+        histogram = Histogram([1, 2, 4, 8])
+        assert histogram.percentile(50) is None
+        for value in (0.5, 1.5, 1.5, 3, 100):
+            histogram.observe(value)
+        assert histogram.count == 5
+        assert histogram.sum == 106.5
+        assert histogram.percentile(50) == 2
+        assert histogram.percentile(100) == float('inf')
+
+    def test_samples(self):
+        histogram = Histogram([1, 2])
+        histogram.observe(0.5)
+        histogram.observe(5)
+        assert histogram.samples('latency', (('upstream', 'a'),)) == [
+            'latency_bucket{upstream="a",le="1"} 1',
+            'latency_bucket{upstream="a",le="2"} 1',
+            'latency_bucket{upstream="a",le="+Inf"} 2',
+            'latency_sum{upstream="a"} 5.5',
+            'latency_count{upstream="a"} 2',
+        ]
+
+
+class TestProxyMetrics(object):
+
+    def test_render(self):
+        metrics = ProxyMetrics(['8.8.8.8'], ['FlagsModifier'])
+        metrics.count_response(False, make_response(dns.rcode.NOERROR))
+        metrics.count_response(False, make_response(dns.rcode.NOERROR))
+        metrics.count_response(True, make_response(dns.rcode.NXDOMAIN))
+        metrics.modified['FlagsModifier'] = 3
+        metrics.observe_upstream('8.8.8.8', 0.01)
+        # unknown upstream servers are ignored
+        metrics.observe_upstream('1.1.1.1', 0.01)
+        metrics.add_collector(lambda: [('bdp_test', 'gauge', 'Test.', [((), 1.5)])])
+
+        text = metrics.render()
+        assert 'bdp_responses_total{transport="udp",rcode="NOERROR"} 2\n' in text
+        assert 'bdp_responses_total{transport="tcp",rcode="NXDOMAIN"} 1\n' in text
+        assert 'bdp_modified_responses_total{modifier="FlagsModifier"} 3\n' in text
+        assert 'bdp_upstream_rtt_seconds_count{upstream="8.8.8.8"} 1\n' in text
+        assert '1.1.1.1' not in text
+        assert '# TYPE bdp_test gauge\nbdp_test 1.5\n' in text
+
+    def test_modified_by_selected_chain(self):
+        metrics = ProxyMetrics([], ['FlagsModifier', 'DelayModifier'])
+        chain = ModificationChain(None, [])
+        chain.active_modifiers = ['FlagsModifier']
+        metrics.count_modified(chain)
+        metrics.count_modified(chain)
+
+        text = metrics.render()
+        assert 'bdp_modified_responses_total{modifier="FlagsModifier"} 2\n' in text
+        assert 'bdp_modified_responses_total{modifier="DelayModifier"} 0\n' in text
+
+        # counters are kept when the chains are replaced
+        metrics.set_modifiers(['DelayModifier', 'FlagsModifier'])
+        assert 'bdp_modified_responses_total{modifier="FlagsModifier"} 2\n' in metrics.render()
+
+    def test_http(self):
+        metrics = ProxyMetrics([])
+        metrics.count_response(False, make_response(dns.rcode.NOERROR))
+        server = MetricsServer(metrics, '127.0.0.1', 0)
+        server.start()
+        try:
+            with urllib.request.urlopen('http://127.0.0.1:{0}/metrics'.format(server.port), timeout=5) as response:
+                assert response.status == 200
+                assert response.read().decode('utf-8') == metrics.render()
+        finally:
+            server.stop()
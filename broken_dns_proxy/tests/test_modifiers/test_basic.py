@@ -18,7 +18,24 @@
 #
 # Authors:
 
-from broken_dns_proxy.modifiers import is_modifier, FlagsModifier
+import importlib.metadata
+
+import pytest
+
+from broken_dns_proxy.exceptions import BrokenDNSProxyError
+from broken_dns_proxy.modifiers import is_modifier, get_modifier_by_name, BaseModifier, FlagsModifier, \
+    ENTRY_POINT_GROUP
+from broken_dns_proxy.modifiers import modifiers as registry
+
+
+class EntryPointModifier(BaseModifier):
+    """ Modifier of another package, not registered when imported """
+
+    CONFIG_SECTION_NAME = 'EntryPointModifier'
+
+
+def _entry_point(name, value):
+    return importlib.metadata.EntryPoint(name, value, ENTRY_POINT_GROUP)
 
 
 class TestModifiersBasic(object):
@@ -26,3 +43,34 @@ class TestModifiersBasic(object):
     def test_modifiers_registration(self):
         """ Test that modifiers are registered successfully """
         assert is_modifier(FlagsModifier.config_section_name())
+
+    def test_builtin_modifier_by_name(self):
+        """ Test that the built-in modifiers are found with any case of the name """
+        assert get_modifier_by_name('dnssecmodifier').config_section_name() == 'DnssecModifier'
+        assert get_modifier_by_name('DELAYMODIFIER').config_section_name() == 'DelayModifier'
+
+    def test_unknown_modifier(self, monkeypatch):
+        monkeypatch.setattr(registry, '_find_entry_point', lambda name: None)
+        assert get_modifier_by_name('NoSuchModifier') is None
+        assert not is_modifier('NoSuchModifier')
+
+    def test_entry_point_modifier(self, monkeypatch):
+        """ Test that modifiers of other packages are loaded from their entry points """
+        # don't leave the modifier registered for other tests
+        monkeypatch.setattr(registry, 'modifiers', dict(registry.modifiers))
+        monkeypatch.setattr(registry, '_find_entry_point', lambda name: _entry_point(
+            'EntryPointModifier', 'broken_dns_proxy.tests.test_modifiers.test_basic:EntryPointModifier'))
+        assert get_modifier_by_name('EntryPointModifier') is EntryPointModifier
+        assert registry.modifiers['entrypointmodifier'] is EntryPointModifier
+
+    def test_entry_point_wrong_name(self, monkeypatch):
+        monkeypatch.setattr(registry, '_find_entry_point', lambda name: _entry_point(
+            'OtherModifier', 'broken_dns_proxy.tests.test_modifiers.test_basic:EntryPointModifier'))
+        with pytest.raises(BrokenDNSProxyError):
+            get_modifier_by_name('OtherModifier')
+
+    def test_entry_point_missing_module(self, monkeypatch):
+        monkeypatch.setattr(registry, '_find_entry_point', lambda name: _entry_point(
+            'MissingModifier', 'broken_dns_proxy.no_such_module:MissingModifier'))
+        with pytest.raises(BrokenDNSProxyError):
+            get_modifier_by_name('MissingModifier')
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import ipaddress
+
+import dns.flags
+import dns.message
+import dns.name
+
+from broken_dns_proxy.modifiers import ChainSelector
+from broken_dns_proxy.modifiers.chain_selector import NameTrie, PrefixTree, wire_labels
+
+CONFIG = """
+[Proxy]
+Modifiers = FlagsModifier
+Chains = zone dnskey clients
+[FlagsModifier]
+RA = no
+[Chain:zone]
+Modifiers = FlagsModifier:ZoneFlags
+Names = broken.test example.org
+[ZoneFlags]
+AA = yes
+[Chain:dnskey]
+Modifiers = FlagsModifier:NoAd
+Names = example.com
+Types = DNSKEY DS
+[NoAd]
+AD = no
+[Chain:clients]
+Names = example.com
+Clients = 10.0.0.0/8 2001:db8::/32
+"""
+
+
+def make_selector(make_config, config=CONFIG):
+    return ChainSelector(make_config(config))
+
+
+def select(selector, qname, rdtype='A', client_addr=('192.0.2.1', 53)):
+    return selector.select(dns.message.make_query(qname, rdtype).to_wire(), client_addr).name
+
+
+class TestNameTrie(object):
+
+    def test_wire_labels(self):
+        assert wire_labels(dns.name.from_text('www.example.com.').to_wire()) == [b'www', b'example', b'com']
+        assert wire_labels(b'\x00') == []
+
+    def test_suffix_match(self):
+        trie = NameTrie()
+        trie.add(dns.name.from_text('example.com.').to_wire(), 1)
+        trie.add(dns.name.from_text('www.example.com.').to_wire(), 2)
+        trie.add(dns.name.from_text('.').to_wire(), 4)
+        assert trie.match(dns.name.from_text('a.www.example.com.').to_wire()) == 7
+        assert trie.match(dns.name.from_text('example.com.').to_wire()) == 5
+        assert trie.match(dns.name.from_text('badexample.com.').to_wire()) == 4
+
+
+class TestPrefixTree(object):
+
+    def test_prefix_match(self):
+        tree = PrefixTree(32)
+        tree.add(ipaddress.ip_network('10.0.0.0/8'), 1)
+        tree.add(ipaddress.ip_network('10.1.0.0/16'), 2)
+        tree.add(ipaddress.ip_network('0.0.0.0/0'), 4)
+        assert tree.match(int(ipaddress.ip_address('10.1.2.3'))) == 7
+        assert tree.match(int(ipaddress.ip_address('10.2.2.3'))) == 5
+        assert tree.match(int(ipaddress.ip_address('11.0.0.1'))) == 4
+
+
+class TestChainSelector(object):
+
+    def test_select(self, make_config):
+        selector = make_selector(make_config)
+        assert select(selector, 'www.broken.test.') == 'zone'
+        assert select(selector, 'example.org.', 'DNSKEY') == 'zone'
+        assert select(selector, 'example.com.', 'DNSKEY') == 'dnskey'
+        assert select(selector, 'example.com.', 'A') == 'default'
+        assert select(selector, 'example.com.', 'A', ('10.1.2.3', 53)) == 'clients'
+        assert select(selector, 'example.com.', 'A', ('::ffff:10.1.2.3', 53, 0, 0)) == 'clients'
+        assert select(selector, 'example.com.', 'A', ('2001:db8::1', 53, 0, 0)) == 'clients'
+        assert select(selector, 'example.net.', 'A', ('10.1.2.3', 53)) == 'default'
+
+    def test_chain_modifiers(self, make_config):
+        selector = make_selector(make_config)
+        query = dns.message.make_query('www.broken.test.', 'A')
+        response = dns.message.make_response(query)
+        response.flags |= dns.flags.RA | dns.flags.AD
+        response_raw = response.to_wire()
+
+        modified = dns.message.from_wire(bytes(selector.select(query.to_wire()).plan(response_raw)))
+        assert modified.flags & dns.flags.AA
+        assert modified.flags & dns.flags.RA
+        modified = dns.message.from_wire(bytes(selector.default.plan(response_raw)))
+        assert not modified.flags & dns.flags.AA
+        assert not modified.flags & dns.flags.RA
+        assert selector.active_modifiers == ['FlagsModifier']
+
+    def test_many_rules(self, make_config):
+        chains = ['c{0}'.format(i) for i in range(200)]
+        config = '[Proxy]\nChains = {0}\n'.format(' '.join(chains)) + ''.join(
+            '[Chain:{0}]\nNames = {0}.example.com\nClients = 10.{1}.0.0/16\n'.format(chain, i)
+            for i, chain in enumerate(chains))
+        selector = make_selector(make_config, config)
+        assert select(selector, 'www.c150.example.com.', 'A', ('10.150.0.1', 53)) == 'c150'
+        assert select(selector, 'www.c150.example.com.', 'A', ('10.151.0.1', 53)) == 'default'
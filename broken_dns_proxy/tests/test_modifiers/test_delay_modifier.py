@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import dns.flags
+import dns.message
+import pytest
+
+from broken_dns_proxy.exceptions import BrokenDNSProxyError
+from broken_dns_proxy.modifiers import ModificationChain, ParseDepth
+
+
+def make_chain(make_config, options, modifiers='DelayModifier'):
+    return ModificationChain(make_config('[Proxy]\nModifiers = {0}\n[DelayModifier]\n'.format(modifiers), options))
+
+
+class TestDelayModifier(object):
+    """
+    Test cases for DelayModifier
+    """
+
+    def test_no_delay_is_dropped(self, make_config):
+        """ Test that the modifier without delay does nothing """
+        chain = make_chain(make_config, {})
+        assert chain.active_modifiers == []
+        assert not chain.plan.delays
+        assert chain.plan.sample_delay() == 0
+
+    def test_fixed_delay(self, make_config):
+        """ Test that the delay doesn't touch the message """
+        chain = make_chain(make_config, {'Delay': '0.25'})
+        assert chain.parse_depth == ParseDepth.NONE
+        assert chain.plan.sample_delay() == 0.25
+        response_raw = dns.message.make_response(dns.message.make_query('example.com.', 'A')).to_wire()
+        assert chain.plan(response_raw) == response_raw
+
+    def test_delay_with_flags(self, make_config):
+        """ Test that the delay is combined with other modifiers """
+        chain = make_chain(make_config, {'Delay': '0.1'}, 'DelayModifier FlagsModifier\n[FlagsModifier]\nAA = yes')
+        assert chain.parse_depth == ParseDepth.HEADER
+        assert chain.plan.sample_delay() == 0.1
+        response_raw = dns.message.make_response(dns.message.make_query('example.com.', 'A')).to_wire()
+        assert dns.message.from_wire(bytes(chain.plan(response_raw))).flags & dns.flags.AA
+
+    @pytest.mark.parametrize('distribution', ['uniform', 'normal', 'exponential'])
+    def test_distributions(self, make_config, distribution):
+        """ Test that the sampled delays are never negative nor above the limit """
+        chain = make_chain(make_config, {'Distribution': distribution, 'Delay': '0.1', 'Jitter': '0.2',
+                                      'MaxDelay': '0.15'})
+        delays = [chain.plan.sample_delay() for _ in range(1000)]
+        assert min(delays) >= 0
+        assert max(delays) <= 0.15
+        assert len(set(delays)) > 1
+
+    def test_wrong_configuration(self, make_config):
+        """ Test that wrong distribution and negative delays are refused """
+        with pytest.raises(BrokenDNSProxyError):
+            make_chain(make_config, {'Distribution': 'pareto', 'Delay': '1'})
+        with pytest.raises(BrokenDNSProxyError):
+            make_chain(make_config, {'Delay': '-1'})
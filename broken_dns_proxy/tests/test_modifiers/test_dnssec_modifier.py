@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import dns.message
+import dns.rdatatype
+import dns.rrset
+import pytest
+
+from broken_dns_proxy import wire
+from broken_dns_proxy.exceptions import BrokenDNSProxyError
+from broken_dns_proxy.modifiers import ModificationChain, ParseDepth
+
+
+SIGNATURE = '{0} 13 3 300 20300101000000 20200101000000 12345 Example.COM. ' + 'c2lnbmF0dXJl' * 8
+
+
+def make_chain(make_config, options, modifiers='DnssecModifier'):
+    return ModificationChain(make_config('[Proxy]\nModifiers = {0}\n[DnssecModifier]\n'.format(modifiers), options))
+
+
+def make_signed_response():
+    query = dns.message.make_query('www.example.com.', 'A', want_dnssec=True)
+    query.id = 4321
+    response = dns.message.make_response(query)
+    response.answer.append(dns.rrset.from_text('www.example.com.', 300, 'IN', 'CNAME', 'web.example.com.'))
+    response.answer.append(dns.rrset.from_text('www.example.com.', 300, 'IN', 'RRSIG', SIGNATURE.format('CNAME')))
+    response.answer.append(dns.rrset.from_text('web.example.com.', 300, 'IN', 'A', '192.0.2.1'))
+    response.answer.append(dns.rrset.from_text('web.example.com.', 300, 'IN', 'RRSIG', SIGNATURE.format('A')))
+    # names of the following records are compressed against the removed NSEC
+    response.authority.append(dns.rrset.from_text('nsec.example.com.', 300, 'IN', 'NSEC',
+                                                  'z.nsec.example.com. A RRSIG NSEC'))
+    response.authority.append(dns.rrset.from_text('nsec.example.com.', 300, 'IN', 'RRSIG', SIGNATURE.format('NSEC')))
+    response.authority.append(dns.rrset.from_text('example.com.', 300, 'IN', 'NS', 'ns.nsec.example.com.'))
+    response.authority.append(dns.rrset.from_text('example.com.', 300, 'IN', 'SOA',
+                                                  'ns.nsec.example.com. admin.nsec.example.com. 1 2 3 4 5'))
+    response.additional.append(dns.rrset.from_text('ns.nsec.example.com.', 300, 'IN', 'A', '192.0.2.53'))
+    response.additional.append(dns.rrset.from_text('example.com.', 300, 'IN', 'DNSKEY',
+                                                   '257 3 13 a2V5a2V5a2V5a2V5a2V5a2V5a2V5a2V5a2V5a2V5'))
+    return response
+
+
+def types(rrsets):
+    return [dns.rdatatype.to_text(rrset.rdtype) for rrset in rrsets]
+
+
+class TestRemoveRecords(object):
+
+    def test_compression_pointers(self):
+        """ Test that names pointing into removed records are still valid """
+        response_raw = make_signed_response().to_wire()
+        removed = [rr for rr in wire.iter_records(response_raw) if rr.rdtype == dns.rdatatype.NSEC]
+        modified = dns.message.from_wire(bytes(wire.remove_records(response_raw, removed)))
+        expected = make_signed_response()
+        del expected.authority[0]
+        assert modified == expected
+        assert str(modified.authority[2][0].mname) == 'ns.nsec.example.com.'
+
+    def test_nothing_removed(self):
+        response_raw = make_signed_response().to_wire()
+        assert wire.remove_records(response_raw, []) == response_raw
+
+
+class TestDnssecModifier(object):
+    """
+    Test cases for DnssecModifier
+    """
+
+    def test_nothing_to_do(self, make_config):
+        """ Test that the modifier without types does nothing """
+        chain = make_chain(make_config, {})
+        assert chain.active_modifiers == []
+        assert chain.parse_depth == ParseDepth.NONE
+
+    def test_strip(self, make_config):
+        """ Test that the records are removed on the wire as from the parsed message """
+        chain = make_chain(make_config, {'Strip': 'RRSIG NSEC'})
+        assert chain.parse_depth == ParseDepth.RECORDS
+        response_raw = make_signed_response().to_wire()
+        modified = dns.message.from_wire(bytes(chain.plan(response_raw)))
+        assert types(modified.answer) == ['CNAME', 'A']
+        assert types(modified.authority) == ['NS', 'SOA']
+        assert types(modified.additional) == ['A', 'DNSKEY']
+        assert modified.edns == 0
+        assert modified == chain.run_modifiers(dns.message.from_wire(response_raw))
+
+    def test_strip_in_section(self, make_config):
+        """ Test that only the selected sections are modified """
+        chain = make_chain(make_config, {'Strip': 'RRSIG DNSKEY', 'Sections': 'authority additional'})
+        modified = dns.message.from_wire(bytes(chain.plan(make_signed_response().to_wire())))
+        assert types(modified.answer) == ['CNAME', 'RRSIG', 'A', 'RRSIG']
+        assert types(modified.authority) == ['NSEC', 'NS', 'SOA']
+        assert types(modified.additional) == ['A']
+
+    def test_corrupt(self, make_config):
+        """ Test that the signatures are broken on the wire as in the parsed message """
+        chain = make_chain(make_config, {'Corrupt': 'RRSIG DNSKEY', 'Sections': 'answer additional'})
+        response = make_signed_response()
+        response_raw = response.to_wire()
+        modified_raw = chain.plan(response_raw)
+        assert len(modified_raw) == len(response_raw)
+        modified = dns.message.from_wire(bytes(modified_raw))
+        assert modified.answer[1][0].signature != response.answer[1][0].signature
+        assert modified.answer[1][0].signature[:-1] == response.answer[1][0].signature[:-1]
+        assert modified.authority == response.authority
+        assert modified.additional[1][0].key != response.additional[1][0].key
+        assert modified == chain.run_modifiers(dns.message.from_wire(response_raw))
+
+    def test_fused_with_full_modifier(self, make_config):
+        """ Test that two modifiers for the same sections are done in one walk """
+        chain = make_chain(make_config, {'Strip': 'NSEC'},
+                           'DnssecModifier DnssecModifier:Signatures\n[Signatures]\nCorrupt = RRSIG\n')
+        assert len(chain.plan.operations) == 1
+        modified = dns.message.from_wire(bytes(chain.plan(make_signed_response().to_wire())))
+        assert types(modified.authority) == ['RRSIG', 'NS', 'SOA']
+
+    def test_wrong_configuration(self, make_config):
+        """ Test that unknown types and sections are refused """
+        with pytest.raises(BrokenDNSProxyError):
+            make_chain(make_config, {'Strip': 'NOTATYPE'})
+        with pytest.raises(BrokenDNSProxyError):
+            make_chain(make_config, {'Strip': 'OPT'})
+        with pytest.raises(BrokenDNSProxyError):
+            make_chain(make_config, {'Strip': 'RRSIG', 'Sections': 'question'})
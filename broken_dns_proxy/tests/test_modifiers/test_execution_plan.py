@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import dns.flags
+import dns.message
+
+from broken_dns_proxy.modifiers import ExecutionPlan, ParseDepth
+from broken_dns_proxy.modifiers.operations import HeaderFlagsOperation, EdnsFlagsOperation
+
+
+class TestExecutionPlan(object):
+    """
+    Test cases for compiling operations into ExecutionPlan
+    """
+
+    def test_empty_plan_relays_message(self):
+        """ Test that plan without operations returns the very same message """
+        plan = ExecutionPlan([HeaderFlagsOperation(), EdnsFlagsOperation()])
+        msg_raw = dns.message.make_query('example.com.', 'A').to_wire()
+
+        assert plan.operations == []
+        assert plan.depth == ParseDepth.NONE
+        assert plan(msg_raw) is msg_raw
+
+    def test_header_operations_fused(self):
+        """ Test that neighbouring header flag edits are fused, the later one taking precedence """
+        plan = ExecutionPlan([HeaderFlagsOperation(set_mask=dns.flags.AA | dns.flags.AD),
+                              HeaderFlagsOperation(set_mask=dns.flags.RA, clear_mask=dns.flags.AA)])
+
+        assert len(plan.operations) == 1
+        assert plan.operations[0].set_mask == dns.flags.AD | dns.flags.RA
+        assert plan.operations[0].clear_mask == dns.flags.AA
+        assert plan.depth == ParseDepth.HEADER
+
+    def test_later_edns_operation_wins(self):
+        """ Test that the later of two conflicting EDNS flag edits is the one which runs """
+        plan = ExecutionPlan([EdnsFlagsOperation(set_mask=dns.flags.DO),
+                              EdnsFlagsOperation(clear_mask=dns.flags.DO)])
+        query = dns.message.make_query('example.com.', 'A', want_dnssec=True)
+
+        assert plan.describe() == ["<EdnsFlagsOperation set='' clear='DO'>"]
+        assert not dns.message.from_wire(bytes(plan(query.to_wire()))).ednsflags & dns.flags.DO
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import dns.flags
+import dns.message
+
+from broken_dns_proxy.modifiers import ModificationChain, ParseDepth
+
+
+def make_chain(make_config, flags):
+    return ModificationChain(make_config('[Proxy]\nModifiers = FlagsModifier\n[FlagsModifier]\n', flags))
+
+
+def make_response(use_edns=True):
+    query = dns.message.make_query('example.com.', 'A', use_edns=0 if use_edns else None)
+    response = dns.message.make_response(query)
+    response.flags |= dns.flags.RA
+    return response
+
+
+class TestFlagsModifier(object):
+    """
+    Test cases for FlagsModifier
+    """
+
+    def test_parse_depth(self, make_config):
+        """ Test that the chain needs only as much parsing as the flags need """
+        assert make_chain(make_config, {}).parse_depth == ParseDepth.NONE
+        assert make_chain(make_config, {'AD': 'yes'}).parse_depth == ParseDepth.HEADER
+        assert make_chain(make_config, {'DO': 'no'}).parse_depth == ParseDepth.EDNS
+
+    def test_header_flags_on_wire(self, make_config):
+        """ Test that header flags are changed in the raw message the same way as in the parsed one """
+        chain = make_chain(make_config, {'AA': 'yes', 'RA': 'no'})
+        response_raw = make_response().to_wire()
+
+        modified = dns.message.from_wire(bytes(chain.plan(response_raw)))
+        expected = chain.run_modifiers(dns.message.from_wire(response_raw))
+
+        assert modified.flags == expected.flags
+        assert modified.flags & dns.flags.AA
+        assert not modified.flags & dns.flags.RA
+
+    def test_do_flag_enables_edns(self, make_config):
+        """ Test that setting DO flag adds OPT record to the raw message without EDNS """
+        chain = make_chain(make_config, {'DO': 'yes'})
+
+        modified = dns.message.from_wire(bytes(chain.plan(make_response(use_edns=False).to_wire())))
+
+        assert modified.edns == 0
+        assert modified.ednsflags & dns.flags.DO
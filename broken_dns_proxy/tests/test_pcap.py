@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import socket
+import struct
+
+import dns.message
+import pytest
+
+from broken_dns_proxy.exceptions import BrokenDNSProxyError
+from broken_dns_proxy.pcap import read_udp_packets, LINKTYPE_ETHERNET, LINKTYPE_RAW
+
+
+def udp_ipv4(src, sport, dst, dport, payload):
+    udp = struct.pack('!HHHH', sport, dport, 8 + len(payload), 0) + payload
+    return struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + len(udp), 0, 0, 64, 17, 0, socket.inet_aton(src),
+                       socket.inet_aton(dst)) + udp
+
+
+def udp_ipv6(src, sport, dst, dport, payload):
+    udp = struct.pack('!HHHH', sport, dport, 8 + len(payload), 0) + payload
+    return struct.pack('!IHBB16s16s', 6 << 28, len(udp), 17, 64, socket.inet_pton(socket.AF_INET6, src),
+                       socket.inet_pton(socket.AF_INET6, dst)) + udp
+
+
+def ethernet(packet, vlan=None):
+    header = b'\x00' * 12
+    if vlan is not None:
+        header += struct.pack('!HH', 0x8100, vlan)
+    ethertype = 0x0800 if packet[0] >> 4 == 4 else 0x86DD
+    return header + struct.pack('!H', ethertype) + packet
+
+
+def write_pcap(path, linktype, frames, byte_order='<'):
+    """
+    :param frames: list of (timestamp, frame)
+    """
+    with open(str(path), 'wb') as f:
+        f.write(struct.pack(byte_order + 'IHHiIII', 0xA1B2C3D4, 2, 4, 0, 0, 65535, linktype))
+        for timestamp, frame in frames:
+            f.write(struct.pack(byte_order + 'IIII', int(timestamp), int(round(timestamp % 1 * 1e6)), len(frame),
+                                len(frame)))
+            f.write(frame)
+
+
+def pcapng_block(block_type, body):
+    body += b'\x00' * (-len(body) % 4)
+    length = len(body) + 12
+    return struct.pack('<II', block_type, length) + body + struct.pack('<I', length)
+
+
+def write_pcapng(path, linktype, frames, tsresol=None):
+    with open(str(path), 'wb') as f:
+        f.write(pcapng_block(0x0A0D0D0A, struct.pack('<IHHq', 0x1A2B3C4D, 1, 0, -1)))
+        options = b''
+        if tsresol is not None:
+            options = struct.pack('<HHB3x', 9, 1, tsresol) + struct.pack('<HH', 0, 0)
+        f.write(pcapng_block(1, struct.pack('<HHI', linktype, 0, 65535) + options))
+        units = 10 ** (tsresol or 6)
+        for timestamp, frame in frames:
+            ts = int(round(timestamp * units))
+            f.write(pcapng_block(6, struct.pack('<IIIII', 0, ts >> 32, ts & 0xFFFFFFFF, len(frame), len(frame)) +
+                                 frame))
+
+
+QUERY = dns.message.make_query('example.com.', 'A').to_wire()
+
+
+class TestReadUdpPackets(object):
+
+    def test_pcap_ethernet(self, tmp_path):
+        path = tmp_path / 'capture.pcap'
+        write_pcap(path, LINKTYPE_ETHERNET, [
+            (10.5, ethernet(udp_ipv4('192.0.2.1', 40000, '192.0.2.53', 53, QUERY))),
+            (10.75, ethernet(udp_ipv6('2001:db8::1', 40001, '2001:db8::53', 53, QUERY), vlan=42)),
+            (11.0, b'\x00' * 12 + b'\x08\x06' + b'\x00' * 28),
+        ])
+        packets = list(read_udp_packets(str(path)))
+        assert [(p.src, p.sport, p.dst, p.dport) for p in packets] == [('192.0.2.1', 40000, '192.0.2.53', 53),
+                                                                     ('2001:db8::1', 40001, '2001:db8::53', 53)]
+        assert [p.timestamp for p in packets] == [10.5, 10.75]
+        assert all(p.payload == QUERY for p in packets)
+
+    def test_pcap_big_endian(self, tmp_path):
+        path = tmp_path / 'capture.pcap'
+        write_pcap(path, LINKTYPE_RAW, [(1.0, udp_ipv4('192.0.2.1', 40000, '192.0.2.53', 53, QUERY))], '>')
+        assert [p.payload for p in read_udp_packets(str(path))] == [QUERY]
+
+    def test_pcapng(self, tmp_path):
+        path = tmp_path / 'capture.pcapng'
+        write_pcapng(path, LINKTYPE_ETHERNET, [(1.25, ethernet(udp_ipv4('192.0.2.1', 1, '192.0.2.53', 53, QUERY))),
+                                               (2.5, ethernet(udp_ipv4('192.0.2.1', 2, '192.0.2.53', 53, QUERY)))],
+                     tsresol=9)
+        packets = list(read_udp_packets(str(path)))
+        assert [(p.timestamp, p.sport) for p in packets] == [(1.25, 1), (2.5, 2)]
+        assert packets[0].payload == QUERY
+
+    def test_truncated_snapshot(self, tmp_path):
+        path = tmp_path / 'capture.pcap'
+        write_pcap(path, LINKTYPE_RAW, [(1.0, udp_ipv4('192.0.2.1', 40000, '192.0.2.53', 53, QUERY)[:24])])
+        assert list(read_udp_packets(str(path))) == []
+
+    def test_corrupt_pcapng(self, tmp_path):
+        path = tmp_path / 'capture.pcapng'
+        write_pcapng(path, LINKTYPE_ETHERNET, [(1.0, ethernet(udp_ipv4('192.0.2.1', 1, '192.0.2.53', 53, QUERY)))])
+        capture = path.read_bytes()
+        shb_length = struct.unpack_from('<I', capture, 4)[0]
+        corrupted = [
+            # truncated Section Header Block
+            capture[:6],
+            capture[:10],
+            # Section Header Block length too short
+            capture[:4] + struct.pack('<I', 8) + capture[8:],
+            # Enhanced Packet Block without Interface Description Block
+            capture[:shb_length] + capture[capture.index(struct.pack('<I', 6), shb_length):],
+        ]
+        for data in corrupted:
+            path.write_bytes(data)
+            with pytest.raises(BrokenDNSProxyError):
+                list(read_udp_packets(str(path)))
+
+    def test_not_a_capture(self, tmp_path):
+        path = tmp_path / 'capture.pcap'
+        path.write_bytes(b'not a capture file')
+        with pytest.raises(BrokenDNSProxyError):
+            list(read_udp_packets(str(path)))
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import socket
+import struct
+import threading
+import time
+
+import dns.exception
+import dns.flags
+import dns.message
+import dns.rcode
+import dns.rrset
+
+from broken_dns_proxy.proxy_server import ProxyServer
+
+
+CHAINS_CONFIG = """
+[FlagsModifier]
+RA = no
+[Chain:zone]
+Modifiers = DnssecModifier
+Names = example.com
+[DnssecModifier]
+Strip = RRSIG
+"""
+
+
+def make_server(make_config, options, sections=''):
+    server = ProxyServer(make_config(sections + '[Proxy]\n', dict({'UpstreamServers': '127.0.0.1@5300'}, **options)))
+
+    def forward(msg_raw, upstream_server, stream=False):
+        try:
+            query = dns.message.from_wire(bytes(msg_raw))
+        except dns.exception.FormError:
+            # header only FORMERR response, like a real upstream server
+            return struct.pack('!6H', struct.unpack_from('!H', msg_raw)[0], dns.flags.QR | dns.rcode.FORMERR, 0, 0, 0, 0)
+        response = dns.message.make_response(query)
+        response.answer.append(dns.rrset.from_text(query.question[0].name, 300, 'IN', 'A', '192.0.2.1'))
+        return response.to_wire()
+
+    server._forward = forward
+    return server
+
+
+class TestProxyServer(object):
+    """
+    Test cases for ProxyServer class
+    """
+
+    def setup_method(self, method):
+        self.s_udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.s_udp.bind(('127.0.0.1', 0))
+        self.s_client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.s_client.settimeout(1)
+
+    def teardown_method(self, method):
+        self.s_udp.close()
+        self.s_client.close()
+
+    def test_malformed_question(self, make_config):
+        """ Test that Query with a truncated question is not cached and the server keeps answering """
+        server = make_server(make_config, {'CacheMaxEntries': 100})
+        # valid header with QDCOUNT=1, the question name is cut off
+        self.s_client.sendto(struct.pack('!6H', 1234, 0x0100, 1, 0, 0, 0) + b'\x07exam', self.s_udp.getsockname())
+        server._process_datagram(self.s_udp)
+        response = dns.message.from_wire(self.s_client.recv(4096))
+        assert response.id == 1234
+        assert response.rcode() == dns.rcode.FORMERR
+        assert len(server._cache) == 0
+
+        query = dns.message.make_query('example.com.', 'A')
+        self.s_client.sendto(query.to_wire(), self.s_udp.getsockname())
+        server._process_datagram(self.s_udp)
+        response = dns.message.from_wire(self.s_client.recv(4096))
+        assert response.id == query.id
+        assert response.answer
+
+    def test_modified_responses_by_chain(self, make_config):
+        """ Test that only the modifiers of the selected chain count the response """
+        server = make_server(make_config, {'Modifiers': 'FlagsModifier', 'Chains': 'zone'}, CHAINS_CONFIG)
+        for qname in ('example.com.', 'www.example.com.', 'example.org.'):
+            self.s_client.sendto(dns.message.make_query(qname, 'A').to_wire(), self.s_udp.getsockname())
+            server._process_datagram(self.s_udp)
+            self.s_client.recv(4096)
+
+        text = server._metrics.render()
+        assert 'bdp_modified_responses_total{modifier="FlagsModifier"} 1\n' in text
+        assert 'bdp_modified_responses_total{modifier="DnssecModifier"} 2\n' in text
+
+
+class TestTcpConnections(object):
+    """
+    Test cases for TCP connections of the select engine
+    """
+
+    def test_more_connections_than_limit(self, make_config):
+        """ Test that connections over the limit are refused and descriptors above FD_SETSIZE are served """
+        probe = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
+        probe.bind(('::1', 0))
+        port = probe.getsockname()[1]
+        probe.close()
+        server = make_server(make_config, {'Address': '::1', 'Port': port, 'TcpMaxConnections': 600})
+        threading.Thread(target=server.process, daemon=True).start()
+
+        connections = []
+        try:
+            for _ in range(50):
+                try:
+                    connections.append(socket.create_connection(('::1', port), 5))
+                    break
+                except ConnectionRefusedError:
+                    time.sleep(0.05)
+            # together with the accepted sockets the descriptors go over 1024
+            while len(connections) < 700:
+                connections.append(socket.create_connection(('::1', port), 5))
+
+            query = dns.message.make_query('example.com.', 'A')
+            query_raw = query.to_wire()
+            accepted = connections[599]
+            accepted.sendall(struct.pack('!H', len(query_raw)) + query_raw)
+            length = struct.unpack('!H', accepted.recv(2))[0]
+            assert dns.message.from_wire(accepted.recv(length)).id == query.id
+            # refused connections are closed by the proxy
+            assert connections[-1].recv(2) == b''
+        finally:
+            for connection in connections:
+                connection.close()
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import asyncio
+import os
+
+import dns.message
+import dns.rcode
+
+from broken_dns_proxy.pcap import UdpPacket
+from broken_dns_proxy.replay import CaptureReplay
+from broken_dns_proxy.stub_upstream import StubResolver, StubServer
+
+ZONE_FILE = os.path.join(os.path.dirname(__file__), 'testing_files', 'example.com.zone')
+
+
+def query_packet(timestamp, qname, sport=40000, msg_id=1, dport=53):
+    query = dns.message.make_query(qname, 'A')
+    query.id = msg_id
+    return UdpPacket(timestamp, '192.0.2.1', sport, '192.0.2.53', dport, query.to_wire())
+
+
+class _BrokenResponder(asyncio.DatagramProtocol):
+    """
+    Answers with other ID to Queries for 'wrong-id.test.' and with other question to the rest
+    """
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        query = dns.message.from_wire(data)
+        if query.question[0].name.to_text() == 'wrong-id.test.':
+            response = dns.message.make_response(query)
+            response.id = (query.id + 1) % 65536
+        else:
+            other = dns.message.make_query('other.test.', 'A')
+            other.id = query.id
+            response = dns.message.make_response(other)
+        self.transport.sendto(response.to_wire(), addr)
+
+
+def run_replay(packets, server_factory, **kwargs):
+    async def replay():
+        server, port = await server_factory()
+        try:
+            return await CaptureReplay('127.0.0.1', port, packets, **kwargs).run()
+        finally:
+            server.close()
+    return asyncio.run(replay())
+
+
+async def stub_server():
+    server = StubServer(StubResolver([ZONE_FILE]), '127.0.0.1', 0)
+    return server, await server.start()
+
+
+async def broken_server():
+    transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(_BrokenResponder,
+                                                                             local_addr=('127.0.0.1', 0))
+    return transport, transport.get_extra_info('sockname')[1]
+
+
+class TestCaptureReplay(object):
+
+    def test_replay(self):
+        response = dns.message.make_response(dns.message.make_query('example.com.', 'A'))
+        packets = [
+            query_packet(100.0, 'example.com.', msg_id=1),
+            UdpPacket(100.01, '192.0.2.53', 53, '192.0.2.1', 40000, response.to_wire()),
+            query_packet(100.02, 'nonexistent.example.com.', sport=40001, msg_id=1),
+            query_packet(100.03, 'example.com.', dport=5353),
+            query_packet(100.2, 'example.com.', msg_id=2),
+        ]
+        result = run_replay(packets, stub_server, speed=2.0, timeout=1.0)
+        assert (result.sent, result.received, result.lost, result.ignored) == (3, 3, 0, 2)
+        assert result.rcodes == {dns.rcode.NOERROR: 2, dns.rcode.NXDOMAIN: 1}
+        assert not result.mismatches
+        # the original timing is kept at double speed
+        assert result.elapsed >= 0.1
+        assert result.percentile(50) is not None
+
+    def test_as_fast_as_possible(self):
+        packets = [query_packet(3600.0 * i, 'example.com.', sport=1000 + i, msg_id=i) for i in range(50)]
+        result = run_replay(packets, stub_server, speed=0, concurrency=4, sockets=2, count=20)
+        assert (result.sent, result.received) == (20, 20)
+        assert result.elapsed < 60
+
+    def test_mismatches(self):
+        packets = [query_packet(0.0, 'wrong-id.test.', msg_id=1), query_packet(0.0, 'example.com.', msg_id=2)]
+        result = run_replay(packets, broken_server, speed=0, timeout=0.2, sockets=1)
+        assert result.mismatches == {'unexpected': 1, 'question': 1}
+        assert (result.sent, result.received, result.lost) == (2, 0, 1)
+        assert 'Mismatches:        2' in result.report()
+
+    def test_id_collision(self):
+        packets = [query_packet(0.0, 'example.com.', msg_id=7)] * 3
+        # the second Query goes from the other socket
+        result = run_replay(packets, stub_server, speed=0, timeout=0.5, sockets=2, concurrency=3)
+        assert result.id_collisions == 1
+        assert (result.sent, result.received, result.lost) == (3, 2, 1)
+        assert result.mismatches == {'unexpected': 1}
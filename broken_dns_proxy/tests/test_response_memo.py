@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import dns.flags
+import dns.message
+
+from broken_dns_proxy.response_memo import ResponseMemo
+
+
+class CountingChain(object):
+
+    def __init__(self):
+        self.calls = 0
+
+    def plan(self, response_raw):
+        self.calls += 1
+        response = dns.message.from_wire(bytes(response_raw))
+        response.flags |= dns.flags.AA
+        return response.to_wire()
+
+
+def make_response(qname, msg_id):
+    query = dns.message.make_query(qname, 'A')
+    query.id = msg_id
+    return dns.message.make_response(query).to_wire()
+
+
+class TestResponseMemo(object):
+
+    def test_hit_ignores_id(self):
+        memo = ResponseMemo(10)
+        chain = CountingChain()
+        first = memo.modify(chain, make_response('example.com.', 1))
+        second = memo.modify(chain, make_response('example.com.', 2))
+        assert chain.calls == 1
+        assert first == second
+        assert dns.message.from_wire(second).flags & dns.flags.AA
+        assert (memo.hits, memo.misses) == (1, 1)
+
+    def test_other_chain_or_response(self):
+        memo = ResponseMemo(10)
+        chain, other_chain = CountingChain(), CountingChain()
+        memo.modify(chain, make_response('example.com.', 1))
+        memo.modify(other_chain, make_response('example.com.', 1))
+        memo.modify(chain, make_response('example.org.', 1))
+        assert (chain.calls, other_chain.calls) == (2, 1)
+        assert memo.hits == 0
+
+    def test_lru_eviction(self):
+        memo = ResponseMemo(2)
+        chain = CountingChain()
+        for qname in ('a.test.', 'b.test.', 'a.test.', 'c.test.', 'a.test.', 'b.test.'):
+            memo.modify(chain, make_response(qname, 1))
+        assert len(memo) == 2
+        # b.test. was evicted by c.test.
+        assert chain.calls == 4
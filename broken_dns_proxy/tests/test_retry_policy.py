@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+
+import dns.message
+
+from broken_dns_proxy.async_proxy_server import AsyncProxyServer
+from broken_dns_proxy.retry_policy import RttPercentile, RetryPolicy
+from broken_dns_proxy.upstream_selection import RoundRobinStrategy
+
+
+def make_server(make_config, options):
+    return AsyncProxyServer(make_config('[Proxy]\n', dict({'UpstreamSelection': 'roundrobin'}, **options)))
+
+
+def run_resolve(server, delays):
+    """
+    Resolve a Query with fake upstream servers answering after the given delay,
+    failing if the delay is None or timing out if the delay is 'timeout'.
+    """
+    msg_raw = dns.message.make_query('example.com.', 'A').to_wire()
+
+    async def forward(msg_raw, upstream_server, stream=False):
+        if delays[upstream_server] is None:
+            raise ConnectionResetError()
+        if delays[upstream_server] == 'timeout':
+            raise asyncio.TimeoutError()
+        await asyncio.sleep(delays[upstream_server])
+        return upstream_server
+
+    async def resolve():
+        server._loop = asyncio.get_running_loop()
+        server._forward = forward
+        return await server._resolve(msg_raw)
+
+    return asyncio.run(resolve())
+
+
+class TestRttPercentile(object):
+
+    def test_percentile(self):
+        rtt = RttPercentile()
+        assert rtt.percentile(50) is None
+        for i in range(100):
+            rtt.add(i / 1000.0)
+        assert rtt.percentile(0) == 0.0
+        assert rtt.percentile(50) == 0.05
+        assert rtt.percentile(100) == 0.099
+
+    def test_window(self):
+        rtt = RttPercentile(window=10)
+        for i in range(100):
+            rtt.add(i)
+        assert len(rtt) == 10
+        assert rtt.percentile(0) == 90
+
+
+    def test_refresh(self):
+        rtt = RttPercentile(refresh=10)
+        for i in range(10):
+            rtt.add(0.01)
+        assert rtt.percentile(100) == 0.01
+        # the samples are sorted again only after 10 new ones
+        for i in range(9):
+            rtt.add(1.0)
+        assert rtt.percentile(100) == 0.01
+        rtt.add(1.0)
+        assert rtt.percentile(100) == 1.0
+
+
+class TestRetryPolicy(object):
+
+    def test_hedge_delay(self):
+        policy = RetryPolicy(1.0, hedge_percentile=90, hedge_min_delay=0.01)
+        assert policy.hedge_delay() is None
+        for _ in range(RetryPolicy.HEDGE_MIN_SAMPLES):
+            policy.report(0.001)
+        assert policy.hedge_delay() == 0.01
+        for _ in range(1000):
+            policy.report(0.2)
+        assert policy.hedge_delay() == 0.2
+
+    def test_hedging_disabled(self):
+        policy = RetryPolicy(1.0)
+        for _ in range(100):
+            policy.report(0.1)
+        assert policy.hedge_delay() is None
+
+    def test_choose_other(self):
+        strategy = RoundRobinStrategy(['a', 'b', 'c'])
+        assert strategy.choose_other([]) == 'a'
+        assert strategy.choose_other(['b']) in ('a', 'c')
+        assert strategy.choose_other(['a', 'b']) == 'c'
+        assert strategy.choose_other(['a', 'b', 'c']) in ('a', 'b', 'c')
+
+
+class TestResolve(object):
+
+    def test_retry_on_failure(self, make_config):
+        server = make_server(make_config, {'UpstreamServers': 'broken fast', 'UpstreamRetries': '1'})
+        assert run_resolve(server, {'broken': None, 'fast': 0}) == 'fast'
+        counters = server._retry_policy.counters
+        assert (counters.failures, counters.retries, counters.exhausted) == (1, 1, 0)
+
+    def test_timeout(self, make_config):
+        server = make_server(make_config, {'UpstreamServers': 'slow fast', 'UpstreamRetries': '1'})
+        assert run_resolve(server, {'slow': 'timeout', 'fast': 0}) == 'fast'
+        counters = server._retry_policy.counters
+        assert (counters.timeouts, counters.retries) == (1, 1)
+
+    def test_retries_exhausted(self, make_config):
+        server = make_server(make_config, {'UpstreamServers': 'broken', 'UpstreamRetries': '2'})
+        try:
+            run_resolve(server, {'broken': None})
+        except ConnectionResetError:
+            pass
+        else:
+            assert False, 'resolving should fail'
+        counters = server._retry_policy.counters
+        assert (counters.failures, counters.retries, counters.exhausted) == (3, 2, 1)
+
+    def test_hedged_query_wins(self, make_config):
+        server = make_server(make_config, {'UpstreamServers': 'slow fast', 'UpstreamHedgePercentile': '50',
+                                        'UpstreamHedgeMinDelay': '0.01'})
+        for _ in range(RetryPolicy.HEDGE_MIN_SAMPLES):
+            server._retry_policy.report(0.01)
+        assert run_resolve(server, {'slow': 1, 'fast': 0}) == 'fast'
+        counters = server._retry_policy.counters
+        assert (counters.hedges, counters.hedge_wins) == (1, 1)
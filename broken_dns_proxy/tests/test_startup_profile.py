@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+
+from broken_dns_proxy.exceptions import BrokenDNSProxyError
+from broken_dns_proxy.startup_profile import ImportTime, StartupProfile, parse_importtime, profile_startup
+
+
+IMPORTTIME_OUTPUT = '''import time: self [us] | cumulative | imported package
+import time:       120 |        120 |   _io
+import time:        80 |        200 | encodings
+INFO:	some log message
+import time:      1000 |       1000 |     dns.flags
+import time:       500 |       1500 |   dns.rcode
+import time:       300 |       1800 | broken_dns_proxy.proxy_server
+'''
+
+
+class TestParseImporttime(object):
+
+    def test_parse(self):
+        imports = parse_importtime(IMPORTTIME_OUTPUT.splitlines())
+        assert imports == [ImportTime('_io', 120, 120, 1),
+                           ImportTime('encodings', 80, 200, 0),
+                           ImportTime('dns.flags', 1000, 1000, 2),
+                           ImportTime('dns.rcode', 500, 1500, 1),
+                           ImportTime('broken_dns_proxy.proxy_server', 300, 1800, 0)]
+
+
+class TestStartupProfile(object):
+
+    def test_times(self):
+        profile = StartupProfile(parse_importtime(IMPORTTIME_OUTPUT.splitlines()), 0.005)
+        assert profile.import_time == pytest.approx(0.002)
+        assert [imp.module for imp in profile.slowest(2)] == ['dns.flags', 'dns.rcode']
+        assert profile.packages()[0] == ('dns', pytest.approx(0.0015))
+        assert profile.is_imported('dns.rcode')
+        assert not profile.is_imported('dns.message')
+
+    def test_report(self):
+        report = StartupProfile(parse_importtime(IMPORTTIME_OUTPUT.splitlines()), 0.005).report(count=1)
+        assert 'Startup time:      5.000 ms' in report
+        assert 'Import time:       2.000 ms (5 modules)' in report
+        assert '1.000 ms     1.000 ms  dns.flags' in report
+        assert 'dns.rcode' not in report
+
+
+class TestProfileStartup(object):
+
+    @staticmethod
+    def _profile(tmp_path, config):
+        path = tmp_path / 'config'
+        path.write_text('[Proxy]\n' + config)
+        return profile_startup(['-c', str(path)])
+
+    def test_select_engine(self, tmp_path):
+        """ Test that the startup imports only what the configuration needs """
+        profile = self._profile(tmp_path, 'Engine = select\nModifiers = FlagsModifier\n')
+        assert profile.startup_time > 0
+        assert profile.is_imported('broken_dns_proxy.proxy_server')
+        assert profile.is_imported('broken_dns_proxy.modifiers.flags_modifier')
+        for module in ('asyncio', 'dns.message', 'dns.name', 'broken_dns_proxy.modifiers.delay_modifier',
+                       'broken_dns_proxy.stub_upstream', 'broken_dns_proxy.metrics_server', 'importlib.metadata'):
+            assert not profile.is_imported(module)
+
+    def test_asyncio_engine(self, tmp_path):
+        profile = self._profile(tmp_path, 'Engine = asyncio\nModifiers = DnssecModifier\n')
+        assert profile.is_imported('asyncio')
+        assert profile.is_imported('broken_dns_proxy.modifiers.dnssec_modifier')
+        assert not profile.is_imported('broken_dns_proxy.modifiers.flags_modifier')
+
+    def test_wrong_configuration(self, tmp_path):
+        with pytest.raises(BrokenDNSProxyError) as e:
+            self._profile(tmp_path, 'Modifiers = NoSuchModifier\n')
+        assert 'NoSuchModifier' in str(e.value)
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import os
+
+import dns.flags
+import dns.message
+import dns.query
+import dns.rcode
+import dns.rdatatype
+import pytest
+
+from broken_dns_proxy.exceptions import BrokenDNSProxyError
+from broken_dns_proxy.stub_upstream import StubResolver, StubServer, StubUpstream
+from broken_dns_proxy.upstream import parse_upstream_address
+
+ZONE_FILE = os.path.join(os.path.dirname(__file__), 'testing_files', 'example.com.zone')
+
+
+def resolve(resolver, qname, rdtype, want_dnssec=False):
+    query = dns.message.make_query(qname, rdtype, want_dnssec=want_dnssec)
+    response = dns.message.from_wire(bytes(resolver.resolve(query.to_wire())))
+    assert response.id == query.id
+    return response
+
+
+class TestStubResolver(object):
+
+    def setup_method(self, method):
+        self.resolver = StubResolver([ZONE_FILE])
+
+    def test_answer(self):
+        response = resolve(self.resolver, 'example.com.', 'A')
+        assert response.rcode() == dns.rcode.NOERROR
+        assert response.flags & dns.flags.AA
+        assert [rrset.to_text() for rrset in response.answer] == ['example.com. 3600 IN A 192.0.2.1']
+
+    def test_dnssec(self):
+        response = resolve(self.resolver, 'example.com.', 'A', want_dnssec=True)
+        assert sorted(rrset.rdtype for rrset in response.answer) == [dns.rdatatype.A, dns.rdatatype.RRSIG]
+        response = resolve(self.resolver, 'nonexistent.example.com.', 'A', want_dnssec=True)
+        assert response.rcode() == dns.rcode.NXDOMAIN
+        assert dns.rdatatype.NSEC in [rrset.rdtype for rrset in response.authority]
+
+    def test_nxdomain_and_nodata(self):
+        response = resolve(self.resolver, 'nonexistent.example.com.', 'A')
+        assert response.rcode() == dns.rcode.NXDOMAIN
+        assert response.authority[0].rdtype == dns.rdatatype.SOA
+        response = resolve(self.resolver, 'ns1.example.com.', 'AAAA')
+        assert response.rcode() == dns.rcode.NOERROR
+        assert not response.answer
+        assert response.authority[0].rdtype == dns.rdatatype.SOA
+
+    def test_cname(self):
+        response = resolve(self.resolver, 'www.example.com.', 'A')
+        assert [rrset.rdtype for rrset in response.answer] == [dns.rdatatype.CNAME, dns.rdatatype.A]
+
+    def test_referral(self):
+        response = resolve(self.resolver, 'host.sub.example.com.', 'A', want_dnssec=True)
+        assert not response.flags & dns.flags.AA
+        assert not response.answer
+        assert sorted(rrset.rdtype for rrset in response.authority) == [dns.rdatatype.NS, dns.rdatatype.DS]
+        assert response.additional[0].to_text() == 'ns.sub.example.com. 3600 IN A 192.0.2.54'
+        # DS is answered by the parent zone
+        response = resolve(self.resolver, 'sub.example.com.', 'DS')
+        assert response.flags & dns.flags.AA
+        assert response.answer[0].rdtype == dns.rdatatype.DS
+
+    def test_wildcard(self):
+        response = resolve(self.resolver, 'anything.wild.example.com.', 'TXT')
+        assert response.answer[0].to_text() == 'anything.wild.example.com. 3600 IN TXT "wildcard"'
+
+    def test_refused(self):
+        assert resolve(self.resolver, 'example.org.', 'A').rcode() == dns.rcode.REFUSED
+
+    def test_remembered_response(self):
+        first = resolve(self.resolver, 'example.com.', 'A')
+        query = dns.message.make_query('EXAMPLE.com.', 'A')
+        query.flags &= ~dns.flags.RD
+        second = dns.message.from_wire(bytes(self.resolver.resolve(query.to_wire())))
+        assert second.id == query.id
+        assert second.question[0].name.to_text() == 'EXAMPLE.com.'
+        assert not second.flags & dns.flags.RD
+        assert first.answer == second.answer
+
+    def test_malformed_query(self):
+        with pytest.raises(BrokenDNSProxyError):
+            self.resolver.resolve(b'\x00\x01')
+        query = dns.message.make_query('example.com.', 'A').to_wire()
+        with pytest.raises(BrokenDNSProxyError):
+            self.resolver.resolve(query[:16])
+
+
+class TestStubUpstream(object):
+
+    def make_resolver(self, tmp_path):
+        zone_file = tmp_path / 'big.example.zone'
+        zone_file.write_text('$ORIGIN big.example.\n$TTL 3600\n'
+                             '@ IN SOA ns.big.example. hostmaster.big.example. 1 7200 3600 1209600 300\n'
+                             '@ IN NS ns.big.example.\n' +
+                             ''.join('@ IN TXT "{0}"\n'.format(str(i) * 100) for i in range(10)))
+        return StubResolver([str(zone_file)])
+
+    def test_udp_truncated(self, tmp_path):
+        upstream = StubUpstream(self.make_resolver(tmp_path))
+        query = dns.message.make_query('big.example.', 'TXT')
+        response_raw = upstream.query(query.to_wire())
+        assert len(response_raw) <= 512
+        response = dns.message.from_wire(bytes(response_raw))
+        assert response.id == query.id
+        assert response.flags & dns.flags.TC
+        assert not response.answer
+        # the remembered response is truncated too
+        response = dns.message.from_wire(bytes(upstream.query(query.to_wire())))
+        assert response.flags & dns.flags.TC
+
+    def test_large_payload_and_stream(self, tmp_path):
+        resolver = self.make_resolver(tmp_path)
+        query = dns.message.make_query('big.example.', 'TXT', use_edns=0, payload=4096)
+        response = dns.message.from_wire(bytes(StubUpstream(resolver).query(query.to_wire())))
+        assert not response.flags & dns.flags.TC
+        assert len(response.answer[0]) == 10
+
+        query = dns.message.make_query('big.example.', 'TXT')
+        response = dns.message.from_wire(bytes(StubUpstream(resolver, stream=True).query(query.to_wire())))
+        assert not response.flags & dns.flags.TC
+        assert len(response.answer[0]) == 10
+
+
+class TestStubServer(object):
+
+    def test_udp_and_tcp(self):
+        async def run():
+            server = StubServer(StubResolver([ZONE_FILE]), '127.0.0.1', 0)
+            port = await server.start()
+            loop = asyncio.get_running_loop()
+            try:
+                query = dns.message.make_query('example.com.', 'A')
+                udp = await loop.run_in_executor(None, lambda: dns.query.udp(query, '127.0.0.1', 2, port))
+                tcp = await loop.run_in_executor(None, lambda: dns.query.tcp(query, '127.0.0.1', 2, port))
+                return udp, tcp
+            finally:
+                server.close()
+
+        for response in asyncio.run(run()):
+            assert response.answer[0].to_text() == 'example.com. 3600 IN A 192.0.2.1'
+
+
+class TestParseUpstreamAddress(object):
+
+    def test_parse(self):
+        assert parse_upstream_address('8.8.8.8') == ('8.8.8.8', 53)
+        assert parse_upstream_address('127.0.0.1@5353') == ('127.0.0.1', 5353)
+        assert parse_upstream_address('::1@5353') == ('::1', 5353)
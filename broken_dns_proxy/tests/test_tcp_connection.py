@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import socket
+import struct
+
+import dns.message
+
+from broken_dns_proxy.tcp_connection import TcpClientConnection, StreamClient
+
+
+def frame(msg_raw):
+    return struct.pack('!H', len(msg_raw)) + msg_raw
+
+
+class TestTcpClientConnection(object):
+
+    def setup_method(self, method):
+        self.client, server = socket.socketpair()
+        self.connection = TcpClientConnection(server, 'client')
+        self.query = dns.message.make_query('example.com', 'A').to_wire()
+
+    def teardown_method(self, method):
+        self.client.close()
+        self.connection.close()
+
+    def test_partial_read(self):
+        data = frame(self.query)
+        assert self.connection.read() == []
+        self.client.send(data[:1])
+        assert self.connection.read() == []
+        self.client.send(data[1:5])
+        assert self.connection.read() == []
+        self.client.send(data[5:])
+        assert self.connection.read() == [self.query]
+
+    def test_pipelined_queries(self):
+        other = dns.message.make_query('example.org', 'AAAA').to_wire()
+        self.client.send(frame(self.query) + frame(other) + frame(self.query)[:3])
+        assert self.connection.read() == [self.query, other]
+        assert self.connection.queries == 2
+
+    def test_response(self):
+        self.client.send(frame(self.query))
+        msg_raw = self.connection.read()[0]
+        client = StreamClient(self.connection, msg_raw)
+        assert client.is_stream()
+        response = dns.message.make_response(client.msg())
+        client.send_raw(response.to_wire())
+        data = self.client.recv(2**16)
+        assert struct.unpack('!H', data[:2])[0] == len(data) - 2
+        assert dns.message.from_wire(data[2:]).id == dns.message.from_wire(self.query).id
+
+    def test_max_queries(self):
+        self.connection = TcpClientConnection(self.connection.sock, 'client', max_queries=1)
+        self.client.send(frame(self.query) + frame(self.query))
+        assert self.connection.read() == [self.query]
+        StreamClient(self.connection, self.query).send_raw(self.query)
+        assert self.connection.is_finished()
+
+    def test_disconnect(self):
+        self.client.close()
+        assert self.connection.read() == []
+        assert self.connection.closed
+
+    def test_idle(self):
+        assert not self.connection.is_idle(self.connection.last_activity + 1, 10)
+        assert self.connection.is_idle(self.connection.last_activity + 11, 10)
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from broken_dns_proxy.timer_wheel import TimerWheel
+
+
+class TestTimerWheel(object):
+
+    def test_fire_in_time(self):
+        wheel = TimerWheel(10.0, tick=0.01, slots=8)
+        fired = []
+        wheel.schedule(10.0, 0.05, fired.append, 'a')
+        wheel.schedule(10.0, 0.02, fired.append, 'b')
+        assert len(wheel) == 2
+        assert abs(wheel.next_deadline() - 10.02) < 1e-9
+        assert wheel.advance(10.015) == 0
+        assert wheel.advance(10.02) == 1
+        assert fired == ['b']
+        assert abs(wheel.next_deadline() - 10.05) < 1e-9
+        assert wheel.advance(10.06) == 1
+        assert fired == ['b', 'a']
+        assert len(wheel) == 0 and wheel.next_deadline() is None
+        assert (wheel.scheduled, wheel.fired) == (2, 2)
+
+    def test_later_revolutions(self):
+        wheel = TimerWheel(0.0, tick=0.01, slots=8)
+        fired = []
+        # 0.25s is three revolutions ahead, in the same slot as 0.01s
+        wheel.schedule(0.0, 0.25, fired.append, 'late')
+        wheel.schedule(0.0, 0.01, fired.append, 'early')
+        assert wheel.advance(0.01) == 1
+        for step in range(2, 25):
+            wheel.advance(step * 0.01)
+        assert fired == ['early']
+        assert wheel.advance(0.25) == 1
+        assert fired == ['early', 'late']
+
+    def test_long_idle_jump(self):
+        wheel = TimerWheel(0.0, tick=0.01, slots=8)
+        fired = []
+        for delay in (0.03, 0.5, 2.0):
+            wheel.schedule(0.0, delay, fired.append, delay)
+        assert wheel.advance(1.0) == 2
+        assert sorted(fired) == [0.03, 0.5]
+        assert wheel.advance(5.0) == 1
+        # nothing is pending, time just moves on
+        assert wheel.advance(100.0) == 0
+
+    def test_zero_delay_and_rescheduling(self):
+        wheel = TimerWheel(0.0, tick=0.01, slots=8)
+        fired = []
+
+        def again(now, count):
+            fired.append(count)
+            if count:
+                wheel.schedule(now, 0, again, now + 0.01, count - 1)
+
+        wheel.schedule(0.0, 0, again, 0.01, 2)
+        # never fires in the tick it was scheduled in
+        assert wheel.advance(0.0) == 0
+        assert wheel.advance(0.01) == 1
+        assert wheel.advance(0.01) == 0
+        assert wheel.advance(0.02) == 1
+        assert wheel.advance(0.03) == 1
+        assert fired == [2, 1, 0]
+
+    def test_failing_callback(self):
+        wheel = TimerWheel(0.0, tick=0.01, slots=8)
+        fired = []
+        wheel.schedule(0.0, 0.01, lambda: 1 / 0)
+        wheel.schedule(0.0, 0.01, fired.append, 'ok')
+        assert wheel.advance(0.01) == 2
+        assert fired == ['ok']
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import socket
+
+import dns.message
+import pytest
+
+from broken_dns_proxy.exceptions import BrokenDNSProxyError
+from broken_dns_proxy.udp_batch import DatagramBatchIO, MmsgBatchIO, BatchClient, mmsg_supported, \
+    decode_sockaddr, encode_sockaddr
+
+
+class TestSockaddr(object):
+
+    def test_ipv4(self):
+        addr = ('192.0.2.1', 5353)
+        assert decode_sockaddr(encode_sockaddr(addr)) == addr
+
+    def test_ipv6(self):
+        addr = ('2001:db8::1', 53, 0, 0)
+        assert decode_sockaddr(encode_sockaddr(addr)) == addr
+
+
+class TestBatchClient(object):
+
+    def test_response_is_queued(self):
+        query = dns.message.make_query('example.com', 'A').to_wire()
+        outbox = []
+        client = BatchClient(query, ('192.0.2.1', 5353), outbox)
+        assert not client.is_stream()
+        client.send_raw(b'\x00\x00' + query[2:])
+        assert outbox == [(query, ('192.0.2.1', 5353))]
+
+    def test_response_is_not_query(self):
+        response = dns.message.make_response(dns.message.make_query('example.com', 'A')).to_wire()
+        with pytest.raises(BrokenDNSProxyError):
+            BatchClient(response, ('192.0.2.1', 5353), [])
+
+
+@pytest.mark.parametrize('batch_io_class', [
+    DatagramBatchIO,
+    pytest.param(MmsgBatchIO, marks=pytest.mark.skipif(not mmsg_supported(),
+                                                       reason='recvmmsg() is not available')),
+])
+class TestBatchIO(object):
+
+    def setup_method(self, method):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.client.bind(('127.0.0.1', 0))
+        self.client.settimeout(2)
+
+    def teardown_method(self, method):
+        self.server.close()
+        self.client.close()
+
+    def test_nothing_ready(self, batch_io_class):
+        batch_io = batch_io_class(self.server, 4)
+        assert batch_io.recv() == []
+        assert batch_io.stats.recv_datagrams == 0
+
+    def test_recv_and_send_batch(self, batch_io_class):
+        batch_io = batch_io_class(self.server, 4)
+        payloads = [str(i).encode() * (i + 1) for i in range(6)]
+        for payload in payloads:
+            self.client.sendto(payload, self.server.getsockname())
+
+        # the data are valid only until the next recv()
+        first = [(bytes(data), addr) for data, addr in batch_io.recv()]
+        second = [(bytes(data), addr) for data, addr in batch_io.recv()]
+        assert [data for data, _ in first + second] == payloads
+        assert len(first) == 4
+        assert all(addr == self.client.getsockname() for _, addr in first + second)
+        assert batch_io.stats.recv_datagrams == 6
+        assert batch_io.stats.recv_batch_size.count == 2
+
+        batch_io.send([(data[::-1], addr) for data, addr in first + second])
+        assert [self.client.recvfrom(100)[0] for _ in payloads] == [payload[::-1] for payload in payloads]
+        assert batch_io.stats.send_calls == 1
+        assert batch_io.stats.send_datagrams == 6
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import asyncio
+import socket
+import struct
+import threading
+
+import dns.message
+import dns.rcode
+import pytest
+
+from broken_dns_proxy.blocking_upstream import BlockingTcpUpstream
+from broken_dns_proxy.exceptions import UpstreamConnectionError
+from broken_dns_proxy.upstream import UdpUpstream, TcpUpstream
+
+
+class ReversingUpstream(asyncio.DatagramProtocol):
+    """
+    Fake upstream server answering every two Queries in reversed order
+    """
+
+    def __init__(self):
+        self.transport = None
+        self.queries = []
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.queries.append((data, addr))
+        if len(self.queries) == 2:
+            for data, addr in reversed(self.queries):
+                response = dns.message.make_response(dns.message.from_wire(data))
+                response.set_rcode(dns.rcode.NXDOMAIN)
+                self.transport.sendto(response.to_wire(), addr)
+            self.queries = []
+
+
+class ReversingStreamUpstream(asyncio.Protocol):
+    """
+    Fake upstream server answering every two pipelined Queries in reversed order
+    and closing the connection afterwards
+    """
+
+    connections = 0
+
+    def connection_made(self, transport):
+        ReversingStreamUpstream.connections += 1
+        self.transport = transport
+        self.buffer = b''
+
+    def data_received(self, data):
+        self.buffer += data
+        queries = []
+        while len(self.buffer) >= 2 and len(self.buffer) >= struct.unpack('!H', self.buffer[:2])[0] + 2:
+            msg_len = struct.unpack('!H', self.buffer[:2])[0]
+            queries.append(self.buffer[2:msg_len + 2])
+            self.buffer = self.buffer[msg_len + 2:]
+        for data in reversed(queries):
+            response = dns.message.make_response(dns.message.from_wire(data)).to_wire()
+            self.transport.write(struct.pack('!H', len(response)) + response)
+        if queries:
+            self.transport.close()
+
+
+class TestUdpUpstream(object):
+    """
+    Test cases for UdpUpstream class
+    """
+
+    def test_out_of_order_responses(self):
+        """
+        Test that responses are matched to Queries by ID and returned with the original ID
+        """
+        loop = asyncio.new_event_loop()
+
+        async def run():
+            transport, _ = await loop.create_datagram_endpoint(ReversingUpstream, local_addr=('127.0.0.1', 0))
+            port = transport.get_extra_info('sockname')[1]
+            upstream = UdpUpstream('127.0.0.1', port, loop=loop)
+            q1 = dns.message.make_query('a.example.', 'A')
+            q2 = dns.message.make_query('b.example.', 'AAAA')
+            q1.id = q2.id = 1234
+            try:
+                return await asyncio.gather(upstream.query(q1.to_wire(), 2), upstream.query(q2.to_wire(), 2))
+            finally:
+                upstream.close()
+                transport.close()
+
+        try:
+            r1, r2 = [dns.message.from_wire(r) for r in loop.run_until_complete(run())]
+        finally:
+            loop.close()
+
+        assert r1.id == r2.id == 1234
+        assert str(r1.question[0].name) == 'a.example.'
+        assert str(r2.question[0].name) == 'b.example.'
+        assert r1.rcode() == dns.rcode.NXDOMAIN
+
+
+class TestTcpUpstream(object):
+    """
+    Test cases for TcpUpstream class
+    """
+
+    def test_pipelining_and_reconnect(self):
+        """
+        Test that Queries are pipelined over one connection and the connection is reopened when closed
+        """
+        loop = asyncio.new_event_loop()
+        ReversingStreamUpstream.connections = 0
+
+        async def run():
+            server = await loop.create_server(ReversingStreamUpstream, '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            upstream = TcpUpstream('127.0.0.1', port, loop=loop)
+            q1 = dns.message.make_query('a.example.', 'A')
+            q2 = dns.message.make_query('b.example.', 'A')
+            q3 = dns.message.make_query('c.example.', 'A')
+            try:
+                responses = await asyncio.gather(upstream.query(q1.to_wire(), 2), upstream.query(q2.to_wire(), 2))
+                # the server closed the connection after the responses
+                await asyncio.sleep(0.05)
+                responses.append(await upstream.query(q3.to_wire(), 2))
+                return responses
+            finally:
+                upstream.close()
+                server.close()
+
+        try:
+            r1, r2, r3 = [dns.message.from_wire(r) for r in loop.run_until_complete(run())]
+        finally:
+            loop.close()
+
+        assert str(r1.question[0].name) == 'a.example.'
+        assert str(r2.question[0].name) == 'b.example.'
+        assert str(r3.question[0].name) == 'c.example.'
+        assert ReversingStreamUpstream.connections == 2
+
+
+def serve_tcp(listener, frames):
+    """
+    Accept one connection for every frame, read the Query and send the frame back
+    or the response to the Query if the frame is None
+    """
+    for frame in frames:
+        conn, _ = listener.accept()
+        with conn:
+            length = struct.unpack('!H', conn.recv(2))[0]
+            query_raw = conn.recv(length)
+            if frame is None:
+                frame = dns.message.make_response(dns.message.from_wire(query_raw)).to_wire()
+                frame = struct.pack('!H', len(frame)) + frame
+            conn.sendall(frame)
+
+
+class TestBlockingTcpUpstream(object):
+    """
+    Test cases for BlockingTcpUpstream class
+    """
+
+    def setup_method(self, method):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(2)
+
+    def teardown_method(self, method):
+        self.listener.close()
+
+    def query(self, frames):
+        thread = threading.Thread(target=serve_tcp, args=(self.listener, frames), daemon=True)
+        thread.start()
+        upstream = BlockingTcpUpstream('127.0.0.1', self.listener.getsockname()[1], timeout=2)
+        query = dns.message.make_query('example.com.', 'A')
+        try:
+            return query, upstream.query(query.to_wire())
+        finally:
+            upstream.close()
+            thread.join(2)
+
+    def test_short_frame_reconnects(self):
+        """ Test that frame shorter than DNS header makes the connection reopen """
+        query, response_raw = self.query([b'\x00\x01\x00', None])
+        assert dns.message.from_wire(response_raw).id == query.id
+
+    def test_short_frames(self):
+        """ Test that upstream server sending only short frames fails the Query """
+        with pytest.raises(UpstreamConnectionError):
+            self.query([b'\x00\x01\x00', b'\x00\x04\x12\x34\x00\x00'])
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import pytest
+
+from broken_dns_proxy.exceptions import BrokenDNSProxyError
+from broken_dns_proxy.upstream_selection import get_strategy_by_name, SrttStrategy
+
+
+class TestSelectionStrategies(object):
+    """
+    Test cases for upstream server selection strategies
+    """
+
+    def test_unknown_strategy(self):
+        """ Test that unknown strategy name is reported """
+        with pytest.raises(BrokenDNSProxyError):
+            get_strategy_by_name('fastest')
+
+    def test_roundrobin(self):
+        """ Test that servers are selected one after another """
+        strategy = get_strategy_by_name('RoundRobin')(['a', 'b', 'c'])
+        assert [strategy.choose() for _ in range(4)] == ['a', 'b', 'c', 'a']
+
+    def test_srtt_prefers_fast_server(self):
+        """ Test that the server with lower smoothed RTT is preferred, but slow server is probed again """
+        strategy = SrttStrategy(['slow', 'fast'])
+        strategy.report('slow', 0.200)
+        strategy.report('fast', 0.010)
+
+        chosen = [strategy.choose() for _ in range(200)]
+        assert chosen[0] == 'fast'
+        assert chosen.count('fast') > chosen.count('slow') > 0
+
+    def test_failure_penalty(self):
+        """ Test that failed Queries make the server less preferred """
+        strategy = get_strategy_by_name('p2c')(['a', 'b'])
+        strategy.report('a', 0.010)
+        strategy.report('b', 0.020)
+        strategy.report_failure('a')
+
+        assert strategy.stats('a').failures == 1
+        assert strategy.stats('a').srtt > strategy.stats('b').srtt
+        assert strategy.choose() == 'b'
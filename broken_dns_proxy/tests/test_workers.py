@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import os
+import signal
+import threading
+import time
+
+import pytest
+
+from broken_dns_proxy.exceptions import BrokenDNSProxyError
+from broken_dns_proxy.workers import WorkerSupervisor
+
+
+class StubServer(object):
+    """
+    Server of a worker writing marker files instead of serving Queries
+    """
+
+    def __init__(self, directory, index, crash=False):
+        self._directory = directory
+        self._index = index
+        self._crash = crash
+
+    def _mark(self, event):
+        (self._directory / '{0}-{1}-{2}'.format(event, self._index, os.getpid())).touch()
+
+    def process(self):
+        if self._crash:
+            raise RuntimeError('crash')
+        signal.signal(signal.SIGHUP, lambda signum, frame: self._mark('reloaded'))
+        self._mark('started')
+        while True:
+            # pause() could miss the signal arriving right before it
+            time.sleep(0.01)
+
+
+def markers(directory, event):
+    return sorted(path.name for path in directory.iterdir() if path.name.startswith(event + '-'))
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def signal_main_thread(signum):
+    # signal sent to the process may be handled by any thread, the blocked waitpid() would not notice
+    signal.pthread_kill(threading.main_thread().ident, signum)
+
+
+def run_supervisor(supervisor, *actions):
+    """
+    Run the supervisor in the main thread, the actions are called one after
+    another from other thread, SIGTERM is sent to the supervisor at the end
+    """
+    def control():
+        try:
+            for action in actions:
+                action()
+        finally:
+            signal_main_thread(signal.SIGTERM)
+
+    thread = threading.Thread(target=control)
+    thread.start()
+    try:
+        supervisor.run()
+    finally:
+        thread.join()
+
+
+def assert_no_children():
+    with pytest.raises(ChildProcessError):
+        os.waitpid(-1, os.WNOHANG)
+
+
+class TestWorkerSupervisor(object):
+    """
+    Test cases for WorkerSupervisor class
+    """
+
+    def make_supervisor(self, tmp_path, workers, crash=lambda index: False):
+        supervisor = WorkerSupervisor(lambda index: StubServer(tmp_path, index, crash(index)), workers)
+        supervisor.MIN_WORKER_LIFETIME = 0.05
+        return supervisor
+
+    def test_sigterm(self, tmp_path):
+        """ Test that SIGTERM stops all workers """
+        supervisor = self.make_supervisor(tmp_path, 2)
+        run_supervisor(supervisor, lambda: wait_for(lambda: len(markers(tmp_path, 'started')) == 2))
+        assert [name.split('-')[1] for name in markers(tmp_path, 'started')] == ['0', '1']
+        assert_no_children()
+
+    def test_restart_after_crash(self, tmp_path):
+        """ Test that crashed worker is started again """
+        crashed = tmp_path / 'crashed'
+
+        def crash(index):
+            if crashed.exists():
+                return False
+            crashed.touch()
+            return True
+
+        supervisor = self.make_supervisor(tmp_path, 1, crash)
+        run_supervisor(supervisor, lambda: wait_for(lambda: markers(tmp_path, 'started')))
+        assert crashed.exists()
+        assert len(markers(tmp_path, 'started')) == 1
+        assert_no_children()
+
+    def test_sighup_forwarded(self, tmp_path):
+        """ Test that SIGHUP is passed to all workers """
+        supervisor = self.make_supervisor(tmp_path, 2)
+        run_supervisor(supervisor,
+                       lambda: wait_for(lambda: len(markers(tmp_path, 'started')) == 2),
+                       lambda: signal_main_thread(signal.SIGHUP),
+                       lambda: wait_for(lambda: len(markers(tmp_path, 'reloaded')) == 2))
+        assert len(markers(tmp_path, 'reloaded')) == 2
+        assert_no_children()
+
+    def test_give_up_on_startup_failure(self, tmp_path):
+        """ Test that worker failing right after every start is not restarted forever """
+        supervisor = self.make_supervisor(tmp_path, 1, lambda index: True)
+        with pytest.raises(BrokenDNSProxyError):
+            supervisor.run()
+        assert_no_children()
+
+
+class TestParseCpuAffinity(object):
+
+    def test_no_pinning(self):
+        assert WorkerSupervisor.parse_cpu_affinity('no') is None
+        assert WorkerSupervisor.parse_cpu_affinity(' ') is None
+
+    def test_cpu_list(self):
+        assert WorkerSupervisor.parse_cpu_affinity('0 2  3') == [0, 2, 3]
+        assert WorkerSupervisor.parse_cpu_affinity('auto') == sorted(os.sched_getaffinity(0))
+
+    def test_wrong_cpu_list(self):
+        with pytest.raises(BrokenDNSProxyError):
+            WorkerSupervisor.parse_cpu_affinity('0 one')
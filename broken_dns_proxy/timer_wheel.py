@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+
+import math
+
+from broken_dns_proxy.logger import logger
+
+
+class TimerWheel(object):
+    """
+    Hashed timing wheel (Varghese and Lauck). Timers are kept in a ring of
+    slots indexed by their expiration tick, so scheduling a timer and firing
+    it cost O(1) no matter how many timers are pending. Timers expiring more
+    than one revolution ahead share the slot and wait for their tick.
+
+    The wheel does not own any thread, the server loop calls advance() when
+    the time from next_deadline() comes.
+    """
+
+    TICK = 0.001
+    SLOTS = 1024
+
+    def __init__(self, now, tick=TICK, slots=SLOTS):
+        """
+        Constructor
+
+        :param now: current time in seconds of the clock used with the wheel
+        :param tick: resolution of the timers in seconds
+        :param slots: number of slots of the wheel
+        :return: new object
+        """
+        self._tick = tick
+        self._slots = [[] for _ in range(slots)]
+        # the last tick all timers were fired for
+        self._current = self._to_tick(now)
+        # lower bound of the tick of the next timer, None if not known
+        self._next = None
+        self._pending = 0
+        # statistics
+        self.scheduled = 0
+        self.fired = 0
+
+    def __len__(self):
+        return self._pending
+
+    def __str__(self):
+        return "<TimerWheel tick='{0}' slots='{1}' pending='{2}'>".format(self._tick, len(self._slots), self._pending)
+
+    def _to_tick(self, now):
+        # tolerate rounding of deadlines computed from ticks
+        return int(now / self._tick + 1e-6)
+
+    def schedule(self, now, delay, callback, *args):
+        """
+        Call the callback with the arguments after the delay
+
+        :param now: current time in seconds
+        :param delay: delay in seconds, rounded up to the tick
+        :param callback: function to call
+        :param args: arguments of the callback
+        :return: None
+        """
+        expires = max(self._current + 1, int(math.ceil((now + delay) / self._tick - 1e-6)))
+        self._slots[expires % len(self._slots)].append((expires, callback, args))
+        self._pending += 1
+        self.scheduled += 1
+        if self._next is not None:
+            self._next = min(self._next, expires)
+        elif self._pending == 1:
+            self._next = expires
+
+    def next_deadline(self):
+        """
+        Return the time the server loop should call advance() at
+
+        :return: time in seconds or None if there are no timers
+        """
+        if not self._pending:
+            return None
+        if self._next is None:
+            # the first non-empty slot, its timers may be due only in later revolutions
+            for tick in range(self._current + 1, self._current + 1 + len(self._slots)):
+                if self._slots[tick % len(self._slots)]:
+                    self._next = tick
+                    break
+        return self._next * self._tick
+
+    def advance(self, now):
+        """
+        Fire all timers which expired until now, in the order of their slots.
+        Timers scheduled by the callbacks fire no sooner than on the next call.
+
+        :param now: current time in seconds
+        :return: number of fired timers
+        """
+        target = self._to_tick(now)
+        if target <= self._current:
+            return 0
+        if not self._pending:
+            self._current = target
+            return 0
+
+        expired = []
+        slots = len(self._slots)
+        # after a full revolution every slot was visited
+        for tick in range(self._current + 1, min(target, self._current + slots) + 1):
+            slot = self._slots[tick % slots]
+            if not slot:
+                continue
+            waiting = [timer for timer in slot if timer[0] > target]
+            if len(waiting) != len(slot):
+                expired.extend(timer for timer in slot if timer[0] <= target)
+                self._slots[tick % slots] = waiting
+        self._current = target
+        self._next = None
+        if not expired:
+            return 0
+
+        self._pending -= len(expired)
+        self.fired += len(expired)
+        for _, callback, args in expired:
+            try:
+                callback(*args)
+            except Exception as e:
+                logger.error("Timer callback %s failed: %s", getattr(callback, '__name__', str(callback)), str(e))
+        return len(expired)
@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+
+import ctypes
+import ctypes.util
+import errno
+import socket
+import struct
+import sys
+
+from broken_dns_proxy.logger import logger
+from broken_dns_proxy.client import Client
+from broken_dns_proxy.buffer_pool import BufferPool, MAX_DATAGRAM
+from broken_dns_proxy.metrics import Histogram
+
+
+# all sockaddr structures fit into sockaddr_storage
+SOCKADDR_STORAGE_LENGTH = 128
+
+
+class _IoVec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p),
+                ('iov_len', ctypes.c_size_t)]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p),
+                ('msg_namelen', ctypes.c_uint32),
+                ('msg_iov', ctypes.POINTER(_IoVec)),
+                ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p),
+                ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', _MsgHdr),
+                ('msg_len', ctypes.c_uint)]
+
+
+def _load_libc():
+    """
+    Return libc with recvmmsg() and sendmmsg(), or None if not available
+
+    :return: ctypes.CDLL object or None
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    except OSError:
+        return None
+    if not hasattr(libc, 'recvmmsg') or not hasattr(libc, 'sendmmsg'):
+        return None
+    for function in (libc.recvmmsg, libc.sendmmsg):
+        function.restype = ctypes.c_int
+    libc.recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    libc.sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int]
+    return libc
+
+
+_libc = _load_libc()
+
+
+def mmsg_supported():
+    """
+    Returns True if recvmmsg() and sendmmsg() can be used
+
+    :return: bool
+    """
+    return _libc is not None
+
+
+def decode_sockaddr(buf):
+    """
+    Decode sockaddr structure into the address tuple socket module uses
+
+    :param buf: bytes with sockaddr_in or sockaddr_in6
+    :return: tuple
+    """
+    family = struct.unpack_from('=H', buf)[0]
+    if family == socket.AF_INET6:
+        port, flowinfo = struct.unpack_from('!HI', buf, 2)
+        scope_id = struct.unpack_from('=I', buf, 24)[0]
+        return socket.inet_ntop(socket.AF_INET6, buf[8:24]), port, flowinfo, scope_id
+    if family == socket.AF_INET:
+        port = struct.unpack_from('!H', buf, 2)[0]
+        return socket.inet_ntop(socket.AF_INET, buf[4:8]), port
+    raise ValueError("Unsupported address family {0}".format(family))
+
+
+def encode_sockaddr(addr):
+    """
+    Encode the address tuple socket module uses into sockaddr structure
+
+    :param addr: tuple (host, port) or (host, port, flowinfo, scope_id)
+    :return: bytes
+    """
+    host = addr[0].split('%', 1)[0]
+    if len(addr) == 4:
+        return struct.pack('=H', socket.AF_INET6) + struct.pack('!HI', addr[1], addr[2]) + \
+            socket.inet_pton(socket.AF_INET6, host) + struct.pack('=I', addr[3])
+    return struct.pack('=H', socket.AF_INET) + struct.pack('!H', addr[1]) + \
+        socket.inet_pton(socket.AF_INET, host) + b'\x00' * 8
+
+
+class BatchClient(Client):
+    """
+    Client whose Query was received in a batch of datagrams. The response
+    is queued and sent together with the other responses of the batch.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, msg_raw, client_addr, outbox, received=None):
+        """
+        Constructor
+
+        :param msg_raw: raw DNS message with the Query
+        :param client_addr: address of the client
+        :param outbox: list the response is appended to as (data, address)
+        :param received: time.perf_counter() value when the Query was received
+        :return: None
+        """
+        self.setup(msg_raw, client_addr, outbox, received)
+
+    def setup(self, msg_raw, client_addr, outbox, received=None):
+        # the outbox is the transport of batched clients
+        self._transport = outbox
+        self._client_addr = client_addr
+        self._client_msg_raw = msg_raw
+        self.received = received
+        self._detached = False
+        self._check_client_msg()
+
+    def is_stream(self):
+        """
+        Batched Queries are always received over UDP
+
+        :return: False
+        """
+        return False
+
+    def _send_datagram(self, msg_raw):
+        """
+        Queue raw DNS Message for the client
+
+        :param msg_raw: raw DNS Message to send to the client
+        :return: None
+        """
+        self._transport.append((msg_raw, self._client_addr))
+
+
+class BatchStats(object):
+    """
+    Statistics of batched receiving and sending
+    """
+
+    def __init__(self, batch_size):
+        self.recv_calls = 0
+        self.recv_datagrams = 0
+        self.send_calls = 0
+        self.send_datagrams = 0
+        bounds = []
+        size = 1
+        while size < batch_size:
+            bounds.append(size)
+            size *= 2
+        bounds.append(batch_size)
+        self.recv_batch_size = Histogram(bounds)
+
+    def __str__(self):
+        return "<BatchStats recv_calls='{0}' recv_datagrams='{1}' send_calls='{2}' " \
+               "send_datagrams='{3}'>".format(self.recv_calls, self.recv_datagrams, self.send_calls,
+                                              self.send_datagrams)
+
+
+class DatagramBatchIO(object):
+    """
+    Receives and sends datagrams on the socket in batches, with one
+    recvfrom_into()/sendto() call for every datagram. The datagrams are
+    received into buffers taken from the pool once.
+    """
+
+    NAME = 'recvfrom'
+
+    def __init__(self, sock, batch_size, buffer_pool=None):
+        """
+        Constructor
+
+        :param sock: bound UDP socket
+        :param batch_size: maximal number of datagrams received at once
+        :param buffer_pool: BufferPool the receive buffers are taken from
+        :return: new object
+        """
+        self._sock = sock
+        self._sock.setblocking(False)
+        self.batch_size = batch_size
+        self.stats = BatchStats(batch_size)
+        if buffer_pool is None:
+            buffer_pool = BufferPool()
+        self._buffers = [buffer_pool.acquire() for _ in range(batch_size)]
+
+    def __str__(self):
+        return "<{0} batch_size='{1}'>".format(self.__class__.__name__, self.batch_size)
+
+    def fileno(self):
+        return self._sock.fileno()
+
+    def _recv(self):
+        datagrams = []
+        for buf in self._buffers:
+            try:
+                nbytes, addr = self._sock.recvfrom_into(buf, MAX_DATAGRAM)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as e:
+                # e.g. ICMP port unreachable for a previous response
+                logger.debug('Receiving UDP datagram failed: %s', str(e))
+                break
+            datagrams.append((memoryview(buf)[:nbytes], addr))
+        return datagrams
+
+    def recv(self):
+        """
+        Receive up to batch_size datagrams which are ready. The data are
+        memoryview slices valid until the next recv().
+
+        :return: list of (data, address)
+        """
+        datagrams = self._recv()
+        self.stats.recv_calls += 1
+        if datagrams:
+            self.stats.recv_datagrams += len(datagrams)
+            self.stats.recv_batch_size.observe(len(datagrams))
+        return datagrams
+
+    def _send(self, datagrams):
+        for data, addr in datagrams:
+            try:
+                self._sock.sendto(data, addr)
+            except OSError as e:
+                logger.debug('Sending UDP datagram to %s failed: %s', str(addr), str(e))
+
+    def send(self, datagrams):
+        """
+        Send the datagrams
+
+        :param datagrams: list of (data, address)
+        :return: None
+        """
+        if not datagrams:
+            return
+        self._send(datagrams)
+        self.stats.send_calls += 1
+        self.stats.send_datagrams += len(datagrams)
+
+
+class MmsgBatchIO(DatagramBatchIO):
+    """
+    Receives and sends datagrams in batches with one recvmmsg()/sendmmsg()
+    system call.
+    """
+
+    NAME = 'recvmmsg'
+
+    def __init__(self, sock, batch_size, buffer_pool=None):
+        super(MmsgBatchIO, self).__init__(sock, batch_size, buffer_pool)
+        # ctypes views of the pooled buffers, so their addresses can be passed to the kernel
+        self._buffer_views = [(ctypes.c_char * len(buf)).from_buffer(buf) for buf in self._buffers]
+        self._names = [ctypes.create_string_buffer(SOCKADDR_STORAGE_LENGTH) for _ in range(batch_size)]
+        self._iovecs = (_IoVec * batch_size)()
+        self._recv_msgs = (_MMsgHdr * batch_size)()
+        for i in range(batch_size):
+            self._iovecs[i].iov_base = ctypes.addressof(self._buffer_views[i])
+            self._iovecs[i].iov_len = MAX_DATAGRAM
+            hdr = self._recv_msgs[i].msg_hdr
+            hdr.msg_name = ctypes.cast(self._names[i], ctypes.c_void_p)
+            hdr.msg_iov = ctypes.pointer(self._iovecs[i])
+            hdr.msg_iovlen = 1
+
+    def _recv(self):
+        for i in range(self.batch_size):
+            self._recv_msgs[i].msg_hdr.msg_namelen = SOCKADDR_STORAGE_LENGTH
+        count = _libc.recvmmsg(self._sock.fileno(), self._recv_msgs, self.batch_size, socket.MSG_DONTWAIT, None)
+        if count < 0:
+            error = ctypes.get_errno()
+            if error not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                logger.debug('recvmmsg() failed: %s', errno.errorcode.get(error, error))
+            return []
+        datagrams = []
+        for i in range(count):
+            msg = self._recv_msgs[i]
+            name = self._names[i].raw[:msg.msg_hdr.msg_namelen]
+            datagrams.append((memoryview(self._buffers[i])[:msg.msg_len], decode_sockaddr(name)))
+        return datagrams
+
+    def _send(self, datagrams):
+        count = len(datagrams)
+        msgs = (_MMsgHdr * count)()
+        iovecs = (_IoVec * count)()
+        # keep the data referenced until the call returns
+        keep = []
+        for i, (data, addr) in enumerate(datagrams):
+            # c_char_p points to the data of bytes object without copying it
+            data = bytes(data)
+            sockaddr = encode_sockaddr(addr)
+            data_pointer, name = ctypes.c_char_p(data), ctypes.c_char_p(sockaddr)
+            keep.append((data, sockaddr, data_pointer, name))
+            iovecs[i].iov_base = ctypes.cast(data_pointer, ctypes.c_void_p)
+            iovecs[i].iov_len = len(data)
+            hdr = msgs[i].msg_hdr
+            hdr.msg_name = ctypes.cast(name, ctypes.c_void_p)
+            hdr.msg_namelen = len(sockaddr)
+            hdr.msg_iov = ctypes.pointer(iovecs[i])
+            hdr.msg_iovlen = 1
+
+        sent = 0
+        while sent < count:
+            result = _libc.sendmmsg(self._sock.fileno(), ctypes.byref(msgs[sent]),
+                                    count - sent, 0)
+            if result <= 0:
+                logger.debug('sendmmsg() failed: %s... sending one by one',
+                             errno.errorcode.get(ctypes.get_errno(), ctypes.get_errno()))
+                super(MmsgBatchIO, self)._send(datagrams[sent + 1:] if result < 0 else datagrams[sent:])
+                return
+            sent += result
+
+
+def create_batch_io(sock, batch_size, buffer_pool=None):
+    """
+    Return the best batched UDP I/O available on this platform
+
+    :param sock: bound UDP socket
+    :param batch_size: maximal number of datagrams received at once
+    :param buffer_pool: BufferPool the receive buffers are taken from
+    :return: DatagramBatchIO object
+    """
+    if mmsg_supported():
+        return MmsgBatchIO(sock, batch_size, buffer_pool)
+    return DatagramBatchIO(sock, batch_size, buffer_pool)
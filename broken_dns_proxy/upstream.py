@@ -0,0 +1,422 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+
+import asyncio
+import random
+import struct
+
+from broken_dns_proxy import wire
+from broken_dns_proxy.logger import logger
+from broken_dns_proxy.exceptions import BrokenDNSProxyError, UpstreamConnectionError
+# the blocking clients live apart, so the select engine does not import asyncio
+from broken_dns_proxy.blocking_upstream import parse_upstream_address, BlockingUdpUpstream, BlockingTcpUpstream
+
+
+class UpstreamDatagramProtocol(asyncio.DatagramProtocol):
+    """
+    asyncio protocol receiving responses from an upstream server
+    """
+
+    def __init__(self, upstream):
+        """
+        Constructor
+
+        :param upstream: UdpUpstream object to pass received responses to
+        :return: new object
+        """
+        self._upstream = upstream
+
+    def datagram_received(self, data, addr):
+        self._upstream.response_received(data)
+
+    def error_received(self, exc):
+        logger.debug("Error on socket to upstream server '%s': %s", self._upstream.address, str(exc))
+
+    def connection_lost(self, exc):
+        self._upstream.connection_lost(exc)
+
+
+class PendingQueries(object):
+    """
+    Outstanding Queries sent over one socket, matched with responses by the message ID
+    """
+
+    address = None
+
+    def __init__(self, loop):
+        self._loop = loop
+        # message ID -> Future waiting for the response
+        self._pending = dict()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def _allocate_id(self):
+        """
+        Pick a random message ID not used by any outstanding Query
+
+        :return: int
+        """
+        if len(self._pending) >= 2**16:
+            raise BrokenDNSProxyError("Too many outstanding Queries to '{0}'".format(self.address))
+        while True:
+            msg_id = random.randint(0, 2**16 - 1)
+            if msg_id not in self._pending:
+                return msg_id
+
+    async def _exchange(self, msg_raw, send, timeout=None):
+        """
+        Send the Query using the send function and wait for the response.
+
+        :param msg_raw: raw DNS message with the Query
+        :param send: function sending the raw Query
+        :param timeout: seconds to wait for the response, None to wait forever
+        :return: raw DNS message with the response, with the ID of the Query
+        """
+        msg_id = self._allocate_id()
+        future = self._loop.create_future()
+        self._pending[msg_id] = future
+        try:
+            # the Query is sent with our own ID, the original one is put back to the response
+            send(struct.pack('!H', msg_id) + msg_raw[2:])
+            response_raw = await asyncio.wait_for(future, timeout)
+        finally:
+            self._pending.pop(msg_id, None)
+
+        return msg_raw[:2] + response_raw[2:]
+
+    def response_received(self, data):
+        """
+        Pass the received response to the Query waiting for it.
+
+        :param data: raw response
+        :return: None
+        """
+        if len(data) < wire.HEADER_LENGTH:
+            logger.debug("Dropping response shorter than DNS header from '%s'", self.address)
+            return
+        msg_id = struct.unpack('!H', data[:2])[0]
+        future = self._pending.get(msg_id)
+        if future is None or future.done():
+            logger.debug("Dropping unexpected response with ID '%d' from '%s'", msg_id, self.address)
+            return
+        future.set_result(data)
+
+    def _fail_pending(self, exc):
+        """
+        Fail all outstanding Queries
+
+        :param exc: exception to raise in the waiting Queries
+        :return: None
+        """
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(exc)
+
+
+class UdpUpstream(PendingQueries):
+    """
+    Non-blocking UDP client for one upstream server. All Queries are sent over
+    a single socket and the responses are matched back by the message ID,
+    so any number of Queries can be outstanding at once.
+    """
+
+    def __init__(self, address, port=53, loop=None):
+        """
+        Constructor
+
+        :param address: address of the upstream server
+        :param port: port of the upstream server
+        :param loop: asyncio event loop to use
+        :return: new object
+        """
+        super(UdpUpstream, self).__init__(loop or asyncio.get_event_loop())
+        self.address = address
+        self.port = port
+        self._transport = None
+        self._connecting = None
+
+    def __str__(self):
+        return "<UdpUpstream address='{0}' port='{1}' pending='{2}'>".format(self.address,
+                                                                             self.port,
+                                                                             len(self._pending))
+
+    async def _connect(self):
+        """
+        Create the socket to the upstream server, if not already created.
+
+        :return: None
+        """
+        if self._transport is not None:
+            return
+        if self._connecting is None:
+            self._connecting = self._loop.create_task(
+                self._loop.create_datagram_endpoint(lambda: UpstreamDatagramProtocol(self),
+                                                    remote_addr=(self.address, self.port)))
+        try:
+            transport, _ = await asyncio.shield(self._connecting)
+        finally:
+            self._connecting = None
+        self._transport = transport
+
+    async def query(self, msg_raw, timeout=None):
+        """
+        Send the Query to the upstream server and wait for the response.
+
+        :param msg_raw: raw DNS message with the Query
+        :param timeout: seconds to wait for the response, None to wait forever
+        :return: raw DNS message with the response
+        """
+        await self._connect()
+        return await self._exchange(msg_raw, self._transport.sendto, timeout)
+
+    def connection_lost(self, exc):
+        """
+        Fail all outstanding Queries, the socket will be recreated by the next Query.
+
+        :param exc: exception or None
+        :return: None
+        """
+        self._transport = None
+        self._fail_pending(exc or BrokenDNSProxyError("Connection to '{0}' lost".format(self.address)))
+
+    def close(self):
+        """
+        Close the socket to the upstream server.
+
+        :return: None
+        """
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+
+
+class UpstreamStreamProtocol(asyncio.Protocol):
+    """
+    asyncio protocol receiving length prefixed responses from an upstream server over TCP
+    """
+
+    def __init__(self, connection):
+        """
+        Constructor
+
+        :param connection: TcpConnection object to pass received responses to
+        :return: new object
+        """
+        self._connection = connection
+        self._buffer = bytearray()
+
+    def data_received(self, data):
+        self._buffer.extend(data)
+        # 1st 2B of every message is the length
+        while len(self._buffer) >= 2:
+            msg_len = struct.unpack('!H', self._buffer[:2])[0]
+            if len(self._buffer) < msg_len + 2:
+                break
+            msg_raw = bytes(self._buffer[2:msg_len + 2])
+            del self._buffer[:msg_len + 2]
+            self._connection.response_received(msg_raw)
+
+    def connection_lost(self, exc):
+        self._connection.connection_lost(exc)
+
+
+class TcpConnection(PendingQueries):
+    """
+    One persistent TCP connection to an upstream server. Queries are pipelined
+    and the responses may arrive in any order.
+    """
+
+    def __init__(self, upstream):
+        """
+        Constructor
+
+        :param upstream: TcpUpstream object owning the connection
+        :return: new object
+        """
+        super(TcpConnection, self).__init__(upstream.loop)
+        self.address = upstream.address
+        self._upstream = upstream
+        self._transport = None
+        self._idle_handle = None
+        self._connecting = self._loop.create_task(
+            self._loop.create_connection(lambda: UpstreamStreamProtocol(self), upstream.address, upstream.port))
+        self._connecting.add_done_callback(self._connected)
+        # number of Queries using the connection, including the ones waiting for the connect
+        self.load = 0
+        self.closed = False
+
+    def __str__(self):
+        return "<TcpConnection address='{0}' load='{1}'>".format(self.address, self.load)
+
+    def _connected(self, future):
+        if future.cancelled() or future.exception() is not None:
+            logger.debug("Unable to connect to upstream server '%s' over TCP", self.address)
+            self._closed()
+            return
+        self._transport, _ = future.result()
+        if self.closed:
+            self._transport.close()
+
+    def _send(self, msg_raw):
+        if self._transport is None or self._transport.is_closing():
+            raise UpstreamConnectionError("Connection to '{0}' lost".format(self.address))
+        self._transport.write(struct.pack('!H', len(msg_raw)) + msg_raw)
+
+    async def query(self, msg_raw, timeout=None):
+        """
+        Send the Query over the connection and wait for the response.
+
+        :param msg_raw: raw DNS message with the Query
+        :param timeout: seconds to wait for the response, None to wait forever
+        :return: raw DNS message with the response
+        """
+        self.load += 1
+        if self._idle_handle is not None:
+            self._idle_handle.cancel()
+            self._idle_handle = None
+        try:
+            if self._transport is None:
+                try:
+                    await asyncio.wait_for(asyncio.shield(self._connecting), timeout)
+                except OSError as e:
+                    raise UpstreamConnectionError("Unable to connect to '{0}': {1}".format(self.address, str(e)))
+                except asyncio.CancelledError:
+                    # only the connection was closed, not the waiting Query
+                    if not self._connecting.cancelled():
+                        raise
+                    raise UpstreamConnectionError("Connection to '{0}' closed".format(self.address))
+            return await self._exchange(msg_raw, self._send, timeout)
+        finally:
+            self.load -= 1
+            if self.load == 0 and not self.closed:
+                self._idle_handle = self._loop.call_later(self._upstream.idle_timeout, self.close)
+
+    def connection_lost(self, exc):
+        """
+        Fail all outstanding Queries and remove the connection from the pool
+
+        :param exc: exception or None
+        :return: None
+        """
+        self._closed()
+        self._fail_pending(UpstreamConnectionError("Connection to '{0}' lost".format(self.address)))
+
+    def _closed(self):
+        self.closed = True
+        if self._idle_handle is not None:
+            self._idle_handle.cancel()
+            self._idle_handle = None
+        self._upstream.connection_closed(self)
+
+    def close(self):
+        """
+        Close the connection.
+
+        :return: None
+        """
+        self._closed()
+        if self._transport is not None:
+            self._transport.close()
+        elif not self._connecting.done():
+            self._connecting.cancel()
+
+
+class TcpUpstream(object):
+    """
+    Pool of persistent TCP connections to one upstream server. Queries are
+    pipelined over the open connections and new connections are opened when
+    all of them are busy. Lost connections are reopened transparently.
+    """
+
+    def __init__(self, address, port=53, loop=None, max_connections=1, max_pipeline=64, idle_timeout=30):
+        """
+        Constructor
+
+        :param address: address of the upstream server
+        :param port: port of the upstream server
+        :param loop: asyncio event loop to use
+        :param max_connections: maximal number of connections to the server
+        :param max_pipeline: number of outstanding Queries on one connection before opening another one
+        :param idle_timeout: seconds after which unused connection is closed
+        :return: new object
+        """
+        self.address = address
+        self.port = port
+        self.loop = loop or asyncio.get_event_loop()
+        self.idle_timeout = idle_timeout
+        self._max_connections = max_connections
+        self._max_pipeline = max_pipeline
+        self._connections = []
+
+    def __str__(self):
+        return "<TcpUpstream address='{0}' port='{1}' connections='{2}'>".format(self.address,
+                                                                                 self.port,
+                                                                                 len(self._connections))
+
+    def _get_connection(self):
+        """
+        Get the least loaded connection, open a new one if all are busy.
+
+        :return: TcpConnection object
+        """
+        connection = min(self._connections, key=lambda c: c.load) if self._connections else None
+        if connection is None or (connection.load >= self._max_pipeline and
+                                  len(self._connections) < self._max_connections):
+            logger.debug("Opening new TCP connection to upstream server '%s'", self.address)
+            connection = TcpConnection(self)
+            self._connections.append(connection)
+        return connection
+
+    async def query(self, msg_raw, timeout=None):
+        """
+        Send the Query to the upstream server over TCP and wait for the response.
+        If the connection is lost, the Query is sent once more over a new connection.
+
+        :param msg_raw: raw DNS message with the Query
+        :param timeout: seconds to wait for the response, None to wait forever
+        :return: raw DNS message with the response
+        """
+        try:
+            return await self._get_connection().query(msg_raw, timeout)
+        except UpstreamConnectionError as e:
+            logger.debug("%s... retrying", str(e))
+        return await self._get_connection().query(msg_raw, timeout)
+
+    def connection_closed(self, connection):
+        """
+        Remove the closed connection from the pool
+
+        :param connection: TcpConnection object
+        :return: None
+        """
+        try:
+            self._connections.remove(connection)
+        except ValueError:
+            pass
+
+    def close(self):
+        """
+        Close all connections to the upstream server.
+
+        :return: None
+        """
+        for connection in list(self._connections):
+            connection.close()
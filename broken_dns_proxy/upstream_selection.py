@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+
+import random
+
+from broken_dns_proxy.exceptions import BrokenDNSProxyError
+
+
+strategies = {}
+
+
+def register_strategy(strategy):
+    if strategy.NAME in strategies:
+        raise BrokenDNSProxyError("Selection strategy with name {0} already exists!".format(strategy.NAME))
+    strategies[strategy.NAME] = strategy
+    return strategy
+
+
+def get_strategy_by_name(strategy_name):
+    try:
+        return strategies[strategy_name.strip().lower()]
+    except KeyError:
+        raise BrokenDNSProxyError("Upstream selection strategy '{0}' does not exist! Available strategies: {1}".format(
+            strategy_name, ', '.join(sorted(strategies))))
+
+
+class UpstreamStats(object):
+    """
+    Latency statistics of one upstream server. The smoothed RTT and its
+    variation are computed the same way as TCP does it (RFC 6298).
+    """
+
+    # RTT in seconds accounted for a Query that failed
+    FAILURE_PENALTY = 1.0
+
+    def __init__(self, upstream_server):
+        self.upstream_server = upstream_server
+        # untried servers get small random RTT so they are tried first in random order
+        self.srtt = random.uniform(0.001, 0.032)
+        self.rttvar = 0.0
+        self.queries = 0
+        self.failures = 0
+
+    def __str__(self):
+        return "<UpstreamStats upstream_server='{0}' srtt='{1:.4f}' rttvar='{2:.4f}' " \
+               "queries='{3}' failures='{4}'>".format(self.upstream_server, self.srtt, self.rttvar,
+                                                      self.queries, self.failures)
+
+    def update(self, rtt):
+        """
+        Account RTT of a successful Query
+
+        :param rtt: RTT in seconds
+        :return: None
+        """
+        if self.queries == self.failures:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar += (abs(self.srtt - rtt) - self.rttvar) / 4
+            self.srtt += (rtt - self.srtt) / 8
+        self.queries += 1
+
+    def update_failure(self):
+        """
+        Account a Query which failed or timed out
+
+        :return: None
+        """
+        self.queries += 1
+        self.failures += 1
+        self.srtt += (max(self.FAILURE_PENALTY, self.srtt * 2) - self.srtt) / 2
+
+
+class SelectionStrategy(object):
+    """
+    Base class for strategies selecting the upstream server for a Query
+    """
+
+    NAME = None
+
+    def __init__(self, upstream_servers):
+        """
+        Constructor
+
+        :param upstream_servers: list of upstream server addresses
+        :return: new object
+        """
+        if not upstream_servers:
+            raise BrokenDNSProxyError("No upstream servers configured!")
+        self.upstream_servers = list(upstream_servers)
+        self._stats = dict((server, UpstreamStats(server)) for server in self.upstream_servers)
+
+    def __str__(self):
+        return "<{0} upstream_servers='{1}'>".format(self.__class__.__name__, self.upstream_servers)
+
+    def stats(self, upstream_server):
+        """
+        Return latency statistics of the upstream server
+
+        :param upstream_server: address of the upstream server
+        :return: UpstreamStats object
+        """
+        return self._stats[upstream_server]
+
+    def choose(self):
+        """
+        Select the upstream server for the next Query
+
+        :return: address of the upstream server
+        """
+        raise NotImplementedError()
+
+    def choose_other(self, exclude):
+        """
+        Select the upstream server for a retried or hedged Query. Servers which
+        were already tried are avoided if there is any other server left.
+
+        :param exclude: collection of upstream servers already tried
+        :return: address of the upstream server
+        """
+        upstream_server = self.choose()
+        if upstream_server not in exclude:
+            return upstream_server
+        candidates = [server for server in self.upstream_servers if server not in exclude]
+        if not candidates:
+            return upstream_server
+        return min(candidates, key=lambda server: self._stats[server].srtt)
+
+    def report(self, upstream_server, rtt):
+        """
+        Account RTT of a successful Query to the upstream server
+
+        :param upstream_server: address of the upstream server
+        :param rtt: RTT in seconds
+        :return: None
+        """
+        self._stats[upstream_server].update(rtt)
+
+    def report_failure(self, upstream_server):
+        """
+        Account a failed Query to the upstream server
+
+        :param upstream_server: address of the upstream server
+        :return: None
+        """
+        self._stats[upstream_server].update_failure()
+
+
+@register_strategy
+class RandomStrategy(SelectionStrategy):
+    """
+    Every upstream server is selected with the same probability
+    """
+
+    NAME = 'random'
+
+    def choose(self):
+        return random.choice(self.upstream_servers)
+
+
+@register_strategy
+class RoundRobinStrategy(SelectionStrategy):
+    """
+    Upstream servers are selected one after another
+    """
+
+    NAME = 'roundrobin'
+
+    def __init__(self, upstream_servers):
+        super(RoundRobinStrategy, self).__init__(upstream_servers)
+        self._next = 0
+
+    def choose(self):
+        upstream_server = self.upstream_servers[self._next]
+        self._next = (self._next + 1) % len(self.upstream_servers)
+        return upstream_server
+
+
+@register_strategy
+class SrttStrategy(SelectionStrategy):
+    """
+    The server with the lowest smoothed RTT is selected, the same way as BIND
+    does it. The smoothed RTT of all other servers decays with every selection,
+    so slower servers are probed again from time to time.
+    """
+
+    NAME = 'srtt'
+
+    DECAY = 0.98
+
+    def choose(self):
+        best = min(self._stats.values(), key=lambda stats: stats.srtt)
+        for stats in self._stats.values():
+            if stats is not best:
+                stats.srtt *= self.DECAY
+        return best.upstream_server
+
+
+@register_strategy
+class PowerOfTwoChoicesStrategy(SelectionStrategy):
+    """
+    Two random servers are picked and the one with lower smoothed RTT is selected
+    """
+
+    NAME = 'p2c'
+
+    def choose(self):
+        if len(self.upstream_servers) == 1:
+            return self.upstream_servers[0]
+        first, second = random.sample(self.upstream_servers, 2)
+        if self._stats[second].srtt < self._stats[first].srtt:
+            return second
+        return first
@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+
+import bisect
+import struct
+from collections import namedtuple
+
+from broken_dns_proxy.exceptions import WireFormatError
+
+
+# Helpers for reading and patching raw DNS messages (RFC 1035 section 4)
+# without parsing them into DNS Message objects.
+
+HEADER_LENGTH = 12
+
+# message sections
+QUESTION = 0
+ANSWER = 1
+AUTHORITY = 2
+ADDITIONAL = 3
+
+# RR types handled on the wire
+TYPE_SOA = 6
+TYPE_OPT = 41
+
+# payload size used when EDNS has to be added to a message
+EDNS_PAYLOAD = 1232
+
+_SHORT = struct.Struct('!H')
+_RR_HEADER = struct.Struct('!HHIH')
+
+# layout of RDATA which may contain compressed domain names (RFC 3597 section 4),
+# None is a domain name, int is the number of bytes of other fields
+_COMPRESSED_RDATA = {
+    2: (None,),             # NS
+    3: (None,),             # MD
+    4: (None,),             # MF
+    5: (None,),             # CNAME
+    6: (None, None, 20),    # SOA
+    7: (None,),             # MB
+    8: (None,),             # MG
+    9: (None,),             # MR
+    12: (None,),            # PTR
+    14: (None, None),       # MINFO
+    15: (2, None),          # MX
+    17: (None, None),       # RP
+    18: (2, None),          # AFSDB
+    21: (2, None),          # RT
+    26: (2, None, None),    # PX
+    33: (6, None),          # SRV
+    36: (2, None),          # KX
+    39: (None,),            # DNAME
+}
+
+# Resource Record located in a raw message
+#   section     - message section the record is in
+#   offset      - offset of the owner name
+#   rdtype      - type of the record
+#   rdclass     - class of the record (payload size for OPT)
+#   ttl_offset  - offset of the 32bit TTL field (extended RCODE, version and flags for OPT)
+#   rdata       - offset of RDATA
+#   rdlength    - length of RDATA
+RRInfo = namedtuple('RRInfo', ['section', 'offset', 'rdtype', 'rdclass', 'ttl_offset', 'rdata', 'rdlength'])
+
+
+def get_id(buf):
+    return _SHORT.unpack_from(buf, 0)[0]
+
+
+def set_id(buf, msg_id):
+    _SHORT.pack_into(buf, 0, msg_id)
+
+
+def get_flags(buf):
+    return _SHORT.unpack_from(buf, 2)[0]
+
+
+def set_flags(buf, flags):
+    _SHORT.pack_into(buf, 2, flags)
+
+
+def get_count(buf, section):
+    return _SHORT.unpack_from(buf, 4 + 2 * section)[0]
+
+
+def set_count(buf, section, count):
+    _SHORT.pack_into(buf, 4 + 2 * section, count)
+
+
+def check_header(buf):
+    """
+    Check that the raw message is long enough to contain the DNS header
+
+    :param buf: raw DNS message
+    :return: None
+    """
+    if len(buf) < HEADER_LENGTH:
+        raise WireFormatError("DNS message too short ({0}B)".format(len(buf)))
+
+
+def skip_name(buf, offset):
+    """
+    Return offset of the first byte after the domain name
+
+    :param buf: raw DNS message
+    :param offset: offset of the domain name
+    :return: int
+    """
+    try:
+        while True:
+            length = buf[offset]
+            if length == 0:
+                return offset + 1
+            if length & 0xC0 == 0xC0:
+                # compression pointer ends the name
+                return offset + 2
+            if length & 0xC0:
+                raise WireFormatError("Unknown label type at offset {0}".format(offset))
+            offset += length + 1
+    except IndexError:
+        raise WireFormatError("Domain name at offset {0} exceeds the message".format(offset))
+
+
+def read_name(buf, offset):
+    """
+    Read the domain name, following compression pointers
+
+    :param buf: raw DNS message
+    :param offset: offset of the domain name
+    :return: tuple (uncompressed name in wire format, offset of the first byte after the name)
+    """
+    labels = []
+    end = None
+    jumps = 0
+    try:
+        while True:
+            length = buf[offset]
+            if length == 0:
+                labels.append(b'\x00')
+                break
+            if length & 0xC0 == 0xC0:
+                if end is None:
+                    end = offset + 2
+                jumps += 1
+                if jumps > 127:
+                    raise WireFormatError("Compression loop at offset {0}".format(offset))
+                offset = _SHORT.unpack_from(buf, offset)[0] & 0x3FFF
+                continue
+            if length & 0xC0:
+                raise WireFormatError("Unknown label type at offset {0}".format(offset))
+            labels.append(bytes(buf[offset:offset + length + 1]))
+            offset += length + 1
+    except (IndexError, struct.error):
+        raise WireFormatError("Domain name at offset {0} exceeds the message".format(offset))
+    return b''.join(labels), end if end is not None else offset + 1
+
+
+def question_end(buf):
+    """
+    Return offset of the first byte after the question section
+
+    :param buf: raw DNS message
+    :return: int
+    """
+    offset = HEADER_LENGTH
+    for _ in range(get_count(buf, QUESTION)):
+        offset = skip_name(buf, offset) + 4
+    return offset
+
+
+def copy_question(buf, query):
+    """
+    Copy the question section of the Query into the response, so the response
+    keeps the case of the Query name. Nothing is copied if the sections differ
+    in length.
+
+    :param buf: raw DNS message with the response (bytearray)
+    :param query: raw DNS message with the Query
+    :return: offset of the first byte after the question section of the response
+    """
+    end = question_end(buf)
+    if end == question_end(query):
+        buf[HEADER_LENGTH:end] = query[HEADER_LENGTH:end]
+    return end
+
+
+def parse_question(buf):
+    """
+    Return the first question of the message
+
+    :param buf: raw DNS message
+    :return: tuple (lower-cased qname in wire format, qtype, qclass) or None if there is no question
+    """
+    check_header(buf)
+    if get_count(buf, QUESTION) == 0:
+        return None
+    qname, offset = read_name(buf, HEADER_LENGTH)
+    try:
+        qtype, qclass = struct.unpack_from('!HH', buf, offset)
+    except struct.error:
+        raise WireFormatError("Question exceeds the message")
+    return qname.lower(), qtype, qclass
+
+
+def iter_records(buf, start=None):
+    """
+    Iterate over all Resource Records in answer, authority and additional sections
+
+    :param buf: raw DNS message
+    :param start: offset of the first record, if already known
+    :return: generator of RRInfo
+    """
+    check_header(buf)
+    offset = question_end(buf) if start is None else start
+    for section in (ANSWER, AUTHORITY, ADDITIONAL):
+        for _ in range(get_count(buf, section)):
+            rr_offset = offset
+            offset = skip_name(buf, offset)
+            try:
+                rdtype, rdclass, _, rdlength = _RR_HEADER.unpack_from(buf, offset)
+            except struct.error:
+                raise WireFormatError("Resource Record at offset {0} exceeds the message".format(rr_offset))
+            rdata = offset + _RR_HEADER.size
+            if rdata + rdlength > len(buf):
+                raise WireFormatError("RDATA at offset {0} exceeds the message".format(rdata))
+            yield RRInfo(section, rr_offset, rdtype, rdclass, offset + 4, rdata, rdlength)
+            offset = rdata + rdlength
+
+
+def find_opt(buf):
+    """
+    Find the OPT pseudo-RR (RFC 6891)
+
+    :param buf: raw DNS message
+    :return: RRInfo or None if the message doesn't use EDNS
+    """
+    if get_count(buf, ADDITIONAL) == 0:
+        return None
+    for rr in iter_records(buf):
+        if rr.rdtype == TYPE_OPT and rr.section == ADDITIONAL:
+            return rr
+    return None
+
+
+def get_edns_flags(buf, opt):
+    return _SHORT.unpack_from(buf, opt.ttl_offset + 2)[0]
+
+
+def set_edns_flags(buf, opt, flags):
+    _SHORT.pack_into(buf, opt.ttl_offset + 2, flags)
+
+
+def add_opt(buf, payload=EDNS_PAYLOAD):
+    """
+    Append empty OPT pseudo-RR to the message
+
+    :param buf: raw DNS message as bytearray
+    :param payload: UDP payload size to advertise
+    :return: RRInfo of the added OPT
+    """
+    offset = len(buf)
+    buf.extend(b'\x00' + _RR_HEADER.pack(TYPE_OPT, payload, 0, 0))
+    set_count(buf, ADDITIONAL, get_count(buf, ADDITIONAL) + 1)
+    return RRInfo(ADDITIONAL, offset, TYPE_OPT, payload, offset + 5, offset + 11, 0)
+
+
+def get_ttl(buf, rr):
+    return struct.unpack_from('!I', buf, rr.ttl_offset)[0]
+
+
+def set_ttl(buf, rr, ttl):
+    struct.pack_into('!I', buf, rr.ttl_offset, ttl)
+
+
+class _OffsetMap(object):
+    """
+    Where the bytes of the original message are in the rebuilt one. Ranges
+    are added in the order of the original message.
+    """
+
+    def __init__(self):
+        self._starts = []
+        self._ends = []
+        self._new_starts = []
+
+    def add(self, start, end, new_start):
+        if self._ends and self._ends[-1] == start and \
+                self._new_starts[-1] + self._ends[-1] - self._starts[-1] == new_start:
+            self._ends[-1] = end
+            return
+        self._starts.append(start)
+        self._ends.append(end)
+        self._new_starts.append(new_start)
+
+    def lookup(self, offset):
+        i = bisect.bisect_right(self._starts, offset) - 1
+        if i < 0 or offset >= self._ends[i]:
+            return None
+        return self._new_starts[i] + offset - self._starts[i]
+
+
+def _copy_name(buf, offset, out, offsets):
+    """
+    Copy the domain name to the rebuilt message. Compression pointers are
+    moved with their target, the rest of the name is copied in place of
+    a pointer to removed data.
+
+    :return: offset of the first byte after the name in the original message
+    """
+    end = None
+    jumps = 0
+    try:
+        while True:
+            length = buf[offset]
+            if length & 0xC0 == 0xC0:
+                if end is None:
+                    end = offset + 2
+                target = _SHORT.unpack_from(buf, offset)[0] & 0x3FFF
+                new_target = offsets.lookup(target)
+                if new_target is not None and new_target < 0x4000:
+                    out.extend(_SHORT.pack(0xC000 | new_target))
+                    return end
+                jumps += 1
+                if jumps > 127:
+                    raise WireFormatError("Compression loop at offset {0}".format(offset))
+                offset = target
+                continue
+            if length & 0xC0:
+                raise WireFormatError("Unknown label type at offset {0}".format(offset))
+            if end is None:
+                # labels copied from a pointer target are not targets themselves
+                offsets.add(offset, offset + length + 1, len(out))
+            out.extend(buf[offset:offset + length + 1])
+            offset += length + 1
+            if length == 0:
+                return end if end is not None else offset
+    except (IndexError, struct.error):
+        raise WireFormatError("Domain name at offset {0} exceeds the message".format(offset))
+
+
+def remove_records(buf, records):
+    """
+    Return the message without the Resource Records. Section counts are
+    updated and compression pointers of the records behind the removed
+    ones are fixed, names pointing into the removed records are copied.
+
+    :param buf: raw DNS message
+    :param records: RRInfo of the records to remove, in the order of the message
+    :return: raw DNS message as bytearray
+    """
+    if not records:
+        return bytearray(buf)
+    removed = set(rr.offset for rr in records)
+    first = records[0].offset
+    # nothing before the first removed record moves
+    out = bytearray(buf[:first])
+    offsets = _OffsetMap()
+    offsets.add(0, first, 0)
+    for rr in iter_records(buf):
+        if rr.offset < first:
+            continue
+        if rr.offset in removed:
+            set_count(out, rr.section, get_count(out, rr.section) - 1)
+            continue
+        header = _copy_name(buf, rr.offset, out, offsets)
+        offsets.add(header, rr.rdata - 2, len(out))
+        out.extend(buf[header:rr.rdata])
+        rdata_end = rr.rdata + rr.rdlength
+        layout = _COMPRESSED_RDATA.get(rr.rdtype)
+        if layout is None:
+            offsets.add(rr.rdata, rdata_end, len(out))
+            out.extend(buf[rr.rdata:rdata_end])
+            continue
+        rdlength_offset = len(out) - 2
+        offset = rr.rdata
+        for field in layout:
+            if field is None:
+                offset = _copy_name(buf, offset, out, offsets)
+            else:
+                offsets.add(offset, offset + field, len(out))
+                out.extend(buf[offset:offset + field])
+                offset += field
+        if offset > rdata_end:
+            raise WireFormatError("RDATA at offset {0} is shorter than its fields".format(rr.rdata))
+        offsets.add(offset, rdata_end, len(out))
+        out.extend(buf[offset:rdata_end])
+        _SHORT.pack_into(out, rdlength_offset, len(out) - rdlength_offset - 2)
+    return out
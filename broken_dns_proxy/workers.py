@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+#
+# Simple DNS Proxy for simulating DNS issues
+# Copyright (C) 2014-2015  Red Hat, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Authors:
+
+import os
+import signal
+import time
+
+from broken_dns_proxy.logger import logger
+from broken_dns_proxy.exceptions import BrokenDNSProxyError
+
+
+class WorkerSupervisor(object):
+    """
+    Forks worker processes, each running its own proxy server, and restarts
+    the workers which crashed. Workers bind their own sockets with SO_REUSEPORT,
+    so the kernel spreads the Queries among them.
+    """
+
+    # workers dying sooner than this after start are restarted with a delay
+    MIN_WORKER_LIFETIME = 1.0
+    # worker dying that many times in a row soon after start can't start at all, e.g. can't bind its sockets
+    MAX_EARLY_EXITS = 5
+    # signals handled by the supervisor
+    SIGNALS = {signal.SIGTERM, signal.SIGHUP}
+
+    def __init__(self, server_factory, workers, cpus=None):
+        """
+        Constructor
+
+        :param server_factory: function creating the proxy server object from the worker index, called in the worker
+        :param workers: number of worker processes
+        :param cpus: list of CPUs to pin the workers to (round robin), None for no pinning
+        :return: new object
+        """
+        self._server_factory = server_factory
+        self._workers_count = workers
+        self._cpus = cpus
+        # pid -> (worker index, start time)
+        self._workers = dict()
+        # worker index -> number of consecutive exits soon after start
+        self._early_exits = dict()
+        self._stopping = False
+
+    @staticmethod
+    def parse_cpu_affinity(value):
+        """
+        Parse the CPU affinity configuration
+
+        :param value: 'no', 'auto' or whitespace separated list of CPU numbers
+        :return: list of CPUs or None for no pinning
+        """
+        value = value.strip().lower()
+        if value in ('', 'no'):
+            return None
+        if not hasattr(os, 'sched_setaffinity'):
+            raise BrokenDNSProxyError("Pinning workers to CPUs is not supported on this platform!")
+        if value == 'auto':
+            return sorted(os.sched_getaffinity(0))
+        try:
+            return [int(cpu) for cpu in value.split()]
+        except ValueError:
+            raise BrokenDNSProxyError("Wrong CPU list '{0}' in configuration".format(value))
+
+    def _spawn(self, index):
+        """
+        Fork new worker process, unless the workers are being stopped
+
+        :param index: index of the worker
+        :return: None
+        """
+        # the handlers must not run before the new worker is known, it would not get the signal
+        signal.pthread_sigmask(signal.SIG_BLOCK, self.SIGNALS)
+        try:
+            if self._stopping:
+                return
+            pid = os.fork()
+            if not pid:
+                self._run_worker(index)
+            logger.debug("Started worker %d with pid %d", index, pid)
+            self._workers[pid] = (index, time.monotonic())
+        finally:
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, self.SIGNALS)
+
+    def _run_worker(self, index):
+        """
+        Run the proxy server in the forked worker process, never returns
+
+        :param index: index of the worker
+        :return: None
+        """
+        status = 0
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            # the server installs its own handler reloading the configuration
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, self.SIGNALS)
+            if self._cpus:
+                cpu = self._cpus[index % len(self._cpus)]
+                os.sched_setaffinity(0, {cpu})
+                logger.debug("Worker %d pinned to CPU %d", index, cpu)
+            self._server_factory(index).process()
+        except KeyboardInterrupt:
+            pass
+        except BaseException:
+            logger.exception("Worker %d failed", index)
+            status = 1
+        finally:
+            os._exit(status)
+
+    def _terminate(self, signum=None, frame=None):
+        """
+        Stop all workers
+
+        :return: None
+        """
+        self._stopping = True
+        for pid in self._workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    def _reload(self, signum=None, frame=None):
+        """
+        Make all workers reload the configuration
+
+        :return: None
+        """
+        for pid in self._workers:
+            try:
+                os.kill(pid, signal.SIGHUP)
+            except OSError:
+                pass
+
+    def run(self):
+        """
+        Start the workers and restart them when they exit, until terminated.
+        SIGHUP is passed to all workers. Worker which keeps exiting right
+        after start is not restarted forever, BrokenDNSProxyError is raised.
+
+        :return: None
+        """
+        previous_handler = signal.signal(signal.SIGTERM, self._terminate)
+        previous_sighup_handler = signal.signal(signal.SIGHUP, self._reload)
+        try:
+            for index in range(self._workers_count):
+                self._spawn(index)
+
+            logger.info('Running %d workers...', self._workers_count)
+
+            while self._workers:
+                pid, status = os.waitpid(-1, 0)
+                try:
+                    index, started = self._workers.pop(pid)
+                except KeyError:
+                    continue
+                if self._stopping:
+                    continue
+                if os.WIFSIGNALED(status):
+                    logger.warning("Worker %d (pid %d) killed by signal %d... restarting",
+                                   index, pid, os.WTERMSIG(status))
+                else:
+                    logger.warning("Worker %d (pid %d) exited with status %d... restarting",
+                                   index, pid, os.WEXITSTATUS(status))
+                if time.monotonic() - started < self.MIN_WORKER_LIFETIME:
+                    self._early_exits[index] = self._early_exits.get(index, 0) + 1
+                    if self._early_exits[index] >= self.MAX_EARLY_EXITS:
+                        raise BrokenDNSProxyError("Worker {0} exited {1} times right after start... giving up".format(
+                            index, self._early_exits[index]))
+                    time.sleep(self.MIN_WORKER_LIFETIME)
+                else:
+                    self._early_exits[index] = 0
+                self._spawn(index)
+        finally:
+            self._terminate()
+            while self._workers:
+                try:
+                    pid, _ = os.waitpid(-1, 0)
+                except ChildProcessError:
+                    break
+                self._workers.pop(pid, None)
+            signal.signal(signal.SIGTERM, previous_handler)
+            signal.signal(signal.SIGHUP, previous_sighup_handler)